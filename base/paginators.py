@@ -0,0 +1,51 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that avoids exact COUNT(*) queries over large tables.
+
+    For unfiltered querysets on PostgreSQL, the row count is read from the planner
+    statistics in `pg_class`, which is instant whatever the table size. Filtered
+    querysets, and databases without statistics, are counted up to `count_limit`
+    rows only, so the count never scans more than that many rows. Pages beyond the
+    limit are reached with keyset filters such as `?id__lt=<last id>` instead.
+
+    Attributes:
+        count_limit (int): The maximum number of rows counted exactly.
+    """
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        """
+        Returns the estimated number of objects.
+        """
+        queryset = self.object_list
+        estimate = self.estimated_table_count(queryset)
+        if estimate is not None and estimate > self.count_limit:
+            return estimate
+        return queryset.order_by()[:self.count_limit].count()
+
+    def estimated_table_count(self, queryset):
+        """
+        Returns the planner estimate of the table size, or None if it is not available.
+
+        Args:
+            queryset (QuerySet): The queryset being paginated.
+
+        Returns:
+            int: The estimated row count of an unfiltered queryset on PostgreSQL, otherwise None.
+        """
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
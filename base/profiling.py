@@ -0,0 +1,224 @@
+import functools
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+PROFILE_HEADER = 'HTTP_X_WALLET_PROFILE'
+PROFILE_FILE_HEADER = 'X-Wallet-Profile-File'
+
+
+def frame_label(frame):
+    """
+    Returns the label of a stack frame in a collapsed stack.
+
+    Args:
+        frame (frame): The frame.
+
+    Returns:
+        str: The module and function name, e.g. "wallets.models:withdraw".
+    """
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+
+def collapse(frame):
+    """
+    Collapses a stack into a single line, outermost frame first.
+
+    Args:
+        frame (frame): The innermost frame of the stack.
+
+    Returns:
+        str: The frame labels joined with semicolons.
+    """
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class StackSampler:
+    """
+    Statistical profiler that samples the stack of one thread from a background thread.
+
+    Every `interval` seconds the sampler reads the current frame of the profiled thread
+    and counts its collapsed stack. Nothing is hooked into the profiled code, so the
+    overhead on the profiled thread is limited to the sampling thread competing for the
+    GIL, and the samples show where wall time goes, including time spent waiting on the
+    database or the bank.
+
+    Usage:
+        with StackSampler() as sampler:
+            do_work()
+        write_profile('work', sampler.stacks)
+
+    Attributes:
+        thread_id (int): The identifier of the profiled thread.
+        interval (float): The time between two samples in seconds.
+        stacks (Counter): The number of samples per collapsed stack.
+    """
+    def __init__(self, thread_id=None, interval=None):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval if interval is not None else settings.WALLET_PROFILE_INTERVAL
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        """
+        Records the current stack of the profiled thread.
+        """
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is not None:
+            self.stacks[collapse(frame)] += 1
+
+    def run(self):
+        """
+        Samples the profiled thread until the sampler is stopped.
+        """
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        """
+        Starts sampling in a daemon thread.
+        """
+        self._thread = threading.Thread(target=self.run, name='wallet-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops sampling and waits for the sampling thread to finish.
+
+        Returns:
+            Counter: The number of samples per collapsed stack.
+        """
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def write_profile(label, stacks):
+    """
+    Writes sampled stacks to WALLET_PROFILE_DIR in the collapsed stack format.
+
+    Each line holds a stack, outermost frame first, and its sample count, which is the
+    input format of flamegraph.pl, speedscope and inferno. The file name starts with
+    the label and is unique per profile.
+
+    Args:
+        label (str): What was profiled, e.g. a view or task name.
+        stacks (Counter): The number of samples per collapsed stack.
+
+    Returns:
+        str: The path of the written file.
+    """
+    directory = settings.WALLET_PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', label)
+    path = os.path.join(directory, f"{name}.{time.strftime('%Y%m%dT%H%M%S')}.{uuid.uuid4().hex[:8]}.collapsed")
+    with open(path, 'w') as profile_file:
+        for stack, count in stacks.most_common():
+            profile_file.write(f"{stack} {count}\n")
+    return path
+
+
+def sampled(rate):
+    """
+    Decides whether a unit of work is selected by a sampling rate.
+
+    Args:
+        rate (float): The fraction of work to select, from 0 to 1.
+
+    Returns:
+        bool: True if the work should be profiled.
+    """
+    return rate > 0 and random.random() < rate
+
+
+class ProfilingMiddleware:
+    """
+    Middleware that profiles requests on demand.
+
+    A request is profiled when it carries an `X-Wallet-Profile` header equal to
+    WALLET_PROFILE_TOKEN, or when it is picked by WALLET_PROFILE_SAMPLE_RATE. The
+    sampled stacks are written to WALLET_PROFILE_DIR and, for requests that asked
+    with the token, the file name is returned in the `X-Wallet-Profile-File` header.
+
+    When neither a token nor a sampling rate is configured, the middleware removes
+    itself from the middleware chain at startup, so it costs nothing.
+
+    Raises:
+        MiddlewareNotUsed: If profiling is disabled.
+    """
+    def __init__(self, get_response):
+        self.token = settings.WALLET_PROFILE_TOKEN
+        self.sample_rate = settings.WALLET_PROFILE_SAMPLE_RATE
+        if not self.token and not self.sample_rate:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def is_privileged(self, request):
+        """
+        Reports whether the request carries the profiling token.
+        """
+        header = request.META.get(PROFILE_HEADER)
+        return bool(self.token and header) and hmac.compare_digest(header.encode(), self.token.encode())
+
+    def __call__(self, request):
+        privileged = self.is_privileged(request)
+        if not privileged and not sampled(self.sample_rate):
+            return self.get_response(request)
+
+        with StackSampler() as sampler:
+            response = self.get_response(request)
+        match = request.resolver_match
+        path = write_profile(f"http.{request.method}.{match.view_name if match else 'unresolved'}", sampler.stacks)
+        if privileged:
+            response[PROFILE_FILE_HEADER] = os.path.basename(path)
+        return response
+
+
+def profile_task(func):
+    """
+    Decorator that profiles a fraction of the runs of a Celery task.
+
+    Runs are picked by WALLET_PROFILE_TASK_SAMPLE_RATE and their sampled stacks are
+    written to WALLET_PROFILE_DIR under the name of the task function. Put it below
+    `@shared_task`. When the rate is 0, a run costs one settings lookup.
+
+    Args:
+        func (callable): The task function.
+
+    Returns:
+        callable: The wrapped function.
+    """
+    label = f"task.{func.__module__}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not sampled(settings.WALLET_PROFILE_TASK_SAMPLE_RATE):
+            return func(*args, **kwargs)
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            write_profile(label, sampler.stop())
+
+    return wrapper
@@ -1,8 +1,41 @@
 import os
 from celery import Celery
+from celery.signals import celeryd_init
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wallet.settings')
+# System checks run with `manage.py check` on deploy. Running them again at worker boot
+# imports the URLconf, the views and Django REST framework, which tasks never use.
+# Set CELERY_SKIP_CHECKS to an empty string to run them anyway.
+os.environ.setdefault('CELERY_SKIP_CHECKS', '1')
 
 app = Celery('WalletCeleryApp')
 app.config_from_object('django.conf:settings', namespace='CELERY')
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+@celeryd_init.connect
+def apply_worker_profile(sender=None, instance=None, conf=None, **kwargs):
+    """
+    Applies the worker profile named by the WALLET_WORKER_PROFILE environment variable.
+
+    The profile sets the queues the worker consumes from, its concurrency, prefetch
+    multiplier, acks_late and time limits. Options given on the command line, such as
+    `-Q` or `--concurrency`, still take precedence over the profile.
+
+    Args:
+        sender (str): The hostname of the worker.
+        instance (celery.apps.worker.Worker): The worker being initialized.
+        conf (celery.app.utils.Settings): The configuration of the worker.
+    """
+    profile_name = os.environ.get('WALLET_WORKER_PROFILE')
+    if not profile_name:
+        return
+    from django.conf import settings
+    profile = settings.CELERY_WORKER_PROFILES[profile_name]
+    conf.update(
+        worker_concurrency=profile['concurrency'],
+        worker_prefetch_multiplier=profile['prefetch_multiplier'],
+        task_acks_late=profile['acks_late'],
+        task_soft_time_limit=profile['soft_time_limit'],
+        task_time_limit=profile['time_limit'],
+    )
+    instance.app.amqp.queues.select(profile['queues'])
@@ -11,7 +11,9 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
 from pathlib import Path
-from base.vars import BROKER_URL
+from celery.schedules import crontab
+from kombu import Queue
+from base.vars import BROKER_URL, DEFAULT_QUEUE, WITHDRAW_URGENT_QUEUE, WITHDRAW_SCHEDULED_QUEUE, WITHDRAW_RETRY_QUEUE, WITHDRAW_BULK_QUEUE, PAYOUT_POLL_BASE_INTERVAL, LEDGER_FOLD_INTERVAL, WEBHOOK_QUEUE, WEBHOOK_RETRY_BASE_INTERVAL
 from wallet.init import initialize_secret_key
 import os
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -49,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'base.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,6 +59,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'wallets.sharding.WalletShardMiddleware',
 ]
 
 ROOT_URLCONF = 'wallet.urls'
@@ -89,6 +93,21 @@ DATABASES = {
     }
 }
 
+# Horizontal sharding of the wallets, see wallets/sharding.py. WALLET_SHARDS lists the
+# database aliases the wallet tables are partitioned over, by a hash of the wallet
+# UUID; a single alias disables sharding. Every other app stays on 'default'. The
+# SQLite aliases below make sharding testable locally, e.g. with
+#   WALLET_SHARDS=default,shard_1,shard_2 python manage.py migrate --database shard_1
+DATABASES.update({
+    f'shard_{index}': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'db_shard_{index}.sqlite3',
+    }
+    for index in range(1, 4)
+})
+WALLET_SHARDS = os.environ.get('WALLET_SHARDS', 'default').split(',')
+DATABASE_ROUTERS = ['wallets.sharding.WalletShardRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -137,6 +156,184 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [],
     'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'wallets.messagepack.MessagePackRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+        'wallets.messagepack.MessagePackParser',
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'wallets.throttling.ClientRateThrottle',
+        'wallets.throttling.WalletRateThrottle',
+    ],
+    # Token bucket limits per endpoint scope: '<capacity>/<period>' allows bursts of
+    # <capacity> requests, refilled at <capacity> tokens per period.
+    'DEFAULT_THROTTLE_RATES': {
+        'deposit_wallet': '60/min',
+        'deposit_client': '600/min',
+        'withdraw_wallet': '10/min',
+        'withdraw_client': '120/min',
+        'transfer_wallet': '60/min',
+        'transfer_client': '600/min',
+        'transfer_batch_client': '60/min',
+        'schedule_withdraw_wallet': '10/min',
+        'schedule_withdraw_client': '120/min',
+        'bulk_create_wallet_client': '60/min',
+        'schedule_withdraw_batch_client': '30/min',
+        'webhook_wallet': '10/min',
+        'webhook_client': '120/min',
+    },
+}
+
+# Cache alias used to share rate limit buckets between processes.
+# None keeps the buckets in process memory.
+WALLET_THROTTLE_CACHE = None
+
+# Serve the deposit, withdraw and retrieve endpoints through the fast path:
+# JSON only, no content negotiation, lightweight amount validation and trimmed
+# retrieve payloads. See wallets/fastpath.py.
+WALLET_FAST_PATH = False
+
+# Append-only ledger mode: deposits and withdrawals only insert ledger entries and
+# the wallet balance is materialized by the fold_ledger_entries task. Balances are
+# read as the materialized balance plus the unfolded entries. See wallets/ledger.py.
+WALLET_APPEND_ONLY_LEDGER = False
+
+# Integer minor-unit columns: every balance and amount write also fills the
+# BigInteger balance_minor and amount_minor columns (cents). Enable it on every
+# process, then run `python manage.py backfill_minor_units`. See wallets/minor_units.py.
+WALLET_MINOR_UNITS = False
+
+# Render balances and amounts from the minor-unit columns without building Decimals.
+# Only enable it once `python manage.py backfill_minor_units --verify` reports no row
+# out of step; it has no effect without WALLET_MINOR_UNITS.
+WALLET_MINOR_UNIT_READS = False
+
+# In-process LRU cache mapping wallet UUIDs to primary keys, so the wallet
+# endpoints load wallets by primary key. 0 disables the cache. Unknown UUIDs are
+# cached for WALLET_PK_CACHE_NEGATIVE_TTL seconds. See wallets/pk_cache.py.
+WALLET_PK_CACHE_SIZE = 100000
+WALLET_PK_CACHE_NEGATIVE_TTL = 5
+
+# On-demand profiling, see base/profiling.py. Requests sending the header
+# `X-Wallet-Profile: <WALLET_PROFILE_TOKEN>` are profiled, as are the given
+# fractions of requests and task runs. With no token and zero rates the
+# middleware is removed at startup. Collapsed stacks are written to
+# WALLET_PROFILE_DIR, sampled every WALLET_PROFILE_INTERVAL seconds.
+WALLET_PROFILE_TOKEN = os.environ.get('WALLET_PROFILE_TOKEN') or None
+WALLET_PROFILE_SAMPLE_RATE = float(os.environ.get('WALLET_PROFILE_SAMPLE_RATE', 0))
+WALLET_PROFILE_TASK_SAMPLE_RATE = float(os.environ.get('WALLET_PROFILE_TASK_SAMPLE_RATE', 0))
+WALLET_PROFILE_DIR = os.environ.get('WALLET_PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+WALLET_PROFILE_INTERVAL = 0.005
+
+# Queries on these tables that take at least WALLET_SLOW_QUERY_MS milliseconds
+# are printed and stored with their EXPLAIN plan, see wallets/slow_queries.py.
+# The recorder is opt-in: it is disabled while WALLET_SLOW_QUERY_MS is None; set it
+# to e.g. 100 to enable it. An empty table list records slow queries on every table.
+# Stored queries older than WALLET_SLOW_QUERY_RETENTION_DAYS are deleted by the
+# cleanup_slow_queries task.
+WALLET_SLOW_QUERY_MS = None
+WALLET_SLOW_QUERY_TABLES = ('wallets_wallet', 'wallets_transaction')
+WALLET_SLOW_QUERY_RETENTION_DAYS = 7
+
+CELERY_BROKER_URL = BROKER_URL
+
+# Withdrawals are split over dedicated queues so that a large batch of scheduled
+# payouts cannot delay time-sensitive work. Each queue is served by its own workers.
+CELERY_TASK_DEFAULT_QUEUE = DEFAULT_QUEUE
+CELERY_TASK_QUEUES = (
+    Queue(DEFAULT_QUEUE),
+    Queue(WITHDRAW_URGENT_QUEUE),
+    Queue(WITHDRAW_SCHEDULED_QUEUE),
+    Queue(WITHDRAW_RETRY_QUEUE),
+    Queue(WITHDRAW_BULK_QUEUE),
+    Queue(WEBHOOK_QUEUE),
+)
+CELERY_TASK_ROUTES = {
+    'wallets.tasks.process_withdrawal': {'queue': WITHDRAW_SCHEDULED_QUEUE},
+    'wallets.tasks.process_withdrawal_batch': {'queue': WITHDRAW_BULK_QUEUE},
+    'wallets.tasks.replay_withdrawal_batch': {'queue': WITHDRAW_RETRY_QUEUE},
+    'wallets.tasks.deliver_webhooks': {'queue': WEBHOOK_QUEUE},
+}
+
+# Worker profiles, selected with the WALLET_WORKER_PROFILE environment variable:
+#   WALLET_WORKER_PROFILE=urgent celery -A wallet worker -E
+# Withdrawal tasks call the bank, which is not idempotent, so acks_late stays off for
+# them: a worker crash loses the task instead of paying out twice.
+CELERY_WORKER_PROFILES = {
+    'urgent': {
+        'queues': [WITHDRAW_URGENT_QUEUE],
+        'concurrency': 8,
+        'prefetch_multiplier': 1,
+        'acks_late': False,
+        'soft_time_limit': 20,
+        'time_limit': 30,
+    },
+    'scheduled': {
+        'queues': [WITHDRAW_SCHEDULED_QUEUE],
+        'concurrency': 8,
+        'prefetch_multiplier': 4,
+        'acks_late': False,
+        'soft_time_limit': 60,
+        'time_limit': 90,
+    },
+    'retry': {
+        'queues': [WITHDRAW_RETRY_QUEUE],
+        'concurrency': 2,
+        'prefetch_multiplier': 1,
+        'acks_late': False,
+        'soft_time_limit': 60,
+        'time_limit': 90,
+    },
+    'bulk': {
+        'queues': [WITHDRAW_BULK_QUEUE, DEFAULT_QUEUE],
+        'concurrency': 16,
+        'prefetch_multiplier': 8,
+        'acks_late': False,
+        'soft_time_limit': 300,
+        'time_limit': 360,
+    },
+    # Each webhook task sends from its own pool of WEBHOOK_WORKERS threads, and a
+    # delivery sent twice is deduplicated by the receiver, so acks_late is safe here.
+    'webhooks': {
+        'queues': [WEBHOOK_QUEUE],
+        'concurrency': 2,
+        'prefetch_multiplier': 1,
+        'acks_late': True,
+        'soft_time_limit': 300,
+        'time_limit': 360,
+    },
 }
 
-CELERY_BROKER_URL = BROKER_URL
\ No newline at end of file
+# Static periodic tasks. The DatabaseScheduler copies them into the beat tables on start-up.
+CELERY_BEAT_SCHEDULE = {
+    'cleanup-spent-schedules': {
+        'task': 'wallets.tasks.cleanup_spent_schedules',
+        'schedule': crontab(minute=15),
+    },
+    'run-standing-orders': {
+        'task': 'wallets.tasks.run_standing_orders',
+        'schedule': crontab(),
+    },
+    'poll-pending-payouts': {
+        'task': 'wallets.tasks.poll_pending_payouts',
+        'schedule': float(PAYOUT_POLL_BASE_INTERVAL),
+    },
+    'fold-ledger-entries': {
+        'task': 'wallets.tasks.fold_ledger_entries',
+        'schedule': float(LEDGER_FOLD_INTERVAL),
+    },
+    'deliver-webhooks': {
+        'task': 'wallets.tasks.deliver_webhooks',
+        'schedule': float(WEBHOOK_RETRY_BASE_INTERVAL),
+    },
+    'cleanup-slow-queries': {
+        'task': 'wallets.tasks.cleanup_slow_queries',
+        'schedule': crontab(minute=45, hour=3),
+    },
+}
@@ -0,0 +1,34 @@
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """
+    Returns a module that is only executed when one of its attributes is first accessed.
+
+    Heavy dependencies that are only needed by a few code paths, such as the HTTP client
+    used to call the bank, are bound at module level with this helper so that web and
+    Celery processes do not pay for them at startup. Attribute access, including
+    `unittest.mock.patch('package.module.attribute')`, loads the module transparently.
+    A module that is already imported is returned as is.
+
+    Args:
+        name (str): The dotted name of the module.
+
+    Returns:
+        module: The module, loaded on first attribute access.
+
+    Raises:
+        ModuleNotFoundError: If the module cannot be found.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
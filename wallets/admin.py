@@ -1,5 +1,8 @@
+from http import HTTPStatus
 from django.contrib import admin
-from wallets.models import Wallet, Transaction, ScheduledWithdrawal
+from base.paginators import EstimatedCountPaginator
+from base.vars import PAYOUT_FAILURE_STATUSES
+from wallets.models import Wallet, Transaction, ScheduledWithdrawal, OutboxEvent
 
 @admin.register(Wallet)
 class WalletAdmin(admin.ModelAdmin):
@@ -22,10 +25,38 @@ class WalletAdmin(admin.ModelAdmin):
 
         readonly_fields (tuple): A tuple of field names that will be read-only in the admin interface.
             - 'uuid': The unique identifier for the wallet, which cannot be modified.
+
+        paginator (Paginator): Estimates the row count instead of running COUNT(*).
+        show_full_result_count (bool): Disables the second, unfiltered COUNT(*) query.
     """
     list_display = ('uuid', 'balance','updated_at','created_at')
     search_fields = ('uuid',)
     readonly_fields = ('uuid',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+class BankStatusCodeFilter(admin.SimpleListFilter):
+    """
+    List filter for the status code returned by the bank.
+
+    The choices are static, so rendering the filter does not run a DISTINCT query
+    over the whole Transaction table like the default field filter does. Besides the
+    codes of paid and failed withdrawals, they include 202 for pending payouts and the
+    PAYOUT_FAILURE_STATUSES of payouts the bank rejected.
+    """
+    title = 'bank status code'
+    parameter_name = 'bank_status_code'
+    labels = {200: 'OK', 408: 'Request Timeout', 500: 'HTTP Error', 503: 'Service Unavailable'}
+
+    def lookups(self, request, model_admin):
+        labels = {code: HTTPStatus(code).phrase for code in (202, *PAYOUT_FAILURE_STATUSES)}
+        labels.update(self.labels)
+        return tuple((str(code), f"{code} {label}") for code, label in sorted(labels.items()))
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(bank_status_code=self.value())
+        return queryset
 
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
@@ -35,6 +66,8 @@ class TransactionAdmin(admin.ModelAdmin):
     This class defines the display options and filters for the Transaction model
     in the Django admin interface. It specifies which fields will be shown in 
     the list display and which fields can be used to filter the transactions.
+    The changelist is built to stay fast on tables with tens of millions of rows:
+    it runs a constant number of queries per page and never counts the full table.
 
     Attributes:
         list_display (tuple): A tuple of field names to display in the list view.
@@ -48,9 +81,25 @@ class TransactionAdmin(admin.ModelAdmin):
 
         list_filter (tuple): A tuple of field names to filter the transactions in the list view.
             - 'is_withdrawal': Filters the transactions based on whether they are withdrawals.
+            - 'settle': Filters the transactions based on whether they are settled.
+            - BankStatusCodeFilter: Filters the transactions based on the bank status code.
+
+        list_select_related (tuple): Fetches the wallet in the same query as the transactions.
+        raw_id_fields (tuple): Shows the wallet as an id input instead of a select of all wallets.
+        date_hierarchy (str): Drill-down navigation on the indexed 'created_at' field.
+        ordering (tuple): Newest first by primary key, so `?id__lt=<id>` pages through the
+            table by keyset instead of by offset.
+        paginator (Paginator): Estimates the row count instead of running COUNT(*).
+        show_full_result_count (bool): Disables the second, unfiltered COUNT(*) query.
     """
     list_display = ('wallet','amount', 'is_withdrawal','settle','bank_status_code','bank_message','created_at')
-    list_filter = ('is_withdrawal',)
+    list_filter = ('is_withdrawal', 'settle', BankStatusCodeFilter)
+    list_select_related = ('wallet',)
+    raw_id_fields = ('wallet',)
+    date_hierarchy = 'created_at'
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 @admin.register(ScheduledWithdrawal)
 class ScheduledWithdrawalAdmin(admin.ModelAdmin):
@@ -65,6 +114,50 @@ class ScheduledWithdrawalAdmin(admin.ModelAdmin):
         list_display (tuple): A tuple of field names to display in the list view.
             - 'wallet': The wallet associated with the scheduled withdrawal.
             - 'amount': The amount of the scheduled withdrawal.
+            - 'scheduled_time': The time the withdrawal is scheduled for.
             - 'processed': Whether the scheduled withdrawal has been processed.
+
+        list_filter (tuple): A tuple of field names to filter the scheduled withdrawals.
+            - 'processed': Filters the scheduled withdrawals based on whether they are processed.
+
+        list_select_related (tuple): Fetches the wallet in the same query as the withdrawals.
+        raw_id_fields (tuple): Shows the wallet as an id input instead of a select of all wallets.
+        date_hierarchy (str): Drill-down navigation on the indexed 'scheduled_time' field.
+        ordering (tuple): Newest first by primary key, so `?id__lt=<id>` pages by keyset.
+        paginator (Paginator): Estimates the row count instead of running COUNT(*).
+        show_full_result_count (bool): Disables the second, unfiltered COUNT(*) query.
+    """
+    list_display = ('wallet', 'amount', 'scheduled_time', 'processed')
+    list_filter = ('processed',)
+    list_select_related = ('wallet',)
+    raw_id_fields = ('wallet',)
+    date_hierarchy = 'scheduled_time'
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    """
+    Admin configuration for the OutboxEvent model.
+
+    Attributes:
+        list_display (tuple): A tuple of field names to display in the list view.
+            - 'id': The id of the event, which is also its publishing order.
+            - 'event_type': The type of the event.
+            - 'wallet_uuid': The UUID of the wallet the event belongs to.
+            - 'created_at': The timestamp when the event was recorded.
+            - 'published_at': The timestamp when the broker confirmed the event.
+
+        list_filter (tuple): A tuple of field names to filter the events in the list view.
+            - 'event_type': Filters the events based on their type.
+
+        ordering (tuple): Newest first by primary key.
+        paginator (Paginator): Estimates the row count instead of running COUNT(*).
+        show_full_result_count (bool): Disables the second, unfiltered COUNT(*) query.
     """
-    list_display = ('wallet', 'amount', 'processed')
\ No newline at end of file
+    list_display = ('id', 'event_type', 'wallet_uuid', 'created_at', 'published_at')
+    list_filter = ('event_type',)
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
@@ -4,3 +4,20 @@ from django.apps import AppConfig
 class WalletsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'wallets'
+
+    def ready(self):
+        """
+        Installs the slow query recorder on every new database connection and keeps
+        the wallet UUID cache in sync with created and deleted wallets. With sharding
+        enabled, each shard gets its own primary key range after `migrate`.
+        """
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_migrate, post_save
+        from wallets.pk_cache import forget_created_wallet, forget_deleted_wallet
+        from wallets.sharding import reset_sequences_after_migrate
+        from wallets.slow_queries import install_slow_query_recorder
+
+        connection_created.connect(install_slow_query_recorder, dispatch_uid='wallets_slow_query_recorder')
+        post_save.connect(forget_created_wallet, sender='wallets.Wallet', dispatch_uid='wallets_pk_cache_created')
+        post_delete.connect(forget_deleted_wallet, sender='wallets.Wallet', dispatch_uid='wallets_pk_cache_deleted')
+        post_migrate.connect(reset_sequences_after_migrate, sender=self, dispatch_uid='wallets_shard_sequences')
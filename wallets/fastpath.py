@@ -0,0 +1,129 @@
+import json
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils import encoders
+from wallets.messagepack import MessagePackParser, MessagePackRenderer
+
+AMOUNT_QUANTUM = Decimal('0.01')
+
+
+def fast_path_enabled():
+    """
+    Returns whether the hot endpoints use the fast path.
+
+    Returns:
+        bool: The value of the WALLET_FAST_PATH setting.
+    """
+    return getattr(settings, 'WALLET_FAST_PATH', False)
+
+
+def parse_amount(value, max_digits=10, decimal_places=2):
+    """
+    Parses a positive amount the way DepositSerializer and WithdrawSerializer do.
+
+    Only inputs that the serializers accept are parsed here, and they yield the same
+    Decimal. Anything else returns None, and the caller falls back to the serializer,
+    which produces the usual error messages. The fast path therefore never accepts an
+    amount the serializers reject.
+
+    Args:
+        value: The raw `amount` value of the request data.
+        max_digits (int): The maximum number of digits of the amount.
+        decimal_places (int): The maximum number of decimal places of the amount.
+
+    Returns:
+        Decimal: The amount quantized to `decimal_places`, or None if the value is not
+            a plain positive amount within the limits.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, str, float, Decimal)):
+        return None
+    try:
+        amount = Decimal(str(value).strip())
+    except InvalidOperation:
+        return None
+    if not amount.is_finite() or amount <= 0:
+        return None
+    sign, digits, exponent = amount.as_tuple()
+    if exponent >= 0:
+        total_digits, places = len(digits) + exponent, 0
+    elif len(digits) > -exponent:
+        total_digits, places = len(digits), -exponent
+    else:
+        total_digits, places = -exponent, -exponent
+    if total_digits > max_digits or places > decimal_places or total_digits - places > max_digits - decimal_places:
+        return None
+    return amount.quantize(AMOUNT_QUANTUM)
+
+
+class FastJSONRenderer(BaseRenderer):
+    """
+    JSON renderer without indentation handling or browsable API support.
+
+    The output matches JSONRenderer in compact mode, so clients see the same JSON.
+    """
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """
+        Renders the data into compact JSON.
+        """
+        if data is None:
+            return b''
+        return json.dumps(data, cls=encoders.JSONEncoder, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode()
+
+
+class FastPathMixin:
+    """
+    View mixin that short-cuts content negotiation and parsing when the fast path is on.
+
+    With WALLET_FAST_PATH enabled, requests are parsed as JSON or MessagePack only, and
+    responses are rendered with MessagePackRenderer when the Accept header is exactly
+    its media type, otherwise with FastJSONRenderer. Content negotiation and the
+    browsable API are skipped. With the setting disabled, the view behaves as before.
+    """
+    fast_renderer = FastJSONRenderer()
+    msgpack_renderer = MessagePackRenderer()
+
+    def get_parsers(self):
+        """
+        Returns only the JSON and MessagePack parsers on the fast path.
+        """
+        if fast_path_enabled():
+            return [JSONParser(), MessagePackParser()]
+        return super().get_parsers()
+
+    def perform_content_negotiation(self, request, force=False):
+        """
+        Selects the fast JSON or the MessagePack renderer without negotiation on the fast path.
+        """
+        if fast_path_enabled():
+            renderer = self.msgpack_renderer if request.META.get('HTTP_ACCEPT') == self.msgpack_renderer.media_type else self.fast_renderer
+            return (renderer, renderer.media_type)
+        return super().perform_content_negotiation(request, force)
+
+    def validated_amount(self, request, serializer_class):
+        """
+        Validates the `amount` of the request.
+
+        On the fast path the amount is parsed with `parse_amount`, and the serializer
+        only runs when that fails, to report the error.
+
+        Args:
+            request (Request): The request.
+            serializer_class (type): The serializer that defines the amount rules.
+
+        Returns:
+            tuple: The amount and None, or None and the serializer errors.
+        """
+        if fast_path_enabled():
+            amount = parse_amount(request.data.get('amount')) if hasattr(request.data, 'get') else None
+            if amount is not None:
+                return amount, None
+        serializer = serializer_class(data=request.data)
+        if serializer.is_valid():
+            return serializer.validated_data['amount'], None
+        return None, serializer.errors
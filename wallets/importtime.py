@@ -0,0 +1,105 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from django.conf import settings
+
+# Python snippets that reproduce the imports a process does before it serves its first request or task.
+STARTUP_TARGETS = {
+    'check': (
+        "from django.core.management import execute_from_command_line; "
+        "execute_from_command_line(['manage.py', 'check'])"
+    ),
+    'web': (
+        "import django; django.setup(); "
+        "from django.conf import settings; from django.urls import get_resolver; "
+        "get_resolver(settings.ROOT_URLCONF).url_patterns"
+    ),
+    'worker': (
+        "from wallet.celery import app; "
+        "app.loader.import_default_modules()"
+    ),
+}
+
+# Printed by the profiled process once it has started. Modules bound with `lazy_import` that were never used are left out.
+LOADED_MODULES_REPORT = (
+    "; import json, sys; "
+    "print(json.dumps(sorted(name for name, module in list(sys.modules.items()) if type(module).__name__ != '_LazyModule')))"
+)
+
+# Modules each process must only import on first use, never at startup. Web processes
+# cannot avoid `requests`, which Django REST framework imports in `rest_framework.compat`.
+LAZY_MODULES = {
+    'check': ('wallets.tasks', 'django_celery_beat.schedulers'),
+    'web': ('wallets.tasks', 'django_celery_beat.schedulers'),
+    'worker': ('requests', 'django_celery_beat.schedulers'),
+}
+
+
+def startup_command(target):
+    """
+    Returns the command line that starts a process of the given kind.
+
+    Args:
+        target (str): One of the keys of STARTUP_TARGETS.
+
+    Returns:
+        list: The arguments of the process, with import time reporting enabled.
+    """
+    return [sys.executable, '-X', 'importtime', '-c', STARTUP_TARGETS[target] + LOADED_MODULES_REPORT]
+
+
+def parse_importtime(output):
+    """
+    Parses the report written to stderr by `python -X importtime`.
+
+    Args:
+        output (str): The stderr of the process.
+
+    Returns:
+        list: A (module, self_us, cumulative_us) tuple per imported module, in import order.
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue
+        imports.append((module.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def profile_startup(target):
+    """
+    Starts a fresh interpreter of the given kind and records what it imports.
+
+    The process runs with the environment of the caller, so it uses the same settings
+    module. Its wall time includes interpreter start-up, which is what cold start and
+    autoscaling pay for. The import report misses modules loaded through
+    `importlib.import_module`, such as models and task modules, so the names of all
+    loaded modules are returned as well.
+
+    Args:
+        target (str): One of the keys of STARTUP_TARGETS.
+
+    Returns:
+        tuple: The wall time of the process in seconds, the parsed import report and
+            the set of modules loaded at the end of startup.
+
+    Raises:
+        subprocess.CalledProcessError: If the process exits with an error.
+    """
+    started = time.perf_counter()
+    process = subprocess.run(
+        startup_command(target),
+        cwd=settings.BASE_DIR,
+        env={**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'wallet.settings')},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    elapsed = time.perf_counter() - started
+    loaded = set(json.loads(process.stdout.splitlines()[-1]))
+    return elapsed, parse_importtime(process.stderr), loaded
@@ -0,0 +1,58 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from wallets.sharding import wallet_db
+from base.vars import LEDGER_FOLD_BATCH_SIZE
+
+
+def append_only_ledger_enabled():
+    """
+    Returns whether deposits and withdrawals only append ledger entries.
+
+    Returns:
+        bool: The value of the WALLET_APPEND_ONLY_LEDGER setting.
+    """
+    return getattr(settings, 'WALLET_APPEND_ONLY_LEDGER', False)
+
+
+def fold_ledger(batch_size=LEDGER_FOLD_BATCH_SIZE):
+    """
+    Materializes the next batch of unfolded ledger entries into the wallet balances.
+
+    The oldest unfolded entries are read from the partial unfolded index and locked with
+    SELECT ... FOR UPDATE SKIP LOCKED, so concurrent folders take different entries and
+    a withdrawal still waiting on the bank is left for a later pass. Their balance effect
+    is summed per wallet, each wallet balance is moved by its sum with one UPDATE, in
+    primary key order, and the entries are marked folded in the same database
+    transaction. A reader therefore sees every entry either in the balance or in the
+    tail, never in both. Settled entries are added to the daily aggregates when folded.
+
+    Progress is kept per entry rather than as an id watermark: withdrawals hold their
+    database transaction open across the bank call, so entries commit out of id order
+    and an entry below a watermark could still appear after the folder passed it.
+
+    Args:
+        batch_size (int): The maximum number of entries to fold.
+
+    Returns:
+        int: The number of entries folded.
+    """
+    from wallets.models import Transaction, Wallet, WalletDailyAggregate
+
+    now = timezone.now()
+    with transaction.atomic(using=wallet_db()):
+        entries = list(Transaction.objects.unfolded().select_for_update(skip_locked=True).order_by('id')[:batch_size])
+        if not entries:
+            return 0
+        deltas = defaultdict(Decimal)
+        for entry in entries:
+            if entry.settle or entry.pending:
+                deltas[entry.wallet_id] += -entry.amount if entry.is_withdrawal else entry.amount
+        for wallet_id in sorted(deltas):
+            if deltas[wallet_id]:
+                Wallet.objects.filter(pk=wallet_id).update(**Wallet.objects.balance_change(deltas[wallet_id]), updated_at=now)
+        Transaction.objects.filter(pk__in=[entry.pk for entry in entries]).update(folded=True, updated_at=now)
+        WalletDailyAggregate.objects.record_many(entries)
+    return len(entries)
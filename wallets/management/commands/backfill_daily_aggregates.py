@@ -0,0 +1,84 @@
+import time
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from wallets.models import Transaction, Wallet, WalletDailyAggregate
+from wallets.sharding import use_shard, wallet_db, wallet_shards
+
+
+class Command(BaseCommand):
+    """
+    Management command that rebuilds the daily per-wallet aggregates from the ledger history.
+
+    The wallets are processed in primary key chunks. For each chunk, in one transaction,
+    the wallet rows are locked in primary key order, their aggregates are deleted and
+    rebuilt from their settled ledger rows. Ledger writes of these wallets wait for the
+    chunk to commit, so a ledger row is either counted by the rebuild or added to the
+    rebuilt aggregates afterwards, never both. The aggregates of a chunk are therefore
+    swapped atomically, and running the command again, or resuming it with
+    `--start-wallet`, gives the same result while the service keeps writing. Appended
+    ledger entries are left to the ledger folder until they are folded. With sharding
+    enabled, the shards are processed in turn.
+
+    Usage:
+        python manage.py backfill_daily_aggregates [--chunk-size 1000] [--start-wallet 0]
+    """
+    help = "Rebuilds the daily per-wallet aggregates from the Transaction history in chunks of wallets."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Number of wallet ids per chunk.")
+        parser.add_argument('--start-wallet', type=int, default=0, help="Resume after this wallet id.")
+
+    def rebuild(self, first_id, last_id):
+        """
+        Replaces the aggregates of the wallets with ids in [first_id, last_id] and
+        returns the number of aggregates written.
+        """
+        with transaction.atomic(using=wallet_db()):
+            list(Wallet.objects.select_for_update().filter(pk__gte=first_id, pk__lte=last_id).order_by('pk').values_list('pk', flat=True))
+            WalletDailyAggregate.objects.filter(wallet_id__gte=first_id, wallet_id__lte=last_id).delete()
+            rows = (
+                Transaction.objects
+                .filter(wallet_id__gte=first_id, wallet_id__lte=last_id, settle=True)
+                .exclude(appended=True, folded=False)
+                .annotate(day=TruncDate('created_at'))
+                .values('wallet_id', 'day', 'is_withdrawal')
+                .annotate(total=Sum('amount'), count=Count('id'))
+                .order_by()
+            )
+            aggregates = defaultdict(dict)
+            for row in rows:
+                kind = 'withdrawal' if row['is_withdrawal'] else 'deposit'
+                aggregates[(row['wallet_id'], row['day'])].update({f'{kind}_total': row['total'], f'{kind}_count': row['count']})
+            WalletDailyAggregate.objects.bulk_create(
+                [WalletDailyAggregate(wallet_id=wallet_id, date=day, **totals) for (wallet_id, day), totals in aggregates.items()],
+            )
+        return len(aggregates)
+
+    def backfill(self, start_id, chunk_size):
+        """
+        Rebuilds the aggregates of the wallets of the current shard after `start_id` and
+        returns the last wallet id.
+        """
+        bounds = Wallet.objects.aggregate(first_id=Min('id'), last_id=Max('id'))
+        last_id = bounds['last_id'] or 0
+        # Each shard has its own range of ids, so the scan starts at the first one.
+        start_id = max(start_id, (bounds['first_id'] or 1) - 1)
+        while start_id < last_id:
+            end_id = min(start_id + chunk_size, last_id)
+            written = self.rebuild(start_id + 1, end_id)
+            self.stdout.write(f"Rebuilt {written} aggregates of wallets {start_id + 1}-{end_id} of {last_id}.")
+            start_id = end_id
+        return last_id
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        last_ids = []
+        for shard in wallet_shards():
+            with use_shard(shard):
+                last_ids.append(self.backfill(options['start_wallet'], options['chunk_size']))
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Backfill finished up to wallet {max(last_ids)} in {elapsed:.3f}s."))
@@ -0,0 +1,50 @@
+from collections import Counter
+from django.core.management.base import BaseCommand
+from wallets.minor_units import backfill_minor_units, minor_unit_mismatches, minor_units_enabled
+from wallets.sharding import for_each_shard
+from base.vars import MINOR_UNITS_BACKFILL_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Management command that copies the wallet balances and transaction amounts into
+    their integer minor-unit columns.
+
+    This is the backfill step of the online migration to minor units: the columns are
+    added empty by a migration, WALLET_MINOR_UNITS is enabled on every process so new
+    writes fill them, and this command copies the existing rows in primary key batches
+    while the service keeps running. It can be run again at any time. With `--verify`
+    nothing is written and the rows whose minor-unit value is missing or differs from
+    the decimal value are counted instead; minor-unit reads may only be enabled once
+    there are none. With sharding enabled, every shard is
+    backfilled or verified in turn.
+
+    Usage:
+        python manage.py backfill_minor_units [--batch-size 1000] [--verify]
+    """
+    help = "Copies balances and amounts into the minor-unit columns in batches, or verifies them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=MINOR_UNITS_BACKFILL_BATCH_SIZE, help="Number of primary keys per UPDATE.")
+        parser.add_argument('--verify', action='store_true', help="Only count the rows out of step.")
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            mismatches = Counter()
+            for shard_mismatches in for_each_shard(lambda shard: minor_unit_mismatches(), parallel=False).values():
+                mismatches.update(shard_mismatches)
+            summary = ', '.join(f"{count} {name} rows" for name, count in mismatches.items())
+            if any(mismatches.values()):
+                self.stdout.write(self.style.WARNING(f"Out of step: {summary}. Keep WALLET_MINOR_UNIT_READS disabled and backfill again."))
+            else:
+                self.stdout.write(self.style.SUCCESS("Every balance and amount matches its minor-unit value. WALLET_MINOR_UNIT_READS can be enabled."))
+            return
+        if not minor_units_enabled():
+            self.stdout.write(self.style.WARNING(
+                "WALLET_MINOR_UNITS is disabled here, so writes after the backfill will not update the minor-unit columns."
+            ))
+        counts = Counter()
+        for shard_counts in for_each_shard(lambda shard: backfill_minor_units(batch_size=options['batch_size']), parallel=False).values():
+            counts.update(shard_counts)
+        summary = ', '.join(f"{count} {name} rows" for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {summary} in batches of {options['batch_size']}."))
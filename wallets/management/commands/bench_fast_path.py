@@ -0,0 +1,71 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+from wallets.fastpath import FastJSONRenderer, parse_amount
+from wallets.models import Wallet
+from wallets.serializers import DepositSerializer
+from wallets.views import CreateDepositView, RetrieveWalletView
+
+
+class Command(BaseCommand):
+    """
+    Management command that compares the CPU time per request of the fast path and the
+    regular DRF stack.
+
+    The retrieve and deposit views are called directly with requests built by a
+    request factory, first with WALLET_FAST_PATH disabled and then enabled. The CPU
+    time of the process is measured, so waiting on the database does not count, but
+    the database driver's CPU work does. Deposits run in a transaction that is rolled
+    back at the end. The amount validation and the rendering are also timed on their
+    own, since the ledger writes dominate the deposit request.
+
+    Usage:
+        python manage.py bench_fast_path [--requests 2000]
+    """
+    help = "Measures CPU time per request of the hot endpoints with and without the fast path."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help="Number of requests per endpoint and mode.")
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        retrieve = RetrieveWalletView.as_view()
+        deposit = CreateDepositView.as_view()
+        count = options['requests']
+
+        with transaction.atomic():
+            wallet = Wallet.objects.create(balance=100)
+            endpoints = (
+                ('retrieve', lambda: retrieve(factory.get(f'/wallets/{wallet.uuid}/', HTTP_ACCEPT='application/json'), uuid=str(wallet.uuid))),
+                ('deposit', lambda: deposit(factory.post(f'/wallets/{wallet.uuid}/deposit', {'amount': '10.50'}, format='json'), uuid=str(wallet.uuid))),
+            )
+            for name, call in endpoints:
+                results = {}
+                for fast in (False, True):
+                    with override_settings(WALLET_FAST_PATH=fast, REST_FRAMEWORK={'DEFAULT_THROTTLE_CLASSES': [], 'DEFAULT_PERMISSION_CLASSES': [], 'DEFAULT_AUTHENTICATION_CLASSES': []}):
+                        call().render()
+                        started = time.process_time()
+                        for _ in range(count):
+                            call().render()
+                        results[fast] = (time.process_time() - started) / count * 1e6
+                self.stdout.write(
+                    f"{name}: {results[False]:.0f}us CPU/request with the DRF stack, "
+                    f"{results[True]:.0f}us with the fast path ({1 - results[True] / results[False]:.0%} less)"
+                )
+            transaction.set_rollback(True)
+
+        payload = {'uuid': wallet.uuid, 'new_balance': wallet.balance}
+        for name, slow, fast in (
+            ('amount validation', lambda: DepositSerializer(data={'amount': '10.50'}).is_valid(), lambda: parse_amount('10.50')),
+            ('rendering', lambda: JSONRenderer().render(payload, 'application/json', {}), lambda: FastJSONRenderer().render(payload)),
+        ):
+            results = {}
+            for fast_path, call in ((False, slow), (True, fast)):
+                started = time.process_time()
+                for _ in range(count):
+                    call()
+                results[fast_path] = (time.process_time() - started) / count * 1e6
+            self.stdout.write(f"{name}: {results[False]:.1f}us CPU with the DRF stack, {results[True]:.1f}us with the fast path")
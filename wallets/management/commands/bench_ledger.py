@@ -0,0 +1,73 @@
+import threading
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import override_settings
+from wallets.ledger import fold_ledger
+from wallets.models import OutboxEvent, Wallet
+
+
+class Command(BaseCommand):
+    """
+    Management command that compares the write throughput of in-place balance updates
+    and the append-only ledger.
+
+    For each mode a fresh wallet receives deposits from several threads at once, each
+    on its own database connection, so every write of the in-place mode competes for
+    the same wallet and daily aggregate rows. In append-only mode the time the ledger
+    folder then takes to materialize the entries is reported separately. The wallets,
+    their ledger rows and their outbox events are deleted at the end.
+
+    Usage:
+        python manage.py bench_ledger [--threads 4] [--deposits 250]
+    """
+    help = "Measures deposit throughput on one wallet with in-place updates and with the append-only ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help="Number of concurrent writers.")
+        parser.add_argument('--deposits', type=int, default=250, help="Number of deposits per writer.")
+
+    def write_deposits(self, wallet_pk, count, errors):
+        """
+        Deposits `count` times into a wallet on the connection of the current thread.
+        """
+        wallet = Wallet.objects.get(pk=wallet_pk)
+        try:
+            for _ in range(count):
+                try:
+                    wallet.deposit(Decimal('1.00'))
+                except Exception:
+                    errors.append(1)
+        finally:
+            connections.close_all()
+
+    def handle(self, *args, **options):
+        threads, deposits = options['threads'], options['deposits']
+        total = threads * deposits
+        for append_only in (False, True):
+            wallet = Wallet.objects.create(balance=0)
+            errors = []
+            try:
+                with override_settings(WALLET_APPEND_ONLY_LEDGER=append_only):
+                    workers = [threading.Thread(target=self.write_deposits, args=(wallet.pk, deposits, errors)) for _ in range(threads)]
+                    started = time.perf_counter()
+                    for worker in workers:
+                        worker.start()
+                    for worker in workers:
+                        worker.join()
+                    elapsed = time.perf_counter() - started
+                    fold_started = time.perf_counter()
+                    while fold_ledger():
+                        pass
+                    fold_elapsed = time.perf_counter() - fold_started
+                wallet.refresh_from_db()
+                self.stdout.write(
+                    f"{'append-only' if append_only else 'in-place'}: {total / elapsed:.0f} deposits/s "
+                    f"({total} deposits, {threads} threads, {len(errors)} errors, balance {wallet.balance})"
+                    + (f", folded in {fold_elapsed * 1000:.0f}ms" if append_only else "")
+                )
+            finally:
+                OutboxEvent.objects.filter(wallet_uuid=wallet.uuid).delete()
+                wallet.delete()
+        connection.close()
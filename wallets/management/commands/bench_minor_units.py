@@ -0,0 +1,87 @@
+import random
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from django.test import override_settings
+from rest_framework import serializers
+from wallets.models import Wallet, Transaction
+from wallets.minor_units import format_minor_units
+from wallets.serializers import WalletSerializer, TransactionSerializer
+from base.vars import WALLET_BULK_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Management command that compares the cost of decimal and integer minor-unit money
+    columns in the ORM and in the serializers.
+
+    Wallets and ledger rows with random amounts are created with both columns filled,
+    inside a transaction that is rolled back at the end. Each step is timed over the
+    same rows with the decimal column and with the minor-unit column: reading the
+    balances with `values_list`, formatting the amounts as the API renders them,
+    rendering the wallets and transactions with their serializers, and summing the
+    amounts in the database. The times are per row.
+
+    Usage:
+        python manage.py bench_minor_units [--rows 5000] [--repeat 5]
+    """
+    help = "Benchmarks ORM reads, serialization and sums of decimal against minor-unit money columns."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help="Number of wallets and of ledger rows.")
+        parser.add_argument('--repeat', type=int, default=5, help="Number of timed runs per step; the best is kept.")
+
+    def best(self, repeat, rows, run):
+        """
+        Returns the best time of `repeat` runs of `run`, in microseconds per row.
+        """
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+        return min(timings) / rows * 1e6
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        rng = random.Random(0)
+        amounts = [Decimal(rng.randint(1, 9999999999)).scaleb(-2) for _ in range(rows)]
+        with transaction.atomic():
+            with override_settings(WALLET_MINOR_UNITS=True):
+                wallets = Wallet.objects.bulk_create(
+                    [Wallet(balance=amount, balance_minor=int(amount.scaleb(2))) for amount in amounts],
+                    batch_size=WALLET_BULK_BATCH_SIZE,
+                )
+                Transaction.objects.bulk_create(
+                    [Transaction(wallet=wallet, amount=amount, amount_minor=int(amount.scaleb(2)), settle=True) for wallet, amount in zip(wallets, amounts)],
+                    batch_size=WALLET_BULK_BATCH_SIZE,
+                )
+            wallet_rows = Wallet.objects.filter(pk__in=[wallet.pk for wallet in wallets])
+            transaction_rows = Transaction.objects.filter(wallet__in=wallet_rows)
+            loaded_wallets = list(wallet_rows)
+            loaded_transactions = list(transaction_rows)
+            minor_amounts = [int(amount.scaleb(2)) for amount in amounts]
+            decimal_field = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+            steps = (
+                ('read balances', lambda minor: lambda: list(wallet_rows.values_list('balance_minor' if minor else 'balance', flat=True))),
+                ('format amounts', lambda minor: (
+                    (lambda: [format_minor_units(value) for value in minor_amounts]) if minor
+                    else (lambda: [decimal_field.to_representation(value) for value in amounts])
+                )),
+                ('serialize wallets', lambda minor: lambda: WalletSerializer(loaded_wallets, many=True).data),
+                ('serialize transactions', lambda minor: lambda: TransactionSerializer(loaded_transactions, many=True).data),
+                ('sum amounts', lambda minor: lambda: transaction_rows.aggregate(total=Sum('amount_minor' if minor else 'amount'))),
+            )
+            for name, make_run in steps:
+                results = {}
+                for minor in (False, True):
+                    with override_settings(WALLET_MINOR_UNITS=minor, WALLET_MINOR_UNIT_READS=minor):
+                        results[minor] = self.best(repeat, rows, make_run(minor))
+                self.stdout.write(
+                    f"{name}: decimal {results[False]:.2f}us per row, minor units {results[True]:.2f}us per row "
+                    f"({results[True] / results[False] - 1:+.0%})"
+                )
+            transaction.set_rollback(True)
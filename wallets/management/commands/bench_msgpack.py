@@ -0,0 +1,60 @@
+import io
+import time
+import uuid
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from wallets.messagepack import MessagePackParser, MessagePackRenderer
+
+
+class Command(BaseCommand):
+    """
+    Management command that compares MessagePack and JSON payload size and encode/decode time.
+
+    Representative wallet payloads are rendered and parsed with the DRF JSON renderer
+    and parser and with the MessagePack ones: a deposit response, a retrieved wallet and
+    a batch transfer request. The reported times are per payload.
+
+    Usage:
+        python manage.py bench_msgpack [--iterations 2000]
+    """
+    help = "Benchmarks MessagePack against JSON for wallet payloads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000, help="Number of encode/decode rounds per payload.")
+
+    def handle(self, *args, **options):
+        wallet_uuid = uuid.uuid4()
+        payloads = (
+            ('deposit response', {'uuid': wallet_uuid, 'new_balance': Decimal('110.50')}),
+            ('wallet', {
+                'id': 42, 'uuid': str(wallet_uuid), 'balance': '110.50',
+                'created_at': timezone.now(), 'updated_at': timezone.now(),
+            }),
+            ('1000-item transfer batch', {'transfers': [
+                {'wallet': str(uuid.uuid4()), 'to': str(uuid.uuid4()), 'amount': Decimal('12.34')}
+                for _ in range(1000)
+            ]}),
+        )
+        formats = (
+            ('json', JSONRenderer(), JSONParser()),
+            ('msgpack', MessagePackRenderer(), MessagePackParser()),
+        )
+        iterations = options['iterations']
+        for name, data in payloads:
+            rounds = max(1, iterations // 100) if len(str(data)) > 10000 else iterations
+            results = []
+            for label, renderer, parser in formats:
+                body = renderer.render(data, renderer.media_type, {})
+                started = time.perf_counter()
+                for _ in range(rounds):
+                    renderer.render(data, renderer.media_type, {})
+                encode = (time.perf_counter() - started) / rounds * 1e6
+                started = time.perf_counter()
+                for _ in range(rounds):
+                    parser.parse(io.BytesIO(body), parser.media_type, {})
+                decode = (time.perf_counter() - started) / rounds * 1e6
+                results.append(f"{label} {len(body)} bytes, encode {encode:.1f}us, decode {decode:.1f}us")
+            self.stdout.write(f"{name}: " + "; ".join(results))
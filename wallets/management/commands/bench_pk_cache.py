@@ -0,0 +1,76 @@
+import random
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.http import Http404
+from django.test import override_settings
+from wallets.models import Wallet
+from wallets.pk_cache import wallet_or_404, wallet_pk_cache
+
+
+class Command(BaseCommand):
+    """
+    Management command that measures the wallet UUID cache on a realistic lookup mix.
+
+    Lookups are drawn from the existing wallets with a Zipf-like skew, so a few wallets
+    are looked up often, as on a live system, and a share of them are unknown UUIDs.
+    Two runs are made over the same sequence, each starting with an empty cache:
+    `resolve` compares a UUID-to-primary-key query with `wallet_pk_cache.resolve`, and
+    `load` compares loading the wallet by UUID, as the views did, with `wallet_or_404`.
+    The wall time per lookup and the cache hit rate are reported.
+
+    Usage:
+        python manage.py bench_pk_cache [--lookups 20000] [--wallets 5000] [--unknown 0.05]
+    """
+    help = "Reports the hit rate and lookup time of the wallet UUID cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lookups', type=int, default=20000, help="Number of lookups per run.")
+        parser.add_argument('--wallets', type=int, default=5000, help="Number of existing wallets to draw from.")
+        parser.add_argument('--unknown', type=float, default=0.05, help="Share of lookups for unknown UUIDs.")
+        parser.add_argument('--cache-size', type=int, default=None, help="Cache size. Defaults to WALLET_PK_CACHE_SIZE.")
+
+    def handle(self, *args, **options):
+        uuids = list(Wallet.objects.values_list('uuid', flat=True)[:options['wallets']])
+        if not uuids:
+            self.stdout.write("No wallets to look up; run seed_wallets first.")
+            return
+        unknown = [uuid.uuid4() for _ in range(max(1, len(uuids) // 20))]
+        weights = [1 / rank for rank in range(1, len(uuids) + 1)]
+        rng = random.Random(0)
+        sequence = [
+            rng.choice(unknown) if rng.random() < options['unknown'] else rng.choices(uuids, weights)[0]
+            for _ in range(options['lookups'])
+        ]
+
+        def load_by_uuid(value):
+            if Wallet.objects.filter(uuid=value).first() is None:
+                raise Http404()
+
+        def resolve_by_uuid(value):
+            return Wallet.objects.filter(uuid=value).values_list('pk', flat=True).first()
+
+        runs = (
+            ('resolve', resolve_by_uuid, wallet_pk_cache.resolve),
+            ('load', load_by_uuid, wallet_or_404),
+        )
+        settings_override = {} if options['cache_size'] is None else {'WALLET_PK_CACHE_SIZE': options['cache_size']}
+        with override_settings(**settings_override):
+            for name, uncached, cached in runs:
+                results = {}
+                for label, lookup in (('uuid', uncached), ('cached', cached)):
+                    wallet_pk_cache.clear()
+                    started = time.perf_counter()
+                    for value in sequence:
+                        try:
+                            lookup(str(value))
+                        except Http404:
+                            pass
+                    results[label] = (time.perf_counter() - started) / len(sequence) * 1e6
+                stats = wallet_pk_cache.stats()
+                self.stdout.write(
+                    f"{name}: {results['uuid']:.1f}us per lookup by UUID, {results['cached']:.1f}us through the cache "
+                    f"({results['cached'] / results['uuid'] - 1:+.0%}), hit rate {stats['hit_rate']:.1%} "
+                    f"({stats['hits']} hits, {stats['negative_hits']} negative hits, {stats['misses']} misses)"
+                )
+        wallet_pk_cache.clear()
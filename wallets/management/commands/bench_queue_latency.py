@@ -0,0 +1,81 @@
+import statistics
+import time
+from celery import Celery
+from celery.contrib.testing.worker import start_worker
+from django.core.management.base import BaseCommand
+from base.vars import WITHDRAW_URGENT_QUEUE, WITHDRAW_SCHEDULED_QUEUE
+
+
+class Command(BaseCommand):
+    """
+    Management command that benchmarks the queue latency of urgent withdrawals under
+    heavy scheduled traffic.
+
+    Two in-process workers on an in-memory broker run the benchmark twice with the
+    same capacity: first with both workers consuming one shared withdrawal queue (the
+    previous topology), then with one worker per queue (the urgent/scheduled split).
+    A backlog of scheduled tasks, each sleeping like a bank call, is enqueued first;
+    urgent probes are then sent at a steady rate and their queue latency is measured.
+    The numbers show the effect of the queue topology only, not of the broker.
+
+    Usage:
+        python manage.py bench_queue_latency [--scheduled 2000] [--urgent 50] [--work-ms 5]
+    """
+    help = "Measures urgent withdrawal queue latency while scheduled traffic is heavy."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scheduled', type=int, default=2000, help="Number of scheduled tasks in the backlog.")
+        parser.add_argument('--urgent', type=int, default=50, help="Number of urgent probes.")
+        parser.add_argument('--work-ms', type=float, default=5, help="Duration of each scheduled task in milliseconds.")
+        parser.add_argument('--interval-ms', type=float, default=10, help="Delay between urgent probes in milliseconds.")
+
+    def handle(self, *args, **options):
+        for label, worker_queues in (
+            ('shared queue', [[WITHDRAW_SCHEDULED_QUEUE], [WITHDRAW_SCHEDULED_QUEUE]]),
+            ('split queues', [[WITHDRAW_URGENT_QUEUE], [WITHDRAW_SCHEDULED_QUEUE]]),
+        ):
+            shared = worker_queues[0] == worker_queues[1]
+            latencies = self.run(worker_queues, WITHDRAW_SCHEDULED_QUEUE if shared else WITHDRAW_URGENT_QUEUE, options)
+            latencies.sort()
+            self.stdout.write(
+                f"{label}: urgent latency p50={statistics.median(latencies) * 1000:.1f}ms "
+                f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms "
+                f"max={latencies[-1] * 1000:.1f}ms over {len(latencies)} probes"
+            )
+
+    def run(self, worker_queues, urgent_queue, options):
+        """
+        Runs one benchmark round and returns the queue latencies of the urgent probes.
+
+        Args:
+            worker_queues (list): The queues consumed by each of the two workers.
+            urgent_queue (str): The queue the urgent probes are sent to.
+            options (dict): The command options.
+
+        Returns:
+            list: The latency of each urgent probe in seconds.
+        """
+        app = Celery('bench_queue_latency', broker='memory://', backend='cache+memory://')
+        app.conf.broker_transport_options = {'polling_interval': 0.001}
+        app.conf.worker_prefetch_multiplier = 1
+        latencies = []
+
+        @app.task(name='bench.probe')
+        def probe(sent_at):
+            latencies.append(time.perf_counter() - sent_at)
+
+        @app.task(name='bench.work')
+        def work(duration):
+            time.sleep(duration)
+
+        with start_worker(app, pool='solo', perform_ping_check=False, queues=worker_queues[0]), \
+                start_worker(app, pool='solo', perform_ping_check=False, queues=worker_queues[1]):
+            for _ in range(options['scheduled']):
+                work.apply_async((options['work_ms'] / 1000,), queue=WITHDRAW_SCHEDULED_QUEUE)
+            for _ in range(options['urgent']):
+                probe.apply_async((time.perf_counter(),), queue=urgent_queue)
+                time.sleep(options['interval_ms'] / 1000)
+            deadline = time.monotonic() + options['scheduled'] * options['work_ms'] / 1000 + 30
+            while len(latencies) < options['urgent'] and time.monotonic() < deadline:
+                time.sleep(0.05)
+        return latencies
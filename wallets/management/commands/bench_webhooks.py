@@ -0,0 +1,181 @@
+import datetime
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from wallets.models import Wallet, WebhookDelivery, WebhookSubscription
+from wallets.webhooks import WebhookSender, deliver_due_webhooks, requests
+from base.vars import WALLET_BULK_BATCH_SIZE, WEBHOOK_BATCH_SIZE, WEBHOOK_ENDPOINT_CONCURRENCY, WEBHOOK_LEASE_SIZE, WEBHOOK_RETRY_MAX_INTERVAL, WEBHOOK_WORKERS
+
+
+class StubReceiver(ThreadingHTTPServer):
+    """
+    Local webhook endpoint that acknowledges batches of events after a delay.
+
+    It speaks HTTP/1.1, so pooled connections are kept alive, counts the events and
+    requests received and the connections opened, and fails a share of the requests
+    with 503.
+    """
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, latency, failure_rate, seed=None):
+        super().__init__(('127.0.0.1', 0), StubReceiverHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.events = self.requests = self.connections = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/events"
+
+    def reset(self):
+        with self.lock:
+            self.events = self.requests = self.connections = 0
+
+
+class StubReceiverHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            failed = self.server.random.random() < self.server.failure_rate
+            self.server.requests += 1
+            if not failed:
+                self.server.events += len(json.loads(body)['events'])
+        self.send_response(503 if failed else 200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    """
+    Management command that measures the webhook delivery throughput against local
+    stub receivers.
+
+    Each `--endpoints` stub receiver runs in this process on its own port and answers
+    after `--latency` seconds. One wallet is subscribed per receiver, `--events`
+    deliveries are queued per wallet inside a transaction that is rolled back at the
+    end, and the same deliveries are sent once per configuration:
+
+    - one event per request, one thread, a new connection per request
+    - one event per request, one thread, pooled connections
+    - one event per request, WEBHOOK_WORKERS threads, pooled connections
+    - WEBHOOK_BATCH_SIZE events per request, WEBHOOK_WORKERS threads, pooled connections
+
+    At most WEBHOOK_ENDPOINT_CONCURRENCY requests are in flight per receiver. The
+    receivers serve plain HTTP on 127.0.0.1, so the sender does not check the URLs.
+
+    Usage:
+        python manage.py bench_webhooks [--endpoints 4] [--events 500] [--latency 0.005] [--failure-rate 0]
+    """
+    help = "Benchmarks webhook delivery throughput against local stub receivers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoints', type=int, default=4, help="Number of stub receivers.")
+        parser.add_argument('--events', type=int, default=500, help="Number of events queued per receiver.")
+        parser.add_argument('--latency', type=float, default=0.005, help="Seconds each receiver takes to answer.")
+        parser.add_argument('--failure-rate', type=float, default=0.0, help="Share of requests answered with 503.")
+
+    def queue(self, subscriptions, events):
+        """
+        Queues `events` deliveries to each subscription, due now.
+        """
+        now = timezone.now()
+        WebhookDelivery.objects.bulk_create(
+            [
+                WebhookDelivery(
+                    subscription=subscription,
+                    event_id=index,
+                    event_type='wallet.deposit',
+                    payload={'wallet': str(subscription.wallet.uuid), 'amount': '10.00', 'transaction_id': index},
+                    next_attempt_at=now,
+                )
+                for subscription in subscriptions
+                for index in range(events)
+            ],
+            batch_size=WALLET_BULK_BATCH_SIZE,
+        )
+
+    def run(self, sender, batch_size):
+        """
+        Sends every queued delivery and returns the counts. The clock is moved past the
+        longest backoff whenever nothing is due, so retries are sent without waiting.
+        """
+        totals = {'sent': 0, 'delivered': 0, 'retrying': 0, 'dropped': 0, 'requests': 0}
+        now = timezone.now()
+        while WebhookDelivery.objects.filter(next_attempt_at__isnull=False).exists():
+            counts = deliver_due_webhooks(
+                now=now,
+                lease_size=WEBHOOK_LEASE_SIZE,
+                batch_size=batch_size,
+                sender=sender,
+            )
+            for key, value in counts.items():
+                totals[key] += value
+            if counts['sent'] < WEBHOOK_LEASE_SIZE:
+                now += datetime.timedelta(seconds=WEBHOOK_RETRY_MAX_INTERVAL)
+        return totals
+
+    def handle(self, *args, **options):
+        receivers = [StubReceiver(options['latency'], options['failure_rate'], seed=index) for index in range(options['endpoints'])]
+        for receiver in receivers:
+            threading.Thread(target=receiver.serve_forever, daemon=True).start()
+        total_events = options['endpoints'] * options['events']
+        configurations = (
+            ('1 event per request, 1 thread, new connections', 1, 1, False),
+            ('1 event per request, 1 thread, pooled', 1, 1, True),
+            (f"1 event per request, {WEBHOOK_WORKERS} threads, pooled", 1, WEBHOOK_WORKERS, True),
+            (f"{WEBHOOK_BATCH_SIZE} events per request, {WEBHOOK_WORKERS} threads, pooled", WEBHOOK_BATCH_SIZE, WEBHOOK_WORKERS, True),
+        )
+        try:
+            with transaction.atomic():
+                wallets = Wallet.objects.bulk_create([Wallet() for _ in receivers])
+                subscriptions = WebhookSubscription.objects.bulk_create(
+                    [WebhookSubscription(wallet=wallet, url=receiver.url) for wallet, receiver in zip(wallets, receivers)]
+                )
+                for name, batch_size, workers, pooled in configurations:
+                    WebhookDelivery.objects.all().delete()
+                    self.queue(subscriptions, options['events'])
+                    for receiver in receivers:
+                        receiver.reset()
+                    sender = WebhookSender(
+                        workers=workers,
+                        endpoint_concurrency=WEBHOOK_ENDPOINT_CONCURRENCY,
+                        session=None if pooled else requests,
+                        check_urls=False,
+                    )
+                    started = time.perf_counter()
+                    totals = self.run(sender, batch_size)
+                    elapsed = time.perf_counter() - started
+                    if pooled:
+                        sender.close()
+                    else:
+                        sender.pool.shutdown()
+                    received = sum(receiver.events for receiver in receivers)
+                    self.stdout.write(
+                        f"{name}: {received} of {total_events} events in {elapsed:.3f}s ({received / elapsed:.0f} events/s), "
+                        f"{totals['requests']} requests, {sum(receiver.connections for receiver in receivers)} connections, "
+                        f"{totals['dropped']} given up"
+                    )
+                transaction.set_rollback(True)
+        finally:
+            for receiver in receivers:
+                receiver.shutdown()
+                receiver.server_close()
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from wallets.importtime import LAZY_MODULES, STARTUP_TARGETS, profile_startup
+from base.vars import STARTUP_TIME_BUDGET
+
+
+class Command(BaseCommand):
+    """
+    Management command that reports the slowest imports of a cold process start.
+
+    Each target is started in a fresh interpreter with `python -X importtime`: `check`
+    runs `manage.py check`, `web` loads the URLconf the way a web worker does before its
+    first request, and `worker` imports the task modules the way a Celery worker does at
+    boot. The slowest imports are listed by cumulative time, which includes the imports
+    they trigger, or by self time. Dependencies that should load lazily are flagged
+    when a target imports them at startup, and so are starts slower than
+    STARTUP_TIME_BUDGET seconds. With `--check` the command fails on either, for a CI
+    step on a machine with stable timings; the test suite only checks the lazy imports.
+
+    Usage:
+        python manage.py profile_imports [--target web] [--limit 20] [--sort self] [--check]
+    """
+    help = "Reports the wall time and the slowest imports of a cold web, check or worker start."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=sorted(STARTUP_TARGETS), action='append', help="Process to profile. Defaults to all of them.")
+        parser.add_argument('--limit', type=int, default=20, help="Number of imports to report per target.")
+        parser.add_argument('--sort', choices=('cumulative', 'self'), default='cumulative', help="Import time to sort by.")
+        parser.add_argument('--check', action='store_true', help="Fail if a start is over budget or imports a lazy module.")
+
+    def handle(self, *args, **options):
+        column = 2 if options['sort'] == 'cumulative' else 1
+        failures = []
+        for target in options['target'] or sorted(STARTUP_TARGETS):
+            elapsed, imports, loaded = profile_startup(target)
+            total_us = sum(self_us for _, self_us, _ in imports)
+            self.stdout.write(self.style.SUCCESS(
+                f"{target}: {elapsed * 1000:.0f}ms wall time, {len(imports)} modules imported in {total_us / 1000:.0f}ms."
+            ))
+            for module, self_us, cumulative_us in sorted(imports, key=lambda row: row[column], reverse=True)[:options['limit']]:
+                self.stdout.write(f"  {cumulative_us / 1000:9.1f}ms cumulative {self_us / 1000:8.1f}ms self  {module}")
+            if elapsed > STARTUP_TIME_BUDGET:
+                failures.append(f"{target} took {elapsed:.2f}s")
+                self.stdout.write(self.style.WARNING(f"  Over the startup budget of {STARTUP_TIME_BUDGET:.1f}s."))
+            eager = sorted(loaded & set(LAZY_MODULES[target]))
+            if eager:
+                failures.append(f"{target} imported {', '.join(eager)}")
+                self.stdout.write(self.style.WARNING(f"  Imported at startup although they should load lazily: {', '.join(eager)}"))
+        if options['check'] and failures:
+            raise CommandError(f"Startup check failed: {'; '.join(failures)}.")
@@ -0,0 +1,83 @@
+from django.core.management.base import BaseCommand, CommandError
+from wallets.rebalance import move_buckets, pin_buckets, wallets_in_buckets
+from wallets.sharding import shard_map, sharding_enabled, wallet_shards
+from base.vars import WALLET_SHARD_BUCKETS, WALLET_SHARD_COPY_BATCH_SIZE, WALLET_SHARD_MAP_TTL
+
+
+class Command(BaseCommand):
+    """
+    Management command that moves ranges of wallet hash buckets to another shard.
+
+    Wallets are spread over WALLET_SHARD_BUCKETS buckets by a hash of their UUID, and
+    a move takes whole buckets: their wallets are locked, copied to the target with all
+    their rows and primary keys, switched over in the shard map and deleted from their
+    old shard, see `move_buckets`. The wallets being moved are answered with 503 for the
+    duration of the move. Pause beat while the command runs. With `--dry-run` nothing
+    is locked or written and the wallets that would move are counted instead.
+
+    Before sharding is enabled on a database that already holds wallets, `--pin`
+    points every bucket at that database, so its wallets stay reachable until they are
+    moved to their shards.
+
+    Usage:
+        python manage.py rebalance_shards --pin default
+        python manage.py rebalance_shards --buckets 0-1023 --to shard_1 [--batch-size 1000] [--dry-run]
+        python manage.py rebalance_shards --buckets 12,40-47 --to default
+    """
+    help = "Moves the wallets of a range of hash buckets, with their rows, to another shard."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buckets', help="Buckets to move, e.g. '0-1023' or '12,40-47'.")
+        parser.add_argument('--to', help="Database alias of the target shard.")
+        parser.add_argument('--pin', help="Point every bucket without an override at this shard.")
+        parser.add_argument('--batch-size', type=int, default=WALLET_SHARD_COPY_BATCH_SIZE, help="Number of wallets copied per transaction.")
+        parser.add_argument('--wait', type=float, default=2 * WALLET_SHARD_MAP_TTL, help="Seconds to wait after locking the buckets.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the wallets that would move.")
+
+    def parse_buckets(self, value):
+        """
+        Parses a comma separated list of buckets and bucket ranges.
+        """
+        buckets = set()
+        try:
+            for part in value.split(','):
+                low, _, high = part.partition('-')
+                buckets.update(range(int(low), int(high or low) + 1))
+        except ValueError:
+            raise CommandError("--buckets must list buckets and ranges, e.g. '0-1023' or '12,40-47'.")
+        if not buckets or min(buckets) < 0 or max(buckets) >= WALLET_SHARD_BUCKETS:
+            raise CommandError(f"Buckets go from 0 to {WALLET_SHARD_BUCKETS - 1}.")
+        return buckets
+
+    def handle(self, *args, **options):
+        if not sharding_enabled():
+            raise CommandError("Sharding is disabled: WALLET_SHARDS lists a single database.")
+        if options['pin']:
+            if options['pin'] not in wallet_shards():
+                raise CommandError(f"{options['pin']} is not one of the shards: {', '.join(wallet_shards())}.")
+            self.stdout.write(self.style.SUCCESS(f"Pinned {pin_buckets(options['pin'])} buckets to {options['pin']}."))
+            return
+        if not options['buckets'] or not options['to']:
+            raise CommandError("--buckets and --to are required.")
+        if options['to'] not in wallet_shards():
+            raise CommandError(f"{options['to']} is not one of the shards: {', '.join(wallet_shards())}.")
+        buckets = self.parse_buckets(options['buckets'])
+
+        if options['dry_run']:
+            shard_map.clear()
+            sources = {}
+            for bucket in buckets:
+                shard = shard_map.locate_bucket(bucket)[0]
+                if shard != options['to']:
+                    sources.setdefault(shard, set()).add(bucket)
+            for shard, shard_buckets in sources.items():
+                count = len(wallets_in_buckets(shard, shard_buckets))
+                self.stdout.write(f"{len(shard_buckets)} buckets with {count} wallets would move from {shard} to {options['to']}.")
+            if not sources:
+                self.stdout.write(f"Every bucket is already on {options['to']}.")
+            return
+
+        result = move_buckets(buckets, options['to'], batch_size=options['batch_size'], wait=options['wait'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {result['buckets']} buckets with {result['wallets']} wallets ({result['rows']} rows) to {options['to']}."
+        ))
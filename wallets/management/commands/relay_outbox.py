@@ -0,0 +1,49 @@
+import time
+from django.core.management.base import BaseCommand
+from wallets.outbox import broker_connection, publish_pending_events
+from wallets.sharding import use_shard, wallet_shards
+from base.vars import BROKER_URL, OUTBOX_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Management command that relays outbox events to the message broker.
+
+    By default the command drains the outbox once and exits. With `--loop` it keeps
+    running and polls for new events, which is how the relay is deployed. Every
+    batch is reported together with the relay throughput. With sharding enabled, each
+    round publishes one batch per shard; events keep their order within a shard.
+
+    Usage:
+        python manage.py relay_outbox [--loop] [--batch-size 500] [--interval 1.0]
+    """
+    help = "Publishes pending wallet events from the outbox to the message broker."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=OUTBOX_BATCH_SIZE, help="Number of events per batch.")
+        parser.add_argument('--loop', action='store_true', help="Keep polling for new events instead of exiting.")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to sleep when the outbox is empty.")
+        parser.add_argument('--broker-url', default=BROKER_URL, help="Broker to publish to.")
+
+    def handle(self, *args, **options):
+        total = 0
+        started = time.perf_counter()
+        with broker_connection(options['broker_url']) as connection:
+            while True:
+                batch_started = time.perf_counter()
+                published = 0
+                for shard in wallet_shards():
+                    with use_shard(shard):
+                        published += publish_pending_events(connection, batch_size=options['batch_size'])
+                if published:
+                    total += published
+                    elapsed = time.perf_counter() - batch_started
+                    self.stdout.write(f"Published {published} events in {elapsed:.3f}s ({published / elapsed:.0f} events/s).")
+                    continue
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+
+        elapsed = time.perf_counter() - started
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(f"Relayed {total} events in {elapsed:.3f}s ({rate:.0f} events/s)."))
@@ -0,0 +1,98 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from wallets.models import Transaction, WithdrawalReplay
+from wallets.replay import replay_report, start_replay
+from wallets.sharding import for_each_shard, use_shard
+from base.vars import WITHDRAW_REPLAY_BATCH_SIZE, WITHDRAW_REPLAY_BATCH_INTERVAL
+
+
+class Command(BaseCommand):
+    """
+    Management command that replays the withdrawals that failed during a bank outage.
+
+    The failed withdrawals created between `--since` and `--until` with one of the
+    `--status` bank codes are queued for replay and sent to the retry queue in batches
+    of `--batch-size`, one batch every `--interval` seconds. Each withdrawal is replayed
+    at most once, whatever the number of replays started, and the new withdrawal points
+    to the failed one through `retry_of`. With `--watch` the command reports the
+    progress until the replay has finished, then the final success rate. `--report`
+    shows the progress of an earlier replay. With sharding enabled, each shard gets its
+    own replay of the withdrawals it holds, and each is reported.
+
+    Usage:
+        python manage.py replay_withdrawals --since 2024-05-24T09:00 --until 2024-05-24T11:00 --status 503 --status 408 [--batch-size 100] [--interval 10] [--dry-run] [--watch]
+        python manage.py replay_withdrawals --report <replay uuid>
+    """
+    help = "Replays failed withdrawals of a time window and bank status codes in throttled batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="Start of the window, ISO 8601.")
+        parser.add_argument('--until', help="End of the window, ISO 8601. Defaults to now.")
+        parser.add_argument('--status', action='append', help="Bank status code to replay; repeat for several.")
+        parser.add_argument('--batch-size', type=int, default=WITHDRAW_REPLAY_BATCH_SIZE, help="Number of withdrawals per task.")
+        parser.add_argument('--interval', type=float, default=WITHDRAW_REPLAY_BATCH_INTERVAL, help="Seconds between two batches.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the withdrawals that would be replayed.")
+        parser.add_argument('--watch', action='store_true', help="Report the progress until the replay has finished.")
+        parser.add_argument('--report', help="UUID of a replay to report on.")
+
+    def parse_time(self, value, name):
+        """
+        Parses an ISO 8601 option into an aware datetime.
+        """
+        moment = parse_datetime(value)
+        if moment is None:
+            raise CommandError(f"--{name} must be an ISO 8601 date and time.")
+        return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+    def write_report(self, replay):
+        """
+        Writes the progress of a replay and returns whether it has finished.
+        """
+        with use_shard(replay._state.db):
+            report = replay_report(replay)
+        self.stdout.write(
+            f"Replay {replay.uuid}: {report['progress']:.0%} of {report['total']} processed, "
+            f"{report['succeeded']} succeeded, {report['failed']} failed, {report['queued']} queued, "
+            f"{report['running']} running, success rate {report['success_rate']:.1%}"
+        )
+        return replay.finished_at is not None
+
+    def handle(self, *args, **options):
+        if options['report']:
+            found = for_each_shard(lambda shard: WithdrawalReplay.objects.filter(uuid=options['report']).first(), parallel=False)
+            replay = next((replay for replay in found.values() if replay is not None), None)
+            if replay is None:
+                raise CommandError("No replay with this UUID.")
+            self.write_report(replay)
+            return
+
+        if not options['since'] or not options['status']:
+            raise CommandError("--since and at least one --status are required.")
+        start = self.parse_time(options['since'], 'since')
+        end = self.parse_time(options['until'], 'until') if options['until'] else timezone.now()
+        if options['dry_run']:
+            counts = for_each_shard(
+                lambda shard: Transaction.objects.failed_withdrawals(start, end, options['status']).filter(replay_item__isnull=True).count(),
+                parallel=False,
+            )
+            self.stdout.write(f"{sum(counts.values())} failed withdrawals would be replayed.")
+            return
+
+        replays = for_each_shard(
+            lambda shard: start_replay(start, end, options['status'], batch_size=options['batch_size'], interval=options['interval']),
+            parallel=False,
+        )
+        for shard, replay in replays.items():
+            self.stdout.write(self.style.SUCCESS(
+                f"Replay {replay.uuid} queued {replay.total} failed withdrawals of {shard} in batches of {options['batch_size']} "
+                f"every {options['interval']:g}s."
+            ))
+        pending = list(replays.values())
+        while options['watch'] and pending:
+            pending = [replay for replay in pending if not self.write_report(replay)]
+            if pending:
+                time.sleep(max(options['interval'], 1))
+                for replay in pending:
+                    replay.refresh_from_db()
@@ -0,0 +1,148 @@
+import random
+import time
+import uuid
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+from django.utils import timezone
+from wallets.models import Wallet, Transaction
+
+
+class Command(BaseCommand):
+    """
+    Management command that seeds wallets and synthetic ledger history for benchmarking.
+
+    Wallets and their transactions are generated in memory and inserted in bulk, one
+    database transaction per batch of wallets. Wallets go through `bulk_create`; the
+    much larger ledger is written with multi-row INSERT statements whose constant
+    columns are prepared once per batch, because per-row ORM value preparation
+    dominates the cost of `bulk_create` at this volume. Every wallet gets a
+    mix of settled deposits and withdrawals whose sum is its balance, so seeded data
+    satisfies the same invariants as real data. Outbox events and daily aggregates
+    are not written; run `backfill_daily_aggregates` afterwards if they are needed.
+
+    Usage:
+        python manage.py seed_wallets --wallets 1000000 --transactions-per-wallet 10 --batch-size 5000
+    """
+    help = "Seeds wallets and synthetic Transaction history and reports the insert throughput."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wallets', type=int, default=10000, help="Number of wallets to create.")
+        parser.add_argument('--transactions-per-wallet', type=int, default=10, help="Number of ledger rows per wallet.")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Number of wallets per database transaction.")
+        parser.add_argument('--insert-batch-size', type=int, default=1000, help="Number of rows per INSERT statement.")
+        parser.add_argument('--seed', type=int, default=None, help="Random seed, for reproducible data.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        total_wallets = options['wallets']
+        batch_size = options['batch_size']
+        insert_batch_size = options['insert_batch_size']
+        created_wallets = 0
+        created_transactions = 0
+        started = time.perf_counter()
+
+        while created_wallets < total_wallets:
+            count = min(batch_size, total_wallets - created_wallets)
+            wallets, histories = self.generate(rng, count, options['transactions_per_wallet'])
+            with transaction.atomic():
+                Wallet.objects.bulk_create(wallets, batch_size=insert_batch_size)
+                self.resolve_pks(wallets)
+                transactions = [
+                    (wallet.pk, amount, is_withdrawal, True)
+                    for wallet, history in zip(wallets, histories)
+                    for amount, is_withdrawal in history
+                ]
+                self.insert_rows(Transaction, ('wallet_id', 'amount', 'is_withdrawal', 'settle'), transactions, insert_batch_size)
+            created_wallets += count
+            created_transactions += len(transactions)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"Seeded {created_wallets}/{total_wallets} wallets and {created_transactions} transactions ({created_wallets / elapsed:.0f} wallets/s).")
+
+        elapsed = time.perf_counter() - started
+        rows = created_wallets + created_transactions
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {created_wallets} wallets and {created_transactions} transactions in {elapsed:.3f}s: "
+            f"{created_wallets / elapsed:.0f} wallets/s, {created_transactions / elapsed:.0f} transactions/s, {rows / elapsed:.0f} rows/s."
+        ))
+
+    def generate(self, rng, count, transactions_per_wallet):
+        """
+        Generates unsaved wallets and their ledger history.
+
+        Withdrawals are only generated when the running balance covers them, so the
+        balance of each wallet never goes negative and equals the sum of its history.
+
+        Args:
+            rng (random.Random): The random number generator.
+            count (int): The number of wallets.
+            transactions_per_wallet (int): The number of ledger rows per wallet.
+
+        Returns:
+            tuple: The wallets and, for each wallet, a list of (amount, is_withdrawal) pairs.
+        """
+        wallets = []
+        histories = []
+        for _ in range(count):
+            balance = 0
+            history = []
+            for _ in range(transactions_per_wallet):
+                cents = rng.randint(100, 100000)
+                is_withdrawal = balance >= cents and rng.random() < 0.4
+                balance += -cents if is_withdrawal else cents
+                history.append((Decimal(cents).scaleb(-2), is_withdrawal))
+            wallets.append(Wallet(uuid=uuid.UUID(int=rng.getrandbits(128), version=4), balance=Decimal(balance).scaleb(-2)))
+            histories.append(history)
+        return wallets, histories
+
+    def resolve_pks(self, wallets):
+        """
+        Sets the primary keys of bulk created wallets on databases that do not return them.
+
+        Args:
+            wallets (list): The wallets inserted with `bulk_create`.
+        """
+        if all(wallet.pk is not None for wallet in wallets):
+            return
+        pks = dict(Wallet.objects.filter(uuid__in=[wallet.uuid for wallet in wallets]).values_list('uuid', 'pk'))
+        for wallet in wallets:
+            wallet.pk = pks[wallet.uuid]
+
+    def insert_rows(self, model, attnames, rows, batch_size):
+        """
+        Inserts rows with multi-row INSERT statements, bypassing per-row ORM work.
+
+        Columns that are not listed in `attnames` get their model default, and
+        `auto_now`/`auto_now_add` columns get the current time, each prepared once.
+
+        Args:
+            model (Model): The model whose table the rows are inserted into.
+            attnames (tuple): The attribute names of the columns given in each row.
+            rows (list): The rows, as tuples of values in `attnames` order.
+            batch_size (int): The maximum number of rows per INSERT statement.
+        """
+        now = timezone.now()
+        fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+        positions = {attname: position for position, attname in enumerate(attnames)}
+        constants = {}
+        for field in fields:
+            if field.attname in positions:
+                continue
+            if isinstance(field, models.DateTimeField) and (field.auto_now or field.auto_now_add):
+                value = now
+            else:
+                value = field.get_default()
+            constants[field.attname] = field.get_db_prep_save(value, connection)
+
+        table = connection.ops.quote_name(model._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        row_placeholder = '(' + ', '.join(['%s'] * len(fields)) + ')'
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                chunk = rows[start:start + batch_size]
+                params = [
+                    row[positions[field.attname]] if field.attname in positions else constants[field.attname]
+                    for row in chunk
+                    for field in fields
+                ]
+                cursor.execute(f"INSERT INTO {table} ({columns}) VALUES {', '.join([row_placeholder] * len(chunk))}", params)
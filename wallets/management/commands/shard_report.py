@@ -0,0 +1,62 @@
+import time
+from collections import Counter
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+from wallets.models import Wallet, Transaction
+from wallets.sharding import for_each_shard, shard_map, sharding_enabled
+from base.vars import WALLET_SHARD_BUCKETS
+
+
+def shard_summary(shard):
+    """
+    Returns the number of wallets, their balance total and the number of ledger rows of a shard.
+    """
+    wallets = Wallet.objects.aggregate(count=Count('pk'), balance=Sum('balance'))
+    return {
+        'buckets': 0,
+        'wallets': wallets['count'],
+        'balance': wallets['balance'] or 0,
+        'transactions': Transaction.objects.count(),
+    }
+
+
+class Command(BaseCommand):
+    """
+    Management command that reports the wallets, balances and ledger rows of every shard.
+
+    The shards are queried in parallel, one thread and connection each, so the report
+    takes about as long as the slowest shard; `--sequential` queries them one after
+    the other for comparison. The number of hash buckets each shard owns is read from
+    the shard map. With sharding disabled the report covers the default database.
+
+    Usage:
+        python manage.py shard_report [--sequential]
+    """
+    help = "Reports the wallet count, balance total and ledger size of every shard."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sequential', action='store_true', help="Query the shards one after the other.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        reports = for_each_shard(shard_summary, parallel=not options['sequential'])
+        elapsed = time.perf_counter() - started
+
+        if sharding_enabled():
+            shard_map.clear()
+            owned = Counter(shard_map.locate_bucket(bucket)[0] for bucket in range(WALLET_SHARD_BUCKETS))
+            for shard, report in reports.items():
+                report['buckets'] = owned[shard]
+        else:
+            for report in reports.values():
+                report['buckets'] = WALLET_SHARD_BUCKETS
+        for shard, report in reports.items():
+            self.stdout.write(
+                f"{shard}: {report['buckets']} buckets, {report['wallets']} wallets, "
+                f"balance {report['balance']:.2f}, {report['transactions']} transactions"
+            )
+        totals = {key: sum(report[key] for report in reports.values()) for key in ('wallets', 'balance', 'transactions')}
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(reports)} shards: {totals['wallets']} wallets, balance {totals['balance']:.2f}, "
+            f"{totals['transactions']} transactions, queried in {elapsed:.3f}s."
+        ))
@@ -0,0 +1,68 @@
+import datetime
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+from wallets.models import SlowQuery
+from wallets.sharding import for_each_shard, use_shard
+
+
+class Command(BaseCommand):
+    """
+    Management command that summarises the recorded slow queries.
+
+    Runs of the same query are grouped by fingerprint and the groups are ranked by
+    their total time, which is what the database spent on them. For each group the
+    latest run is shown with its origin and EXPLAIN plan, so a query that stopped using
+    its index can be spotted from the plan alone. Each shard stores the slow queries
+    that ran on it, so with sharding enabled the groups of every shard are merged.
+
+    Usage:
+        python manage.py slow_queries [--hours 24] [--limit 10] [--no-plan]
+    """
+    help = "Lists the slow wallet queries with the highest total time, with their origin and plan."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24, help="Only consider queries recorded in the last hours.")
+        parser.add_argument('--limit', type=int, default=10, help="Number of queries to report.")
+        parser.add_argument('--no-plan', action='store_true', help="Do not print the EXPLAIN plans.")
+
+    def shard_offenders(self, since):
+        """
+        Returns the slow queries of the current shard recorded after `since`, grouped by fingerprint.
+        """
+        return list(
+            SlowQuery.objects.filter(created_at__gte=since)
+            .values('fingerprint')
+            .annotate(total=Sum('duration'), count=Count('id'), slowest=Max('duration'), latest_id=Max('id'), latest_at=Max('created_at'))
+            .order_by()
+        )
+
+    def handle(self, *args, **options):
+        since = timezone.now() - datetime.timedelta(hours=options['hours'])
+        groups = {}
+        for shard, offenders in for_each_shard(lambda shard: self.shard_offenders(since), parallel=False).items():
+            for offender in offenders:
+                offender['shard'] = shard
+                group = groups.setdefault(offender['fingerprint'], offender)
+                if group is offender:
+                    continue
+                group['total'] += offender['total']
+                group['count'] += offender['count']
+                group['slowest'] = max(group['slowest'], offender['slowest'])
+                if offender['latest_at'] > group['latest_at']:
+                    group.update(latest_id=offender['latest_id'], latest_at=offender['latest_at'], shard=offender['shard'])
+        offenders = sorted(groups.values(), key=lambda group: group['total'], reverse=True)[:options['limit']]
+        if not offenders:
+            self.stdout.write("No slow queries recorded.")
+        for rank, offender in enumerate(offenders, 1):
+            with use_shard(offender['shard']):
+                query = SlowQuery.objects.get(pk=offender['latest_id'])
+            self.stdout.write(self.style.SUCCESS(
+                f"#{rank} total={offender['total']:.1f}ms runs={offender['count']} "
+                f"avg={offender['total'] / offender['count']:.1f}ms max={offender['slowest']:.1f}ms"
+            ))
+            self.stdout.write(f"  origin: {query.origin}")
+            self.stdout.write(f"  sql: {query.sql}")
+            if query.plan and not options['no_plan']:
+                for line in query.plan.splitlines():
+                    self.stdout.write(f"  plan: {line}")
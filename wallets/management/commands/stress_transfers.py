@@ -0,0 +1,93 @@
+import random
+import threading
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import connection, OperationalError
+from django.db.models import Sum
+from wallets.models import Wallet, Transaction
+from base.exceptions import InsufficientFundsError
+
+
+class Command(BaseCommand):
+    """
+    Management command that stress tests concurrent wallet-to-wallet transfers.
+
+    A small set of wallets is created and every thread sends transfers between random
+    pairs of them, half of the threads in one direction and half in the other, so
+    opposing transfers between the same wallets run at the same time. Lock errors are
+    retried and counted; deadlocks reported by the database are counted separately.
+    At the end the command checks that the total balance is unchanged and that every
+    transfer wrote exactly two ledger rows, then reports the throughput.
+
+    The command writes to the configured database, including the outbox, so run it
+    against a test database only.
+
+    Usage:
+        python manage.py stress_transfers [--wallets 4] [--threads 8] [--transfers 200]
+    """
+    help = "Runs many concurrent opposing transfers and reports deadlocks and throughput."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wallets', type=int, default=4, help="Number of wallets transfers move between.")
+        parser.add_argument('--threads', type=int, default=8, help="Number of concurrent threads.")
+        parser.add_argument('--transfers', type=int, default=200, help="Number of transfers per thread.")
+        parser.add_argument('--balance', type=Decimal, default=Decimal('1000.00'), help="Initial balance of each wallet.")
+        parser.add_argument('--seed', type=int, default=None, help="Random seed, for reproducible runs.")
+
+    def handle(self, *args, **options):
+        wallets = [Wallet.objects.create(balance=options['balance']) for _ in range(options['wallets'])]
+        total_before = options['balance'] * len(wallets)
+        stats = {'transfers': 0, 'insufficient_funds': 0, 'lock_retries': 0, 'deadlocks': 0}
+        stats_lock = threading.Lock()
+
+        def worker(index):
+            rng = random.Random(None if options['seed'] is None else options['seed'] + index)
+            local = dict.fromkeys(stats, 0)
+            try:
+                for _ in range(options['transfers']):
+                    source, target = rng.sample(wallets, 2)
+                    if index % 2 and source.pk < target.pk or not index % 2 and source.pk > target.pk:
+                        source, target = target, source
+                    amount = Decimal(rng.randint(1, 1000)).scaleb(-2)
+                    while True:
+                        try:
+                            Wallet(pk=source.pk, uuid=source.uuid).transfer_to(Wallet(pk=target.pk, uuid=target.uuid), amount)
+                            local['transfers'] += 1
+                        except InsufficientFundsError:
+                            local['insufficient_funds'] += 1
+                        except OperationalError as e:
+                            local['deadlocks' if 'deadlock' in str(e).lower() else 'lock_retries'] += 1
+                            time.sleep(rng.random() / 1000)
+                            continue
+                        break
+            finally:
+                connection.close()
+                with stats_lock:
+                    for key, value in local.items():
+                        stats[key] += value
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        pks = [wallet.pk for wallet in wallets]
+        total_after = Wallet.objects.filter(pk__in=pks).aggregate(total=Sum('balance'))['total']
+        ledger_rows = Transaction.objects.filter(wallet_id__in=pks, transfer_id__isnull=False).count()
+        self.stdout.write(
+            f"{stats['transfers']} transfers in {elapsed:.3f}s ({stats['transfers'] / elapsed:.0f} transfers/s) "
+            f"with {options['threads']} threads over {len(wallets)} wallets; "
+            f"{stats['insufficient_funds']} rejected for insufficient funds, "
+            f"{stats['lock_retries']} lock retries, {stats['deadlocks']} deadlocks."
+        )
+        if total_after != total_before or ledger_rows != 2 * stats['transfers']:
+            self.stderr.write(self.style.ERROR(
+                f"Invariant violated: total balance {total_before:.2f} -> {total_after:.2f}, "
+                f"{ledger_rows} ledger rows for {stats['transfers']} transfers."
+            ))
+            return
+        self.stdout.write(self.style.SUCCESS(f"Total balance {total_after:.2f} unchanged and ledger rows paired."))
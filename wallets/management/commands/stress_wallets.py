@@ -0,0 +1,224 @@
+import random
+import threading
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
+from django.core.management.base import BaseCommand
+from django.db import connection, OperationalError
+from django.db.models import Sum
+from django.test import override_settings
+from django.utils import timezone
+from wallets.ledger import fold_ledger
+from wallets.models import Wallet, Transaction, ScheduledWithdrawal
+from wallets.tasks import process_withdrawal
+from base.exceptions import InsufficientFundsError
+
+OPERATIONS = ('deposit', 'withdraw', 'process_withdrawal')
+
+
+class StubBankResponse:
+    """
+    Response of the stub bank, shaped like the `requests` response the wallet reads.
+    """
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+class StubBank:
+    """
+    Stand-in for the bank payout endpoint that answers after a short random delay and
+    fails at random.
+
+    A payout is paid, accepted as pending, rejected with a non-200 status, or fails
+    with an HTTP, connection or timeout error, so every branch of `Wallet.withdraw`
+    runs under load.
+
+    Attributes:
+        failure_rate (float): The share of payouts that do not go through.
+        pending_rate (float): The share of payouts accepted as pending.
+        latency (float): The maximum answer delay in seconds.
+    """
+    def __init__(self, failure_rate, pending_rate, latency, seed=None):
+        self.failure_rate = failure_rate
+        self.pending_rate = pending_rate
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.references = 0
+
+    def post(self, url, timeout=None):
+        import requests
+
+        with self.lock:
+            draw = self.rng.random()
+            delay = self.rng.random() * self.latency
+            self.references += 1
+            reference = f"stub-{self.references}"
+        time.sleep(delay)
+        if draw < self.failure_rate:
+            failure = int(draw / self.failure_rate * 4)
+            if failure == 0:
+                return StubBankResponse({'status': 500, 'data': 'rejected'})
+            raise (requests.exceptions.HTTPError, requests.exceptions.ConnectionError, requests.exceptions.Timeout)[failure - 1]()
+        if draw < self.failure_rate + self.pending_rate:
+            return StubBankResponse({'status': 202, 'data': 'pending', 'reference': reference})
+        return StubBankResponse({'status': 200, 'data': 'paid'})
+
+
+class Command(BaseCommand):
+    """
+    Management command that stress tests deposits, withdrawals and scheduled payouts
+    on the same wallets and checks the balance invariants.
+
+    Every thread runs a random mix of `Wallet.deposit`, `Wallet.withdraw` and the
+    `process_withdrawal` task against a few shared wallets, each on its own database
+    connection, with the bank replaced by a stub that answers slowly and fails at
+    random. Database lock errors are retried and counted, including the retries inside
+    `process_withdrawal`, whose back-off is shortened. A monitor thread samples the
+    balances throughout the run. At the end the command checks that no balance was
+    ever negative and that every balance equals its initial value plus the ledger sum
+    of its settled and pending rows, then reports the throughput per operation.
+
+    With `--append-only` the same mix runs in append-only ledger mode, the monitor
+    samples the available balance, and the ledger is folded before the check.
+
+    The command writes to the configured database, including the outbox, so run it
+    against a test database only.
+
+    Usage:
+        python manage.py stress_wallets [--wallets 2] [--threads 8] [--operations 100] [--failure-rate 0.3] [--append-only]
+    """
+    help = "Runs concurrent deposits, withdrawals and scheduled payouts against a stub bank and checks the balance invariants."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wallets', type=int, default=2, help="Number of shared wallets.")
+        parser.add_argument('--threads', type=int, default=8, help="Number of concurrent threads.")
+        parser.add_argument('--operations', type=int, default=100, help="Number of operations per thread.")
+        parser.add_argument('--balance', type=Decimal, default=Decimal('100.00'), help="Initial balance of each wallet.")
+        parser.add_argument('--failure-rate', type=float, default=0.3, help="Share of payouts the stub bank fails.")
+        parser.add_argument('--pending-rate', type=float, default=0.1, help="Share of payouts the stub bank leaves pending.")
+        parser.add_argument('--latency', type=float, default=0.002, help="Maximum stub bank latency in seconds.")
+        parser.add_argument('--append-only', action='store_true', help="Run in append-only ledger mode.")
+        parser.add_argument('--seed', type=int, default=None, help="Random seed, for reproducible runs.")
+
+    def handle(self, *args, **options):
+        seed = options['seed']
+        bank = StubBank(options['failure_rate'], options['pending_rate'], options['latency'], seed)
+        wallets = [Wallet.objects.create(balance=options['balance']) for _ in range(options['wallets'])]
+        pks = [wallet.pk for wallet in wallets]
+        stats = {f'{operation}_{outcome}': 0 for operation in OPERATIONS for outcome in ('done', 'insufficient_funds')}
+        stats.update(lock_retries=0, task_lock_retries=0)
+        stats_lock = threading.Lock()
+        lowest = {'balance': None}
+        running = threading.Event()
+        running.set()
+
+        def task_sleep(seconds):
+            # Stands in for the one second back-off of process_withdrawal.
+            with stats_lock:
+                stats['task_lock_retries'] += 1
+            time.sleep(0.001)
+
+        def monitor():
+            try:
+                while running.is_set():
+                    queryset = Wallet.objects.with_available_balance() if options['append_only'] else Wallet.objects.all()
+                    field = 'available_balance' if options['append_only'] else 'balance'
+                    try:
+                        balances = list(queryset.filter(pk__in=pks).values_list(field, flat=True))
+                    except OperationalError:
+                        continue
+                    current = min(balances, default=None)
+                    with stats_lock:
+                        if current is not None and (lowest['balance'] is None or current < lowest['balance']):
+                            lowest['balance'] = current
+                    time.sleep(0.001)
+            finally:
+                connection.close()
+
+        def run_operation(operation, wallet_pk, amount):
+            if operation == 'deposit':
+                Wallet.objects.get(pk=wallet_pk).deposit(amount)
+            elif operation == 'withdraw':
+                Wallet.objects.get(pk=wallet_pk).withdraw(amount)
+            else:
+                scheduled = ScheduledWithdrawal.objects.create(wallet_id=wallet_pk, amount=amount, scheduled_time=timezone.now())
+                process_withdrawal(scheduled.pk)
+
+        def worker(index):
+            rng = random.Random(None if seed is None else seed + index)
+            local = dict.fromkeys(stats, 0)
+            try:
+                for _ in range(options['operations']):
+                    operation = rng.choice(OPERATIONS)
+                    wallet_pk = rng.choice(pks)
+                    amount = Decimal(rng.randint(1, 3000)).scaleb(-2)
+                    while True:
+                        try:
+                            run_operation(operation, wallet_pk, amount)
+                            local[f'{operation}_done'] += 1
+                        except InsufficientFundsError:
+                            local[f'{operation}_insufficient_funds'] += 1
+                        except OperationalError:
+                            local['lock_retries'] += 1
+                            time.sleep(rng.random() / 1000)
+                            continue
+                        break
+            finally:
+                connection.close()
+                with stats_lock:
+                    for key, value in local.items():
+                        stats[key] += value
+
+        monitor_thread = threading.Thread(target=monitor)
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(options['threads'])]
+        with override_settings(WALLET_APPEND_ONLY_LEDGER=options['append_only']), \
+                mock.patch('wallets.models.requests.post', bank.post), \
+                mock.patch('wallets.tasks.time', SimpleNamespace(sleep=task_sleep, perf_counter=time.perf_counter)):
+            monitor_thread.start()
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            running.clear()
+            monitor_thread.join()
+            while fold_ledger():
+                pass
+
+        done = sum(stats[f'{operation}_done'] for operation in OPERATIONS)
+        self.stdout.write(
+            f"{done} operations in {elapsed:.3f}s ({done / elapsed:.0f} operations/s) with {options['threads']} threads "
+            f"over {len(wallets)} wallets; {stats['lock_retries']} lock retries, "
+            f"{stats['task_lock_retries']} lock retries inside process_withdrawal."
+        )
+        for operation in OPERATIONS:
+            self.stdout.write(
+                f"  {operation}: {stats[f'{operation}_done']} done ({stats[f'{operation}_done'] / elapsed:.0f}/s), "
+                f"{stats[f'{operation}_insufficient_funds']} rejected for insufficient funds"
+            )
+
+        violations = []
+        if lowest['balance'] is not None and lowest['balance'] < 0:
+            violations.append(f"a balance went down to {lowest['balance']:.2f}")
+        for wallet in Wallet.objects.filter(pk__in=pks).order_by('pk'):
+            ledger = Transaction.objects.filter(wallet=wallet).aggregate(total=Sum(Transaction.objects.balance_effect()))['total'] or 0
+            ledger = Decimal(ledger).quantize(Decimal('0.01'))
+            if wallet.balance < 0:
+                violations.append(f"wallet {wallet.pk} ended at {wallet.balance:.2f}")
+            if wallet.balance != options['balance'] + ledger:
+                violations.append(f"wallet {wallet.pk} holds {wallet.balance:.2f} but its ledger sums to {options['balance'] + ledger:.2f}")
+        if violations:
+            self.stderr.write(self.style.ERROR(f"Invariant violated: {'; '.join(violations)}."))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"No balance went negative (lowest {lowest['balance']:.2f}) and every balance equals its ledger sum."
+        ))
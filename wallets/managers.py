@@ -1,4 +1,11 @@
-from django.db import models
+import json
+from collections import defaultdict
+from decimal import Decimal
+from django.db import models, transaction, IntegrityError
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
+from wallets.minor_units import minor_units_enabled, to_minor_units
+from wallets.sharding import group_by_shard, wallet_db
 
 class WalletManager(models.Manager):
     """
@@ -8,7 +15,111 @@ class WalletManager(models.Manager):
         wallet_manager = WalletManager()
         wallet = wallet_manager.create_wallet(user=user, balance=100)
     """
-    pass
+    def pks_by_uuid(self, uuids, batch_size=1000):
+        """
+        Maps the given UUIDs to the primary keys of their wallets.
+
+        The lookup is split into batches so that large lists stay below the
+        database limit on query parameters. With sharding enabled, each UUID is looked
+        up on its own shard.
+
+        Args:
+            uuids (list): The UUIDs to look up.
+            batch_size (int): The maximum number of UUIDs per query.
+
+        Returns:
+            dict: The primary key of each UUID that belongs to a wallet.
+        """
+        pks = {}
+        for shard, group in group_by_shard(uuids).items():
+            for start in range(0, len(group), batch_size):
+                pks.update(self.using(shard).filter(uuid__in=group[start:start + batch_size]).values_list('uuid', 'pk'))
+        return pks
+
+    def existing_uuids(self, uuids, batch_size=1000):
+        """
+        Returns which of the given UUIDs already belong to a wallet.
+
+        Args:
+            uuids (list): The UUIDs to look up.
+            batch_size (int): The maximum number of UUIDs per query.
+
+        Returns:
+            list: The UUIDs that are already taken.
+        """
+        return list(self.pks_by_uuid(uuids, batch_size))
+
+    def balance_change(self, delta):
+        """
+        Returns the `update()` arguments that move wallet balances by an amount.
+
+        With WALLET_MINOR_UNITS enabled the minor-unit balance moves by the same amount
+        in the same statement. A wallet not backfilled yet keeps a NULL minor-unit
+        balance, since NULL plus the amount is NULL, until the backfill copies it.
+
+        Usage:
+            Wallet.objects.filter(pk=pk).update(**Wallet.objects.balance_change(-amount))
+
+        Args:
+            delta (Decimal): The amount to add, negative for a debit.
+
+        Returns:
+            dict: The new values of `balance` and, if enabled, `balance_minor`.
+        """
+        changes = {'balance': models.F('balance') + delta}
+        if minor_units_enabled():
+            changes['balance_minor'] = models.F('balance_minor') + to_minor_units(delta)
+        return changes
+
+    def with_available_balance(self):
+        """
+        Annotates each wallet with its balance including the unfolded ledger tail.
+
+        In append-only ledger mode the `balance` column only holds the folded entries.
+        `available_balance` adds the entries the ledger folder has not reached yet, in
+        the same statement, so it is what the wallet holds right now in either mode.
+
+        Returns:
+            QuerySet: The wallets with an `available_balance` annotation.
+        """
+        transactions = self.model.transaction_set.field.model.objects
+        balance_field = self.model._meta.get_field('balance')
+        return self.annotate(
+            available_balance=models.ExpressionWrapper(
+                Round(
+                    models.F('balance') + Coalesce(transactions.unfolded_total(models.OuterRef('pk')), models.Value(Decimal(0))),
+                    precision=balance_field.decimal_places,
+                ),
+                output_field=models.DecimalField(max_digits=balance_field.max_digits, decimal_places=balance_field.decimal_places),
+            )
+        )
+
+    def available_balance(self, pk):
+        """
+        Returns the balance of a wallet including the unfolded ledger tail.
+
+        Args:
+            pk (int): The ID of the wallet.
+
+        Returns:
+            Decimal: The available balance.
+        """
+        return self.with_available_balance().values_list('available_balance', flat=True).get(pk=pk)
+
+    def available_balances(self, pks):
+        """
+        Returns the balances of several wallets including the unfolded ledger tail.
+
+        Callers that debit based on the result lock the wallet rows first, in the same
+        database transaction, the way an append-only withdrawal does.
+
+        Args:
+            pks (iterable): The IDs of the wallets.
+
+        Returns:
+            dict: The available balance of each existing wallet by ID.
+        """
+        return dict(self.with_available_balance().filter(pk__in=list(pks)).values_list('pk', 'available_balance'))
 
 class TransactionManager(models.Manager):
     """
@@ -18,7 +129,158 @@ class TransactionManager(models.Manager):
         transaction_manager = TransactionManager()
         transactions = transaction_manager.filter(user=user)
     """
-    pass
+    def pending_payouts(self):
+        """
+        Returns the withdrawals accepted by the bank but not paid out yet.
+
+        Returns:
+            QuerySet: The pending withdrawal ledger rows.
+        """
+        return self.filter(pending=True)
+
+    def due_payouts(self, now):
+        """
+        Returns the pending payouts whose status should be checked, oldest check first.
+
+        The filter matches the partial `next_poll_at` index on pending rows, so the
+        cost depends on the number of pending payouts, not on the size of the ledger.
+
+        Args:
+            now (datetime): The current time.
+
+        Returns:
+            QuerySet: The due pending payouts ordered by `next_poll_at`.
+        """
+        return self.pending_payouts().filter(next_poll_at__lte=now).order_by('next_poll_at')
+
+    def failed_withdrawals(self, start, end, status_codes):
+        """
+        Returns the bank withdrawals that failed within a window with the given bank status codes.
+
+        Failed withdrawals were credited back, or never counted in append-only ledger
+        mode, so they can be replayed as new withdrawals. Internal transfers are excluded.
+        The filter matches the `(bank_status_code, created_at)` index.
+
+        Args:
+            start (datetime): The start of the window.
+            end (datetime): The end of the window.
+            status_codes (list): The bank status codes, e.g. ["503", "408"].
+
+        Returns:
+            QuerySet: The failed withdrawals.
+        """
+        return self.filter(
+            bank_status_code__in=[str(code) for code in status_codes],
+            created_at__gte=start,
+            created_at__lt=end,
+            is_withdrawal=True,
+            settle=False,
+            pending=False,
+            transfer_id__isnull=True,
+        )
+
+    def append_withdrawal(self, wallet, amount, **fields):
+        """
+        Appends a withdrawal entry if the available balance of the wallet covers it.
+
+        The balance check and the insert are one `INSERT ... SELECT ... WHERE EXISTS`
+        statement, so no other write can slip in between them on databases that lock
+        the whole file for writes, like SQLite. On PostgreSQL the caller must lock the
+        wallet row first, so two withdrawals of the same wallet do not both check
+        against a tail that lacks the other one.
+
+        Args:
+            wallet (Wallet): The wallet to withdraw from.
+            amount (Decimal): The amount to be withdrawn.
+            **fields: Further field values of the entry.
+
+        Returns:
+            Transaction: The appended entry, or None if the balance does not cover the amount.
+        """
+        entry = self.model(wallet=wallet, amount=amount, is_withdrawal=True, settle=True, appended=True, **fields)
+        if entry.amount_minor is None and minor_units_enabled():
+            entry.amount_minor = to_minor_units(amount)
+        entry.created_at = entry.updated_at = timezone.now()
+        connection = transaction.get_connection(self.db)
+        columns = []
+        values = []
+        for field in self.model._meta.concrete_fields:
+            value = field.get_db_prep_save(getattr(entry, field.attname), connection)
+            # Unset columns are left to their NULL default, so no parameter is untyped.
+            if not field.primary_key and value is not None:
+                columns.append(connection.ops.quote_name(field.column))
+                values.append(value)
+        covered = wallet.__class__.objects.with_available_balance().filter(pk=wallet.pk, available_balance__gte=amount).values('pk')
+        covered_sql, covered_params = covered.query.get_compiler(self.db).as_sql()
+        sql = (
+            f"INSERT INTO {connection.ops.quote_name(self.model._meta.db_table)} ({', '.join(columns)}) "
+            f"SELECT {', '.join(['%s'] * len(values))} WHERE EXISTS ({covered_sql})"
+        )
+        pk_column = connection.ops.quote_name(self.model._meta.pk.column)
+        returning = connection.features.can_return_columns_from_insert
+        if returning:
+            sql += f" RETURNING {pk_column}"
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [*values, *covered_params])
+            if returning:
+                rows = cursor.fetchall()
+                entry.pk = rows[0][0] if rows else None
+            elif cursor.rowcount:
+                entry.pk = connection.ops.last_insert_id(cursor, self.model._meta.db_table, self.model._meta.pk.column)
+        if entry.pk is None:
+            return None
+        entry._state.adding = False
+        entry._state.db = self.db
+        return entry
+
+    def unfolded(self):
+        """
+        Returns the append-only ledger entries not yet folded into their wallet balance.
+
+        The filter matches the partial `(wallet, id)` index on unfolded rows, so the
+        cost depends on the size of the tail, not on the size of the ledger.
+
+        Returns:
+            QuerySet: The unfolded ledger entries.
+        """
+        return self.filter(appended=True, folded=False)
+
+    def balance_effect(self):
+        """
+        Returns the expression of what a ledger row adds to its wallet balance.
+
+        Settled and pending rows count: deposits add their amount, withdrawals subtract
+        it. Failed withdrawals add nothing.
+
+        Returns:
+            Expression: The signed amount of the row.
+        """
+        return models.Case(
+            models.When(models.Q(settle=False, pending=False), then=models.Value(Decimal(0))),
+            models.When(is_withdrawal=True, then=-models.F('amount')),
+            default=models.F('amount'),
+            output_field=models.DecimalField(max_digits=16, decimal_places=2),
+        )
+
+    def unfolded_total(self, wallet):
+        """
+        Returns a subquery summing the balance effect of the unfolded entries of a wallet.
+
+        Args:
+            wallet (Expression): The wallet ID, usually an `OuterRef`.
+
+        Returns:
+            Subquery: The sum, or NULL if the wallet has no unfolded entry.
+        """
+        return models.Subquery(
+            self.unfolded()
+            .filter(wallet=wallet)
+            .order_by()
+            .values('wallet')
+            .annotate(total=models.Sum(self.balance_effect()))
+            .values('total'),
+            output_field=models.DecimalField(max_digits=16, decimal_places=2),
+        )
 
 class ScheduledWithdrawalManager(models.Manager):
     """
@@ -28,4 +290,475 @@ class ScheduledWithdrawalManager(models.Manager):
         scheduled_withdrawal_manager = ScheduledWithdrawalManager()
         scheduled_withdrawals = scheduled_withdrawal_manager.filter(user=user)
     """
-    pass
\ No newline at end of file
+    def pending(self):
+        """
+        Returns the scheduled withdrawals that have neither run nor been cancelled.
+
+        Returns:
+            QuerySet: The pending scheduled withdrawals.
+        """
+        return self.filter(processed=False, cancelled=False)
+
+    def claim(self, pk, scheduled_time=None):
+        """
+        Atomically marks a pending withdrawal as processed so that only one worker runs it.
+
+        The claim is a single conditional UPDATE, so it cannot succeed for a withdrawal
+        that was cancelled, already claimed or, when `scheduled_time` is given, moved
+        to another time after the task message was sent.
+
+        Args:
+            pk (int): The ID of the scheduled withdrawal.
+            scheduled_time (datetime.datetime): The scheduled time the task was sent for.
+
+        Returns:
+            bool: True if the caller now owns the withdrawal and must run it.
+        """
+        pending = self.pending().filter(pk=pk)
+        if scheduled_time is not None:
+            pending = pending.filter(scheduled_time=scheduled_time)
+        return bool(pending.update(processed=True))
+
+    def schedule_task(self, scheduled_withdrawal, queue):
+        """
+        Points the beat task of a withdrawal at its scheduled time.
+
+        The dedicated one-off task of the withdrawal is moved to the clocked schedule of
+        its current scheduled time and re-enabled, or created if the withdrawal does not
+        have one yet. The task carries the scheduled time, so a message sent for an
+        earlier time cannot claim the withdrawal, and the wallet UUID, from which the
+        worker finds the shard of the withdrawal.
+
+        Args:
+            scheduled_withdrawal (ScheduledWithdrawal): The withdrawal to schedule.
+            queue (str): The queue the task is sent to when it is created.
+
+        Returns:
+            PeriodicTask: The dedicated task of the withdrawal.
+        """
+        from django_celery_beat.models import ClockedSchedule, PeriodicTask
+
+        clocked, created = ClockedSchedule.objects.get_or_create(clocked_time=scheduled_withdrawal.scheduled_time)
+        kwargs = json.dumps(
+            {
+                "scheduled_withdrawal_id": scheduled_withdrawal.id,
+                "scheduled_time": scheduled_withdrawal.scheduled_time.isoformat(),
+                "wallet_uuid": str(scheduled_withdrawal.wallet.uuid),
+            }
+        )
+        task = PeriodicTask.objects.filter(pk=scheduled_withdrawal.periodic_task_id).first()
+        if task is None:
+            task = PeriodicTask.objects.create(
+                clocked=clocked,
+                name=f"withdraw-{scheduled_withdrawal.id}",
+                task="wallets.tasks.process_withdrawal",
+                one_off=True,
+                queue=queue,
+                kwargs=kwargs,
+            )
+            scheduled_withdrawal.periodic_task = task
+            self.filter(pk=scheduled_withdrawal.pk).update(periodic_task=task)
+            return task
+
+        previous_clocked_id = task.clocked_id
+        task.clocked = clocked
+        task.kwargs = kwargs
+        task.enabled = True
+        task.save()
+        self.release_clocked(previous_clocked_id)
+        return task
+
+    def release_clocked(self, clocked_id):
+        """
+        Deletes a clocked schedule if no beat task uses it anymore.
+
+        Args:
+            clocked_id (int): The ID of the clocked schedule.
+        """
+        from django_celery_beat.models import ClockedSchedule
+
+        if clocked_id is not None:
+            ClockedSchedule.objects.filter(pk=clocked_id, periodictask__isnull=True).delete()
+
+    def cancel(self, scheduled_withdrawal):
+        """
+        Cancels a pending withdrawal and removes its beat task.
+
+        The withdrawal is flagged with a conditional UPDATE, so it cannot be cancelled
+        once a worker has claimed it and a worker cannot claim it once it is cancelled.
+        The dedicated task and its clocked schedule are deleted in the same database
+        transaction, so beat never fires for a cancelled withdrawal. Withdrawals of a
+        batch share the task of their time slot, which skips cancelled withdrawals.
+
+        Args:
+            scheduled_withdrawal (ScheduledWithdrawal): The withdrawal to cancel.
+
+        Returns:
+            bool: True if the withdrawal was cancelled, False if it had already run or
+                been cancelled.
+        """
+        from django_celery_beat.models import PeriodicTask
+
+        # The beat tables are on the default database, which is not the wallet shard
+        # when sharding is enabled; the two transactions commit one after the other.
+        with transaction.atomic(using=wallet_db()), transaction.atomic():
+            if not self.pending().filter(pk=scheduled_withdrawal.pk).update(cancelled=True):
+                return False
+            scheduled_withdrawal.cancelled = True
+            task = PeriodicTask.objects.filter(pk=scheduled_withdrawal.periodic_task_id).first()
+            if task is not None:
+                task.delete()
+                self.release_clocked(task.clocked_id)
+        return True
+
+    def reschedule(self, scheduled_withdrawal, scheduled_time, queue):
+        """
+        Moves a pending withdrawal to another scheduled time.
+
+        The new time is written with a conditional UPDATE, so a withdrawal that a worker
+        has already claimed is not moved. The beat task is moved in the same database
+        transaction. A withdrawal of a batch gets a dedicated task and leaves the task
+        of its batch time slot.
+
+        Args:
+            scheduled_withdrawal (ScheduledWithdrawal): The withdrawal to move.
+            scheduled_time (datetime.datetime): The new scheduled time.
+            queue (str): The queue used when a dedicated task has to be created.
+
+        Returns:
+            bool: True if the withdrawal was moved, False if it had already run or been
+                cancelled.
+        """
+        with transaction.atomic(using=wallet_db()), transaction.atomic():
+            if not self.pending().filter(pk=scheduled_withdrawal.pk).update(scheduled_time=scheduled_time):
+                return False
+            scheduled_withdrawal.scheduled_time = scheduled_time
+            self.schedule_task(scheduled_withdrawal, queue)
+        return True
+
+class StandingOrderManager(models.Manager):
+    """
+    Manager class for standing orders.
+
+    Example usage:
+        standing_order_manager = StandingOrderManager()
+        due_orders = standing_order_manager.due(timezone.now())
+    """
+    def due(self, now):
+        """
+        Returns the active standing orders whose next occurrence is due.
+
+        Args:
+            now (datetime.datetime): The current time.
+
+        Returns:
+            QuerySet: The due standing orders.
+        """
+        return self.filter(active=True, next_run_at__lte=now)
+
+class OutboxEventManager(models.Manager):
+    """
+    Manager class for recording wallet events in the transactional outbox.
+
+    Events are written in the same database transaction as the ledger row they
+    describe, so an event exists if and only if the balance change was committed.
+    The webhook deliveries of the event are queued in the same transaction.
+
+    Example usage:
+        outbox_event_manager = OutboxEventManager()
+        event = outbox_event_manager.record(transaction_log)
+    """
+    def event_fields(self, transaction_log):
+        """
+        Builds the field values of the outbox event describing a ledger row.
+
+        Args:
+            transaction_log (Transaction): The ledger row the event is about.
+
+        Returns:
+            dict: The keyword arguments used to create the OutboxEvent instance.
+        """
+        event_type = self.model.EventType.WITHDRAWAL if transaction_log.is_withdrawal else self.model.EventType.DEPOSIT
+        return {
+            'event_type': event_type,
+            'wallet_uuid': transaction_log.wallet.uuid,
+            'payload': {
+                'transaction_id': transaction_log.id,
+                'wallet': str(transaction_log.wallet.uuid),
+                'amount': str(transaction_log.amount),
+                'is_withdrawal': transaction_log.is_withdrawal,
+                'settle': transaction_log.settle,
+                'bank_status_code': transaction_log.bank_status_code,
+                'transfer_id': str(transaction_log.transfer_id) if transaction_log.transfer_id else None,
+                'pending': transaction_log.pending,
+                'created_at': transaction_log.created_at.isoformat(),
+            },
+        }
+
+    def record(self, transaction_log):
+        """
+        Records the outbox event for a single ledger row.
+
+        Args:
+            transaction_log (Transaction): The ledger row the event is about.
+
+        Returns:
+            OutboxEvent: The created event.
+        """
+        event = self.create(**self.event_fields(transaction_log))
+        if transaction_log.wallet.has_webhooks:
+            self.queue_webhooks([event])
+        return event
+
+    def record_many(self, transaction_logs, batch_size=None):
+        """
+        Records the outbox events for several ledger rows with a single bulk insert.
+
+        Args:
+            transaction_logs (list): The ledger rows the events are about.
+            batch_size (int): The maximum number of rows per INSERT statement.
+
+        Returns:
+            list: The created events.
+        """
+        events = [self.model(**self.event_fields(transaction_log)) for transaction_log in transaction_logs]
+        events = self.bulk_create(events, batch_size=batch_size)
+        self.queue_webhooks(
+            [event for event, transaction_log in zip(events, transaction_logs) if transaction_log.wallet.has_webhooks],
+            batch_size=batch_size,
+        )
+        return events
+
+    def queue_webhooks(self, events, batch_size=None):
+        """
+        Queues recorded events to the webhook subscriptions of their wallets.
+
+        Only the events of wallets flagged with `has_webhooks` are passed in, so balance
+        changes of the other wallets cost no query.
+
+        Args:
+            events (list): The recorded events.
+            batch_size (int): The maximum number of rows per INSERT statement.
+
+        Returns:
+            list: The queued WebhookDelivery instances.
+        """
+        return self.model._meta.apps.get_model('wallets', 'WebhookDelivery').objects.queue(events, batch_size=batch_size)
+
+    def pending(self):
+        """
+        Returns the events that have not been published yet, oldest first.
+
+        Returns:
+            QuerySet: The unpublished events ordered by id.
+        """
+        return self.filter(published_at__isnull=True).order_by('id')
+
+
+class WalletDailyAggregateManager(models.Manager):
+    """
+    Manager class for maintaining the daily per-wallet aggregates.
+
+    Aggregates are updated incrementally with `F()` expressions, so recording a
+    ledger row costs one UPDATE (or one INSERT for the first row of the day).
+
+    Example usage:
+        aggregate_manager = WalletDailyAggregateManager()
+        aggregate_manager.record(transaction_log)
+    """
+    def add(self, wallet_id, date, deposit_total=0, deposit_count=0, withdrawal_total=0, withdrawal_count=0):
+        """
+        Adds totals and counts to the aggregate of a wallet for a day, creating it if needed.
+
+        Args:
+            wallet_id (int): The id of the wallet.
+            date (datetime.date): The day of the aggregate.
+            deposit_total (Decimal): The deposited amount to add.
+            deposit_count (int): The number of deposits to add.
+            withdrawal_total (Decimal): The withdrawn amount to add.
+            withdrawal_count (int): The number of withdrawals to add.
+        """
+        updated = self.filter(wallet_id=wallet_id, date=date).update(
+            deposit_total=models.F('deposit_total') + deposit_total,
+            deposit_count=models.F('deposit_count') + deposit_count,
+            withdrawal_total=models.F('withdrawal_total') + withdrawal_total,
+            withdrawal_count=models.F('withdrawal_count') + withdrawal_count,
+            updated_at=timezone.now(),
+        )
+        if updated:
+            return
+        try:
+            with transaction.atomic(using=wallet_db()):
+                self.create(
+                    wallet_id=wallet_id,
+                    date=date,
+                    deposit_total=deposit_total,
+                    deposit_count=deposit_count,
+                    withdrawal_total=withdrawal_total,
+                    withdrawal_count=withdrawal_count,
+                )
+        except IntegrityError:
+            # Another transaction created the row first; add to it instead.
+            self.add(wallet_id, date, deposit_total, deposit_count, withdrawal_total, withdrawal_count)
+
+    def record(self, transaction_log):
+        """
+        Adds a settled ledger row to the aggregate of its wallet and day.
+
+        Args:
+            transaction_log (Transaction): The ledger row to record.
+        """
+        self.record_many([transaction_log])
+
+    def record_many(self, transaction_logs):
+        """
+        Adds settled ledger rows to the aggregates, with one write per wallet and day.
+
+        Args:
+            transaction_logs (list): The ledger rows to record.
+        """
+        totals = defaultdict(lambda: {'deposit_total': 0, 'deposit_count': 0, 'withdrawal_total': 0, 'withdrawal_count': 0})
+        for transaction_log in transaction_logs:
+            if not transaction_log.settle:
+                continue
+            kind = 'withdrawal' if transaction_log.is_withdrawal else 'deposit'
+            key = (transaction_log.wallet_id, timezone.localdate(transaction_log.created_at))
+            totals[key][f'{kind}_total'] += transaction_log.amount
+            totals[key][f'{kind}_count'] += 1
+        for (wallet_id, date), values in totals.items():
+            self.add(wallet_id, date, **values)
+
+
+class WithdrawalReplayItemManager(models.Manager):
+    """
+    Manager class for the withdrawals queued by a replay.
+
+    Example usage:
+        item_manager = WithdrawalReplayItemManager()
+        if item_manager.claim(item_id):
+            ...
+    """
+    def claim(self, pk):
+        """
+        Atomically marks a queued replay item as running so that only one worker replays it.
+
+        The claim is a single conditional UPDATE, so a task delivered twice replays the
+        withdrawal once.
+
+        Args:
+            pk (int): The ID of the replay item.
+
+        Returns:
+            bool: True if the caller now owns the item and must replay it.
+        """
+        return bool(self.filter(pk=pk, state=self.model.State.QUEUED).update(state=self.model.State.RUNNING, updated_at=timezone.now()))
+
+    def progress(self, replay):
+        """
+        Counts the items of a replay by state.
+
+        Args:
+            replay (WithdrawalReplay): The replay.
+
+        Returns:
+            dict: The number of items in each state, including states with none.
+        """
+        counts = dict.fromkeys(self.model.State.values, 0)
+        counts.update(self.filter(replay=replay).order_by().values_list('state').annotate(count=models.Count('id')))
+        return counts
+
+
+class WebhookSubscriptionManager(models.Manager):
+    """
+    Manager class for the webhook subscriptions of wallets.
+
+    Example usage:
+        webhook_subscription_manager = WebhookSubscriptionManager()
+        webhook_subscription_manager.flag_wallet(wallet_id)
+    """
+    def flag_wallet(self, wallet_id):
+        """
+        Sets `Wallet.has_webhooks` to whether the wallet has active subscriptions.
+
+        The flag is computed in the UPDATE itself, so a subscription created and one
+        cancelled at the same time leave it right.
+
+        Args:
+            wallet_id (int): The id of the wallet.
+        """
+        wallet_model = self.model._meta.get_field('wallet').related_model
+        wallet_model.objects.using(self.db).filter(pk=wallet_id).update(
+            has_webhooks=models.Exists(self.filter(wallet_id=models.OuterRef('pk'), active=True)),
+        )
+
+
+class WebhookDeliveryManager(models.Manager):
+    """
+    Manager class for queueing wallet events to webhook endpoints.
+
+    Deliveries are queued in the transaction of the balance change, and the delivery
+    task is sent once that transaction has committed, see wallets/webhooks.py.
+
+    Example usage:
+        webhook_delivery_manager = WebhookDeliveryManager()
+        deliveries = webhook_delivery_manager.queue(events)
+    """
+    def queue(self, events, batch_size=None):
+        """
+        Queues the outbox events to the active webhook subscriptions of their wallets.
+
+        The subscriptions are looked up with one query. When deliveries are queued, a
+        delivery task is sent after the current transaction commits.
+
+        Args:
+            events (list): The outbox events.
+            batch_size (int): The maximum number of rows per INSERT statement.
+
+        Returns:
+            list: The queued deliveries.
+        """
+        if not events:
+            return []
+        subscription_model = self.model._meta.get_field('subscription').related_model
+        subscriptions = defaultdict(list)
+        for pk, wallet_uuid in subscription_model.objects.filter(
+            active=True,
+            wallet__uuid__in={event.wallet_uuid for event in events},
+        ).values_list('pk', 'wallet__uuid'):
+            subscriptions[str(wallet_uuid)].append(pk)
+        if not subscriptions:
+            return []
+
+        now = timezone.now()
+        deliveries = self.bulk_create(
+            [
+                self.model(
+                    subscription_id=subscription_id,
+                    event_id=event.pk,
+                    event_type=event.event_type,
+                    payload=event.payload,
+                    next_attempt_at=now,
+                )
+                for event in events
+                for subscription_id in subscriptions.get(str(event.wallet_uuid), ())
+            ],
+            batch_size=batch_size,
+        )
+        from wallets.webhooks import enqueue_delivery
+
+        shard = wallet_db()
+        transaction.on_commit(lambda: enqueue_delivery(shard), using=shard)
+        return deliveries
+
+    def due(self, now):
+        """
+        Returns the deliveries to send, oldest first.
+
+        Args:
+            now (datetime.datetime): The current time.
+
+        Returns:
+            QuerySet: The deliveries whose next attempt is due, read from the partial
+                `next_attempt_at` index.
+        """
+        return self.filter(next_attempt_at__isnull=False, next_attempt_at__lte=now).order_by('next_attempt_at', 'id')
@@ -0,0 +1,109 @@
+from decimal import Decimal, InvalidOperation
+import msgpack
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils import encoders
+
+DECIMAL_EXT_TYPE = 1
+
+json_encoder = encoders.JSONEncoder()
+
+
+def encode_default(obj):
+    """
+    Converts values MessagePack cannot pack natively.
+
+    Decimals are packed as an extension type holding their exact string form, so
+    amounts round-trip without going through float. Every other type is converted
+    the way DRF's JSON encoder converts it, so both formats carry the same values.
+
+    Args:
+        obj: The value to convert.
+
+    Returns:
+        The packable value.
+    """
+    if isinstance(obj, Decimal):
+        return msgpack.ExtType(DECIMAL_EXT_TYPE, str(obj).encode())
+    return json_encoder.default(obj)
+
+
+def decode_ext(code, data):
+    """
+    Converts extension types back into Python values.
+
+    Args:
+        code (int): The extension type code.
+        data (bytes): The extension payload.
+
+    Returns:
+        Decimal or msgpack.ExtType: The decoded Decimal, or the extension unchanged
+            if its type is unknown.
+
+    Raises:
+        ValueError: If a decimal payload is not a decimal string.
+    """
+    if code == DECIMAL_EXT_TYPE:
+        try:
+            return Decimal(data.decode())
+        except InvalidOperation:
+            raise ValueError(f"Invalid decimal extension payload {data!r}.")
+    return msgpack.ExtType(code, data)
+
+
+def packb(data):
+    """
+    Packs data into MessagePack bytes with the wallet extension types.
+    """
+    return msgpack.packb(data, default=encode_default, use_bin_type=True)
+
+
+def unpackb(payload):
+    """
+    Unpacks MessagePack bytes with the wallet extension types.
+    """
+    return msgpack.unpackb(payload, ext_hook=decode_ext, raw=False)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Renderer that serializes responses to MessagePack.
+
+    Selected when a client sends `Accept: application/msgpack`. Decimals use extension
+    type 1 with the decimal string as payload.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """
+        Renders the data into MessagePack.
+        """
+        if data is None:
+            return b''
+        return packb(data)
+
+
+class MessagePackParser(BaseParser):
+    """
+    Parser for MessagePack request bodies, sent with `Content-Type: application/msgpack`.
+
+    Decimals may be sent as extension type 1, as strings or as numbers.
+    """
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        """
+        Parses the request body into Python data.
+
+        Raises:
+            ParseError: If the body is not valid MessagePack, holds an invalid decimal
+                extension or uses a map or array as a map key.
+        """
+        try:
+            return unpackb(stream.read())
+        except (ValueError, TypeError, msgpack.UnpackException) as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
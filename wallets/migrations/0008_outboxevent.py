@@ -0,0 +1,29 @@
+# Generated by Django 4.2.13 on 2026-10-19 16:59
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0007_alter_wallet_uuid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created Date')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated Date')),
+                ('event_type', models.CharField(choices=[('wallet.deposit', 'Deposit'), ('wallet.withdrawal', 'Withdrawal')], max_length=64)),
+                ('wallet_uuid', models.UUIDField()),
+                ('payload', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('published_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['published_at', 'id'], name='wallets_outbox_pending_idx')],
+            },
+        ),
+    ]
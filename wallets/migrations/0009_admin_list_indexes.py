@@ -0,0 +1,33 @@
+# Generated by Django 4.2.13 on 2026-10-19 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0008_outboxevent'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='scheduledwithdrawal',
+            index=models.Index(fields=['scheduled_time'], name='wallets_sw_scheduled_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scheduledwithdrawal',
+            index=models.Index(fields=['processed', 'scheduled_time'], name='wallets_sw_processed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['created_at'], name='wallets_tx_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['settle', 'created_at'], name='wallets_tx_settle_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['bank_status_code', 'created_at'], name='wallets_tx_bank_status_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.13 on 2026-10-19 17:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0009_admin_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletDailyAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created Date')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated Date')),
+                ('date', models.DateField()),
+                ('deposit_total', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('deposit_count', models.PositiveIntegerField(default=0)),
+                ('withdrawal_total', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('withdrawal_count', models.PositiveIntegerField(default=0)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='wallets.wallet')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='walletdailyaggregate',
+            constraint=models.UniqueConstraint(fields=('wallet', 'date'), name='wallets_daily_aggregate_unique'),
+        ),
+    ]
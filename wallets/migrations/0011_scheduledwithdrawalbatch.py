@@ -0,0 +1,33 @@
+# Generated by Django 4.2.13 on 2026-10-19 17:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0010_walletdailyaggregate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledWithdrawalBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created Date')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated Date')),
+                ('uuid', models.UUIDField(default=uuid.uuid4, unique=True)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='scheduledwithdrawal',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='wallets.scheduledwithdrawalbatch'),
+        ),
+    ]
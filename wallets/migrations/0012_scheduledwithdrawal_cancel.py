@@ -0,0 +1,25 @@
+# Generated by Django 4.2.13 on 2026-10-19 17:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_beat', '0018_improve_crontab_helptext'),
+        ('wallets', '0011_scheduledwithdrawalbatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduledwithdrawal',
+            name='cancelled',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='scheduledwithdrawal',
+            name='periodic_task',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='django_celery_beat.periodictask'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.13 on 2026-10-19 17:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0012_scheduledwithdrawal_cancel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StandingOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created Date')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated Date')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('cron', models.CharField(blank=True, max_length=100)),
+                ('interval', models.DurationField(blank=True, null=True)),
+                ('next_run_at', models.DateTimeField()),
+                ('last_run_at', models.DateTimeField(blank=True, null=True)),
+                ('active', models.BooleanField(default=True)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='standing_orders', to='wallets.wallet')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='scheduledwithdrawal',
+            name='standing_order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='occurrences', to='wallets.standingorder'),
+        ),
+        migrations.AddIndex(
+            model_name='standingorder',
+            index=models.Index(condition=models.Q(('active', True)), fields=['next_run_at'], name='wallets_so_due_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.13 on 2026-10-19 17:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0013_standingorder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='transfer_id',
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+    ]
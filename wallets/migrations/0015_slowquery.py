@@ -0,0 +1,30 @@
+# Generated by Django 4.2.13 on 2026-10-19 17:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0014_transaction_transfer_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created Date')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated Date')),
+                ('fingerprint', models.CharField(max_length=40)),
+                ('sql', models.TextField()),
+                ('params', models.TextField(blank=True)),
+                ('duration', models.FloatField()),
+                ('origin', models.CharField(max_length=255)),
+                ('plan', models.TextField(blank=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='wallets_slow_query_time_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.13 on 2026-10-19 17:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0015_slowquery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='bank_reference',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='next_poll_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='pending',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='poll_attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('pending', True)), fields=['next_poll_at'], name='wallets_tx_pending_poll_idx'),
+        ),
+    ]
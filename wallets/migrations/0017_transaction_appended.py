@@ -0,0 +1,27 @@
+# Generated by Django 4.2.13 on 2026-10-19 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0016_transaction_pending'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='appended',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='folded',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('appended', True), ('folded', False)), fields=['wallet', 'id'], name='wallets_tx_unfolded_idx'),
+        ),
+    ]
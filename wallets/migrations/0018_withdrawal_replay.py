@@ -0,0 +1,52 @@
+# Generated by Django 4.2.13 on 2026-10-19 18:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0017_transaction_appended'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WithdrawalReplay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created Date')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated Date')),
+                ('uuid', models.UUIDField(default=uuid.uuid4, unique=True)),
+                ('window_start', models.DateTimeField()),
+                ('window_end', models.DateTimeField()),
+                ('status_codes', models.JSONField(default=list)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='retry_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='retries', to='wallets.transaction'),
+        ),
+        migrations.CreateModel(
+            name='WithdrawalReplayItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created Date')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated Date')),
+                ('state', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=16)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('original', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='replay_item', to='wallets.transaction')),
+                ('replay', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='wallets.withdrawalreplay')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
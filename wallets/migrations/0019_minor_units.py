@@ -0,0 +1,23 @@
+# Generated by Django 4.2.13 on 2026-10-19 18:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0018_withdrawal_replay'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='amount_minor',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='wallet',
+            name='balance_minor',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
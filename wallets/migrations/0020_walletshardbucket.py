@@ -0,0 +1,27 @@
+# Generated by Django 4.2.13 on 2026-10-19 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0019_minor_units'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletShardBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created Date')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated Date')),
+                ('bucket', models.PositiveIntegerField(unique=True)),
+                ('shard', models.CharField(max_length=64)),
+                ('locked', models.BooleanField(default=False)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
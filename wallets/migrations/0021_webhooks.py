@@ -0,0 +1,58 @@
+# Generated by Django 4.2.13 on 2026-10-19 19:08
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+import wallets.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0020_walletshardbucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='has_webhooks',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='WebhookSubscription',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created Date')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated Date')),
+                ('url', models.URLField(max_length=500)),
+                ('secret', models.CharField(default=wallets.models.generate_webhook_secret, max_length=64)),
+                ('active', models.BooleanField(default=True)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='webhooks', to='wallets.wallet')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WebhookDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created Date')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated Date')),
+                ('event_id', models.BigIntegerField()),
+                ('event_type', models.CharField(max_length=64)),
+                ('payload', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(blank=True, null=True)),
+                ('delivered_at', models.DateTimeField(blank=True, null=True)),
+                ('last_status', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('last_error', models.CharField(blank=True, max_length=255)),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='wallets.webhooksubscription')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='webhooksubscription',
+            index=models.Index(condition=models.Q(('active', True)), fields=['wallet'], name='wallets_webhook_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='webhookdelivery',
+            index=models.Index(condition=models.Q(('next_attempt_at__isnull', False)), fields=['next_attempt_at'], name='wallets_webhook_due_idx'),
+        ),
+    ]
@@ -0,0 +1,162 @@
+from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+from django.db import models
+from django.db.models.functions import Cast, Round
+from base.vars import MINOR_UNIT_DECIMAL_PLACES, MINOR_UNITS_BACKFILL_BATCH_SIZE
+
+MINOR_UNIT_QUANTUM = Decimal(1).scaleb(-MINOR_UNIT_DECIMAL_PLACES)
+MINOR_UNITS_PER_UNIT = 10 ** MINOR_UNIT_DECIMAL_PLACES
+# The decimal columns and their integer minor-unit copies, per model.
+MINOR_UNIT_COLUMNS = (
+    ('Wallet', 'balance', 'balance_minor'),
+    ('Transaction', 'amount', 'amount_minor'),
+)
+
+
+def minor_units_enabled():
+    """
+    Returns whether balances and amounts are also stored in integer minor units.
+
+    Returns:
+        bool: The value of the WALLET_MINOR_UNITS setting.
+    """
+    return getattr(settings, 'WALLET_MINOR_UNITS', False)
+
+
+def minor_unit_reads_enabled():
+    """
+    Returns whether the API renders balances and amounts from the minor-unit columns.
+
+    Reads stay off until WALLET_MINOR_UNIT_READS is set too, which is only safe once
+    `backfill_minor_units --verify` reports no row out of step. Before that a row
+    written by a process with dual writes disabled would be rendered stale.
+
+    Returns:
+        bool: Whether both WALLET_MINOR_UNITS and WALLET_MINOR_UNIT_READS are enabled.
+    """
+    return minor_units_enabled() and getattr(settings, 'WALLET_MINOR_UNIT_READS', False)
+
+
+def to_minor_units(amount):
+    """
+    Converts an amount to integer minor units (cents).
+
+    Args:
+        amount (Decimal): The amount. Integers, floats and strings are accepted too.
+
+    Returns:
+        int: The amount in minor units, rounded half up to the nearest minor unit.
+    """
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    return int(amount.quantize(MINOR_UNIT_QUANTUM, rounding=ROUND_HALF_UP).scaleb(MINOR_UNIT_DECIMAL_PLACES))
+
+
+def format_minor_units(value):
+    """
+    Formats an amount in minor units the way the API renders decimal amounts.
+
+    No Decimal is built: 11050 becomes "110.50" with integer arithmetic only.
+
+    Args:
+        value (int): The amount in minor units.
+
+    Returns:
+        str: The amount with MINOR_UNIT_DECIMAL_PLACES decimal places, e.g. "-0.05".
+    """
+    units, minor = divmod(abs(value), MINOR_UNITS_PER_UNIT)
+    return f"{'-' if value < 0 else ''}{units}.{minor:0{MINOR_UNIT_DECIMAL_PLACES}d}"
+
+
+def minor_unit_update_fields(update_fields, field, minor_field):
+    """
+    Returns the `update_fields` of a save that keeps a minor-unit column in step.
+
+    Args:
+        update_fields (iterable): The fields passed to `save()`, or None for all fields.
+        field (str): The name of the decimal field.
+        minor_field (str): The name of its minor-unit field.
+
+    Returns:
+        list: The fields to save, with `minor_field` added if `field` is saved, or None
+            if every field is saved.
+    """
+    if update_fields is None:
+        return None
+    update_fields = list(update_fields)
+    if field in update_fields and minor_field not in update_fields:
+        update_fields.append(minor_field)
+    return update_fields
+
+
+def minor_units_of(field):
+    """
+    Returns an expression computing the minor units of a decimal column in the database.
+
+    Args:
+        field (str): The name of the decimal field.
+
+    Returns:
+        Expression: The column times the minor units per unit, rounded to an integer.
+    """
+    scaled = models.ExpressionWrapper(
+        models.F(field) * models.Value(MINOR_UNITS_PER_UNIT),
+        output_field=models.DecimalField(),
+    )
+    return Cast(Round(scaled), models.BigIntegerField())
+
+
+def minor_unit_models():
+    """
+    Returns the models with minor-unit columns and the names of their column pairs.
+
+    Returns:
+        list: (model, decimal field, minor-unit field) tuples.
+    """
+    from django.apps import apps
+
+    return [(apps.get_model('wallets', name), field, minor_field) for name, field, minor_field in MINOR_UNIT_COLUMNS]
+
+
+def backfill_minor_units(batch_size=MINOR_UNITS_BACKFILL_BATCH_SIZE):
+    """
+    Copies every balance and amount into its minor-unit column.
+
+    The rows are rewritten in primary key ranges of `batch_size`, one UPDATE each in its
+    own short transaction, so the tables stay writable during the backfill. Each UPDATE
+    computes the minor units from the decimal column of the same row, so a row written
+    concurrently is either copied after the write or kept in step by the dual write.
+    Running it again is harmless and repairs rows written while some process still had
+    WALLET_MINOR_UNITS disabled.
+
+    Args:
+        batch_size (int): The number of primary keys per UPDATE.
+
+    Returns:
+        dict: The number of rows copied per model name.
+    """
+    counts = {}
+    for model, field, minor_field in minor_unit_models():
+        bounds = model.objects.aggregate(low=models.Min('pk'), high=models.Max('pk'))
+        counts[model._meta.model_name] = 0
+        if bounds['low'] is None:
+            continue
+        for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+            counts[model._meta.model_name] += model.objects.filter(pk__gte=start, pk__lt=start + batch_size).update(
+                **{minor_field: minor_units_of(field)},
+            )
+    return counts
+
+
+def minor_unit_mismatches():
+    """
+    Counts the rows whose minor-unit column is missing or differs from the decimal column.
+
+    Returns:
+        dict: The number of such rows per model name. All zero once the backfill has run
+            with dual writes enabled everywhere.
+    """
+    return {
+        model._meta.model_name: model.objects.exclude(**{minor_field: minor_units_of(field)}).count()
+        for model, field, minor_field in minor_unit_models()
+    }
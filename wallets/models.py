@@ -1,12 +1,20 @@
+import datetime
+import secrets
 import uuid
-import requests
 from decimal import Decimal
-from django.db import models, transaction
-from requests.exceptions import HTTPError, ConnectionError, Timeout
-from wallets.managers import WalletManager, TransactionManager, ScheduledWithdrawalManager
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction, OperationalError
+from django.utils import timezone
+from wallets.managers import WalletManager, TransactionManager, ScheduledWithdrawalManager, StandingOrderManager, OutboxEventManager, WalletDailyAggregateManager, WithdrawalReplayItemManager, WebhookSubscriptionManager, WebhookDeliveryManager
 from base.models import BaseModel
-from base.vars import BANK_URL
+from base.vars import BANK_URL, PAYOUT_POLL_BASE_INTERVAL
 from base.exceptions import InsufficientFundsError, BankException
+from wallet.utils import lazy_import
+from wallets.ledger import append_only_ledger_enabled
+from wallets.minor_units import minor_unit_update_fields, minor_units_enabled, to_minor_units
+from wallets.sharding import shard_for_uuid, sharding_enabled, wallet_db
+
+requests = lazy_import('requests')
 
 class Wallet(BaseModel):
     """
@@ -15,9 +23,15 @@ class Wallet(BaseModel):
     Attributes:
         uuid (UUIDField): A unique identifier for the wallet.
         balance (DecimalField): The current balance of the wallet.
+        balance_minor (BigIntegerField): The balance in minor units (cents), kept in step
+            with `balance` when WALLET_MINOR_UNITS is enabled, or None until backfilled.
+        has_webhooks (BooleanField): Whether the wallet has active webhook subscriptions,
+            so balance changes of other wallets do not look them up.
     """
     uuid = models.UUIDField(default=uuid.uuid4, unique=True, db_index=True)
     balance = models.DecimalField(default=0, max_digits=10, decimal_places=2)
+    balance_minor = models.BigIntegerField(blank=True, null=True)
+    has_webhooks = models.BooleanField(default=False)
 
     objects = WalletManager()
 
@@ -30,27 +44,38 @@ class Wallet(BaseModel):
 
         Raises:
             ValueError: If the deposit amount is not positive.
+            OperationalError: If the database is locked; nothing was written.
+
+        In append-only ledger mode (WALLET_APPEND_ONLY_LEDGER) the deposit only appends
+        a ledger entry, and `balance` is set to the available balance afterwards.
         """
         if amount <= 0:
             raise ValueError("Deposit amount must be positive.")
+        if append_only_ledger_enabled():
+            with transaction.atomic(using=wallet_db()):
+                self._append_entry(amount=amount, is_withdrawal=False, settle=True)
+            self.balance = Wallet.objects.available_balance(self.pk)
+            return
         try:
-            with transaction.atomic():
-                self.balance = models.F('balance') + amount
-                self.save(update_fields=['balance','updated_at'])
-                transaction_log = Transaction.objects.create(
-                    wallet=self,
+            with transaction.atomic(using=wallet_db()):
+                Wallet.objects.filter(pk=self.pk).update(**Wallet.objects.balance_change(amount), updated_at=timezone.now())
+                transaction_log = self._log_transaction(
                     amount=amount,
                     is_withdrawal=False,
                     settle=True
                 )
                 self.refresh_from_db()
+        except OperationalError:
+            # The database is locked or busy; nothing was written and the caller may retry.
+            raise
         except Exception as e:
-            with transaction.atomic():
+            # The balance change was rolled back, so the attempt is logged as unsettled.
+            with transaction.atomic(using=wallet_db()):
                 transaction_log = Transaction.objects.create(
                         wallet=self,
                         amount=amount,
                         is_withdrawal=False,
-                        settle=True
+                        settle=False
                     )
 
     # This method is no longer used due to system improvements and bug fixes.
@@ -73,84 +98,251 @@ class Wallet(BaseModel):
             raise InsufficientFundsError("Insufficient funds.")
         
         try:
-            with transaction.atomic():
-                self.balance = models.F('balance') - amount
-                self.save(update_fields=['balance','updated_at'])
+            with transaction.atomic(using=wallet_db()):
+                Wallet.objects.filter(pk=self.pk).update(**Wallet.objects.balance_change(-amount), updated_at=timezone.now())
         except Exception as e:
             return False
 
-    def withdraw(self, amount: Decimal):
+    def withdraw(self, amount: Decimal, retry_of=None):
         """
         Withdraws a specified amount from the wallet and interacts with a bank endpoint.
 
         Args:
             amount (Decimal): The amount to be withdrawn.
+            retry_of (Transaction): The failed withdrawal this one replays, if any.
+
+        Returns:
+            Transaction: The ledger row of the withdrawal.
 
         Raises:
             ValueError: If the withdrawal amount is not positive.
             InsufficientFundsError: If the wallet has insufficient funds.
-            BankException: If the bank response status code is not 200.
+            OperationalError: If the database is locked; nothing was written.
+
+        The debit is a conditional UPDATE that only applies while the balance covers the
+        amount, so concurrent withdrawals cannot overdraw the wallet whatever balance this
+        instance was loaded with. Database lock errors are raised so the caller can retry.
+
+        A bank answer with status 202 and a payout reference means the payout was accepted
+        but is not paid yet. The amount then stays debited and the ledger row is marked
+        pending until the payout poller settles or refunds it.
+
+        In append-only ledger mode (WALLET_APPEND_ONLY_LEDGER) the withdrawal only appends
+        a ledger entry, see `_append_withdraw`.
         """
-        balance = self.balance
         if amount <= Decimal('0'):
             raise ValueError("Withdraw amount must be positive.")
-        elif balance < amount:
+        if append_only_ledger_enabled():
+            return self._append_withdraw(amount, retry_of=retry_of)
+        if self.balance < amount:
             raise InsufficientFundsError("Insufficient funds.")
 
         try:
-            with transaction.atomic():
-                self.balance = models.F('balance') - amount
-                self.save(update_fields=['balance','updated_at'])
-                try:
-                    bank_response = requests.post(BANK_URL, timeout=5)
-                    bank_response.raise_for_status()
-                    json_response = bank_response.json()
-                    status_code = json_response.get("status", "-")
-                    status_response = json_response.get("data","-")
-                    settle=True
-                    if status_code != 200:
-                        raise BankException("Bank Status code not equal to 200 raised.")
-                except HTTPError as http_err:
-                    self.balance = models.F('balance') + amount
-                    self.save(update_fields=['balance','updated_at'])
-                    status_code = 500
-                    status_response = "HTTP Error."
-                    settle=False
-                except ConnectionError as conn_err:
-                    self.balance = models.F('balance') + amount
-                    self.save(update_fields=['balance','updated_at'])
-                    status_code = 503
-                    status_response = "Service unavailable."
-                    settle=False
-                except Timeout as timeout_err:
-                    self.balance = models.F('balance') + amount
-                    self.save(update_fields=['balance','updated_at'])
-                    status_code = 408
-                    status_response = "Request Timeout"
-                    settle=False
-                except Exception as e:
-                    self.balance = models.F('balance') + amount
-                    self.save(update_fields=['balance','updated_at'])
-                    settle=False
-                finally:
-                    transaction_log = Transaction.objects.create(
-                        wallet=self,
-                        amount=amount,
-                        is_withdrawal=True,
-                        settle=settle,
-                        bank_status_code = status_code,
-                        bank_message = status_response
-                    )
-                    self.refresh_from_db()
-                
+            with transaction.atomic(using=wallet_db()):
+                wallet = Wallet.objects.filter(pk=self.pk)
+                if not wallet.filter(balance__gte=amount).update(**Wallet.objects.balance_change(-amount), updated_at=timezone.now()):
+                    raise InsufficientFundsError("Insufficient funds.")
+                payout = self._request_payout()
+                if not payout['settle'] and not payout['pending']:
+                    wallet.update(**Wallet.objects.balance_change(amount), updated_at=timezone.now())
+                transaction_log = self._log_transaction(amount=amount, is_withdrawal=True, retry_of=retry_of, **payout)
+                self.refresh_from_db()
+
+        except (InsufficientFundsError, OperationalError):
+            # Nothing was written: the balance no longer covers the amount, or the database
+            # is locked or busy and the caller may retry.
+            raise
         except Exception as e:
-            with transaction.atomic():
+            with transaction.atomic(using=wallet_db()):
                 transaction_log = Transaction.objects.create(
                         wallet=self,
                         amount=amount,
                         is_withdrawal=True,
-                        settle=False
+                        settle=False,
+                        retry_of=retry_of,
                     )
+        return transaction_log
+
+    def _append_withdraw(self, amount: Decimal, retry_of=None):
+        """
+        Withdraws an amount in append-only ledger mode.
+
+        The entry is appended with the conditional insert of
+        `TransactionManager.append_withdrawal`, then the bank is called. If the payout
+        fails, the still uncommitted entry is marked unsettled, so it never counts in the
+        balance. The wallet row is locked first, which serializes the withdrawals of a
+        wallet on databases with row locks; deposits are not blocked.
+
+        Args:
+            amount (Decimal): The amount to be withdrawn.
+            retry_of (Transaction): The failed withdrawal this one replays, if any.
+
+        Returns:
+            Transaction: The appended ledger entry.
+
+        Raises:
+            InsufficientFundsError: If the available balance does not cover the amount.
+        """
+        with transaction.atomic(using=wallet_db()):
+            Wallet.objects.select_for_update().filter(pk=self.pk).values_list('pk', flat=True).get()
+            entry = Transaction.objects.append_withdrawal(self, amount, retry_of=retry_of)
+            if entry is None:
+                raise InsufficientFundsError("Insufficient funds.")
+            payout = self._request_payout()
+            Transaction.objects.filter(pk=entry.pk).update(**payout)
+            for name, value in payout.items():
+                setattr(entry, name, value)
+            OutboxEvent.objects.record(entry)
+        self.balance = Wallet.objects.available_balance(self.pk)
+        return entry
+
+    def _request_payout(self):
+        """
+        Asks the bank to pay out a withdrawal.
+
+        Errors are not raised but described in the result: a payout the bank rejected or
+        could not be reached for is unsettled and not pending.
+
+        Returns:
+            dict: The ledger fields describing the outcome: `settle`, `pending`,
+                `bank_status_code`, `bank_message`, `bank_reference` and `next_poll_at`.
+        """
+        payout = {'settle': False, 'pending': False, 'bank_status_code': None, 'bank_message': None, 'bank_reference': None, 'next_poll_at': None}
+        try:
+            bank_response = requests.post(BANK_URL, timeout=5)
+            bank_response.raise_for_status()
+            json_response = bank_response.json()
+            payout['bank_status_code'] = json_response.get("status", "-")
+            payout['bank_message'] = json_response.get("data","-")
+            if payout['bank_status_code'] == 202 and json_response.get("reference"):
+                payout['pending'] = True
+                payout['bank_reference'] = str(json_response["reference"])
+                payout['next_poll_at'] = timezone.now() + datetime.timedelta(seconds=PAYOUT_POLL_BASE_INTERVAL)
+            elif payout['bank_status_code'] != 200:
+                raise BankException("Bank Status code not equal to 200 raised.")
+            else:
+                payout['settle'] = True
+        except requests.exceptions.HTTPError as http_err:
+            payout['bank_status_code'] = 500
+            payout['bank_message'] = "HTTP Error."
+        except requests.exceptions.ConnectionError as conn_err:
+            payout['bank_status_code'] = 503
+            payout['bank_message'] = "Service unavailable."
+        except requests.exceptions.Timeout as timeout_err:
+            payout['bank_status_code'] = 408
+            payout['bank_message'] = "Request Timeout"
+        except Exception as e:
+            pass
+        return payout
+
+    def transfer_to(self, target, amount: Decimal):
+        """
+        Transfers a specified amount from this wallet to another wallet.
+
+        The transfer is internal, so the bank is not called. The debit and the credit
+        are both single UPDATE statements, which lock the wallet rows, and they are
+        issued in primary key order. Every transfer locks in that order, so two
+        opposing transfers between the same wallets wait for each other instead of
+        deadlocking. The debit only applies if the balance covers the amount, so there is
+        no separate read to go stale. The debit, the credit and the paired ledger rows
+        are committed in one short database transaction.
+
+        In append-only ledger mode the balance column misses the unfolded entries, so
+        both wallet rows are locked in primary key order and the debit is checked
+        against the available balance instead, under the same lock an append-only
+        withdrawal takes.
+
+        Args:
+            target (Wallet): The wallet receiving the amount.
+            amount (Decimal): The amount to be transferred.
+
+        Returns:
+            UUID: The transfer ID shared by the debit and credit ledger rows.
+
+        Raises:
+            ValueError: If the amount is not positive or the target is this wallet.
+            InsufficientFundsError: If this wallet has insufficient funds.
+            Wallet.DoesNotExist: If the target wallet was deleted.
+        """
+        if amount <= 0:
+            raise ValueError("Transfer amount must be positive.")
+        if target.pk == self.pk:
+            raise ValueError("Cannot transfer to the same wallet.")
+
+        transfer_id = uuid.uuid4()
+        now = timezone.now()
+        append_only = append_only_ledger_enabled()
+        source = Wallet.objects.filter(pk=self.pk) if append_only else Wallet.objects.filter(pk=self.pk, balance__gte=amount)
+        debit = (source, Wallet.objects.balance_change(-amount), InsufficientFundsError("Insufficient funds."))
+        credit = (Wallet.objects.filter(pk=target.pk), Wallet.objects.balance_change(amount), Wallet.DoesNotExist("Target wallet does not exist."))
+        with transaction.atomic(using=wallet_db()):
+            if append_only:
+                list(Wallet.objects.select_for_update().filter(pk__in=[self.pk, target.pk]).order_by('pk').values_list('pk', flat=True))
+                if Wallet.objects.available_balances([self.pk]).get(self.pk, Decimal('0')) < amount:
+                    raise InsufficientFundsError("Insufficient funds.")
+            for queryset, changes, error in (debit, credit) if self.pk < target.pk else (credit, debit):
+                if not queryset.update(**changes, updated_at=now):
+                    raise error
+            self._log_transaction(amount=amount, is_withdrawal=True, settle=True, transfer_id=transfer_id)
+            target._log_transaction(amount=amount, is_withdrawal=False, settle=True, transfer_id=transfer_id)
+            self.refresh_from_db(fields=['balance', 'balance_minor', 'updated_at'])
+            target.refresh_from_db(fields=['balance', 'balance_minor', 'updated_at'])
+            if append_only:
+                available = Wallet.objects.available_balances([self.pk, target.pk])
+                self.balance, target.balance = available[self.pk], available[target.pk]
+        return transfer_id
+
+    def _log_transaction(self, **fields):
+        """
+        Creates a ledger row for this wallet together with its outbox event and
+        updates the daily aggregate of the wallet.
+
+        Must be called inside the database transaction that changes the balance,
+        so the ledger row, the event and the aggregate are committed or rolled back together.
+
+        Args:
+            **fields: The field values of the Transaction to create.
+
+        Returns:
+            Transaction: The created ledger row.
+        """
+        transaction_log = Transaction.objects.create(wallet=self, **fields)
+        OutboxEvent.objects.record(transaction_log)
+        WalletDailyAggregate.objects.record(transaction_log)
+        return transaction_log
+
+    def _append_entry(self, **fields):
+        """
+        Appends a ledger entry for this wallet together with its outbox event, without
+        touching the balance.
+
+        The entry is folded into the balance and the daily aggregates later by the
+        ledger folder, so the write does not contend on the wallet row.
+
+        Args:
+            **fields: The field values of the Transaction to create.
+
+        Returns:
+            Transaction: The created ledger entry.
+        """
+        entry = Transaction.objects.create(wallet=self, appended=True, **fields)
+        OutboxEvent.objects.record(entry)
+        return entry
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the wallet, with its balance in minor units if WALLET_MINOR_UNITS is
+        enabled, also when an existing wallet is updated. With sharding enabled, a new
+        wallet is saved to the shard of its UUID, whatever database the manager was
+        pointed at.
+        """
+        if minor_units_enabled():
+            kwargs['update_fields'] = minor_unit_update_fields(kwargs.get('update_fields'), 'balance', 'balance_minor')
+            if kwargs['update_fields'] is None or 'balance_minor' in kwargs['update_fields']:
+                self.balance_minor = to_minor_units(self.balance)
+        if self._state.adding and sharding_enabled():
+            kwargs['using'] = shard_for_uuid(self.uuid)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         """
@@ -172,16 +364,59 @@ class Transaction(BaseModel):
         settle (BooleanField): Indicates if the transaction is settled.
         bank_status_code (CharField): The status code returned by the bank.
         bank_message (CharField): The message returned by the bank.
+        transfer_id (UUIDField): The ID shared by the debit and credit rows of an
+            internal transfer, or None for bank deposits and withdrawals.
+        pending (BooleanField): Indicates a withdrawal the bank accepted but has not paid
+            out yet. Its amount stays debited until the payout poller settles or refunds it.
+        bank_reference (CharField): The bank's reference of a pending payout.
+        next_poll_at (DateTimeField): When the payout poller checks a pending payout next.
+        poll_attempts (PositiveIntegerField): The number of status checks of a pending payout.
+        appended (BooleanField): Indicates a row written in append-only ledger mode, whose
+            amount is not in the wallet balance until the ledger folder materializes it.
+        folded (BooleanField): Indicates an appended row whose amount the ledger folder
+            has added to the wallet balance.
+        retry_of (ForeignKey): The failed withdrawal this withdrawal replays, if any.
+        amount_minor (BigIntegerField): The amount in minor units (cents), set when the
+            row is created with WALLET_MINOR_UNITS enabled, or None until backfilled.
     """
     amount = models.DecimalField(default=0, max_digits=10, decimal_places=2)
+    amount_minor = models.BigIntegerField(blank=True, null=True)
     wallet = models.ForeignKey(Wallet,on_delete=models.CASCADE, db_index=True)
     is_withdrawal = models.BooleanField(default=False)
     settle = models.BooleanField(default=False)
     bank_status_code = models.CharField(max_length=5, blank=True, null=True)
     bank_message = models.CharField(max_length=10, blank=True, null=True)
+    transfer_id = models.UUIDField(blank=True, null=True, db_index=True)
+    pending = models.BooleanField(default=False)
+    bank_reference = models.CharField(max_length=64, blank=True, null=True)
+    next_poll_at = models.DateTimeField(blank=True, null=True)
+    poll_attempts = models.PositiveIntegerField(default=0)
+    appended = models.BooleanField(default=False)
+    folded = models.BooleanField(default=False)
+    retry_of = models.ForeignKey('self', on_delete=models.SET_NULL, blank=True, null=True, related_name='retries')
 
     objects = TransactionManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='wallets_tx_created_idx'),
+            models.Index(fields=['settle', 'created_at'], name='wallets_tx_settle_idx'),
+            models.Index(fields=['bank_status_code', 'created_at'], name='wallets_tx_bank_status_idx'),
+            models.Index(fields=['next_poll_at'], name='wallets_tx_pending_poll_idx', condition=models.Q(pending=True)),
+            models.Index(fields=['wallet', 'id'], name='wallets_tx_unfolded_idx', condition=models.Q(appended=True, folded=False)),
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the transaction, with its amount in minor units if WALLET_MINOR_UNITS is
+        enabled, also when an existing transaction is updated.
+        """
+        if minor_units_enabled():
+            kwargs['update_fields'] = minor_unit_update_fields(kwargs.get('update_fields'), 'amount', 'amount_minor')
+            if kwargs['update_fields'] is None or 'amount_minor' in kwargs['update_fields']:
+                self.amount_minor = to_minor_units(self.amount)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         """
         Returns a string representation of the transaction.
@@ -191,6 +426,123 @@ class Transaction(BaseModel):
         """
         return f"{'Withdrawal' if self.is_withdrawal else 'Deposit'} of {self.amount} for {self.wallet.uuid}"
 
+class ScheduledWithdrawalBatch(BaseModel):
+    """
+    A model representing a batch of withdrawals scheduled together, such as a payroll run.
+
+    Attributes:
+        uuid (UUIDField): The public identifier used to track the batch.
+        item_count (PositiveIntegerField): The number of withdrawals in the batch.
+    """
+    uuid = models.UUIDField(default=uuid.uuid4, unique=True)
+    item_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        """
+        Returns a string representation of the batch.
+
+        Returns:
+            str: A string indicating the batch UUID and its number of withdrawals.
+        """
+        return f"Withdrawal batch {self.uuid} of {self.item_count} items"
+
+class StandingOrder(BaseModel):
+    """
+    A model representing a recurring withdrawal, such as a weekly or monthly payment.
+
+    The recurrence is either a cron expression or a fixed interval. The time of the
+    next occurrence is precomputed in `next_run_at`, so finding the orders that are
+    due is an index range scan over active orders, whatever their number.
+
+    Attributes:
+        wallet (ForeignKey): The wallet the withdrawals are taken from.
+        amount (DecimalField): The amount withdrawn at every occurrence.
+        cron (CharField): A five-field cron expression ("minute hour day month weekday"),
+            or blank when `interval` is used.
+        interval (DurationField): The time between two occurrences, or None when `cron` is used.
+        next_run_at (DateTimeField): The time of the next occurrence.
+        last_run_at (DateTimeField): The time of the last occurrence, if any.
+        active (BooleanField): Indicates if the order still creates withdrawals.
+    """
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='standing_orders')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    cron = models.CharField(max_length=100, blank=True)
+    interval = models.DurationField(blank=True, null=True)
+    next_run_at = models.DateTimeField()
+    last_run_at = models.DateTimeField(blank=True, null=True)
+    active = models.BooleanField(default=True)
+
+    objects = StandingOrderManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_run_at'], name='wallets_so_due_idx', condition=models.Q(active=True)),
+        ]
+
+    @staticmethod
+    def parse_cron(expression):
+        """
+        Parses a five-field cron expression.
+
+        Args:
+            expression (str): The expression, e.g. "0 9 * * mon" for every Monday at 9:00.
+
+        Returns:
+            celery.schedules.crontab: The parsed schedule.
+
+        Raises:
+            ValueError: If the expression does not have five fields or a field is invalid.
+        """
+        from celery.schedules import crontab
+
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError("A cron expression must have five fields.")
+        minute, hour, day_of_month, month_of_year, day_of_week = fields
+        return crontab(
+            minute=minute,
+            hour=hour,
+            day_of_month=day_of_month,
+            month_of_year=month_of_year,
+            day_of_week=day_of_week,
+        )
+
+    def next_run_after(self, moment):
+        """
+        Computes the first occurrence strictly after a given time.
+
+        Interval orders keep their phase: the result is `next_run_at` plus a whole
+        number of intervals.
+
+        Args:
+            moment (datetime.datetime): The time after which the occurrence must fall.
+
+        Returns:
+            datetime.datetime: The time of the occurrence.
+
+        Raises:
+            ValueError: If the cron expression is invalid or never fires, e.g. "0 9 31 2 *".
+        """
+        if self.interval:
+            if moment < self.next_run_at:
+                return self.next_run_at
+            return self.next_run_at + self.interval * ((moment - self.next_run_at) // self.interval + 1)
+        try:
+            start, delta, now = self.parse_cron(self.cron).remaining_delta(moment)
+        except RuntimeError:
+            # celery gives up when no day matches the day-of-month and month fields.
+            raise ValueError("The cron expression never fires.")
+        return start + delta
+
+    def __str__(self):
+        """
+        Returns a string representation of the standing order.
+
+        Returns:
+            str: A string indicating the amount, the wallet UUID and the recurrence.
+        """
+        return f"Standing order of {self.amount} for {self.wallet.uuid} every {self.cron or self.interval}"
+
 class ScheduledWithdrawal(BaseModel):
     """
     A model representing a scheduled withdrawal transaction.
@@ -200,14 +552,38 @@ class ScheduledWithdrawal(BaseModel):
         amount (DecimalField): The amount to be withdrawn.
         scheduled_time (DateTimeField): The time the withdrawal is scheduled for.
         processed (BooleanField): Indicates if the scheduled withdrawal has been processed.
+        batch (ForeignKey): The batch the withdrawal was scheduled with, if any.
+        cancelled (BooleanField): Indicates if the scheduled withdrawal was cancelled before it ran.
+        periodic_task (ForeignKey): The one-off beat task dedicated to this withdrawal, if any.
+            Withdrawals of a batch share the task of their time slot and have none. The
+            column has no database constraint, so spent beat rows can be garbage
+            collected without touching this table.
+        standing_order (ForeignKey): The standing order this withdrawal is an occurrence of, if any.
     """
     wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, db_index=True)
     amount = models.DecimalField(default=0, max_digits=10, decimal_places=2)
     scheduled_time = models.DateTimeField()
     processed = models.BooleanField(default=False)
+    batch = models.ForeignKey(ScheduledWithdrawalBatch, on_delete=models.CASCADE, blank=True, null=True, related_name='items')
+    cancelled = models.BooleanField(default=False)
+    periodic_task = models.ForeignKey(
+        'django_celery_beat.PeriodicTask',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        blank=True,
+        null=True,
+        related_name='+',
+    )
+    standing_order = models.ForeignKey(StandingOrder, on_delete=models.SET_NULL, blank=True, null=True, related_name='occurrences')
 
     objects = ScheduledWithdrawalManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['scheduled_time'], name='wallets_sw_scheduled_idx'),
+            models.Index(fields=['processed', 'scheduled_time'], name='wallets_sw_processed_idx'),
+        ]
+
     def __str__(self):
         """
         Returns a string representation of the scheduled withdrawal.
@@ -216,3 +592,301 @@ class ScheduledWithdrawal(BaseModel):
             str: A string indicating the amount to be withdrawn, the associated wallet UUID, and the scheduled time.
         """
         return f"Scheduled Withdrawal of {self.amount} for {self.wallet.uuid} at {self.scheduled_time}"
+
+class OutboxEvent(BaseModel):
+    """
+    A model representing a wallet event waiting to be published to the message broker.
+
+    Rows are written in the same database transaction as the balance change they
+    describe and are published in id order by the outbox relay.
+
+    Attributes:
+        event_type (CharField): The type of the event, also used as the routing key.
+        wallet_uuid (UUIDField): The UUID of the wallet the event belongs to.
+        payload (JSONField): The body of the message published to the broker.
+        published_at (DateTimeField): The time the broker confirmed the event, or null if pending.
+    """
+    class EventType(models.TextChoices):
+        DEPOSIT = 'wallet.deposit', 'Deposit'
+        WITHDRAWAL = 'wallet.withdrawal', 'Withdrawal'
+
+    event_type = models.CharField(max_length=64, choices=EventType.choices)
+    wallet_uuid = models.UUIDField()
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    published_at = models.DateTimeField(blank=True, null=True)
+
+    objects = OutboxEventManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['published_at', 'id'], name='wallets_outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        """
+        Returns a string representation of the outbox event.
+
+        Returns:
+            str: A string indicating the event type, its id and the associated wallet UUID.
+        """
+        return f"{self.event_type} #{self.id} for {self.wallet_uuid}"
+
+class WalletDailyAggregate(BaseModel):
+    """
+    A model representing the settled deposit and withdrawal totals of a wallet for one day.
+
+    Rows are maintained incrementally in the same transaction as each ledger write,
+    so reports can read them directly instead of grouping the Transaction table.
+
+    Attributes:
+        wallet (ForeignKey): The wallet the aggregate belongs to.
+        date (DateField): The day of the aggregate.
+        deposit_total (DecimalField): The sum of the settled deposits of the day.
+        deposit_count (PositiveIntegerField): The number of settled deposits of the day.
+        withdrawal_total (DecimalField): The sum of the settled withdrawals of the day.
+        withdrawal_count (PositiveIntegerField): The number of settled withdrawals of the day.
+    """
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE)
+    date = models.DateField()
+    deposit_total = models.DecimalField(default=0, max_digits=16, decimal_places=2)
+    deposit_count = models.PositiveIntegerField(default=0)
+    withdrawal_total = models.DecimalField(default=0, max_digits=16, decimal_places=2)
+    withdrawal_count = models.PositiveIntegerField(default=0)
+
+    objects = WalletDailyAggregateManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'date'], name='wallets_daily_aggregate_unique'),
+        ]
+
+    def __str__(self):
+        """
+        Returns a string representation of the daily aggregate.
+
+        Returns:
+            str: A string indicating the associated wallet id and the day.
+        """
+        return f"Daily aggregate of wallet {self.wallet_id} on {self.date}"
+
+class SlowQuery(BaseModel):
+    """
+    A model representing a wallet query that ran longer than WALLET_SLOW_QUERY_MS.
+
+    Rows are written by the slow query recorder on the connection that ran the query,
+    so queries of transactions that roll back are printed but not stored.
+
+    Attributes:
+        fingerprint (CharField): A hash of the normalized SQL, shared by runs of the same query.
+        sql (TextField): The SQL with placeholders, as sent to the database.
+        params (TextField): The parameters of the run.
+        duration (FloatField): The execution time in milliseconds.
+        origin (CharField): The view, task or command that issued the query.
+        plan (TextField): The EXPLAIN output of the query, captured right after it ran.
+    """
+    fingerprint = models.CharField(max_length=40)
+    sql = models.TextField()
+    params = models.TextField(blank=True)
+    duration = models.FloatField()
+    origin = models.CharField(max_length=255)
+    plan = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='wallets_slow_query_time_idx'),
+        ]
+
+    def __str__(self):
+        """
+        Returns a string representation of the slow query.
+
+        Returns:
+            str: A string indicating the duration and the origin of the query.
+        """
+        return f"Slow query of {self.duration:.1f}ms from {self.origin}"
+
+class WithdrawalReplay(BaseModel):
+    """
+    A model representing a bulk replay of failed withdrawals, e.g. after a bank outage.
+
+    Attributes:
+        uuid (UUIDField): The public identifier used to follow the replay.
+        window_start (DateTimeField): The start of the window the failed withdrawals were created in.
+        window_end (DateTimeField): The end of the window.
+        status_codes (JSONField): The bank status codes of the withdrawals replayed, e.g. ["503", "408"].
+        total (PositiveIntegerField): The number of withdrawals queued for replay.
+        finished_at (DateTimeField): The time the last withdrawal of the replay was processed.
+    """
+    uuid = models.UUIDField(default=uuid.uuid4, unique=True)
+    window_start = models.DateTimeField()
+    window_end = models.DateTimeField()
+    status_codes = models.JSONField(default=list)
+    total = models.PositiveIntegerField(default=0)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        """
+        Returns a string representation of the replay.
+
+        Returns:
+            str: A string indicating the replay UUID and its number of withdrawals.
+        """
+        return f"Withdrawal replay {self.uuid} of {self.total} withdrawals"
+
+class WithdrawalReplayItem(BaseModel):
+    """
+    A model representing one failed withdrawal queued for replay.
+
+    A failed withdrawal has at most one item, whatever the number of replays started,
+    so it is never replayed twice. The replayed withdrawal points back to the original
+    through `Transaction.retry_of`.
+
+    Attributes:
+        replay (ForeignKey): The replay the withdrawal belongs to.
+        original (OneToOneField): The failed withdrawal.
+        state (CharField): "queued", "running", "succeeded" (paid or accepted by the bank)
+            or "failed".
+        error (CharField): Why the replay failed, if it did.
+    """
+    class State(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        RUNNING = 'running', 'Running'
+        SUCCEEDED = 'succeeded', 'Succeeded'
+        FAILED = 'failed', 'Failed'
+
+    replay = models.ForeignKey(WithdrawalReplay, on_delete=models.CASCADE, related_name='items')
+    original = models.OneToOneField(Transaction, on_delete=models.CASCADE, related_name='replay_item')
+    state = models.CharField(max_length=16, choices=State.choices, default=State.QUEUED)
+    error = models.CharField(max_length=255, blank=True)
+
+    objects = WithdrawalReplayItemManager()
+
+    def __str__(self):
+        """
+        Returns a string representation of the replay item.
+
+        Returns:
+            str: A string indicating the original withdrawal and the state of its replay.
+        """
+        return f"Replay of transaction {self.original_id}: {self.state}"
+
+
+class WalletShardBucket(BaseModel):
+    """
+    A model representing a hash bucket of wallets that is not on its default shard.
+
+    Wallets are spread over WALLET_SHARD_BUCKETS buckets by a hash of their UUID, and
+    the buckets are split evenly over the shards by default. A row overrides the shard
+    of one bucket, after `rebalance_shards` moved it, or marks it as locked while it is
+    being moved. The rows live on the default database only, see wallets/sharding.py.
+
+    Attributes:
+        bucket (PositiveIntegerField): The bucket number.
+        shard (CharField): The database alias the wallets of the bucket are on.
+        locked (BooleanField): Whether the bucket is being moved; its wallets are not
+            served until the move is over.
+    """
+    bucket = models.PositiveIntegerField(unique=True)
+    shard = models.CharField(max_length=64)
+    locked = models.BooleanField(default=False)
+
+    def __str__(self):
+        """
+        Returns a string representation of the bucket.
+
+        Returns:
+            str: A string indicating the bucket number and its shard.
+        """
+        return f"Bucket {self.bucket} on {self.shard}{' (locked)' if self.locked else ''}"
+
+
+def generate_webhook_secret():
+    """
+    Returns a random key for signing the requests of a new webhook subscription.
+
+    Returns:
+        str: 64 hexadecimal characters.
+    """
+    return secrets.token_hex(32)
+
+
+class WebhookSubscription(BaseModel):
+    """
+    A model representing an HTTPS endpoint notified of the balance changes of a wallet.
+
+    Every ledger row recorded in the outbox queues one WebhookDelivery per active
+    subscription of its wallet, in the same database transaction. `Wallet.has_webhooks`
+    is kept in step with the active subscriptions by the manager.
+
+    Attributes:
+        wallet (ForeignKey): The wallet whose balance changes are sent.
+        url (URLField): The endpoint the events are POSTed to.
+        secret (CharField): The key of the HMAC-SHA256 signature sent with every request.
+        active (BooleanField): Indicates if new events are still queued for the endpoint.
+    """
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='webhooks')
+    url = models.URLField(max_length=500)
+    secret = models.CharField(max_length=64, default=generate_webhook_secret)
+    active = models.BooleanField(default=True)
+
+    objects = WebhookSubscriptionManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['wallet'], name='wallets_webhook_active_idx', condition=models.Q(active=True)),
+        ]
+
+    def __str__(self):
+        """
+        Returns a string representation of the subscription.
+
+        Returns:
+            str: A string indicating the endpoint and the associated wallet id.
+        """
+        return f"Webhook {self.url} for wallet {self.wallet_id}"
+
+
+class WebhookDelivery(BaseModel):
+    """
+    A model representing one wallet event waiting to be sent to one webhook endpoint.
+
+    The event is copied from the outbox, so the delivery moves with its wallet between
+    shards. Rows still to be sent have a `next_attempt_at`; it is cleared once the
+    endpoint has acknowledged the event or WEBHOOK_MAX_ATTEMPTS attempts have failed.
+
+    Attributes:
+        subscription (ForeignKey): The endpoint the event is sent to.
+        event_id (BigIntegerField): The id of the outbox event, sent for deduplication.
+        event_type (CharField): The type of the event, e.g. "wallet.deposit".
+        payload (JSONField): The event, as published to the broker.
+        attempts (PositiveIntegerField): The number of sends started.
+        next_attempt_at (DateTimeField): When the event is sent next, or null once it is done.
+        delivered_at (DateTimeField): When the endpoint acknowledged the event, if it did.
+        last_status (PositiveSmallIntegerField): The HTTP status of the last attempt, if any.
+        last_error (CharField): Why the last attempt failed, if it did.
+    """
+    subscription = models.ForeignKey(WebhookSubscription, on_delete=models.CASCADE, related_name='deliveries')
+    event_id = models.BigIntegerField()
+    event_type = models.CharField(max_length=64)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(blank=True, null=True)
+    delivered_at = models.DateTimeField(blank=True, null=True)
+    last_status = models.PositiveSmallIntegerField(blank=True, null=True)
+    last_error = models.CharField(max_length=255, blank=True)
+
+    objects = WebhookDeliveryManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_attempt_at'], name='wallets_webhook_due_idx', condition=models.Q(next_attempt_at__isnull=False)),
+        ]
+
+    def __str__(self):
+        """
+        Returns a string representation of the delivery.
+
+        Returns:
+            str: A string indicating the event and the subscription it is sent to.
+        """
+        return f"{self.event_type} #{self.event_id} to webhook {self.subscription_id}"
@@ -0,0 +1,92 @@
+import uuid
+from collections import defaultdict
+from django.db import transaction
+from django.utils import timezone
+from wallets.models import Wallet, Transaction, OutboxEvent, WalletDailyAggregate
+from wallets.ledger import append_only_ledger_enabled
+from wallets.minor_units import minor_units_enabled, to_minor_units
+from wallets.sharding import wallet_db
+from base.exceptions import InsufficientFundsError
+from base.vars import WALLET_BULK_BATCH_SIZE
+
+
+def net_deltas(transfers):
+    """
+    Nets a list of transfers into one balance delta per wallet.
+
+    Args:
+        transfers (list): The transfers, as (source wallet ID, target wallet ID, amount) tuples.
+
+    Returns:
+        dict: The net balance change of every wallet that takes part in a transfer.
+    """
+    deltas = defaultdict(int)
+    for source_id, target_id, amount in transfers:
+        deltas[source_id] -= amount
+        deltas[target_id] += amount
+    return deltas
+
+
+def apply_transfer_batch(transfers, batch_size=WALLET_BULK_BATCH_SIZE):
+    """
+    Applies a batch of internal transfers with one balance update per wallet.
+
+    All wallets of the batch are locked with SELECT ... FOR UPDATE in primary key
+    order, the order single transfers use too, so batches and single transfers cannot
+    deadlock each other. The transfers are then replayed in memory in request order,
+    and every debit is checked against the balance the wallet has at that point,
+    including the credits it received earlier in the batch. If every debit is covered,
+    the netted delta of each wallet is written with one UPDATE. The two ledger rows of
+    each transfer, their outbox events and the daily aggregates are bulk inserted in
+    the same transaction. Row updates therefore grow with the number of distinct
+    wallets, not with the number of transfers.
+
+    In append-only ledger mode the debits are checked against the available balances,
+    which include the unfolded ledger entries, read after the rows are locked.
+
+    Args:
+        transfers (list): The transfers, as (source wallet ID, target wallet ID, amount) tuples.
+        batch_size (int): The maximum number of rows per INSERT statement.
+
+    Returns:
+        dict: The transfer ID of each transfer in request order, and the number of
+            wallets whose balance was updated.
+
+    Raises:
+        InsufficientFundsError: If a debit is not covered; nothing is applied then.
+    """
+    deltas = net_deltas(transfers)
+    with transaction.atomic(using=wallet_db()):
+        wallets = {
+            wallet.pk: wallet
+            for wallet in Wallet.objects.select_for_update().filter(pk__in=list(deltas)).order_by('pk')
+        }
+        if append_only_ledger_enabled():
+            balances = Wallet.objects.available_balances(wallets)
+        else:
+            balances = {pk: wallet.balance for pk, wallet in wallets.items()}
+        for index, (source_id, target_id, amount) in enumerate(transfers):
+            if balances[source_id] < amount:
+                raise InsufficientFundsError(f"Insufficient funds for transfer {index}.")
+            balances[source_id] -= amount
+            balances[target_id] += amount
+
+        now = timezone.now()
+        updated = 0
+        for pk in sorted(deltas):
+            if deltas[pk]:
+                Wallet.objects.filter(pk=pk).update(**Wallet.objects.balance_change(deltas[pk]), updated_at=now)
+                updated += 1
+
+        transfer_ids = [uuid.uuid4() for _ in transfers]
+        transaction_logs = []
+        minor_units = minor_units_enabled()
+        for transfer_id, (source_id, target_id, amount) in zip(transfer_ids, transfers):
+            # bulk_create skips Transaction.save, so the minor-unit amount is set here.
+            amount_minor = to_minor_units(amount) if minor_units else None
+            transaction_logs.append(Transaction(wallet=wallets[source_id], amount=amount, amount_minor=amount_minor, is_withdrawal=True, settle=True, transfer_id=transfer_id))
+            transaction_logs.append(Transaction(wallet=wallets[target_id], amount=amount, amount_minor=amount_minor, is_withdrawal=False, settle=True, transfer_id=transfer_id))
+        Transaction.objects.bulk_create(transaction_logs, batch_size=batch_size)
+        OutboxEvent.objects.record_many(transaction_logs, batch_size=batch_size)
+        WalletDailyAggregate.objects.record_many(transaction_logs)
+    return {'transfer_ids': transfer_ids, 'wallets_updated': updated}
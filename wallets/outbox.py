@@ -0,0 +1,63 @@
+from django.db import transaction
+from django.utils import timezone
+from kombu import Connection, Exchange
+from wallets.models import OutboxEvent
+from wallets.sharding import wallet_db
+from base.vars import BROKER_URL, OUTBOX_EXCHANGE, OUTBOX_BATCH_SIZE
+
+wallet_events_exchange = Exchange(OUTBOX_EXCHANGE, type='topic', durable=True)
+
+
+def broker_connection(broker_url=BROKER_URL):
+    """
+    Opens a broker connection with publisher confirms enabled.
+
+    With confirms enabled, every publish blocks until the broker has acknowledged
+    the message, so an event is only marked as published once it is safe on the broker.
+
+    Args:
+        broker_url (str): The URL of the message broker.
+
+    Returns:
+        kombu.Connection: The broker connection.
+    """
+    return Connection(broker_url, transport_options={'confirm_publish': True})
+
+
+def publish_pending_events(connection, batch_size=OUTBOX_BATCH_SIZE):
+    """
+    Publishes the next ordered batch of outbox events to the broker.
+
+    The batch is locked with SELECT ... FOR UPDATE so that concurrent relays wait
+    for each other instead of publishing events out of order. Events are marked as
+    published with a single UPDATE only after every message of the batch has been
+    confirmed. If publishing fails part-way, the transaction is rolled back and the
+    whole batch is published again on the next run, which gives at-least-once
+    delivery; consumers should deduplicate on the `message_id` (the event id).
+
+    Args:
+        connection (kombu.Connection): An open broker connection.
+        batch_size (int): The maximum number of events to publish.
+
+    Returns:
+        int: The number of events published.
+    """
+    with transaction.atomic(using=wallet_db()):
+        events = list(OutboxEvent.objects.pending().select_for_update()[:batch_size])
+        if not events:
+            return 0
+
+        producer = connection.Producer(serializer='json')
+        for event in events:
+            producer.publish(
+                event.payload,
+                exchange=wallet_events_exchange,
+                routing_key=event.event_type,
+                declare=[wallet_events_exchange],
+                delivery_mode=2,
+                message_id=str(event.id),
+                retry=True,
+            )
+
+        OutboxEvent.objects.filter(id__in=[event.id for event in events]).update(published_at=timezone.now())
+    return len(events)
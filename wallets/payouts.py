@@ -0,0 +1,197 @@
+import datetime
+from collections import defaultdict
+from django.db import transaction
+from django.utils import timezone
+from wallets.models import OutboxEvent, Transaction, Wallet, WalletDailyAggregate
+from wallets.sharding import wallet_db
+from wallet.utils import lazy_import
+from base.vars import BANK_BATCH_STATUS, BANK_STATUS_URL, PAYOUT_FAILURE_STATUSES, PAYOUT_POLL_BASE_INTERVAL, PAYOUT_POLL_BATCH_SIZE, PAYOUT_POLL_MAX_INTERVAL
+
+requests = lazy_import('requests')
+
+
+def poll_interval(attempts, retry_after=None):
+    """
+    Returns the delay before the next status check of a pending payout.
+
+    The delay doubles with every check, from PAYOUT_POLL_BASE_INTERVAL up to
+    PAYOUT_POLL_MAX_INTERVAL, so fresh payouts, which usually clear quickly, are checked
+    often and stuck ones do not keep the bank busy. A delay suggested by the bank takes
+    precedence, within the same bounds.
+
+    Args:
+        attempts (int): The number of checks already made.
+        retry_after (int): The delay suggested by the bank in seconds, if any.
+
+    Returns:
+        datetime.timedelta: The delay.
+    """
+    if retry_after is not None:
+        seconds = retry_after
+    else:
+        seconds = PAYOUT_POLL_BASE_INTERVAL * 2 ** min(attempts, 32)
+    return datetime.timedelta(seconds=max(1, min(seconds, PAYOUT_POLL_MAX_INTERVAL)))
+
+
+def fetch_payout_statuses(references):
+    """
+    Asks the bank for the status of pending payouts.
+
+    With BANK_BATCH_STATUS the statuses are fetched with one call,
+    `POST BANK_STATUS_URL {"references": [...]}` answering `{"payouts": [{"reference", "status", "data"}]}`.
+    Otherwise each payout is fetched with `GET BANK_STATUS_URL/<reference>`. Payouts the
+    bank could not be asked about, or whose answer is not a JSON object, are left out of
+    the result, so they stay pending.
+
+    Args:
+        references (list): The bank references of the payouts.
+
+    Returns:
+        dict: The bank answer of each reference, with a `status` of 200 (paid), 202 (still
+            pending) or one of PAYOUT_FAILURE_STATUSES (failed), and an optional `retry_after`.
+    """
+    if BANK_BATCH_STATUS:
+        try:
+            response = requests.post(BANK_STATUS_URL, json={'references': references}, timeout=10)
+            response.raise_for_status()
+            body = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Payout status batch of {len(references)} failed: {e}")
+            return {}
+        answers = body.get('payouts') if isinstance(body, dict) else None
+        if not isinstance(answers, list):
+            print(f"Payout status batch of {len(references)} failed: unexpected answer {str(body)[:100]}")
+            return {}
+        return {str(answer.get('reference')): answer for answer in answers if isinstance(answer, dict)}
+
+    statuses = {}
+    for reference in references:
+        try:
+            response = requests.get(f"{BANK_STATUS_URL}/{reference}", timeout=5)
+            response.raise_for_status()
+            answer = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Payout status of {reference} failed: {e}")
+            continue
+        if isinstance(answer, dict):
+            statuses[reference] = answer
+        else:
+            print(f"Payout status of {reference} failed: unexpected answer {str(answer)[:100]}")
+    return statuses
+
+
+def lease_due_payouts(now, batch_size):
+    """
+    Takes the next batch of due payouts and schedules their following check.
+
+    The due rows are read from the partial `next_poll_at` index and locked with
+    SELECT ... FOR UPDATE SKIP LOCKED, so concurrent pollers take different payouts.
+    Their `next_poll_at` is moved forward before the bank is called, which both leases
+    the rows to this poller and sets the backoff for payouts that stay pending. Rows with
+    the same number of attempts get the same next time and are updated together.
+
+    Args:
+        now (datetime): The current time.
+        batch_size (int): The maximum number of payouts to take.
+
+    Returns:
+        list: The leased payouts, with their wallets.
+    """
+    with transaction.atomic(using=wallet_db()):
+        payouts = list(
+            Transaction.objects.due_payouts(now)
+            .select_related('wallet')
+            .select_for_update(skip_locked=True, of=('self',))[:batch_size]
+        )
+        by_attempts = defaultdict(list)
+        for payout in payouts:
+            by_attempts[payout.poll_attempts].append(payout.pk)
+        for attempts, pks in by_attempts.items():
+            Transaction.objects.filter(pk__in=pks).update(
+                poll_attempts=attempts + 1,
+                next_poll_at=now + poll_interval(attempts + 1),
+            )
+    return payouts
+
+
+def resolve_payout(payout, answer, now):
+    """
+    Applies the bank answer for one pending payout.
+
+    A paid payout (status 200) is settled and added to the daily aggregates. A failed
+    payout, with one of PAYOUT_FAILURE_STATUSES, is marked unsettled and its amount is
+    credited back to the wallet. Either way an outbox event is recorded. Any other
+    answer, such as a 5xx or a missing status, says nothing about the payout, so it is
+    logged and the payout stays pending like on a 202. A payout appended in append-only
+    ledger mode that was not folded yet is only updated, and the ledger folder applies
+    its outcome. The row is only changed if it is still pending, so a payout resolved by
+    another poller is neither settled nor refunded twice. A payout that is still pending
+    keeps the next check set when it was leased, unless the bank suggests another delay.
+
+    Args:
+        payout (Transaction): The pending payout.
+        answer (dict): The bank answer for the payout.
+        now (datetime): The current time.
+
+    Returns:
+        str: "settled", "refunded" or "pending", or None if the payout had already been resolved.
+    """
+    status_code = answer.get('status')
+    if status_code != 200 and status_code not in PAYOUT_FAILURE_STATUSES:
+        if status_code != 202:
+            print(f"Payout {payout.pk} kept pending on unexpected bank status {str(status_code)[:20]}.")
+        if answer.get('retry_after') is not None:
+            Transaction.objects.pending_payouts().filter(pk=payout.pk).update(
+                next_poll_at=now + poll_interval(payout.poll_attempts, answer['retry_after'])
+            )
+        return 'pending'
+
+    settled = status_code == 200
+    fields = {
+        'pending': False,
+        'settle': settled,
+        'next_poll_at': None,
+        'bank_status_code': str(status_code)[:5],
+        'bank_message': str(answer.get('data', '-'))[:10],
+    }
+    with transaction.atomic(using=wallet_db()):
+        if not Transaction.objects.pending_payouts().filter(pk=payout.pk).update(**fields):
+            return None
+        for name, value in fields.items():
+            setattr(payout, name, value)
+        # An appended payout only reaches the balance and the aggregates when it is folded.
+        # The row is locked by the update above, so `folded` cannot change under us, and
+        # an unfolded payout is folded later with its new fields.
+        in_balance = not payout.appended or Transaction.objects.filter(pk=payout.pk, folded=True).exists()
+        if in_balance and settled:
+            WalletDailyAggregate.objects.record(payout)
+        elif in_balance:
+            Wallet.objects.filter(pk=payout.wallet_id).update(**Wallet.objects.balance_change(payout.amount), updated_at=now)
+        OutboxEvent.objects.record(payout)
+    return 'settled' if settled else 'refunded'
+
+
+def poll_due_payouts(now=None, batch_size=PAYOUT_POLL_BATCH_SIZE):
+    """
+    Checks the next batch of due pending payouts with the bank.
+
+    Args:
+        now (datetime): The current time. Defaults to now.
+        batch_size (int): The maximum number of payouts to check.
+
+    Returns:
+        dict: The number of payouts checked, settled, refunded and still pending.
+    """
+    now = now or timezone.now()
+    counts = {'checked': 0, 'settled': 0, 'refunded': 0, 'pending': 0}
+    payouts = lease_due_payouts(now, batch_size)
+    if not payouts:
+        return counts
+    statuses = fetch_payout_statuses([payout.bank_reference for payout in payouts])
+    counts['checked'] = len(payouts)
+    for payout in payouts:
+        answer = statuses.get(payout.bank_reference)
+        outcome = resolve_payout(payout, answer, now) if answer is not None else 'pending'
+        if outcome is not None:
+            counts[outcome] += 1
+    return counts
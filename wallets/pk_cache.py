@@ -0,0 +1,231 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
+
+
+class WalletPkCache:
+    """
+    Bounded in-process LRU cache mapping wallet UUIDs to primary keys.
+
+    Wallet UUIDs never change, so a positive entry stays valid until the wallet is
+    deleted, which evicts it through the `post_delete` signal. A wallet deleted by
+    another process leaves a stale entry behind, which is harmless: the lookup by
+    primary key then finds no row and the caller forgets the entry. Unknown UUIDs are
+    cached too, for WALLET_PK_CACHE_NEGATIVE_TTL seconds only, because another process
+    may create a wallet with that UUID; wallets created by this process evict them at once.
+
+    Usage:
+        pk = wallet_pk_cache.resolve(uuid)
+
+    Attributes:
+        hits (int): The lookups answered with a primary key from the cache.
+        negative_hits (int): The lookups answered as unknown from the cache.
+        misses (int): The lookups that went to the database.
+    """
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Looks up a UUID and marks it as recently used.
+
+        Args:
+            key (UUID): The wallet UUID.
+
+        Returns:
+            tuple: Whether the UUID is cached, and its primary key or None if it is
+                cached as unknown.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            pk, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            if pk is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return True, pk
+
+    def put(self, key, pk):
+        """
+        Caches the primary key of a UUID, or None for an unknown UUID, evicting the
+        least recently used entries beyond WALLET_PK_CACHE_SIZE.
+
+        Args:
+            key (UUID): The wallet UUID.
+            pk (int): The primary key of the wallet, or None if no wallet has the UUID.
+        """
+        max_size = settings.WALLET_PK_CACHE_SIZE
+        if not max_size:
+            return
+        expires_at = time.monotonic() + settings.WALLET_PK_CACHE_NEGATIVE_TTL if pk is None else None
+        with self._lock:
+            self._entries[key] = (pk, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+
+    def forget(self, *keys):
+        """
+        Evicts UUIDs from the cache.
+
+        Args:
+            *keys (UUID): The wallet UUIDs.
+        """
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Empties the cache and resets its counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.negative_hits = self.misses = 0
+
+    def stats(self):
+        """
+        Returns the counters of the cache.
+
+        Returns:
+            dict: The number of entries, hits, negative hits and misses, and the hit rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+            }
+
+    def remember(self, key, pk):
+        """
+        Caches the answer of a database lookup if it is known to be committed.
+
+        Inside a transaction the answer may include an uncommitted wallet, whose primary
+        key could be reused after a rollback, so only answers read in autocommit are kept.
+
+        Args:
+            key (UUID): The wallet UUID.
+            pk (int): The primary key of the wallet, or None if no wallet has the UUID.
+        """
+        from wallets.sharding import wallet_db
+
+        if not transaction.get_connection(wallet_db()).in_atomic_block:
+            self.put(key, pk)
+
+    def resolve(self, value):
+        """
+        Returns the primary key of the wallet with a UUID, querying the database on a miss.
+
+        Args:
+            value (str): The wallet UUID, as a UUID or a string.
+
+        Returns:
+            int: The primary key, or None if no wallet has the UUID or it is not a valid UUID.
+        """
+        from wallets.models import Wallet
+
+        key = parse_uuid(value)
+        if key is None:
+            return None
+        cached, pk = self.get(key)
+        if cached:
+            return pk
+        pk = Wallet.objects.filter(uuid=key).values_list('pk', flat=True).first()
+        self.remember(key, pk)
+        return pk
+
+
+wallet_pk_cache = WalletPkCache()
+
+
+def parse_uuid(value):
+    """
+    Parses a wallet UUID.
+
+    Args:
+        value (str): The UUID, as a UUID or a string.
+
+    Returns:
+        UUID: The parsed UUID, or None if the value is not a valid UUID.
+    """
+    if isinstance(value, uuid.UUID):
+        return value
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+def wallet_or_404(value, queryset=None):
+    """
+    Returns the wallet with a UUID, loaded by primary key when the UUID is cached.
+
+    Replaces `get_object_or_404(Wallet, uuid=value)` in the views. Every call costs at
+    most one query: a cached UUID is loaded by primary key, an unknown UUID cached as
+    such costs none, and a miss is loaded by UUID and cached. A cached primary key whose
+    wallet was deleted by another process is forgotten.
+
+    Args:
+        value (str): The wallet UUID.
+        queryset (QuerySet): The wallets to load from. Defaults to all wallets.
+
+    Returns:
+        Wallet: The wallet.
+
+    Raises:
+        Http404: If no wallet has the UUID.
+    """
+    from wallets.models import Wallet
+
+    key = parse_uuid(value)
+    if key is None:
+        raise Http404("No Wallet matches the given query.")
+    queryset = queryset if queryset is not None else Wallet.objects.all()
+    cached, pk = wallet_pk_cache.get(key)
+    if not cached:
+        wallet = queryset.filter(uuid=key).first()
+        wallet_pk_cache.remember(key, wallet.pk if wallet is not None else None)
+    elif pk is not None:
+        wallet = queryset.filter(pk=pk).first()
+        if wallet is None:
+            wallet_pk_cache.forget(key)
+    else:
+        wallet = None
+    if wallet is None:
+        raise Http404("No Wallet matches the given query.")
+    return wallet
+
+
+def forget_deleted_wallet(sender, instance, **kwargs):
+    """
+    Evicts a deleted wallet from the UUID cache. Connected to `post_delete` of Wallet.
+    """
+    wallet_pk_cache.forget(instance.uuid)
+
+
+def forget_created_wallet(sender, instance, created, **kwargs):
+    """
+    Evicts a negative entry for the UUID of a new wallet. Connected to `post_save` of Wallet.
+    """
+    if created:
+        wallet_pk_cache.forget(instance.uuid)
@@ -0,0 +1,203 @@
+import time
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+from django.db.models.functions import Coalesce
+from wallets.models import Wallet, Transaction, ScheduledWithdrawal, ScheduledWithdrawalBatch, StandingOrder, WalletDailyAggregate, WalletShardBucket, WebhookDelivery, WebhookSubscription, WithdrawalReplayItem
+from wallets.sharding import bucket_for_uuid, copy_rows, shard_map
+from base.vars import WALLET_SHARD_BUCKETS, WALLET_SHARD_COPY_BATCH_SIZE, WALLET_SHARD_MAP_TTL
+
+# The rows that move with a wallet, in insert order, and how they refer to it.
+WALLET_ROWS = (
+    (Wallet, 'pk__in'),
+    (StandingOrder, 'wallet_id__in'),
+    (Transaction, 'wallet_id__in'),
+    (ScheduledWithdrawal, 'wallet_id__in'),
+    (WalletDailyAggregate, 'wallet_id__in'),
+    (WebhookSubscription, 'wallet_id__in'),
+    (WebhookDelivery, 'subscription__wallet_id__in'),
+)
+
+
+def pin_buckets(shard):
+    """
+    Points every bucket without an override at one shard.
+
+    Run it before sharding is enabled on a database that already holds wallets: the
+    wallets stay reachable where they are, and are then spread over the shards with
+    `move_buckets`.
+
+    Args:
+        shard (str): The database alias the wallets are on.
+
+    Returns:
+        int: The number of buckets pinned.
+    """
+    pinned = set(WalletShardBucket.objects.using(DEFAULT_DB_ALIAS).values_list('bucket', flat=True))
+    rows = [WalletShardBucket(bucket=bucket, shard=shard) for bucket in range(WALLET_SHARD_BUCKETS) if bucket not in pinned]
+    WalletShardBucket.objects.using(DEFAULT_DB_ALIAS).bulk_create(rows, ignore_conflicts=True)
+    shard_map.clear()
+    return len(rows)
+
+
+def wallets_in_buckets(shard, buckets):
+    """
+    Returns the primary keys of the wallets of a shard that fall in the given buckets.
+
+    The buckets are computed from the UUIDs in Python, so the wallet table of the shard
+    is read once, UUIDs only.
+
+    Args:
+        shard (str): The database alias of the shard.
+        buckets (set): The buckets.
+
+    Returns:
+        list: The primary keys, in ascending order.
+    """
+    wallets = Wallet.objects.using(shard).order_by('pk').values_list('pk', 'uuid')
+    return [pk for pk, uuid in wallets.iterator(chunk_size=WALLET_SHARD_COPY_BATCH_SIZE) if bucket_for_uuid(uuid) in buckets]
+
+
+def copy_wallets(source, target, wallet_pks):
+    """
+    Copies wallets and their rows from one shard to another, keeping their primary keys.
+
+    The batches their scheduled withdrawals belong to are copied too, unless the target
+    already has them.
+
+    Args:
+        source (str): The database alias of the shard the wallets are on.
+        target (str): The database alias of the shard they move to.
+        wallet_pks (list): The primary keys of the wallets.
+
+    Returns:
+        int: The number of rows copied.
+    """
+    copied = 0
+    with transaction.atomic(using=target):
+        # Leftovers of an interrupted move are deleted first.
+        delete_wallets(target, wallet_pks)
+        for model, lookup in WALLET_ROWS:
+            if model is ScheduledWithdrawal:
+                batch_ids = set(
+                    ScheduledWithdrawal.objects.using(source)
+                    .filter(wallet_id__in=wallet_pks, batch__isnull=False)
+                    .values_list('batch_id', flat=True)
+                )
+                batch_ids -= set(ScheduledWithdrawalBatch.objects.using(target).filter(pk__in=batch_ids).values_list('pk', flat=True))
+                copied += copy_rows(ScheduledWithdrawalBatch.objects.using(source).filter(pk__in=batch_ids), target)
+            copied += copy_rows(model.objects.using(source).filter(**{lookup: wallet_pks}).order_by('pk'), target)
+    return copied
+
+
+def delete_wallets(shard, wallet_pks):
+    """
+    Deletes wallets and their rows from a shard, children first.
+
+    The rows are deleted with one DELETE per table and no model signals, instead of
+    being collected for the cascade one by one.
+
+    Args:
+        shard (str): The database alias of the shard.
+        wallet_pks (list): The primary keys of the wallets.
+    """
+    for model, lookup in reversed(WALLET_ROWS):
+        model.objects.using(shard).filter(**{lookup: wallet_pks})._raw_delete(shard)
+
+
+def recount_batches(shard, batch_ids):
+    """
+    Sets the item count of withdrawal batches to the number of their items on a shard.
+
+    Args:
+        shard (str): The database alias of the shard.
+        batch_ids (set): The IDs of the batches.
+    """
+    items = ScheduledWithdrawal.objects.using(shard).filter(batch_id=models.OuterRef('pk')).order_by().values('batch_id')
+    ScheduledWithdrawalBatch.objects.using(shard).filter(pk__in=batch_ids).update(
+        item_count=Coalesce(models.Subquery(items.annotate(count=models.Count('pk')).values('count')), 0),
+    )
+
+
+def move_buckets(buckets, target, batch_size=WALLET_SHARD_COPY_BATCH_SIZE, wait=2 * WALLET_SHARD_MAP_TTL):
+    """
+    Moves the wallets of hash buckets, with all their rows, to another shard.
+
+    The move runs in four steps:
+
+    1. The buckets are locked in the shard map, and the command waits `wait` seconds:
+       WALLET_SHARD_MAP_TTL for every process to see the lock, then as long again for
+       the requests already routed to finish. From then on the wallet endpoints answer
+       503 for these wallets and `process_withdrawal` postpones their withdrawals.
+    2. The wallets are copied to the target in batches of `batch_size` wallets, each in
+       one transaction, with their primary keys, so references held elsewhere, such as
+       beat task arguments and the UUID cache, stay valid.
+    3. The buckets are pointed at the target and unlocked.
+    4. The wallets are deleted from their old shard, along with their rows.
+
+    If the copy fails, the buckets are unlocked on their old shard and the rows copied
+    so far are left on the target, where nothing reads them; running the move again
+    deletes them before copying. Wallets with withdrawals queued by a failed withdrawal replay
+    are not moved, since the replay items stay on the old shard; the move is refused.
+
+    The periodic tasks, such as standing orders and payout polling, do not check the
+    locks, so beat should be paused during a move.
+
+    Args:
+        buckets (iterable): The buckets to move.
+        target (str): The database alias of the shard they move to.
+        batch_size (int): The number of wallets copied per transaction.
+        wait (float): The number of seconds to wait after locking the buckets.
+
+    Returns:
+        dict: The number of buckets and wallets moved and of rows copied.
+
+    Raises:
+        ValueError: If some of the wallets have replayed withdrawals.
+    """
+    shard_map.clear()
+    sources = {}
+    for bucket in set(buckets):
+        shard = shard_map.locate_bucket(bucket)[0]
+        if shard != target:
+            sources.setdefault(shard, set()).add(bucket)
+    moving = set().union(*sources.values())
+    if not moving:
+        return {'buckets': 0, 'wallets': 0, 'rows': 0}
+
+    for source, source_buckets in sources.items():
+        for bucket in source_buckets:
+            WalletShardBucket.objects.using(DEFAULT_DB_ALIAS).update_or_create(bucket=bucket, defaults={'shard': source, 'locked': True})
+    shard_map.clear()
+    time.sleep(wait)
+
+    moved = {}
+    copied = 0
+    try:
+        for source, source_buckets in sources.items():
+            wallet_pks = wallets_in_buckets(source, source_buckets)
+            chunks = [wallet_pks[start:start + batch_size] for start in range(0, len(wallet_pks), batch_size)]
+            if any(WithdrawalReplayItem.objects.using(source).filter(original__wallet_id__in=chunk).exists() for chunk in chunks):
+                raise ValueError(f"Wallets of these buckets on {source} have replayed withdrawals and cannot be moved.")
+            moved[source] = chunks
+        for source, chunks in moved.items():
+            for chunk in chunks:
+                copied += copy_wallets(source, target, chunk)
+    except Exception:
+        WalletShardBucket.objects.using(DEFAULT_DB_ALIAS).filter(bucket__in=moving).update(locked=False)
+        shard_map.clear()
+        raise
+
+    WalletShardBucket.objects.using(DEFAULT_DB_ALIAS).filter(bucket__in=moving).update(shard=target, locked=False)
+    shard_map.clear()
+
+    for source, chunks in moved.items():
+        for chunk in chunks:
+            batch_ids = set(
+                ScheduledWithdrawal.objects.using(source)
+                .filter(wallet_id__in=chunk, batch__isnull=False)
+                .values_list('batch_id', flat=True)
+            )
+            with transaction.atomic(using=source):
+                delete_wallets(source, chunk)
+                recount_batches(source, batch_ids)
+            recount_batches(target, batch_ids)
+    return {'buckets': len(moving), 'wallets': sum(len(chunk) for chunks in moved.values() for chunk in chunks), 'rows': copied}
@@ -0,0 +1,149 @@
+from django.db import transaction
+from django.utils import timezone
+from wallets.models import Transaction, WithdrawalReplay, WithdrawalReplayItem
+from wallets.sharding import wallet_db
+from base.exceptions import InsufficientFundsError
+from base.vars import WITHDRAW_REPLAY_BATCH_SIZE, WITHDRAW_REPLAY_BATCH_INTERVAL, WITHDRAW_RETRY_QUEUE
+
+
+def enqueue_replay_batches(item_ids, batch_size, interval):
+    """
+    Sends the replay tasks of a replay, one per batch, spaced out in time.
+
+    Batch `n` is sent with a countdown of `n * interval` seconds, so the bank receives
+    at most `batch_size` replayed withdrawals per interval however many are queued.
+    The tasks run on the shard the replay was started on.
+
+    Args:
+        item_ids (list): The IDs of the replay items, in replay order.
+        batch_size (int): The number of withdrawals per task.
+        interval (float): The time between two batches in seconds.
+
+    Returns:
+        int: The number of tasks sent.
+    """
+    from wallets.tasks import replay_withdrawal_batch
+
+    batches = 0
+    for start in range(0, len(item_ids), batch_size):
+        replay_withdrawal_batch.apply_async(
+            kwargs={'item_ids': item_ids[start:start + batch_size], 'shard': wallet_db()},
+            queue=WITHDRAW_RETRY_QUEUE,
+            countdown=batches * interval,
+        )
+        batches += 1
+    return batches
+
+
+def start_replay(start, end, status_codes, batch_size=WITHDRAW_REPLAY_BATCH_SIZE, interval=WITHDRAW_REPLAY_BATCH_INTERVAL):
+    """
+    Queues the failed withdrawals of a window for replay.
+
+    The withdrawals are selected with `TransactionManager.failed_withdrawals` and get one
+    WithdrawalReplayItem each. The item is unique per withdrawal and inserted with
+    ON CONFLICT DO NOTHING, so a withdrawal already queued by this or an earlier replay
+    is skipped and starting the same replay twice queues nothing the second time. The
+    tasks are sent once the items are committed.
+
+    Args:
+        start (datetime): The start of the window.
+        end (datetime): The end of the window.
+        status_codes (list): The bank status codes to replay, e.g. ["503", "408"].
+        batch_size (int): The number of withdrawals per task.
+        interval (float): The time between two batches in seconds.
+
+    Returns:
+        WithdrawalReplay: The replay, with `total` set to the number of withdrawals queued.
+    """
+    with transaction.atomic(using=wallet_db()):
+        replay = WithdrawalReplay.objects.create(window_start=start, window_end=end, status_codes=[str(code) for code in status_codes])
+        originals = (
+            Transaction.objects.failed_withdrawals(start, end, status_codes)
+            .filter(replay_item__isnull=True)
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+        WithdrawalReplayItem.objects.bulk_create(
+            [WithdrawalReplayItem(replay=replay, original_id=original_id) for original_id in originals.iterator(chunk_size=batch_size)],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        item_ids = list(replay.items.order_by('id').values_list('id', flat=True))
+        replay.total = len(item_ids)
+        if not item_ids:
+            replay.finished_at = timezone.now()
+        replay.save(update_fields=['total', 'finished_at', 'updated_at'])
+        transaction.on_commit(lambda: enqueue_replay_batches(item_ids, batch_size, interval), using=wallet_db())
+    return replay
+
+
+def replay_item(item_id):
+    """
+    Replays one failed withdrawal as a new withdrawal linked to it.
+
+    The item is claimed first, so a task delivered twice does not withdraw twice. The
+    new withdrawal goes through `Wallet.withdraw` like any other and points to the
+    original through `retry_of`. It succeeds when the bank pays or accepts the payout.
+
+    Args:
+        item_id (int): The ID of the replay item.
+
+    Returns:
+        str: The final state of the item, or None if it was already claimed.
+    """
+    if not WithdrawalReplayItem.objects.claim(item_id):
+        return None
+    item = WithdrawalReplayItem.objects.select_related('original__wallet').get(pk=item_id)
+    original = item.original
+    error = ''
+    try:
+        retry = original.wallet.withdraw(original.amount, retry_of=original)
+        if not (retry.settle or retry.pending):
+            error = f"Bank status {retry.bank_status_code}: {retry.bank_message}"
+    except InsufficientFundsError as e:
+        error = str(e.detail)
+    except Exception as e:
+        error = str(e) or e.__class__.__name__
+    state = WithdrawalReplayItem.State.FAILED if error else WithdrawalReplayItem.State.SUCCEEDED
+    WithdrawalReplayItem.objects.filter(pk=item_id).update(state=state, error=error[:255], updated_at=timezone.now())
+    return state
+
+
+def replay_items(item_ids):
+    """
+    Replays a batch of failed withdrawals and marks their replays finished when done.
+
+    Args:
+        item_ids (list): The IDs of the replay items.
+
+    Returns:
+        dict: The number of items that succeeded, failed or were already claimed.
+    """
+    counts = {'succeeded': 0, 'failed': 0, 'skipped': 0}
+    for item_id in item_ids:
+        state = replay_item(item_id)
+        counts[state or 'skipped'] += 1
+    open_states = (WithdrawalReplayItem.State.QUEUED, WithdrawalReplayItem.State.RUNNING)
+    WithdrawalReplay.objects.filter(items__id__in=item_ids, finished_at__isnull=True).exclude(
+        items__state__in=open_states,
+    ).update(finished_at=timezone.now())
+    return counts
+
+
+def replay_report(replay):
+    """
+    Reports the progress of a replay.
+
+    Args:
+        replay (WithdrawalReplay): The replay.
+
+    Returns:
+        dict: The number of withdrawals per state, the share processed, and the success
+            rate over the processed withdrawals.
+    """
+    report = WithdrawalReplayItem.objects.progress(replay)
+    processed = report['succeeded'] + report['failed']
+    report['total'] = replay.total
+    report['progress'] = processed / replay.total if replay.total else 1.0
+    report['success_rate'] = report['succeeded'] / processed if processed else 0.0
+    return report
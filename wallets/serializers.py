@@ -1,7 +1,37 @@
 from rest_framework import serializers
-from wallets.models import Wallet, Transaction
+from wallets.models import Wallet, Transaction, WalletDailyAggregate, StandingOrder, WebhookSubscription
 from django.utils import timezone
+import datetime
 from decimal import Decimal
+from base.vars import WALLET_BULK_MAX_ITEMS, WITHDRAWAL_BATCH_MAX_ITEMS, TRANSFER_BATCH_MAX_ITEMS
+from wallets.minor_units import minor_unit_reads_enabled, to_minor_units, format_minor_units
+from wallets.webhooks import check_webhook_url
+
+class MinorUnitsField(serializers.Field):
+    """
+    Read-only field rendering an amount stored in minor units as a decimal string.
+
+    The output is the same as a DecimalField with two decimal places, e.g. "110.50",
+    but it is formatted from the integer column without building a Decimal. A row not
+    backfilled yet has no minor-unit value and is rendered from its decimal column.
+
+    Attributes:
+        decimal_source (str): The decimal attribute used when the minor-unit one is None.
+    """
+    def __init__(self, decimal_source, **kwargs):
+        self.decimal_source = decimal_source
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        value = super().get_attribute(instance)
+        if value is None:
+            return to_minor_units(getattr(instance, self.decimal_source))
+        return value
+
+    def to_representation(self, value):
+        return format_minor_units(value)
+
 
 class WalletSerializer(serializers.ModelSerializer):
     """
@@ -21,6 +51,19 @@ class WalletSerializer(serializers.ModelSerializer):
         model = Wallet
         fields = '__all__'
 
+    def get_fields(self):
+        """
+        Returns the fields, with the balance read from minor units when minor-unit reads
+        are enabled and the serializer only renders. `balance_minor` itself and the
+        internal `has_webhooks` flag are never exposed.
+        """
+        fields = super().get_fields()
+        fields.pop('balance_minor')
+        fields.pop('has_webhooks')
+        if minor_unit_reads_enabled() and not hasattr(self, 'initial_data'):
+            fields['balance'] = MinorUnitsField(source='balance_minor', decimal_source='balance')
+        return fields
+
 class TransactionSerializer(serializers.ModelSerializer):
     """
     Serializer for the Transaction model.
@@ -39,6 +82,17 @@ class TransactionSerializer(serializers.ModelSerializer):
         model = Transaction
         fields = '__all__'
 
+    def get_fields(self):
+        """
+        Returns the fields, with the amount read from minor units when minor-unit reads
+        are enabled and the serializer only renders. `amount_minor` itself is never exposed.
+        """
+        fields = super().get_fields()
+        fields.pop('amount_minor')
+        if minor_unit_reads_enabled() and not hasattr(self, 'initial_data'):
+            fields['amount'] = MinorUnitsField(source='amount_minor', decimal_source='amount')
+        return fields
+
 class DepositSerializer(serializers.Serializer):
     """
     Serializer for validating deposit amount.
@@ -105,6 +159,17 @@ class WithdrawSerializer(serializers.Serializer):
             raise serializers.ValidationError("Withdraw amount must be greater than zero.")
         return value
     
+class TransferSerializer(WithdrawSerializer):
+    """
+    Serializer for validating a transfer to another wallet.
+
+    It applies the amount check of WithdrawSerializer.
+
+    Attributes:
+        to (UUIDField): The UUID of the wallet receiving the amount.
+    """
+    to = serializers.UUIDField()
+
 class ScheduleWithdrawSerializer(serializers.Serializer):
     """
     Serializer for validating scheduled withdrawal parameters.
@@ -116,6 +181,7 @@ class ScheduleWithdrawSerializer(serializers.Serializer):
     Attributes:
         amount (DecimalField): A decimal field representing the amount to be withdrawn.
         scheduled_time (DateTimeField): A datetime field representing the scheduled time for withdrawal.
+        urgent (BooleanField): Whether the withdrawal is time-sensitive and goes to the urgent queue.
 
     Methods:
         validate_amount(value): Custom validation method to check if the amount is positive.
@@ -125,6 +191,7 @@ class ScheduleWithdrawSerializer(serializers.Serializer):
     """
     amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0.00'))
     scheduled_time = serializers.DateTimeField()
+    urgent = serializers.BooleanField(default=False)
 
     def validate_amount(self, value):
         """
@@ -158,4 +225,371 @@ class ScheduleWithdrawSerializer(serializers.Serializer):
         """
         if value <= timezone.now():
             raise serializers.ValidationError("Scheduled time must be in the future")
-        return value
\ No newline at end of file
+        return value
+
+class RescheduleWithdrawSerializer(ScheduleWithdrawSerializer):
+    """
+    Serializer for validating the new time of a rescheduled withdrawal.
+
+    It applies the scheduled time check of ScheduleWithdrawSerializer; the amount and
+    queue of the withdrawal cannot be changed.
+    """
+    amount = None
+    urgent = None
+
+class WalletDailyAggregateSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the WalletDailyAggregate model.
+
+    Attributes:
+        Meta (class): Inner class containing metadata for the serializer.
+            - model (Model): The Django model class to serialize (WalletDailyAggregate).
+            - fields (tuple): The day and the deposit and withdrawal totals and counts.
+    """
+    class Meta:
+        model = WalletDailyAggregate
+        fields = ('date', 'deposit_total', 'deposit_count', 'withdrawal_total', 'withdrawal_count')
+
+class AggregateRangeSerializer(serializers.Serializer):
+    """
+    Serializer for validating the date range of an aggregate report.
+
+    Attributes:
+        start (DateField): The first day of the range.
+        end (DateField): The last day of the range, inclusive.
+
+    Methods:
+        validate(attrs): Checks that the range is not reversed and is at most
+            `max_days` days long.
+    """
+    max_days = 366
+
+    start = serializers.DateField()
+    end = serializers.DateField()
+
+    def validate(self, attrs):
+        """
+        Check that the range is ordered and not longer than `max_days`.
+
+        Args:
+            attrs (dict): The validated start and end dates.
+
+        Returns:
+            dict: The validated range.
+
+        Raises:
+            serializers.ValidationError: If the range is reversed or too long.
+        """
+        if attrs['end'] < attrs['start']:
+            raise serializers.ValidationError("End date must not be before start date.")
+        if (attrs['end'] - attrs['start']).days >= self.max_days:
+            raise serializers.ValidationError(f"Date range must not be longer than {self.max_days} days.")
+        return attrs
+
+class BulkWalletItemSerializer(serializers.Serializer):
+    """
+    Serializer for validating one wallet of a bulk creation request.
+
+    Attributes:
+        uuid (UUIDField): The optional UUID of the wallet; generated when omitted.
+        balance (DecimalField): The optional initial balance of the wallet; zero when omitted.
+    """
+    uuid = serializers.UUIDField(required=False)
+    balance = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0.00'), default=Decimal('0.00'))
+
+class BulkCreateWalletSerializer(serializers.Serializer):
+    """
+    Serializer for validating a bulk wallet creation request.
+
+    Either `wallets` lists the wallets to create, or `count` asks for that many wallets
+    with generated UUIDs and a zero balance.
+
+    Attributes:
+        wallets (ListSerializer): The wallets to create.
+        count (IntegerField): The number of wallets to create when `wallets` is omitted.
+
+    Methods:
+        validate(attrs): Checks that exactly one of `wallets` and `count` is given, that
+            the request is not larger than WALLET_BULK_MAX_ITEMS and that the UUIDs are unique.
+    """
+    wallets = BulkWalletItemSerializer(many=True, required=False)
+    count = serializers.IntegerField(min_value=1, required=False)
+
+    def validate(self, attrs):
+        """
+        Check the size of the request and the uniqueness of the given UUIDs.
+
+        Args:
+            attrs (dict): The validated wallets or count.
+
+        Returns:
+            dict: The validated data, with `wallets` always set.
+
+        Raises:
+            serializers.ValidationError: If the request is empty, too large or has duplicate UUIDs.
+        """
+        if ('wallets' in attrs) == ('count' in attrs):
+            raise serializers.ValidationError("Provide either 'wallets' or 'count'.")
+        size = len(attrs['wallets']) if 'wallets' in attrs else attrs['count']
+        if not size:
+            raise serializers.ValidationError("At least one wallet is required.")
+        if size > WALLET_BULK_MAX_ITEMS:
+            raise serializers.ValidationError(f"At most {WALLET_BULK_MAX_ITEMS} wallets can be created per request.")
+        wallets = attrs.get('wallets') or [{'balance': Decimal('0.00')} for _ in range(size)]
+        uuids = [wallet['uuid'] for wallet in wallets if 'uuid' in wallet]
+        if len(uuids) != len(set(uuids)):
+            raise serializers.ValidationError("Wallet UUIDs must be unique.")
+        attrs['wallets'] = wallets
+        return attrs
+
+class BatchWithdrawalItemSerializer(ScheduleWithdrawSerializer):
+    """
+    Serializer for validating one withdrawal of a batch scheduling request.
+
+    It applies the amount and scheduled time checks of ScheduleWithdrawSerializer.
+    Batch withdrawals always run on the bulk queue, so there is no `urgent` flag.
+
+    Attributes:
+        wallet (UUIDField): The UUID of the wallet to withdraw from.
+    """
+    wallet = serializers.UUIDField()
+    urgent = None
+
+class BatchScheduleWithdrawSerializer(serializers.Serializer):
+    """
+    Serializer for validating a batch scheduling request, such as a payroll run.
+
+    Every item is validated before anything is written, so a single invalid item
+    rejects the whole batch.
+
+    Attributes:
+        items (ListSerializer): The withdrawals to schedule.
+
+    Methods:
+        validate_items(value): Checks that the batch is neither empty nor larger than
+            WITHDRAWAL_BATCH_MAX_ITEMS.
+    """
+    items = BatchWithdrawalItemSerializer(many=True)
+
+    def validate_items(self, value):
+        """
+        Check the size of the batch.
+
+        Args:
+            value (list): The validated withdrawals.
+
+        Returns:
+            list: The validated withdrawals.
+
+        Raises:
+            serializers.ValidationError: If the batch is empty or too large.
+        """
+        if not value:
+            raise serializers.ValidationError("At least one withdrawal is required.")
+        if len(value) > WITHDRAWAL_BATCH_MAX_ITEMS:
+            raise serializers.ValidationError(f"At most {WITHDRAWAL_BATCH_MAX_ITEMS} withdrawals can be scheduled per batch.")
+        return value
+
+class StandingOrderSerializer(serializers.Serializer):
+    """
+    Serializer for validating a standing order.
+
+    Exactly one of `cron` and `interval` sets the recurrence. The first occurrence is
+    at `start_at` for interval orders, and at the first cron match after `start_at`
+    for cron orders.
+
+    Attributes:
+        amount (DecimalField): The amount withdrawn at every occurrence.
+        cron (CharField): A five-field cron expression, e.g. "0 9 1 * *" for the first
+            of every month at 9:00.
+        interval (IntegerField): The number of seconds between two occurrences.
+        start_at (DateTimeField): The time from which the order runs; defaults to now.
+
+    Methods:
+        validate_amount(value): Checks that the amount is positive.
+        validate_cron(value): Checks that the cron expression is valid.
+        validate(attrs): Checks that exactly one recurrence is given and computes the
+            first occurrence.
+    """
+    min_interval = 60
+
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2)
+    cron = serializers.CharField(max_length=100, required=False)
+    interval = serializers.IntegerField(min_value=min_interval, required=False)
+    start_at = serializers.DateTimeField(required=False)
+
+    def validate_amount(self, value):
+        """
+        Check that the amount is a positive decimal value.
+
+        Args:
+            value (decimal.Decimal): The value of the amount to be validated.
+
+        Returns:
+            decimal.Decimal: The validated amount if it is positive.
+
+        Raises:
+            serializers.ValidationError: If the amount is not greater than zero.
+        """
+        if value <= 0:
+            raise serializers.ValidationError("Withdraw amount must be greater than zero.")
+        return value
+
+    def validate_cron(self, value):
+        """
+        Check that the cron expression can be parsed.
+
+        Args:
+            value (str): The cron expression.
+
+        Returns:
+            str: The validated expression.
+
+        Raises:
+            serializers.ValidationError: If the expression is invalid.
+        """
+        try:
+            StandingOrder.parse_cron(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+    def validate(self, attrs):
+        """
+        Check the recurrence and compute the first occurrence.
+
+        Args:
+            attrs (dict): The validated fields.
+
+        Returns:
+            dict: The validated data with `interval` as a timedelta and `next_run_at` set.
+
+        Raises:
+            serializers.ValidationError: If not exactly one of `cron` and `interval` is
+                given, or the cron expression never fires.
+        """
+        if ('cron' in attrs) == ('interval' in attrs):
+            raise serializers.ValidationError("Provide either 'cron' or 'interval'.")
+        start_at = max(attrs.pop('start_at', timezone.now()), timezone.now())
+        if 'interval' in attrs:
+            attrs['interval'] = datetime.timedelta(seconds=attrs['interval'])
+            attrs['next_run_at'] = start_at
+        else:
+            try:
+                attrs['next_run_at'] = StandingOrder(cron=attrs['cron']).next_run_after(start_at)
+            except ValueError as e:
+                raise serializers.ValidationError({'cron': [str(e)]})
+        return attrs
+
+class BatchTransferItemSerializer(TransferSerializer):
+    """
+    Serializer for validating one transfer of a batch transfer request.
+
+    Attributes:
+        wallet (UUIDField): The UUID of the wallet the amount is taken from.
+
+    Methods:
+        validate(attrs): Checks that the transfer is not to the same wallet.
+    """
+    wallet = serializers.UUIDField()
+
+    def validate(self, attrs):
+        """
+        Check that the source and target wallets differ.
+
+        Args:
+            attrs (dict): The validated transfer.
+
+        Returns:
+            dict: The validated transfer.
+
+        Raises:
+            serializers.ValidationError: If the transfer is to the same wallet.
+        """
+        if attrs['wallet'] == attrs['to']:
+            raise serializers.ValidationError("Cannot transfer to the same wallet.")
+        return attrs
+
+class BatchTransferSerializer(serializers.Serializer):
+    """
+    Serializer for validating a batch transfer request.
+
+    Attributes:
+        transfers (ListSerializer): The transfers to apply, in order.
+
+    Methods:
+        validate_transfers(value): Checks that the batch is neither empty nor larger
+            than TRANSFER_BATCH_MAX_ITEMS.
+    """
+    transfers = BatchTransferItemSerializer(many=True)
+
+    def validate_transfers(self, value):
+        """
+        Check the size of the batch.
+
+        Args:
+            value (list): The validated transfers.
+
+        Returns:
+            list: The validated transfers.
+
+        Raises:
+            serializers.ValidationError: If the batch is empty or too large.
+        """
+        if not value:
+            raise serializers.ValidationError("At least one transfer is required.")
+        if len(value) > TRANSFER_BATCH_MAX_ITEMS:
+            raise serializers.ValidationError(f"At most {TRANSFER_BATCH_MAX_ITEMS} transfers can be applied per batch.")
+        return value
+
+class WebhookSubscriptionSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the WebhookSubscription model.
+
+    Clients write the URL and, optionally, the signing secret; a random secret is
+    generated otherwise. The events of subscriptions with the same URL and secret are
+    sent together, so a merchant subscribing many wallets to one endpoint should give
+    them the same secret. The secret is only rendered in the answer to the creation
+    of the subscription.
+
+    Attributes:
+        Meta (class): Inner class containing metadata for the serializer.
+            - model (Model): The Django model class to serialize/deserialize (WebhookSubscription).
+            - fields (tuple): The fields of the serialized output.
+            - read_only_fields (tuple): The fields set by the server.
+            - extra_kwargs (dict): The secret is optional and at least 16 characters long.
+    """
+    class Meta:
+        model = WebhookSubscription
+        fields = ('id', 'url', 'secret', 'active', 'created_at')
+        read_only_fields = ('id', 'active', 'created_at')
+        extra_kwargs = {'secret': {'required': False, 'min_length': 16}}
+
+    def validate_url(self, value):
+        """
+        Check that the URL is an https URL of a public host.
+
+        Args:
+            value (str): The webhook URL.
+
+        Returns:
+            str: The validated URL.
+
+        Raises:
+            serializers.ValidationError: If the URL is not https or its host is not public,
+                see `check_webhook_url`.
+        """
+        try:
+            check_webhook_url(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+    def get_fields(self):
+        """
+        Returns the fields, with the secret only rendered for a subscription just created.
+        """
+        fields = super().get_fields()
+        if not self.context.get('created'):
+            fields['secret'].write_only = True
+        return fields
@@ -0,0 +1,423 @@
+import contextlib
+import contextvars
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Max
+from django.http import JsonResponse
+from wallets.pk_cache import parse_uuid
+from base.vars import WALLET_SHARD_BUCKETS, WALLET_SHARD_COPY_BATCH_SIZE, WALLET_SHARD_MAP_TTL, WALLET_SHARD_PK_STRIDE
+
+# The shard the wallet queries of the current request, task or command go to.
+current_shard = contextvars.ContextVar('wallet_shard', default=None)
+
+
+def wallet_shards():
+    """
+    Returns the database aliases the wallets are partitioned over.
+
+    Returns:
+        list: The value of the WALLET_SHARDS setting, ["default"] when it is not set.
+    """
+    return list(getattr(settings, 'WALLET_SHARDS', None) or [DEFAULT_DB_ALIAS])
+
+
+def sharding_enabled():
+    """
+    Returns whether the wallets are partitioned over more than one database.
+
+    Returns:
+        bool: True if WALLET_SHARDS lists several aliases.
+    """
+    return len(wallet_shards()) > 1
+
+
+def wallet_db():
+    """
+    Returns the database alias of the wallet tables for the current request or task.
+
+    Use it wherever a wallet transaction is opened, e.g.
+    `transaction.atomic(using=wallet_db())`, since `transaction.atomic()` alone always
+    opens the transaction on the default database.
+
+    Returns:
+        str: The shard set with `use_shard`, or the first shard if none is set.
+    """
+    return current_shard.get() or wallet_shards()[0]
+
+
+@contextlib.contextmanager
+def use_shard(alias):
+    """
+    Sends the wallet queries of the block to a shard.
+
+    Usage:
+        with use_shard(shard_for_uuid(wallet_uuid)):
+            Wallet.objects.get(uuid=wallet_uuid).deposit(amount)
+
+    Args:
+        alias (str): The database alias of the shard. None keeps the current shard.
+    """
+    token = current_shard.set(alias or current_shard.get())
+    try:
+        yield alias
+    finally:
+        current_shard.reset(token)
+
+
+def bucket_for_uuid(value):
+    """
+    Returns the hash bucket of a wallet UUID.
+
+    The bucket only depends on the UUID, so it never changes; moving wallets between
+    shards moves whole buckets.
+
+    Args:
+        value (UUID): The wallet UUID, as a UUID or a string.
+
+    Returns:
+        int: The bucket, between 0 and WALLET_SHARD_BUCKETS - 1.
+
+    Raises:
+        ValueError: If the value is not a valid UUID.
+    """
+    key = parse_uuid(value)
+    if key is None:
+        raise ValueError(f"{value!r} is not a valid wallet UUID.")
+    digest = hashlib.blake2b(key.bytes, digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % WALLET_SHARD_BUCKETS
+
+
+def default_shard_for_bucket(bucket):
+    """
+    Returns the shard of a bucket that was never moved.
+
+    The buckets are split into equal contiguous ranges, one per shard, in WALLET_SHARDS order.
+
+    Args:
+        bucket (int): The bucket.
+
+    Returns:
+        str: The database alias of the shard.
+    """
+    shards = wallet_shards()
+    return shards[bucket * len(shards) // WALLET_SHARD_BUCKETS]
+
+
+class ShardMap:
+    """
+    Process-wide copy of the bucket overrides, reloaded every WALLET_SHARD_MAP_TTL seconds.
+
+    Only the buckets moved by `rebalance_shards`, or being moved, have a
+    WalletShardBucket row, so the table stays small and is read in one query. A change
+    is seen by every process within WALLET_SHARD_MAP_TTL seconds, which is how long
+    `rebalance_shards` waits after locking buckets before it copies them.
+
+    Methods:
+        locate(value): Returns the shard of a wallet UUID and whether its bucket is locked.
+        clear(): Drops the copy, so the next lookup reloads the table.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.overrides = None
+        self.loaded_at = 0.0
+
+    def get(self):
+        """
+        Returns the bucket overrides, reloading them when the copy is older than the TTL.
+
+        Returns:
+            dict: (shard, locked) per overridden bucket.
+        """
+        from wallets.models import WalletShardBucket
+
+        now = time.monotonic()
+        with self.lock:
+            if self.overrides is not None and now - self.loaded_at < WALLET_SHARD_MAP_TTL:
+                return self.overrides
+        overrides = {
+            bucket: (shard, locked)
+            for bucket, shard, locked in WalletShardBucket.objects.using(DEFAULT_DB_ALIAS).values_list('bucket', 'shard', 'locked')
+        }
+        with self.lock:
+            self.overrides, self.loaded_at = overrides, now
+        return overrides
+
+    def locate_bucket(self, bucket):
+        """
+        Returns the shard of a bucket and whether it is locked.
+
+        Args:
+            bucket (int): The bucket.
+
+        Returns:
+            tuple: The database alias of the shard and the lock flag.
+        """
+        return self.get().get(bucket, (default_shard_for_bucket(bucket), False))
+
+    def locate(self, value):
+        """
+        Returns the shard of a wallet UUID and whether its bucket is locked.
+
+        Args:
+            value (UUID): The wallet UUID, as a UUID or a string.
+
+        Returns:
+            tuple: The database alias of the shard and the lock flag.
+        """
+        if not sharding_enabled():
+            return wallet_shards()[0], False
+        return self.locate_bucket(bucket_for_uuid(value))
+
+    def clear(self):
+        """
+        Drops the copy of the overrides.
+        """
+        with self.lock:
+            self.overrides = None
+
+
+shard_map = ShardMap()
+
+
+def shard_for_uuid(value):
+    """
+    Returns the shard a wallet UUID belongs to.
+
+    Args:
+        value (UUID): The wallet UUID, as a UUID or a string.
+
+    Returns:
+        str: The database alias of the shard.
+    """
+    return shard_map.locate(value)[0]
+
+
+def group_by_shard(values, key=None):
+    """
+    Groups wallet UUIDs, or items carrying one, by shard.
+
+    Args:
+        values (list): The UUIDs or items.
+        key (callable): Returns the UUID of an item. Defaults to the item itself.
+
+    Returns:
+        dict: The items of each shard, in their original order.
+    """
+    groups = {}
+    for value in values:
+        groups.setdefault(shard_for_uuid(key(value) if key else value), []).append(value)
+    return groups
+
+
+def for_each_shard(func, shards=None, parallel=True):
+    """
+    Runs a function once per shard, with the wallet queries sent to that shard.
+
+    With `parallel`, the shards are queried at the same time from a thread pool, one
+    database connection per shard and thread, so a fan-out costs about as long as the
+    slowest shard. The connections are closed when the function returns.
+
+    Usage:
+        totals = for_each_shard(lambda shard: Wallet.objects.aggregate(total=Sum('balance')))
+
+    Args:
+        func (callable): Called with the database alias of each shard.
+        shards (list): The shards to run on. Defaults to every shard.
+        parallel (bool): Whether to run on the shards concurrently.
+
+    Returns:
+        dict: The result of the function per shard.
+    """
+    shards = shards or wallet_shards()
+
+    def run(shard):
+        with use_shard(shard):
+            return func(shard)
+
+    def run_in_thread(shard):
+        try:
+            return run(shard)
+        finally:
+            connections.close_all()
+
+    if not parallel or len(shards) == 1:
+        return {shard: run(shard) for shard in shards}
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        return dict(zip(shards, executor.map(run_in_thread, shards)))
+
+
+def sharded_models():
+    """
+    Returns the wallet models whose rows are partitioned over the shards.
+
+    Returns:
+        list: Every model of the wallets app but WalletShardBucket.
+    """
+    from django.apps import apps
+
+    return [model for model in apps.get_app_config('wallets').get_models() if model._meta.model_name != 'walletshardbucket']
+
+
+def reset_shard_sequences(alias):
+    """
+    Points the primary key sequences of a shard at its own range of primary keys.
+
+    Shard `n` of WALLET_SHARDS allocates primary keys from `n * WALLET_SHARD_PK_STRIDE + 1`,
+    so the keys are unique across shards and a wallet keeps its primary key, and the
+    rows their references, when it is moved. Each sequence is set to the highest key of
+    the shard's own range, which also repairs a SQLite sequence pushed into another
+    range by rows copied in with their keys. Runs after `migrate` on each shard and
+    after every copy. Only SQLite and PostgreSQL sequences are handled.
+
+    Args:
+        alias (str): The database alias of the shard.
+    """
+    connection = connections[alias]
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        print(f"Primary key ranges are not set on {alias}: {connection.vendor} is not supported.")
+        return
+    start = wallet_shards().index(alias) * WALLET_SHARD_PK_STRIDE
+    for model in sharded_models():
+        table = model._meta.db_table
+        high = (
+            model.objects.using(alias)
+            .filter(pk__gt=start, pk__lte=start + WALLET_SHARD_PK_STRIDE)
+            .aggregate(high=Max('pk'))['high']
+        ) or start
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    "SELECT setval(pg_get_serial_sequence(%s, %s), %s, %s)",
+                    [table, model._meta.pk.column, max(high, 1), high > 0],
+                )
+                continue
+            cursor.execute("UPDATE sqlite_sequence SET seq = %s WHERE name = %s", [high, table])
+            if not cursor.rowcount:
+                cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [table, high])
+
+
+def reset_sequences_after_migrate(sender, using, **kwargs):
+    """
+    Sets the primary key ranges of a shard after `migrate`. Connected to `post_migrate`
+    of the wallets app.
+    """
+    if sharding_enabled() and using in wallet_shards():
+        reset_shard_sequences(using)
+
+
+def copy_rows(queryset, alias, batch_size=WALLET_SHARD_COPY_BATCH_SIZE):
+    """
+    Copies the rows of a queryset into a shard as they are, primary keys and timestamps included.
+
+    The rows are read and written as raw column values, with no model instances in
+    between, so every shard must run the same database backend. The sequences of the
+    shard are reset afterwards, see `reset_shard_sequences`.
+
+    Args:
+        queryset (QuerySet): The rows, on the shard they are copied from.
+        alias (str): The database alias of the target shard.
+        batch_size (int): The number of rows fetched and inserted at a time.
+
+    Returns:
+        int: The number of rows copied.
+    """
+    model = queryset.model
+    fields = model._meta.concrete_fields
+    try:
+        select_sql, params = queryset.values_list(*(field.attname for field in fields)).query.get_compiler(queryset.db).as_sql()
+    except EmptyResultSet:
+        return 0
+    target = connections[alias]
+    insert_sql = (
+        f"INSERT INTO {target.ops.quote_name(model._meta.db_table)} "
+        f"({', '.join(target.ops.quote_name(field.column) for field in fields)}) "
+        f"VALUES ({', '.join(['%s'] * len(fields))})"
+    )
+    copied = 0
+    with connections[queryset.db].cursor() as source_cursor, target.cursor() as target_cursor:
+        source_cursor.execute(select_sql, params)
+        while rows := source_cursor.fetchmany(batch_size):
+            target_cursor.executemany(insert_sql, rows)
+            copied += len(rows)
+    if copied:
+        reset_shard_sequences(alias)
+    return copied
+
+
+class WalletShardRouter:
+    """
+    Database router sending each wallet to the shard of its UUID.
+
+    Inactive unless WALLET_SHARDS lists several aliases. Then the models of the wallets
+    app are read from and written to the current shard, see `use_shard`, or to the
+    database an instance was loaded from. A new wallet goes to the shard of its UUID.
+    Every other app, including the beat tables and WalletShardBucket, stays on the
+    default database.
+    """
+    def db_for_model(self, model, **hints):
+        if not sharding_enabled():
+            return None
+        if model._meta.app_label != 'wallets' or model._meta.model_name == 'walletshardbucket':
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None:
+            if instance._state.db:
+                return instance._state.db
+            if instance._meta.model_name == 'wallet':
+                return shard_for_uuid(instance.uuid)
+        return wallet_db()
+
+    db_for_read = db_for_model
+    db_for_write = db_for_model
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """
+        Allows the references of wallet rows to rows of other apps, such as beat tasks,
+        which live on the default database.
+        """
+        if sharding_enabled() and (obj1._meta.app_label == 'wallets') != (obj2._meta.app_label == 'wallets'):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not sharding_enabled():
+            return None
+        if app_label == 'wallets' and model_name != 'walletshardbucket':
+            return db in wallet_shards()
+        return db == DEFAULT_DB_ALIAS
+
+
+class WalletShardMiddleware:
+    """
+    Middleware sending the queries of a wallet endpoint to the shard of the wallet.
+
+    The shard is looked up from the `uuid` of the URL, before the view runs, and reset
+    when the response is returned. A wallet whose bucket is being moved is answered
+    with 503 and a Retry-After header. Endpoints without a wallet UUID choose their
+    shards themselves.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = current_shard.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            current_shard.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not sharding_enabled() or parse_uuid(view_kwargs.get('uuid')) is None:
+            return None
+        shard, locked = shard_map.locate(view_kwargs['uuid'])
+        if locked:
+            response = JsonResponse({'error': 'The wallet is being moved, try again shortly.'}, status=503)
+            response['Retry-After'] = str(WALLET_SHARD_MAP_TTL)
+            return response
+        current_shard.set(shard)
+        return None
@@ -0,0 +1,174 @@
+import contextlib
+import hashlib
+import re
+import sys
+import threading
+import time
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+# Statements whose plan shows how rows are found, explained without running them.
+EXPLAINABLE = re.compile(r'^\s*(SELECT|UPDATE|DELETE)\b', re.IGNORECASE)
+# Placeholder lists such as "IN (%s, %s, %s)" differ only by their length.
+PLACEHOLDER_LIST = re.compile(r'\((?:%s|\?)(?:\s*,\s*(?:%s|\?))*\)')
+# Modules whose frames name the entry point of a query.
+ENTRY_POINTS = ('wallets.views', 'wallets.tasks', 'wallets.management.commands.')
+PROJECT_MODULES = ('wallets.', 'base.')
+
+_local = threading.local()
+
+
+def fingerprint(sql):
+    """
+    Returns a hash shared by every run of the same query.
+
+    Args:
+        sql (str): The SQL with placeholders.
+
+    Returns:
+        str: The SHA-1 hex digest of the SQL with placeholder lists collapsed.
+    """
+    return hashlib.sha1(PLACEHOLDER_LIST.sub('(...)', sql).encode()).hexdigest()
+
+
+def find_origin(frame):
+    """
+    Finds the view, task or command that issued a query.
+
+    The outermost frame of a view, task or management command module is returned.
+    Queries issued elsewhere are attributed to the innermost project frame.
+
+    Args:
+        frame (frame): The frame that called the database.
+
+    Returns:
+        str: The module and qualified function name, e.g. "wallets.views:CreateWithdrawView.post",
+            or "-" if no project code is on the stack.
+    """
+    origin = None
+    fallback = None
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith(PROJECT_MODULES) and module != __name__:
+            label = f"{module}:{frame.f_code.co_qualname}"
+            fallback = fallback or label
+            if module.startswith(ENTRY_POINTS):
+                origin = label
+        frame = frame.f_back
+    return origin or fallback or '-'
+
+
+def explain_prefix(vendor):
+    """
+    Returns the EXPLAIN statement prefix of a database backend, or None if it is not supported.
+
+    Args:
+        vendor (str): The vendor of the connection, e.g. "postgresql".
+
+    Returns:
+        str: The prefix that turns a query into a plan query.
+    """
+    return {
+        'sqlite': 'EXPLAIN QUERY PLAN ',
+        'postgresql': 'EXPLAIN ',
+        'mysql': 'EXPLAIN ',
+    }.get(vendor)
+
+
+class SlowQueryRecorder:
+    """
+    Database execute wrapper that records slow queries on the wallet tables.
+
+    Every query is timed. Queries that take at least WALLET_SLOW_QUERY_MS and touch one
+    of WALLET_SLOW_QUERY_TABLES are printed with their origin, explained on the same
+    connection and stored as SlowQuery rows. The plan is captured with a plain EXPLAIN,
+    never EXPLAIN ANALYZE, so writes are not executed twice. Recording never fails the
+    query: errors while explaining or storing are printed and ignored.
+
+    Usage:
+        with connection.execute_wrapper(SlowQueryRecorder()):
+            ...
+    """
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = (time.perf_counter() - started) * 1000
+        threshold = settings.WALLET_SLOW_QUERY_MS
+        if threshold is not None and duration >= threshold and not getattr(_local, 'recording', False):
+            connection = context['connection']
+            tables = settings.WALLET_SLOW_QUERY_TABLES
+            if not tables or any(connection.ops.quote_name(table) in sql for table in tables):
+                _local.recording = True
+                try:
+                    self.record(connection, sql, params, many, duration, find_origin(sys._getframe(1)))
+                finally:
+                    _local.recording = False
+        return result
+
+    def explain(self, connection, sql, params):
+        """
+        Returns the plan of a query, or an empty string if it cannot be explained.
+        """
+        prefix = explain_prefix(connection.vendor)
+        if prefix is None or not EXPLAINABLE.match(sql):
+            return ''
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+
+    def record(self, connection, sql, params, many, duration, origin):
+        """
+        Prints a slow query and stores it with its plan.
+
+        Args:
+            connection (DatabaseWrapper): The connection that ran the query.
+            sql (str): The SQL with placeholders.
+            params (list): The parameters, or a list of them for executemany.
+            many (bool): Whether the query was run with executemany.
+            duration (float): The execution time in milliseconds.
+            origin (str): The view, task or command that issued the query.
+        """
+        from wallets.models import SlowQuery
+
+        print(f"Slow query ({duration:.1f}ms) from {origin}: {sql}")
+        # A failed statement can abort the whole transaction, as on PostgreSQL, so
+        # recording is isolated in a savepoint. SQLite cannot open one while the slow
+        # statement still has rows to return, and does not need it.
+        isolated = contextlib.nullcontext() if connection.vendor == 'sqlite' else transaction.atomic(using=connection.alias)
+        needs_rollback = connection.needs_rollback
+        try:
+            with isolated:
+                plan = '' if many else self.explain(connection, sql, params)
+                SlowQuery.objects.using(connection.alias).create(
+                    fingerprint=fingerprint(sql),
+                    sql=sql,
+                    params='' if many else repr(params),
+                    duration=duration,
+                    origin=origin[:255],
+                    plan=plan,
+                )
+        except DatabaseError as e:
+            print(f"Slow query could not be recorded: {e}")
+            # The failed insert marks the caller's atomic block for rollback, but on SQLite
+            # the transaction is still usable (e.g. after "database is locked"), so the
+            # caller's work must not be lost to a failed recording. Other databases
+            # recorded in a savepoint, which already kept the caller's block intact.
+            if connection.vendor == 'sqlite' and connection.in_atomic_block:
+                transaction.set_rollback(needs_rollback, using=connection.alias)
+
+
+def install_slow_query_recorder(sender, connection, **kwargs):
+    """
+    Adds the slow query recorder to a new database connection.
+
+    Connected to the `connection_created` signal. Nothing is installed when
+    WALLET_SLOW_QUERY_MS is None, so the recorder then costs nothing.
+
+    Args:
+        sender (type): The database wrapper class.
+        connection (DatabaseWrapper): The connection that was opened.
+    """
+    if settings.WALLET_SLOW_QUERY_MS is None:
+        return
+    if not any(isinstance(wrapper, SlowQueryRecorder) for wrapper in connection.execute_wrappers):
+        connection.execute_wrappers.append(SlowQueryRecorder())
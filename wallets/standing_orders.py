@@ -0,0 +1,92 @@
+from collections import defaultdict
+from django.db import transaction
+from django.utils import timezone
+from wallets.models import ScheduledWithdrawal, StandingOrder, Wallet
+from wallets.sharding import wallet_db
+from base.vars import STANDING_ORDER_BATCH_SIZE, WITHDRAW_SCHEDULED_QUEUE
+
+
+def enqueue_withdrawals(withdrawals):
+    """
+    Sends a processing task for each of the given scheduled withdrawals.
+
+    Args:
+        withdrawals (list): The scheduled withdrawals, with their primary keys set.
+    """
+    from wallets.tasks import process_withdrawal
+
+    wallet_uuids = dict(Wallet.objects.filter(pk__in={withdrawal.wallet_id for withdrawal in withdrawals}).values_list('pk', 'uuid'))
+    for withdrawal in withdrawals:
+        process_withdrawal.apply_async(
+            kwargs={
+                'scheduled_withdrawal_id': withdrawal.pk,
+                'scheduled_time': withdrawal.scheduled_time.isoformat(),
+                'wallet_uuid': str(wallet_uuids[withdrawal.wallet_id]),
+            },
+            queue=WITHDRAW_SCHEDULED_QUEUE,
+        )
+
+
+def run_due_standing_orders(now=None, batch_size=STANDING_ORDER_BATCH_SIZE):
+    """
+    Creates the withdrawals of the next batch of due standing orders.
+
+    The due orders are read from the partial `next_run_at` index and locked with
+    SELECT ... FOR UPDATE SKIP LOCKED, so concurrent passes share the work instead
+    of creating the same occurrence twice. For each order, one withdrawal is
+    bulk-inserted for the occurrence at `next_run_at`, and `next_run_at` is moved
+    past `now`. Orders that move from and to the same times, which is the common case
+    for orders sharing a rule, are advanced with one UPDATE per group; the others
+    share one `bulk_update`. An order that missed several occurrences, for instance
+    while the scheduler was down, gets a single withdrawal rather than one per
+    missed occurrence. The processing tasks are sent once the transaction has committed.
+
+    An order whose next occurrence cannot be computed, such as a cron expression that
+    never fires again, still gets the withdrawal that is due and is then deactivated,
+    so it cannot fail the whole batch on every pass.
+
+    Args:
+        now (datetime.datetime): The current time; defaults to `timezone.now()`.
+        batch_size (int): The maximum number of orders handled in this batch.
+
+    Returns:
+        int: The number of withdrawals created; 0 when no order is due.
+    """
+    now = now or timezone.now()
+    with transaction.atomic(using=wallet_db()):
+        orders = list(
+            StandingOrder.objects.due(now)
+            .select_for_update(skip_locked=True)
+            .order_by('next_run_at')[:batch_size]
+        )
+        if not orders:
+            return 0
+
+        withdrawals = [
+            ScheduledWithdrawal(
+                wallet_id=order.wallet_id,
+                amount=order.amount,
+                scheduled_time=order.next_run_at,
+                standing_order=order,
+            )
+            for order in orders
+        ]
+        ScheduledWithdrawal.objects.bulk_create(withdrawals, batch_size=batch_size)
+        advances = defaultdict(list)
+        for order in orders:
+            order.last_run_at = order.next_run_at
+            try:
+                order.next_run_at = order.next_run_after(max(now, order.next_run_at))
+            except ValueError as e:
+                print(f"Standing order {order.pk} deactivated: {e}")
+                order.active = False
+            advances[(order.last_run_at, order.next_run_at, order.active)].append(order)
+        singles = []
+        for (last_run_at, next_run_at, active), group in advances.items():
+            if len(group) == 1:
+                singles.extend(group)
+                continue
+            StandingOrder.objects.filter(pk__in=[order.pk for order in group]).update(last_run_at=last_run_at, next_run_at=next_run_at, active=active)
+        StandingOrder.objects.bulk_update(singles, ['last_run_at', 'next_run_at', 'active'], batch_size=batch_size)
+        transaction.on_commit(lambda: enqueue_withdrawals(withdrawals), using=wallet_db())
+    return len(orders)
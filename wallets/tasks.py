@@ -1,10 +1,24 @@
-from celery import shared_task
-from wallets.models import ScheduledWithdrawal, Wallet
+from celery import shared_task, current_app
+from wallets.models import ScheduledWithdrawal, SlowQuery, Wallet
+from django.conf import settings
 from django.db import transaction, OperationalError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from base.profiling import profile_task
+from base.vars import WITHDRAW_BULK_QUEUE, STANDING_ORDER_BATCH_SIZE, PAYOUT_POLL_BATCH_SIZE, LEDGER_FOLD_BATCH_SIZE, WALLET_SHARD_MAP_TTL, WEBHOOK_LEASE_SIZE
+from wallets.standing_orders import run_due_standing_orders
+from wallets.payouts import poll_due_payouts
+from wallets.ledger import fold_ledger
+from wallets.replay import replay_items
+from wallets.webhooks import deliver_due_webhooks
+from wallets.sharding import wallet_db, wallet_shards, sharding_enabled, shard_map, use_shard
+from django_celery_beat.models import ClockedSchedule, PeriodicTask
+import datetime
 import time
 
 @shared_task
-def process_withdrawal(scheduled_withdrawal_id):
+@profile_task
+def process_withdrawal(scheduled_withdrawal_id, scheduled_time=None, wallet_uuid=None):
     """
     Asynchronous task for processing a scheduled withdrawal.
 
@@ -20,17 +34,50 @@ def process_withdrawal(scheduled_withdrawal_id):
     The task retries if it encounters a database lock, waiting for a 
     certain period before retrying, up to a maximum number of attempts.
 
+    Before anything else, the withdrawal is claimed with a conditional update that
+    marks it as processed. A withdrawal that was cancelled, already claimed by
+    another worker, or rescheduled after this task was sent is skipped.
+
+    With sharding enabled, the withdrawal is looked up on the shard of `wallet_uuid`.
+    A withdrawal of a wallet that is being moved to another shard is sent again after
+    WALLET_SHARD_MAP_TTL seconds.
+
     Args:
         scheduled_withdrawal_id (int): The ID of the scheduled withdrawal to process.
+        scheduled_time (str): The ISO 8601 scheduled time the task was sent for, if known.
+        wallet_uuid (str): The UUID of the wallet, if known. Required with sharding.
 
     Returns:
         str: A message indicating the success or failure of the withdrawal processing.
     """
-    scheduled_withdrawal = ScheduledWithdrawal.objects.get(id=scheduled_withdrawal_id)
-    wallet = scheduled_withdrawal.wallet
-    
-    if scheduled_withdrawal.processed:
+    shard = None
+    if wallet_uuid is not None and sharding_enabled():
+        shard, locked = shard_map.locate(wallet_uuid)
+        if locked:
+            process_withdrawal.apply_async(
+                kwargs={'scheduled_withdrawal_id': scheduled_withdrawal_id, 'scheduled_time': scheduled_time, 'wallet_uuid': wallet_uuid},
+                countdown=WALLET_SHARD_MAP_TTL,
+            )
+            return f"Postponed withdrawal {scheduled_withdrawal_id}: wallet {wallet_uuid} is being moved"
+    with use_shard(shard):
+        return withdraw_scheduled(scheduled_withdrawal_id, scheduled_time)
+
+
+def withdraw_scheduled(scheduled_withdrawal_id, scheduled_time=None):
+    """
+    Claims and runs a scheduled withdrawal on the current shard, see `process_withdrawal`.
+
+    Args:
+        scheduled_withdrawal_id (int): The ID of the scheduled withdrawal to process.
+        scheduled_time (str): The ISO 8601 scheduled time the task was sent for, if known.
+
+    Returns:
+        str: A message indicating the success or failure of the withdrawal processing.
+    """
+    if not ScheduledWithdrawal.objects.claim(scheduled_withdrawal_id, scheduled_time and parse_datetime(scheduled_time)):
         return
+    scheduled_withdrawal = ScheduledWithdrawal.objects.select_related('wallet').get(id=scheduled_withdrawal_id)
+    wallet = scheduled_withdrawal.wallet
     
     attempt = 0
     max_attempts = 50
@@ -38,7 +85,7 @@ def process_withdrawal(scheduled_withdrawal_id):
 
     try:
         while attempt <= max_attempts:
-            with transaction.atomic():
+            with transaction.atomic(using=wallet_db()):
                     try:
                         wallet = Wallet.objects.select_for_update().get(id=wallet.id)
                         wallet.withdraw(scheduled_withdrawal.amount)
@@ -54,7 +101,323 @@ def process_withdrawal(scheduled_withdrawal_id):
         print(e)
 
     finally:
-        scheduled_withdrawal.processed = True
-        scheduled_withdrawal.save()
         return f"Success Processed withdrawal of {scheduled_withdrawal.amount} for {wallet.uuid}"
     
+
+
+@shared_task
+@profile_task
+def process_withdrawal_batch(batch_id, scheduled_time, chunk_size=1000):
+    """
+    Asynchronous task that fans out the withdrawals of a batch due at one scheduled time.
+
+    A batch gets one clocked task per distinct scheduled time instead of one per
+    withdrawal. When it fires, this task enqueues a `process_withdrawal` task on the
+    bulk queue for every pending withdrawal of the batch in that time slot, so the
+    withdrawals are still processed, retried and settled one by one. Withdrawals that
+    were rescheduled have a dedicated task and are skipped here. With sharding enabled,
+    the batch has a row with the same ID on every shard holding some of its withdrawals,
+    and each shard is scanned in turn.
+
+    Args:
+        batch_id (int): The ID of the ScheduledWithdrawalBatch.
+        scheduled_time (str): The ISO 8601 scheduled time of the time slot.
+        chunk_size (int): The number of withdrawal IDs fetched per database round trip.
+
+    Returns:
+        str: A message indicating how many withdrawals were enqueued.
+    """
+    enqueued = 0
+    for shard in wallet_shards():
+        with use_shard(shard):
+            withdrawals = ScheduledWithdrawal.objects.pending().filter(
+                batch_id=batch_id,
+                scheduled_time=parse_datetime(scheduled_time),
+                periodic_task__isnull=True,
+            ).order_by('id').values_list('id', 'wallet__uuid')
+
+            for withdrawal_id, wallet_uuid in withdrawals.iterator(chunk_size=chunk_size):
+                process_withdrawal.apply_async(
+                    kwargs={'scheduled_withdrawal_id': withdrawal_id, 'scheduled_time': scheduled_time, 'wallet_uuid': str(wallet_uuid)},
+                    queue=WITHDRAW_BULK_QUEUE,
+                )
+                enqueued += 1
+    return f"Enqueued {enqueued} withdrawals of batch {batch_id} due at {scheduled_time}"
+
+
+def measure_beat_load_time():
+    """
+    Measures how long the beat DatabaseScheduler takes to load the schedule from the database.
+
+    This is the work beat does at start-up and every time the periodic task table changes.
+
+    Returns:
+        float: The load time in seconds.
+    """
+    from django_celery_beat.schedulers import DatabaseScheduler
+
+    scheduler = DatabaseScheduler(app=current_app, lazy=True)
+    started = time.perf_counter()
+    scheduler.all_as_schedule()
+    return time.perf_counter() - started
+
+
+def delete_in_batches(queryset, batch_size, max_batches):
+    """
+    Deletes the rows of a queryset in bounded batches of primary keys.
+
+    Rows are deleted without model signals, so removing spent rows does not mark
+    the beat schedule as changed and does not make beat reload it.
+
+    Args:
+        queryset (QuerySet): The rows to delete.
+        batch_size (int): The maximum number of rows per DELETE statement.
+        max_batches (int): The maximum number of batches per call.
+
+    Returns:
+        int: The number of rows deleted.
+    """
+    deleted = 0
+    for _ in range(max_batches):
+        ids = list(queryset.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        queryset.model.objects.filter(id__in=ids)._raw_delete(queryset.db)
+        deleted += len(ids)
+    return deleted
+
+
+@shared_task
+def cleanup_spent_schedules(batch_size=1000, max_batches=100, clocked_grace_minutes=60):
+    """
+    Periodic maintenance task that removes spent one-off beat rows.
+
+    Every scheduled withdrawal leaves a one-off PeriodicTask, which beat disables after
+    running it, and a ClockedSchedule behind. This task deletes the disabled one-off
+    tasks whose clocked time has passed, then the clocked schedules that are in the
+    past and no longer used by any task. Beat clears `last_run_at` when it disables a
+    task, so the clocked time is what tells a spent task apart. Both deletions run in bounded batches, so one run never holds
+    long locks on the beat tables.
+
+    Args:
+        batch_size (int): The maximum number of rows per DELETE statement.
+        max_batches (int): The maximum number of batches per table and run.
+        clocked_grace_minutes (int): How long a clocked time must be in the past before
+            its task and schedule are removed.
+
+    Returns:
+        dict: The number of rows removed per table and the beat schedule load time
+            before and after the cleanup, in seconds.
+    """
+    cutoff = timezone.now() - datetime.timedelta(minutes=clocked_grace_minutes)
+    load_time_before = measure_beat_load_time()
+    periodic_tasks = delete_in_batches(
+        PeriodicTask.objects.filter(one_off=True, enabled=False, clocked__clocked_time__lt=cutoff),
+        batch_size,
+        max_batches,
+    )
+    clocked_schedules = delete_in_batches(
+        ClockedSchedule.objects.filter(periodictask__isnull=True, clocked_time__lt=cutoff),
+        batch_size,
+        max_batches,
+    )
+    load_time_after = measure_beat_load_time()
+
+    print(
+        f"Removed {periodic_tasks} spent periodic tasks and {clocked_schedules} clocked schedules. "
+        f"Beat schedule load time: {load_time_before:.4f}s before, {load_time_after:.4f}s after."
+    )
+    return {
+        'periodic_tasks': periodic_tasks,
+        'clocked_schedules': clocked_schedules,
+        'beat_load_seconds_before': load_time_before,
+        'beat_load_seconds_after': load_time_after,
+    }
+
+
+@shared_task
+def cleanup_slow_queries(batch_size=1000, max_batches=100):
+    """
+    Periodic maintenance task that removes old slow query records.
+
+    Beat runs it daily. The SlowQuery rows older than WALLET_SLOW_QUERY_RETENTION_DAYS
+    are deleted in bounded batches from the `created_at` index, on every shard, since
+    each database stores the slow queries that ran on it.
+
+    Args:
+        batch_size (int): The maximum number of rows per DELETE statement.
+        max_batches (int): The maximum number of batches per shard and run.
+
+    Returns:
+        int: The number of rows removed.
+    """
+    cutoff = timezone.now() - datetime.timedelta(days=settings.WALLET_SLOW_QUERY_RETENTION_DAYS)
+    deleted = 0
+    for shard in wallet_shards():
+        deleted += delete_in_batches(SlowQuery.objects.using(shard).filter(created_at__lt=cutoff), batch_size, max_batches)
+    print(f"Removed {deleted} slow queries older than {settings.WALLET_SLOW_QUERY_RETENTION_DAYS} days.")
+    return deleted
+
+
+@shared_task
+@profile_task
+def run_standing_orders(batch_size=STANDING_ORDER_BATCH_SIZE, max_batches=1000):
+    """
+    Periodic task that creates the withdrawals of all due standing orders.
+
+    This single pass replaces one beat task per occurrence: beat runs it every minute,
+    and it works through the due orders in batches of `batch_size`, each in its own
+    database transaction, until none is left or `max_batches` is reached.
+
+    Args:
+        batch_size (int): The maximum number of orders per batch.
+        max_batches (int): The maximum number of batches per shard and run.
+
+    Returns:
+        int: The number of withdrawals created.
+    """
+    started = time.perf_counter()
+    now = timezone.now()
+    created = 0
+    for shard in wallet_shards():
+        with use_shard(shard):
+            for _ in range(max_batches):
+                count = run_due_standing_orders(now=now, batch_size=batch_size)
+                if not count:
+                    break
+                created += count
+    print(f"Created {created} standing order withdrawals in {time.perf_counter() - started:.3f}s.")
+    return created
+
+
+@shared_task
+@profile_task
+def poll_pending_payouts(batch_size=PAYOUT_POLL_BATCH_SIZE, max_batches=100):
+    """
+    Periodic task that checks the status of pending payouts with the bank.
+
+    Beat runs it every PAYOUT_POLL_BASE_INTERVAL seconds. It works through the due
+    payouts in batches of `batch_size`, one bank status call per batch where the bank
+    supports it, until none is due or `max_batches` is reached. Each payout schedules
+    its own next check with an increasing interval, so the task only touches the
+    payouts that are due.
+
+    Args:
+        batch_size (int): The maximum number of payouts per batch.
+        max_batches (int): The maximum number of batches per shard and run.
+
+    Returns:
+        dict: The number of payouts checked, settled, refunded and still pending.
+    """
+    started = time.perf_counter()
+    now = timezone.now()
+    totals = {'checked': 0, 'settled': 0, 'refunded': 0, 'pending': 0}
+    for shard in wallet_shards():
+        with use_shard(shard):
+            for _ in range(max_batches):
+                counts = poll_due_payouts(now=now, batch_size=batch_size)
+                if not counts['checked']:
+                    break
+                for key, value in counts.items():
+                    totals[key] += value
+    print(
+        f"Checked {totals['checked']} pending payouts in {time.perf_counter() - started:.3f}s: "
+        f"{totals['settled']} settled, {totals['refunded']} refunded, {totals['pending']} still pending."
+    )
+    return totals
+
+
+@shared_task
+@profile_task
+def fold_ledger_entries(batch_size=LEDGER_FOLD_BATCH_SIZE, max_batches=100):
+    """
+    Periodic task that materializes the append-only ledger into the wallet balances.
+
+    Beat runs it every LEDGER_FOLD_INTERVAL seconds. It folds the unfolded entries in
+    batches of `batch_size` until none is left or `max_batches` is reached. Outside
+    append-only ledger mode there is nothing to fold and a run costs one index lookup.
+
+    Args:
+        batch_size (int): The maximum number of entries per batch.
+        max_batches (int): The maximum number of batches per shard and run.
+
+    Returns:
+        int: The number of entries folded.
+    """
+    started = time.perf_counter()
+    folded = 0
+    for shard in wallet_shards():
+        with use_shard(shard):
+            for _ in range(max_batches):
+                count = fold_ledger(batch_size=batch_size)
+                folded += count
+                if count < batch_size:
+                    break
+    if folded:
+        print(f"Folded {folded} ledger entries in {time.perf_counter() - started:.3f}s.")
+    return folded
+
+
+@shared_task
+@profile_task
+def replay_withdrawal_batch(item_ids, shard=None):
+    """
+    Asynchronous task that replays a batch of failed withdrawals.
+
+    Sent by `start_replay` on the retry queue, whose workers run few tasks at once, so a
+    large replay does not hold up regular withdrawals. Each withdrawal is claimed
+    before it is replayed, so the task is safe to deliver twice.
+
+    Args:
+        item_ids (list): The IDs of the WithdrawalReplayItem rows to replay.
+        shard (str): The shard the replay was started on.
+
+    Returns:
+        dict: The number of withdrawals that succeeded, failed or were already claimed.
+    """
+    started = time.perf_counter()
+    with use_shard(shard):
+        counts = replay_items(item_ids)
+    print(
+        f"Replayed {len(item_ids)} failed withdrawals in {time.perf_counter() - started:.3f}s: "
+        f"{counts['succeeded']} succeeded, {counts['failed']} failed, {counts['skipped']} already claimed."
+    )
+    return counts
+
+
+@shared_task
+@profile_task
+def deliver_webhooks(shard=None, lease_size=WEBHOOK_LEASE_SIZE, max_rounds=100):
+    """
+    Asynchronous task that sends the queued webhook deliveries.
+
+    Sent on the webhook queue after every transaction that queued deliveries, and run
+    by beat every WEBHOOK_RETRY_BASE_INTERVAL seconds to send the retries and the
+    deliveries whose task could not be sent. It sends the due deliveries in rounds of
+    `lease_size` until none is due or `max_rounds` is reached.
+
+    Args:
+        shard (str): The shard to send from; every shard if not given.
+        lease_size (int): The maximum number of deliveries per round.
+        max_rounds (int): The maximum number of rounds per shard and run.
+
+    Returns:
+        dict: The number of deliveries sent, delivered, left to retry and given up,
+            and of requests made.
+    """
+    started = time.perf_counter()
+    totals = {'sent': 0, 'delivered': 0, 'retrying': 0, 'dropped': 0, 'requests': 0}
+    for current in ([shard] if shard else wallet_shards()):
+        with use_shard(current):
+            for _ in range(max_rounds):
+                counts = deliver_due_webhooks(lease_size=lease_size)
+                for key, value in counts.items():
+                    totals[key] += value
+                if counts['sent'] < lease_size:
+                    break
+    if totals['sent']:
+        print(
+            f"Sent {totals['sent']} webhook events in {totals['requests']} requests in {time.perf_counter() - started:.3f}s: "
+            f"{totals['delivered']} delivered, {totals['retrying']} to retry, {totals['dropped']} given up."
+        )
+    return totals
@@ -1,9 +1,57 @@
-from django.test import TestCase
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
-from wallets.models import Wallet
-from unittest.mock import patch
+from wallets.models import Wallet, Transaction, ScheduledWithdrawal, ScheduledWithdrawalBatch, StandingOrder, OutboxEvent, WalletDailyAggregate, SlowQuery, WithdrawalReplay, WalletShardBucket, WebhookSubscription, WebhookDelivery
+from wallets.slow_queries import SlowQueryRecorder, fingerprint, install_slow_query_recorder
+from wallets.payouts import poll_due_payouts
+from wallets.ledger import fold_ledger
+from wallets.netting import apply_transfer_batch
+from wallets.pk_cache import WalletPkCache, wallet_pk_cache
+from wallets.replay import replay_items, replay_report, start_replay
+from wallets.minor_units import backfill_minor_units, format_minor_units, minor_unit_mismatches, to_minor_units
+from wallets.outbox import publish_pending_events, wallet_events_exchange
+from wallets.sharding import bucket_for_uuid, reset_shard_sequences, shard_for_uuid, shard_map, use_shard
+from wallets.rebalance import move_buckets
+from wallets.webhooks import SIGNATURE_HEADER, WebhookSender, deliver_due_webhooks, send_delivery_task, sign
+from wallets.fastpath import parse_amount
+from wallets.messagepack import packb, unpackb
+from wallets.importtime import LAZY_MODULES, profile_startup
+from wallet.utils import lazy_import
+from base.profiling import ProfilingMiddleware, PROFILE_FILE_HEADER
+from base.exceptions import InsufficientFundsError
+from django.core.exceptions import MiddlewareNotUsed
+from wallets.serializers import DepositSerializer, WithdrawSerializer
+from kombu import Connection, Queue
+from unittest.mock import patch, Mock
+from io import StringIO
+from decimal import Decimal
+from uuid import uuid4
+from django.utils import timezone
+from http import HTTPStatus
+import datetime
+import json
+import msgpack
+import os
+import requests
+import socket
+import sys
+import tempfile
+import threading
+import time
+import types
+from celery import Celery
+from django_celery_beat.models import ClockedSchedule, PeriodicTask
+from wallets.tasks import cleanup_slow_queries, cleanup_spent_schedules, process_withdrawal, process_withdrawal_batch, run_standing_orders, poll_pending_payouts
+from wallet.celery import apply_worker_profile
+from base.vars import WITHDRAW_URGENT_QUEUE, WITHDRAW_SCHEDULED_QUEUE, WITHDRAW_BULK_QUEUE, WITHDRAW_RETRY_QUEUE, STARTUP_TIME_BUDGET, WALLET_SHARD_MAP_TTL, WALLET_SHARD_PK_STRIDE
 
 class WalletViewTest(TestCase):
     """
@@ -225,3 +273,2376 @@ class WalletViewTest(TestCase):
         data = {'amount': 1000}  # Deposit amount
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_402_PAYMENT_REQUIRED)
+
+class OutboxTest(TestCase):
+    """
+    Test class for the transactional outbox.
+
+    This class contains test methods checking that balance changes write outbox
+    events and that the relay publishes them in order.
+    """
+    def setUp(self):
+        """
+        Set up the test environment.
+
+        It sets up the test client and creates a wallet with an initial balance of 200.00.
+        """
+        self.client = APIClient()
+        self.wallet = Wallet.objects.create(balance=200.00)
+
+    @patch('wallets.models.requests.post')
+    def test_balance_changes_record_events(self, mock_post):
+        """
+        Test that deposits and withdrawals write an outbox event.
+
+        Steps:
+        1. Deposit into the wallet and withdraw from it through the API.
+        2. Verify that one deposit and one withdrawal event are pending in the outbox.
+        3. Verify that the events carry the wallet UUID and the amount.
+        """
+        mock_post.return_value.json.return_value = {'status': 200, 'data': 'success'}
+
+        self.client.post(reverse('wallets:create_deposit', kwargs={'uuid': self.wallet.uuid}), {'amount': 50}, format='json')
+        self.client.post(reverse('wallets:create_withdraw', kwargs={'uuid': self.wallet.uuid}), {'amount': 20}, format='json')
+
+        events = list(OutboxEvent.objects.pending())
+        self.assertEqual([event.event_type for event in events], [OutboxEvent.EventType.DEPOSIT, OutboxEvent.EventType.WITHDRAWAL])
+        self.assertEqual(events[0].payload['wallet'], str(self.wallet.uuid))
+        self.assertEqual(events[1].payload['amount'], '20.00')
+
+    def test_relay_publishes_in_order(self):
+        """
+        Test that the relay publishes pending events in order and marks them as published.
+
+        Steps:
+        1. Deposit three times into the wallet.
+        2. Relay the outbox to an in-memory broker in batches of two.
+        3. Verify that every event is marked as published.
+        4. Verify that the broker received the events in ledger order.
+        """
+        for amount in ('1.00', '2.00', '3.00'):
+            self.wallet.deposit(Decimal(amount))
+
+        with Connection('memory://') as connection:
+            queue = Queue('outbox-test', exchange=wallet_events_exchange, routing_key='wallet.#')
+            queue(connection.default_channel).declare()
+
+            self.assertEqual(publish_pending_events(connection, batch_size=2), 2)
+            self.assertEqual(publish_pending_events(connection, batch_size=2), 1)
+            self.assertEqual(publish_pending_events(connection, batch_size=2), 0)
+            self.assertFalse(OutboxEvent.objects.pending().exists())
+
+            with connection.SimpleQueue(queue) as simple_queue:
+                amounts = []
+                for _ in range(3):
+                    message = simple_queue.get(timeout=1)
+                    amounts.append(message.payload['amount'])
+                    message.ack()
+        self.assertEqual(amounts, ['1.00', '2.00', '3.00'])
+
+
+def throttle_rates(**rates):
+    """
+    Returns the REST_FRAMEWORK setting with the given throttle rates.
+    """
+    return {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}
+
+
+class RateLimitTest(TestCase):
+    """
+    Test class for the per-wallet and per-client rate limits.
+    """
+    def setUp(self):
+        """
+        Set up the test environment.
+
+        It sets up the test client and creates two wallets with an initial balance of 200.00.
+        """
+        self.client = APIClient()
+        self.wallet = Wallet.objects.create(balance=200.00)
+        self.other_wallet = Wallet.objects.create(balance=200.00)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(withdraw_wallet='1/min'))
+    @patch('wallets.models.requests.post')
+    def test_wallet_limit(self, mock_post):
+        """
+        Test that the per-wallet limit rejects requests before any bank work happens.
+
+        Steps:
+        1. Limit withdrawals to one per minute per wallet.
+        2. Withdraw twice from the same wallet and once from another wallet.
+        3. Verify that the second withdrawal is rejected with 429 and a Retry-After header.
+        4. Verify that the bank was called only for the accepted withdrawals.
+        """
+        mock_post.return_value.json.return_value = {'status': 200, 'data': 'success'}
+        url = reverse('wallets:create_withdraw', kwargs={'uuid': self.wallet.uuid})
+        other_url = reverse('wallets:create_withdraw', kwargs={'uuid': self.other_wallet.uuid})
+
+        self.assertEqual(self.client.post(url, {'amount': 10}, format='json').status_code, status.HTTP_200_OK)
+        response = self.client.post(url, {'amount': 10}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertEqual(self.client.post(other_url, {'amount': 10}, format='json').status_code, status.HTTP_200_OK)
+        self.assertEqual(mock_post.call_count, 2)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(deposit_client='2/min'))
+    def test_client_limit(self):
+        """
+        Test that the per-client limit applies across wallets.
+
+        Steps:
+        1. Limit deposits to two per minute per client.
+        2. Deposit into two different wallets, then once more.
+        3. Verify that the third deposit is rejected with 429 and leaves the balance unchanged.
+        """
+        url = reverse('wallets:create_deposit', kwargs={'uuid': self.wallet.uuid})
+        other_url = reverse('wallets:create_deposit', kwargs={'uuid': self.other_wallet.uuid})
+
+        self.assertEqual(self.client.post(url, {'amount': 10}, format='json').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.post(other_url, {'amount': 10}, format='json').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.post(url, {'amount': 10}, format='json').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('210.00'))
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(deposit_wallet='2/min', deposit_client='2/min'))
+    def test_rejected_requests_keep_tokens(self):
+        """
+        Test that a request rejected by one limit does not use up the other.
+
+        Steps:
+        1. Limit deposits to two per minute per wallet and per client.
+        2. Use up the limit of one client on another wallet, then flood the wallet from it.
+        3. Verify that the flood is rejected and the owner can still deposit twice into the wallet.
+        4. Deposit from a third client into the wallet, which is now over its limit.
+        5. Verify that the third client can still deposit twice into a fresh wallet.
+        """
+        url = reverse('wallets:create_deposit', kwargs={'uuid': self.wallet.uuid})
+        other_url = reverse('wallets:create_deposit', kwargs={'uuid': self.other_wallet.uuid})
+        fresh_url = reverse('wallets:create_deposit', kwargs={'uuid': Wallet.objects.create().uuid})
+        flooder = APIClient(REMOTE_ADDR='10.0.0.1')
+        owner = APIClient(REMOTE_ADDR='10.0.0.2')
+        third = APIClient(REMOTE_ADDR='10.0.0.3')
+
+        for _ in range(2):
+            self.assertEqual(flooder.post(other_url, {'amount': 10}, format='json').status_code, status.HTTP_200_OK)
+        for _ in range(5):
+            self.assertEqual(flooder.post(url, {'amount': 10}, format='json').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        for _ in range(2):
+            self.assertEqual(owner.post(url, {'amount': 10}, format='json').status_code, status.HTTP_200_OK)
+
+        self.assertEqual(third.post(url, {'amount': 10}, format='json').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        for _ in range(2):
+            self.assertEqual(third.post(fresh_url, {'amount': 10}, format='json').status_code, status.HTTP_200_OK)
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('220.00'))
+
+
+class AdminChangelistTest(TestCase):
+    """
+    Test class for the query counts of the admin changelists.
+
+    Every changelist must run the same number of queries whatever the number of
+    rows on the page, and must never count the whole table.
+    """
+    changelists = (
+        'admin:wallets_wallet_changelist',
+        'admin:wallets_transaction_changelist',
+        'admin:wallets_scheduledwithdrawal_changelist',
+        'admin:wallets_outboxevent_changelist',
+    )
+
+    def setUp(self):
+        """
+        Set up the test environment.
+
+        It logs in a superuser and creates one wallet with ledger rows.
+        """
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.add_rows(1)
+
+    def add_rows(self, count):
+        """
+        Creates wallets, each with a deposit and a scheduled withdrawal.
+        """
+        for _ in range(count):
+            wallet = Wallet.objects.create(balance=0)
+            wallet.deposit(Decimal('10.00'))
+            ScheduledWithdrawal.objects.create(wallet=wallet, amount=Decimal('1.00'), scheduled_time=timezone.now() + datetime.timedelta(days=1))
+
+    def capture_changelist_queries(self, url_name):
+        """
+        Loads a changelist and returns the queries it ran.
+        """
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [query['sql'] for query in context.captured_queries]
+
+    def test_changelist_query_counts(self):
+        """
+        Test that the changelist query counts do not grow with the number of rows.
+
+        Steps:
+        1. Load every changelist with one row per model and record the queries.
+        2. Add twenty more rows per model and load every changelist again.
+        3. Verify that each changelist ran the same number of queries both times.
+        4. Verify that every COUNT query is bounded by a LIMIT.
+        """
+        before = {url_name: self.capture_changelist_queries(url_name) for url_name in self.changelists}
+        self.add_rows(20)
+        for url_name in self.changelists:
+            queries = self.capture_changelist_queries(url_name)
+            self.assertEqual(len(queries), len(before[url_name]), url_name)
+            for sql in queries:
+                if 'COUNT(' in sql:
+                    self.assertIn('LIMIT', sql, url_name)
+
+    def test_bank_status_code_filter(self):
+        """
+        Test that pending and rejected payouts can be filtered by their bank status code.
+
+        Steps:
+        1. Store a paid, a pending and a rejected withdrawal.
+        2. Filter the transaction changelist on 202, then on 422.
+        3. Verify that both codes are offered and each filter lists only its withdrawal.
+        """
+        wallet = Wallet.objects.get()
+        _, pending, rejected = [
+            Transaction.objects.create(wallet=wallet, amount=Decimal('1.00'), is_withdrawal=True, bank_status_code=code)
+            for code in ('200', '202', '422')
+        ]
+        for payout in (pending, rejected):
+            response = self.client.get(reverse('admin:wallets_transaction_changelist'), {'bank_status_code': payout.bank_status_code})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(list(response.context['cl'].result_list), [payout])
+            self.assertContains(response, f"{payout.bank_status_code} {HTTPStatus(int(payout.bank_status_code)).phrase}")
+
+
+class DailyAggregateTest(TestCase):
+    """
+    Test class for the daily per-wallet aggregates.
+    """
+    def setUp(self):
+        """
+        Set up the test environment.
+
+        It sets up the test client and creates a wallet with two deposits, a settled
+        withdrawal and a withdrawal rejected by the bank.
+        """
+        self.client = APIClient()
+        self.wallet = Wallet.objects.create(balance=0)
+        self.wallet.deposit(Decimal('50.00'))
+        self.wallet.deposit(Decimal('25.00'))
+        with patch('wallets.models.requests.post') as mock_post:
+            mock_post.return_value.json.return_value = {'status': 200, 'data': 'success'}
+            self.wallet.withdraw(Decimal('20.00'))
+            mock_post.return_value.json.return_value = {'status': 503, 'data': 'failed'}
+            self.wallet.withdraw(Decimal('5.00'))
+        self.today = timezone.localdate()
+
+    def assert_today_totals(self):
+        """
+        Verifies the aggregate of the wallet for today.
+        """
+        aggregate = WalletDailyAggregate.objects.get(wallet=self.wallet, date=self.today)
+        self.assertEqual(aggregate.deposit_total, Decimal('75.00'))
+        self.assertEqual(aggregate.deposit_count, 2)
+        self.assertEqual(aggregate.withdrawal_total, Decimal('20.00'))
+        self.assertEqual(aggregate.withdrawal_count, 1)
+
+    def test_incremental_aggregates(self):
+        """
+        Test that ledger writes update the aggregate of the day, ignoring unsettled withdrawals.
+        """
+        self.assert_today_totals()
+
+    def test_aggregate_api(self):
+        """
+        Test retrieving the aggregates of a date range.
+
+        Steps:
+        1. Request the aggregates from yesterday to today.
+        2. Verify that one day is returned with the expected totals.
+        3. Verify that a reversed range is rejected with 400 (Bad Request).
+        """
+        url = reverse('wallets:daily_aggregates', kwargs={'uuid': self.wallet.uuid})
+        start = self.today - datetime.timedelta(days=1)
+        response = self.client.get(url, {'start': start.isoformat(), 'end': self.today.isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['deposit_total'], '75.00')
+        self.assertEqual(response.data[0]['withdrawal_count'], 1)
+
+        response = self.client.get(url, {'start': self.today.isoformat(), 'end': start.isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_backfill_rebuilds_aggregates(self):
+        """
+        Test that the backfill command rebuilds the aggregates from the ledger in chunks.
+        """
+        WalletDailyAggregate.objects.all().delete()
+        call_command('backfill_daily_aggregates', chunk_size=1, stdout=StringIO())
+        self.assert_today_totals()
+
+    def test_backfill_after_incremental_writes(self):
+        """
+        Test that the backfill does not count again the rows aggregated incrementally.
+
+        Steps:
+        1. Run the backfill over the aggregates written by the ledger writes of setUp.
+        2. Verify that the totals are unchanged, also after running it a second time.
+        3. Deposit after the backfill and verify the deposit is counted once.
+        4. Append an unfolded entry, run the backfill and fold the entry.
+        5. Verify that the entry was only counted by the fold.
+        """
+        other = Wallet.objects.create(balance=0)
+        other.deposit(Decimal('1.00'))
+        for _ in range(2):
+            call_command('backfill_daily_aggregates', chunk_size=1, stdout=StringIO())
+            self.assert_today_totals()
+        self.assertEqual(WalletDailyAggregate.objects.get(wallet=other).deposit_total, Decimal('1.00'))
+
+        self.wallet.deposit(Decimal('5.00'))
+        aggregate = WalletDailyAggregate.objects.get(wallet=self.wallet, date=self.today)
+        self.assertEqual((aggregate.deposit_total, aggregate.deposit_count), (Decimal('80.00'), 3))
+
+        with override_settings(WALLET_APPEND_ONLY_LEDGER=True):
+            self.wallet.deposit(Decimal('0.50'))
+        call_command('backfill_daily_aggregates', stdout=StringIO())
+        fold_ledger()
+        aggregate = WalletDailyAggregate.objects.get(wallet=self.wallet, date=self.today)
+        self.assertEqual((aggregate.deposit_total, aggregate.deposit_count), (Decimal('80.50'), 4))
+
+
+class BulkWalletTest(TestCase):
+    """
+    Test class for bulk wallet creation and the seeding command.
+    """
+    def setUp(self):
+        """
+        Set up the test environment.
+
+        It sets up the test client and the URL of the bulk creation endpoint.
+        """
+        self.client = APIClient()
+        self.url = reverse('wallets:bulk_create_wallet')
+
+    def test_bulk_create_wallets(self):
+        """
+        Test creating wallets from a list of UUIDs and balances.
+
+        Steps:
+        1. Send a list with one wallet with a UUID and balance and one with defaults.
+        2. Verify that the response status code is 201 (Created) and both wallets exist.
+        3. Send the same UUID again and verify that it is rejected with 400 (Bad Request).
+        """
+        wallet_uuid = '12c599be-7847-47d4-b063-e80e6e36b0cb'
+        data = {'wallets': [{'uuid': wallet_uuid, 'balance': 10}, {}]}
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(Wallet.objects.get(uuid=wallet_uuid).balance, Decimal('10.00'))
+        self.assertEqual(Wallet.objects.count(), 2)
+
+        response = self.client.post(self.url, {'wallets': [{'uuid': wallet_uuid}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Wallet.objects.count(), 2)
+
+    def test_bulk_create_wallets_by_count(self):
+        """
+        Test creating a number of wallets with generated UUIDs.
+        """
+        response = self.client.post(self.url, {'count': 25}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Wallet.objects.count(), 25)
+
+    def test_bulk_create_wallets_invalid(self):
+        """
+        Test that duplicate UUIDs and requests with both a list and a count are rejected.
+        """
+        wallet_uuid = '12c599be-7847-47d4-b063-e80e6e36b0cb'
+        response = self.client.post(self.url, {'wallets': [{'uuid': wallet_uuid}, {'uuid': wallet_uuid}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url, {'wallets': [{}], 'count': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Wallet.objects.exists())
+
+    def test_seed_wallets(self):
+        """
+        Test that seeded wallet balances equal the sum of their synthetic ledger.
+        """
+        call_command('seed_wallets', wallets=7, transactions_per_wallet=4, batch_size=3, seed=1, stdout=StringIO())
+        self.assertEqual(Wallet.objects.count(), 7)
+        self.assertEqual(Transaction.objects.count(), 28)
+        for wallet in Wallet.objects.all():
+            deposits = wallet.transaction_set.filter(is_withdrawal=False).aggregate(total=Sum('amount'))['total'] or 0
+            withdrawals = wallet.transaction_set.filter(is_withdrawal=True).aggregate(total=Sum('amount'))['total'] or 0
+            self.assertEqual(wallet.balance, deposits - withdrawals)
+
+
+class WithdrawalQueueTest(TestCase):
+    """
+    Test class for the withdrawal queues and worker profiles.
+    """
+    def setUp(self):
+        """
+        Set up the test environment.
+
+        It sets up the test client and creates a wallet with an initial balance of 200.00.
+        """
+        self.client = APIClient()
+        self.wallet = Wallet.objects.create(balance=200.00)
+
+    def test_schedule_withdraw_queues(self):
+        """
+        Test that scheduled withdrawals go to the scheduled queue unless flagged as urgent.
+        """
+        url = reverse('wallets:schedule_withdraw', kwargs={'uuid': self.wallet.uuid})
+        scheduled_time = (timezone.now() + datetime.timedelta(days=1)).isoformat()
+        self.client.post(url, {'amount': 10, 'scheduled_time': scheduled_time}, format='json')
+        self.client.post(url, {'amount': 10, 'scheduled_time': scheduled_time, 'urgent': True}, format='json')
+        queues = list(PeriodicTask.objects.filter(task='wallets.tasks.process_withdrawal').order_by('id').values_list('queue', flat=True))
+        self.assertEqual(queues, [WITHDRAW_SCHEDULED_QUEUE, WITHDRAW_URGENT_QUEUE])
+
+    def test_worker_profile(self):
+        """
+        Test that the worker profile selected by WALLET_WORKER_PROFILE configures the worker.
+
+        Steps:
+        1. Create a Celery app configured from the Django settings.
+        2. Apply the 'urgent' profile to it as the worker initialization signal would.
+        3. Verify the concurrency, prefetch multiplier, acks_late and time limits.
+        4. Verify that the worker only consumes from the urgent queue.
+        """
+        app = Celery('profile-test', set_as_current=False)
+        app.config_from_object('django.conf:settings', namespace='CELERY')
+        with patch.dict(os.environ, {'WALLET_WORKER_PROFILE': 'urgent'}):
+            apply_worker_profile(instance=Mock(app=app), conf=app.conf)
+        self.assertEqual(app.conf.worker_concurrency, 8)
+        self.assertEqual(app.conf.worker_prefetch_multiplier, 1)
+        self.assertFalse(app.conf.task_acks_late)
+        self.assertEqual(app.conf.task_time_limit, 30)
+        self.assertEqual(list(app.amqp.queues.consume_from), [WITHDRAW_URGENT_QUEUE])
+
+
+class CleanupSpentSchedulesTest(TestCase):
+    """
+    Test class for the garbage collection of spent one-off beat rows.
+    """
+    def create_task(self, name, clocked_time, enabled):
+        """
+        Creates a one-off periodic task on its own clocked schedule.
+        """
+        clocked = ClockedSchedule.objects.create(clocked_time=clocked_time)
+        return PeriodicTask.objects.create(
+            name=name,
+            task='wallets.tasks.process_withdrawal',
+            clocked=clocked,
+            one_off=True,
+            enabled=enabled,
+        )
+
+    def test_cleanup_spent_schedules(self):
+        """
+        Test that spent one-off tasks and their clocked schedules are removed in batches.
+
+        Steps:
+        1. Create three spent one-off tasks, one pending task, one disabled task that is
+           not due yet and one unused future schedule.
+        2. Run the cleanup task with a batch size of two.
+        3. Verify that the spent tasks and their schedules were removed and reported.
+        4. Verify that the pending and paused tasks and the future schedule were kept.
+        """
+        past = timezone.now() - datetime.timedelta(days=1)
+        future = timezone.now() + datetime.timedelta(days=1)
+        for index in range(3):
+            self.create_task(f'spent-{index}', past + datetime.timedelta(minutes=index), enabled=False)
+        pending = self.create_task('pending', future, enabled=True)
+        paused = self.create_task('paused', future, enabled=False)
+        unused = ClockedSchedule.objects.create(clocked_time=future + datetime.timedelta(hours=1))
+
+        result = cleanup_spent_schedules(batch_size=2)
+
+        self.assertEqual(result['periodic_tasks'], 3)
+        self.assertEqual(result['clocked_schedules'], 3)
+        self.assertEqual(set(PeriodicTask.objects.filter(one_off=True)), {pending, paused})
+        self.assertEqual(set(ClockedSchedule.objects.all()), {pending.clocked, paused.clocked, unused})
+
+
+class WithdrawalBatchTest(TestCase):
+    """
+    Test class for batch scheduling of withdrawals.
+    """
+    def setUp(self):
+        """
+        Set up the test environment.
+
+        It sets up the test client, two wallets and two future scheduled times.
+        """
+        self.client = APIClient()
+        self.url = reverse('wallets:schedule_withdraw_batch')
+        self.wallets = [Wallet.objects.create(balance=200.00) for _ in range(2)]
+        self.first = timezone.now() + datetime.timedelta(days=1)
+        self.second = self.first + datetime.timedelta(hours=1)
+
+    def items(self):
+        """
+        Returns three withdrawals spread over the two scheduled times.
+        """
+        return [
+            {'wallet': str(self.wallets[0].uuid), 'amount': 10, 'scheduled_time': self.first.isoformat()},
+            {'wallet': str(self.wallets[1].uuid), 'amount': 20, 'scheduled_time': self.first.isoformat()},
+            {'wallet': str(self.wallets[0].uuid), 'amount': 30, 'scheduled_time': self.second.isoformat()},
+        ]
+
+    def test_schedule_batch(self):
+        """
+        Test that a batch creates its withdrawals and one clocked task per scheduled time.
+
+        Steps:
+        1. Post a batch of three withdrawals over two scheduled times.
+        2. Verify that the batch and its three withdrawals were created.
+        3. Verify that two one-off tasks on the bulk queue were created.
+        4. Verify that the batch status reports three pending withdrawals.
+        """
+        response = self.client.post(self.url, {'items': self.items()}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['scheduled'], 3)
+        self.assertEqual(response.data['triggers'], 2)
+
+        batch = ScheduledWithdrawalBatch.objects.get(uuid=response.data['batch'])
+        self.assertEqual(batch.items.count(), 3)
+        tasks = PeriodicTask.objects.filter(task='wallets.tasks.process_withdrawal_batch')
+        self.assertEqual(tasks.count(), 2)
+        self.assertEqual(set(tasks.values_list('queue', flat=True)), {WITHDRAW_BULK_QUEUE})
+
+        response = self.client.get(reverse('wallets:retrieve_withdraw_batch', kwargs={'batch_uuid': batch.uuid}))
+        self.assertEqual(response.data['total'], 3)
+        self.assertEqual(response.data['pending'], 3)
+
+    def test_schedule_batch_is_all_or_nothing(self):
+        """
+        Test that a batch with an invalid item or an unknown wallet schedules nothing.
+        """
+        items = self.items()
+        items[1]['amount'] = 0
+        response = self.client.post(self.url, {'items': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        items = self.items()
+        items[2]['wallet'] = '12c599be-7847-47d4-b063-e80e6e36b0cb'
+        response = self.client.post(self.url, {'items': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['uuids'], ['12c599be-7847-47d4-b063-e80e6e36b0cb'])
+        self.assertFalse(ScheduledWithdrawal.objects.exists())
+        self.assertFalse(PeriodicTask.objects.exists())
+
+    def test_process_withdrawal_batch(self):
+        """
+        Test that the batch task enqueues the withdrawals of its time slot only.
+
+        Steps:
+        1. Schedule a batch of three withdrawals over two scheduled times.
+        2. Run the batch task for the first scheduled time with the publisher mocked.
+        3. Verify that the two withdrawals of that time were sent to the bulk queue.
+        """
+        response = self.client.post(self.url, {'items': self.items()}, format='json')
+        batch = ScheduledWithdrawalBatch.objects.get(uuid=response.data['batch'])
+        with patch('wallets.tasks.process_withdrawal.apply_async') as apply_async:
+            process_withdrawal_batch(batch.id, self.first.isoformat())
+        expected = list(batch.items.filter(scheduled_time=self.first).order_by('id').values_list('id', flat=True))
+        self.assertEqual(
+            [call.kwargs['kwargs']['scheduled_withdrawal_id'] for call in apply_async.call_args_list],
+            expected,
+        )
+        self.assertEqual({call.kwargs['queue'] for call in apply_async.call_args_list}, {WITHDRAW_BULK_QUEUE})
+
+
+class CancelRescheduleWithdrawTest(TestCase):
+    """
+    Test class for cancelling and rescheduling scheduled withdrawals.
+    """
+    def setUp(self):
+        """
+        Set up the test environment.
+
+        It sets up the test client, a wallet with a balance of 200.00 and a withdrawal
+        of 10.00 scheduled for tomorrow.
+        """
+        self.client = APIClient()
+        self.wallet = Wallet.objects.create(balance=200.00)
+        self.scheduled_time = timezone.now() + datetime.timedelta(days=1)
+        response = self.client.post(
+            reverse('wallets:schedule_withdraw', kwargs={'uuid': self.wallet.uuid}),
+            {'amount': 10, 'scheduled_time': self.scheduled_time.isoformat()},
+            format='json',
+        )
+        self.withdrawal = ScheduledWithdrawal.objects.get(pk=response.data['id'])
+
+    def url(self, name, withdrawal=None):
+        """
+        Returns the URL of the cancel or reschedule endpoint of a withdrawal.
+        """
+        withdrawal = withdrawal or self.withdrawal
+        return reverse(f'wallets:{name}', kwargs={'uuid': withdrawal.wallet.uuid, 'pk': withdrawal.pk})
+
+    def test_cancel(self):
+        """
+        Test that cancelling removes the beat rows and stops the task from withdrawing.
+
+        Steps:
+        1. Cancel the scheduled withdrawal.
+        2. Verify that its periodic task and clocked schedule were deleted.
+        3. Run the task as if its message had already been sent.
+        4. Verify that nothing was withdrawn and that a second cancel is rejected.
+        """
+        self.assertIsNotNone(self.withdrawal.periodic_task_id)
+        response = self.client.post(self.url('cancel_scheduled_withdraw'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(PeriodicTask.objects.exists())
+        self.assertFalse(ClockedSchedule.objects.exists())
+
+        with patch('wallets.models.requests.post') as mock_post:
+            process_withdrawal(self.withdrawal.id)
+        mock_post.assert_not_called()
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('200.00'))
+
+        response = self.client.post(self.url('cancel_scheduled_withdraw'))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_cancel_after_processing(self):
+        """
+        Test that a withdrawal claimed by a worker can no longer be cancelled.
+        """
+        self.assertTrue(ScheduledWithdrawal.objects.claim(self.withdrawal.id))
+        response = self.client.post(self.url('cancel_scheduled_withdraw'))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(ScheduledWithdrawal.objects.claim(self.withdrawal.id))
+
+    def test_reschedule(self):
+        """
+        Test that rescheduling moves the beat task and invalidates the old message.
+
+        Steps:
+        1. Reschedule the withdrawal one day later.
+        2. Verify that its task now uses a clocked schedule at the new time and that the
+           old clocked schedule was removed.
+        3. Verify that a task message sent for the old time cannot claim it.
+        4. Verify that a task message sent for the new time claims it.
+        """
+        new_time = self.scheduled_time + datetime.timedelta(days=1)
+        response = self.client.post(self.url('reschedule_withdraw'), {'scheduled_time': new_time.isoformat()}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        task = PeriodicTask.objects.get()
+        self.assertEqual(task.clocked.clocked_time, new_time)
+        self.assertEqual(ClockedSchedule.objects.count(), 1)
+        self.assertFalse(ScheduledWithdrawal.objects.claim(self.withdrawal.id, self.scheduled_time))
+        self.assertTrue(ScheduledWithdrawal.objects.claim(self.withdrawal.id, new_time))
+
+    def test_reschedule_batch_item(self):
+        """
+        Test that a rescheduled batch withdrawal leaves its batch time slot.
+
+        Steps:
+        1. Schedule a batch of two withdrawals at the same time.
+        2. Reschedule the first one.
+        3. Verify that it got a dedicated task and that the batch task of the original
+           time slot only enqueues the second one.
+        """
+        response = self.client.post(
+            reverse('wallets:schedule_withdraw_batch'),
+            {'items': [
+                {'wallet': str(self.wallet.uuid), 'amount': 5, 'scheduled_time': self.scheduled_time.isoformat()},
+                {'wallet': str(self.wallet.uuid), 'amount': 6, 'scheduled_time': self.scheduled_time.isoformat()},
+            ]},
+            format='json',
+        )
+        batch = ScheduledWithdrawalBatch.objects.get(uuid=response.data['batch'])
+        first, second = batch.items.order_by('id')
+        new_time = self.scheduled_time + datetime.timedelta(hours=2)
+        response = self.client.post(self.url('reschedule_withdraw', first), {'scheduled_time': new_time.isoformat()}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first.refresh_from_db()
+        self.assertIsNotNone(first.periodic_task_id)
+
+        with patch('wallets.tasks.process_withdrawal.apply_async') as apply_async:
+            process_withdrawal_batch(batch.id, self.scheduled_time.isoformat())
+        self.assertEqual([call.kwargs['kwargs']['scheduled_withdrawal_id'] for call in apply_async.call_args_list], [second.id])
+
+
+class StandingOrderTest(TestCase):
+    """
+    Test class for standing orders and the scheduler pass that runs them.
+    """
+    def setUp(self):
+        """
+        Set up the test environment.
+
+        It sets up the test client and a wallet with an initial balance of 200.00.
+        """
+        self.client = APIClient()
+        self.wallet = Wallet.objects.create(balance=200.00)
+        self.url = reverse('wallets:create_standing_order', kwargs={'uuid': self.wallet.uuid})
+
+    def test_create_standing_order(self):
+        """
+        Test that a standing order is created with its first occurrence precomputed.
+
+        Steps:
+        1. Create a cron order running every Monday at 9:00.
+        2. Verify that its next run is a Monday at 9:00 in the future.
+        3. Verify that orders with both or neither recurrence, or an invalid cron
+           expression, are rejected.
+        """
+        response = self.client.post(self.url, {'amount': 10, 'cron': '0 9 * * mon'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        order = StandingOrder.objects.get(pk=response.data['id'])
+        self.assertGreater(order.next_run_at, timezone.now())
+        self.assertEqual((order.next_run_at.weekday(), order.next_run_at.hour, order.next_run_at.minute), (0, 9, 0))
+
+        for data in ({'amount': 10}, {'amount': 10, 'cron': '0 9 * * mon', 'interval': 3600}, {'amount': 10, 'cron': '99 9 * * *'}):
+            response = self.client.post(self.url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_run_standing_orders(self):
+        """
+        Test that one scheduler pass creates the due occurrences in batches.
+
+        Steps:
+        1. Create three due interval orders, one of which missed several occurrences,
+           one order that is not due yet and one cancelled order.
+        2. Run the scheduler pass with a batch size of two and the publisher mocked.
+        3. Verify that one withdrawal was created and enqueued per due order.
+        4. Verify that the next runs moved past now on the interval grid.
+        """
+        now = timezone.now()
+        hour = datetime.timedelta(hours=1)
+        due = [
+            StandingOrder.objects.create(wallet=self.wallet, amount=1, interval=hour, next_run_at=now - datetime.timedelta(minutes=1)),
+            StandingOrder.objects.create(wallet=self.wallet, amount=2, interval=hour, next_run_at=now - datetime.timedelta(minutes=2)),
+            StandingOrder.objects.create(wallet=self.wallet, amount=3, interval=hour, next_run_at=now - datetime.timedelta(hours=5, minutes=30)),
+        ]
+        StandingOrder.objects.create(wallet=self.wallet, amount=4, interval=hour, next_run_at=now + hour)
+        StandingOrder.objects.create(wallet=self.wallet, amount=5, interval=hour, next_run_at=now - hour, active=False)
+
+        with patch('wallets.tasks.process_withdrawal.apply_async') as apply_async, \
+                self.captureOnCommitCallbacks(execute=True):
+            created = run_standing_orders(batch_size=2)
+
+        self.assertEqual(created, 3)
+        occurrences = ScheduledWithdrawal.objects.filter(standing_order__isnull=False)
+        self.assertEqual(sorted(occurrences.values_list('amount', flat=True)), [1, 2, 3])
+        self.assertEqual(
+            sorted(call.kwargs['kwargs']['scheduled_withdrawal_id'] for call in apply_async.call_args_list),
+            sorted(occurrences.values_list('id', flat=True)),
+        )
+        for order in due:
+            previous = order.next_run_at
+            order.refresh_from_db()
+            self.assertEqual(order.last_run_at, previous)
+            self.assertGreater(order.next_run_at, now)
+            self.assertLessEqual(order.next_run_at, now + hour)
+            self.assertEqual((order.next_run_at - previous) % hour, datetime.timedelta(0))
+
+    def test_cron_that_never_fires(self):
+        """
+        Test that a cron expression without any occurrence is rejected and that a
+        stored one does not break the scheduler pass.
+
+        Steps:
+        1. Create an order running on February 31 and verify it is rejected with a 400.
+        2. Store such an order directly, due now, next to a valid due order.
+        3. Run the scheduler pass and verify both withdrawals were created.
+        4. Verify that the broken order was deactivated and the valid one advanced.
+        """
+        response = self.client.post(self.url, {'amount': 10, 'cron': '0 9 31 2 *'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('cron', response.data)
+
+        now = timezone.now()
+        broken = StandingOrder.objects.create(wallet=self.wallet, amount=1, cron='0 9 31 2 *', next_run_at=now - datetime.timedelta(minutes=1))
+        valid = StandingOrder.objects.create(wallet=self.wallet, amount=2, interval=datetime.timedelta(hours=1), next_run_at=now - datetime.timedelta(minutes=1))
+        with patch('wallets.tasks.process_withdrawal.apply_async'), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(run_standing_orders(), 2)
+        broken.refresh_from_db()
+        valid.refresh_from_db()
+        self.assertFalse(broken.active)
+        self.assertTrue(valid.active)
+        self.assertGreater(valid.next_run_at, now)
+        self.assertFalse(StandingOrder.objects.due(now + datetime.timedelta(days=400)).filter(pk=broken.pk).exists())
+
+    def test_cancel_standing_order(self):
+        """
+        Test that a cancelled standing order is no longer due.
+        """
+        order = StandingOrder.objects.create(wallet=self.wallet, amount=1, interval=datetime.timedelta(hours=1), next_run_at=timezone.now())
+        url = reverse('wallets:cancel_standing_order', kwargs={'uuid': self.wallet.uuid, 'pk': order.pk})
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(StandingOrder.objects.due(timezone.now()).exists())
+
+
+class TransferTest(TestCase):
+    """
+    Test class for wallet-to-wallet transfers.
+    """
+    def setUp(self):
+        """
+        Set up the test environment.
+
+        It sets up the test client and two wallets with balances of 100.00 and 50.00.
+        """
+        self.client = APIClient()
+        self.source = Wallet.objects.create(balance=100.00)
+        self.target = Wallet.objects.create(balance=50.00)
+        self.url = reverse('wallets:create_transfer', kwargs={'uuid': self.source.uuid})
+
+    @patch('wallets.models.requests.post')
+    def test_transfer(self, mock_post):
+        """
+        Test that a transfer moves the amount without calling the bank.
+
+        Steps:
+        1. Transfer 30.00 from the source wallet to the target wallet.
+        2. Verify both balances.
+        3. Verify that one settled debit and one settled credit share the transfer ID.
+        4. Verify that the bank was not called.
+        """
+        response = self.client.post(self.url, {'to': str(self.target.uuid), 'amount': 30}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['new_balance'], Decimal('70.00'))
+        self.target.refresh_from_db()
+        self.assertEqual(self.target.balance, Decimal('80.00'))
+
+        rows = Transaction.objects.filter(transfer_id=response.data['transfer_id'])
+        self.assertEqual(
+            set(rows.values_list('wallet_id', 'is_withdrawal', 'settle', 'amount')),
+            {(self.source.id, True, True, Decimal('30.00')), (self.target.id, False, True, Decimal('30.00'))},
+        )
+        mock_post.assert_not_called()
+
+    def test_transfer_rejected(self):
+        """
+        Test that failed transfers change nothing.
+
+        Steps:
+        1. Transfer more than the source balance and verify the 402 response.
+        2. Transfer to the source wallet itself and verify the 400 response.
+        3. Verify that no balance or ledger row changed.
+        """
+        response = self.client.post(self.url, {'to': str(self.target.uuid), 'amount': 100.01}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_402_PAYMENT_REQUIRED)
+        response = self.client.post(self.url, {'to': str(self.source.uuid), 'amount': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.source.refresh_from_db()
+        self.target.refresh_from_db()
+        self.assertEqual((self.source.balance, self.target.balance), (Decimal('100.00'), Decimal('50.00')))
+        self.assertFalse(Transaction.objects.exists())
+
+
+class TransferStressTest(TransactionTestCase):
+    """
+    Test class for concurrent opposing transfers.
+    """
+    def test_stress_transfers(self):
+        """
+        Test that concurrent opposing transfers neither deadlock nor lose money.
+
+        Steps:
+        1. Run the stress command with four threads over two wallets, so every transfer
+           has an opposing one running at the same time.
+        2. Verify that no deadlock was reported and that the invariants held.
+        """
+        out = StringIO()
+        err = StringIO()
+        call_command('stress_transfers', wallets=2, threads=4, transfers=25, seed=1, stdout=out, stderr=err)
+        self.assertIn('0 deadlocks', out.getvalue(), err.getvalue())
+        self.assertEqual(err.getvalue(), '')
+        self.assertIn('unchanged and ledger rows paired', out.getvalue())
+
+
+class WalletStressTest(TransactionTestCase):
+    """
+    Test class for concurrent deposits, withdrawals and scheduled payouts on shared wallets.
+    """
+    def run_stress(self, **options):
+        """
+        Runs the stress command and returns its output and error output.
+        """
+        out = StringIO()
+        err = StringIO()
+        call_command('stress_wallets', wallets=2, threads=4, operations=25, seed=1, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_stress_in_place(self):
+        """
+        Test that the balance invariants hold under a concurrent mix of operations.
+
+        Steps:
+        1. Run the stress command with four threads over two wallets and a failing bank.
+        2. Verify that no invariant was violated and every operation kind ran.
+        """
+        out, err = self.run_stress()
+        self.assertEqual(err, '')
+        self.assertIn('every balance equals its ledger sum', out)
+        for operation in ('deposit', 'withdraw', 'process_withdrawal'):
+            self.assertIn(f'  {operation}: ', out)
+
+    def test_stress_append_only(self):
+        """
+        Test that the balance invariants hold in append-only ledger mode.
+
+        Steps:
+        1. Run the stress command in append-only ledger mode.
+        2. Verify that no invariant was violated once the ledger is folded.
+        """
+        out, err = self.run_stress(append_only=True)
+        self.assertEqual(err, '')
+        self.assertIn('every balance equals its ledger sum', out)
+        self.assertFalse(Transaction.objects.unfolded().exists())
+
+    @patch('wallets.models.requests.post')
+    def test_stale_withdraw_cannot_overdraw(self, mock_post):
+        """
+        Test that a withdrawal checked against a stale balance does not overdraw.
+
+        Steps:
+        1. Load the same wallet twice, both copies with a balance of 100.00.
+        2. Withdraw 80.00 through each copy.
+        3. Verify that the second withdrawal is rejected and only one was debited and logged.
+        """
+        mock_post.return_value.json.return_value = {'status': 200, 'data': 'paid'}
+        wallet = Wallet.objects.create(balance=100)
+        first = Wallet.objects.get(pk=wallet.pk)
+        second = Wallet.objects.get(pk=wallet.pk)
+        first.withdraw(Decimal('80.00'))
+        with self.assertRaises(InsufficientFundsError):
+            second.withdraw(Decimal('80.00'))
+        wallet.refresh_from_db()
+        self.assertEqual(wallet.balance, Decimal('20.00'))
+        self.assertEqual(Transaction.objects.filter(wallet=wallet, is_withdrawal=True).count(), 1)
+
+
+class BatchTransferTest(TestCase):
+    """
+    Test class for netted batch transfers.
+    """
+    def setUp(self):
+        """
+        Set up the test environment.
+
+        It sets up the test client, three buyer wallets with a balance of 100.00 and
+        two seller wallets with a zero balance.
+        """
+        self.client = APIClient()
+        self.url = reverse('wallets:batch_transfer')
+        self.buyers = [Wallet.objects.create(balance=100.00) for _ in range(3)]
+        self.sellers = [Wallet.objects.create(balance=0) for _ in range(2)]
+
+    def transfer(self, source, target, amount):
+        """
+        Returns one transfer of a batch request.
+        """
+        return {'wallet': str(source.uuid), 'to': str(target.uuid), 'amount': amount}
+
+    def test_batch_transfer(self):
+        """
+        Test that a batch is applied with one balance update per wallet.
+
+        Steps:
+        1. Post six transfers from three buyers to two sellers.
+        2. Verify the balances and that exactly five wallet UPDATE statements ran.
+        3. Verify that every transfer wrote a paired debit and credit and two outbox events.
+        """
+        transfers = [
+            self.transfer(buyer, seller, 10)
+            for buyer in self.buyers
+            for seller in self.sellers
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {'transfers': transfers}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['wallets_updated'], 5)
+        wallet_updates = [query for query in queries.captured_queries if query['sql'].startswith('UPDATE "wallets_wallet"')]
+        self.assertEqual(len(wallet_updates), 5)
+
+        for buyer in self.buyers:
+            buyer.refresh_from_db()
+            self.assertEqual(buyer.balance, Decimal('80.00'))
+        for seller in self.sellers:
+            seller.refresh_from_db()
+            self.assertEqual(seller.balance, Decimal('30.00'))
+        self.assertEqual(Transaction.objects.filter(transfer_id__in=response.data['transfer_ids']).count(), 12)
+        self.assertEqual(OutboxEvent.objects.count(), 12)
+
+    def test_batch_transfer_checks_every_debit(self):
+        """
+        Test that debits are checked in order, counting credits received earlier in the batch.
+
+        Steps:
+        1. Post a batch where a seller passes on money it only receives in the batch.
+        2. Verify that it is applied.
+        3. Post a batch whose second debit is not covered at that point, although the
+           net delta of the wallet is positive.
+        4. Verify the 402 response and that nothing was applied.
+        """
+        buyer, seller = self.buyers[0], self.sellers[0]
+        response = self.client.post(self.url, {'transfers': [
+            self.transfer(buyer, seller, 50),
+            self.transfer(seller, self.sellers[1], 40),
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.post(self.url, {'transfers': [
+            self.transfer(self.buyers[1], seller, 1),
+            self.transfer(seller, self.sellers[1], 20),
+            self.transfer(self.buyers[2], seller, 100),
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_402_PAYMENT_REQUIRED)
+        seller.refresh_from_db()
+        self.assertEqual(seller.balance, Decimal('10.00'))
+        self.assertEqual(Transaction.objects.count(), 4)
+
+
+class FastPathTest(TestCase):
+    """
+    Test class for the fast path of the hot endpoints.
+    """
+    def setUp(self):
+        """
+        Set up the test environment.
+
+        It sets up the test client and a wallet with an initial balance of 100.00.
+        """
+        self.client = APIClient()
+        self.wallet = Wallet.objects.create(balance=100.00)
+
+    def test_parse_amount_matches_serializers(self):
+        """
+        Test that the fast amount validator never accepts what the serializers reject.
+
+        Steps:
+        1. Validate a range of valid and invalid amounts with both serializers.
+        2. Verify that whenever the fast validator accepts an amount, both serializers
+           accept it with the same value.
+        3. Verify that plain valid amounts are accepted by the fast validator.
+        """
+        values = [
+            10, 1, '10.5', '10.50', ' 7 ', 0.1, '0.01', '99999999.99', '1E+2', '1_000',
+            0, -1, '0.00', '0.001', '10.505', '100000000', '1E+8', '1e-3', 'nan', 'inf',
+            'abc', '', None, True, [], {'amount': 1}, '12345678.9', 1.005,
+        ]
+        for value in values:
+            fast = parse_amount(value)
+            for serializer_class in (DepositSerializer, WithdrawSerializer):
+                serializer = serializer_class(data={'amount': value})
+                if fast is not None:
+                    self.assertTrue(serializer.is_valid(), value)
+                    self.assertEqual(serializer.validated_data['amount'], fast, value)
+        for value in (10, '10.5', '0.01', 0.1, '99999999.99'):
+            self.assertIsNotNone(parse_amount(value), value)
+
+    @override_settings(WALLET_FAST_PATH=True)
+    def test_fast_path_endpoints(self):
+        """
+        Test the responses of the hot endpoints on the fast path.
+
+        Steps:
+        1. Retrieve the wallet asking for HTML and verify the trimmed JSON payload.
+        2. Deposit a valid amount and verify the new balance.
+        3. Deposit an invalid amount and verify the serializer error is returned.
+        """
+        response = self.client.get(reverse('wallets:retrieve_wallet', kwargs={'uuid': self.wallet.uuid}), HTTP_ACCEPT='text/html')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.json(), {'uuid': str(self.wallet.uuid), 'balance': '100.00'})
+
+        url = reverse('wallets:create_deposit', kwargs={'uuid': self.wallet.uuid})
+        response = self.client.post(url, {'amount': '10.50'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['new_balance'], 110.5)
+
+        response = self.client.post(url, {'amount': '-1'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'amount': ['Ensure this value is greater than or equal to 0.00.']})
+
+
+class MessagePackTest(TestCase):
+    """
+    Test class for MessagePack content negotiation.
+    """
+    def setUp(self):
+        """
+        Set up the test environment.
+
+        It sets up the test client and a wallet with an initial balance of 100.00.
+        """
+        self.client = APIClient()
+        self.wallet = Wallet.objects.create(balance=100.00)
+
+    def test_decimal_round_trip(self):
+        """
+        Test that decimals survive packing and unpacking exactly.
+        """
+        data = {'amounts': [Decimal('0.10'), Decimal('12345678.91'), Decimal('-0.01')], 'id': 1}
+        self.assertEqual(unpackb(packb(data)), data)
+        self.assertIsInstance(unpackb(packb(Decimal('0.10'))), Decimal)
+
+    def deposit(self):
+        """
+        Deposits 0.10 with a MessagePack request and returns the decoded response.
+        """
+        response = self.client.post(
+            reverse('wallets:create_deposit', kwargs={'uuid': self.wallet.uuid}),
+            packb({'amount': Decimal('0.10')}),
+            content_type='application/msgpack',
+            HTTP_ACCEPT='application/msgpack',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        return unpackb(response.content)
+
+    def test_msgpack_deposit(self):
+        """
+        Test a deposit sent and answered in MessagePack, on the regular and the fast path.
+
+        Steps:
+        1. Deposit 0.10 with a MessagePack body and Accept header.
+        2. Verify that the new balance is the exact Decimal 100.10.
+        3. Repeat on the fast path and verify the exact Decimal 100.20.
+        4. Verify that a malformed body is rejected with 400.
+        """
+        self.assertEqual(self.deposit()['new_balance'], Decimal('100.10'))
+        with override_settings(WALLET_FAST_PATH=True):
+            self.assertEqual(self.deposit()['new_balance'], Decimal('100.20'))
+
+        response = self.client.post(
+            reverse('wallets:create_deposit', kwargs={'uuid': self.wallet.uuid}),
+            b'\xc1',
+            content_type='application/msgpack',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_bodies(self):
+        """
+        Test that bodies that unpack into invalid values are rejected with 400, not 500.
+
+        Steps:
+        1. Send a decimal extension holding a non-decimal string, one holding invalid
+           UTF-8 and a map with an array key, on the regular and the fast path.
+        2. Verify that each is answered with 400 and the balance is unchanged.
+        """
+        bodies = (
+            msgpack.packb({'amount': msgpack.ExtType(1, b'ten')}),
+            msgpack.packb({'amount': msgpack.ExtType(1, b'\xff')}),
+            b'\x81\x91\x01\x02',
+        )
+        url = reverse('wallets:create_deposit', kwargs={'uuid': self.wallet.uuid})
+        for fast_path in (False, True):
+            with override_settings(WALLET_FAST_PATH=fast_path):
+                for body in bodies:
+                    response = self.client.post(url, body, content_type='application/msgpack')
+                    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('100.00'))
+
+
+class StartupTimeTest(TestCase):
+    """
+    Test class for process startup.
+
+    This class guards the cold start of web and Celery processes against heavy
+    dependencies creeping back into module-level imports. Wall times depend on the
+    machine, so the startup budget is checked by `profile_imports --check` instead.
+    """
+    def test_lazy_import(self):
+        """
+        Test that a lazily imported module only runs on first attribute access.
+
+        Steps:
+        1. Lazily import a standard library module that is not loaded yet.
+        2. Verify that the module has not been executed.
+        3. Access one of its functions and verify that the module is now loaded.
+        """
+        sys.modules.pop('colorsys', None)
+        self.addCleanup(sys.modules.pop, 'colorsys', None)
+        colorsys = lazy_import('colorsys')
+        self.assertIsNot(type(colorsys), types.ModuleType)
+        self.assertEqual(colorsys.rgb_to_hsv(1, 0, 0), (0, 1, 1))
+        self.assertIs(type(colorsys), types.ModuleType)
+
+    def test_check_startup(self):
+        """
+        Test the cold start of `manage.py check`.
+
+        Steps:
+        1. Run `manage.py check` in a fresh interpreter.
+        2. Verify that the views were checked but the task module and beat scheduler were not imported.
+        """
+        elapsed, imports, modules = profile_startup('check')
+        self.assertIn('wallets.views', modules)
+        self.assertFalse(modules & set(LAZY_MODULES['check']))
+
+    def test_worker_startup(self):
+        """
+        Test the cold start of a Celery worker.
+
+        Steps:
+        1. Import the Celery app and its task modules in a fresh interpreter.
+        2. Verify that the tasks were imported but not the views, the HTTP client or the beat scheduler.
+        """
+        elapsed, imports, modules = profile_startup('worker')
+        self.assertIn('wallets.tasks', modules)
+        self.assertNotIn('wallets.views', modules)
+        self.assertFalse(modules & set(LAZY_MODULES['worker']))
+
+    def test_profile_imports_check(self):
+        """
+        Test that `profile_imports --check` fails on a start over the budget.
+
+        Steps:
+        1. Report a web start within the budget and one over it, with a stubbed profile.
+        2. Verify that only the slow start fails the check, and that without `--check`
+           it is only reported.
+        """
+        with patch('wallets.management.commands.profile_imports.profile_startup') as profile:
+            profile.return_value = (STARTUP_TIME_BUDGET / 2, [('wallets.views', 10, 20)], {'wallets.views'})
+            call_command('profile_imports', '--target', 'web', '--check', stdout=StringIO())
+            profile.return_value = (STARTUP_TIME_BUDGET + 1, [('wallets.views', 10, 20)], {'wallets.views'})
+            out = StringIO()
+            call_command('profile_imports', '--target', 'web', stdout=out)
+            self.assertIn('Over the startup budget', out.getvalue())
+            with self.assertRaises(CommandError):
+                call_command('profile_imports', '--target', 'web', '--check', stdout=StringIO())
+
+
+class ProfilingTest(TestCase):
+    """
+    Test class for on-demand profiling.
+
+    This class tests that the profiling middleware and task decorator write collapsed
+    stacks when asked to, and stay out of the way otherwise.
+    """
+    def setUp(self):
+        """
+        Set up a wallet, a slow bank mock and a temporary profile directory.
+        """
+        self.client = APIClient()
+        self.wallet = Wallet.objects.create(balance=Decimal('200.00'))
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profile_dir.cleanup)
+        patcher = patch('wallets.models.requests.post', side_effect=self.slow_bank)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def slow_bank(self, *args, **kwargs):
+        """
+        Answers like the bank after 50ms, so the sampler catches the withdrawal.
+        """
+        time.sleep(0.05)
+        return Mock(status_code=200, **{'json.return_value': {'status': 200, 'data': 'success'}})
+
+    def profiles(self):
+        """
+        Returns the contents of the written profiles by file name.
+        """
+        return {name: open(os.path.join(self.profile_dir.name, name)).read() for name in os.listdir(self.profile_dir.name)}
+
+    def test_disabled_middleware_is_removed(self):
+        """
+        Test that the middleware removes itself when no token or sampling rate is set.
+        """
+        with self.assertRaises(MiddlewareNotUsed):
+            ProfilingMiddleware(lambda request: None)
+
+    def test_privileged_header(self):
+        """
+        Test that a withdrawal sent with the profiling token is profiled.
+
+        Steps:
+        1. Send a withdrawal with a wrong token and verify that nothing was written.
+        2. Send a withdrawal with the right token.
+        3. Verify that the response names the profile file.
+        4. Verify that the file holds collapsed stacks through the view and the model.
+        """
+        url = reverse('wallets:create_withdraw', kwargs={'uuid': self.wallet.uuid})
+        with override_settings(WALLET_PROFILE_TOKEN='secret', WALLET_PROFILE_DIR=self.profile_dir.name):
+            response = self.client.post(url, {'amount': 10}, format='json', HTTP_X_WALLET_PROFILE='wrong')
+            self.assertNotIn(PROFILE_FILE_HEADER, response)
+            self.assertEqual(self.profiles(), {})
+
+            self.client = APIClient()
+            response = self.client.post(url, {'amount': 10}, format='json', HTTP_X_WALLET_PROFILE='secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profiles = self.profiles()
+        self.assertEqual(list(profiles), [response[PROFILE_FILE_HEADER]])
+        self.assertTrue(response[PROFILE_FILE_HEADER].startswith('http.POST.wallets_create_withdraw.'))
+        stack, count = profiles[response[PROFILE_FILE_HEADER]].splitlines()[0].rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+        self.assertIn('wallets.views:post;', stack)
+        self.assertIn('wallets.models:withdraw;', stack)
+
+    def test_task_sampling(self):
+        """
+        Test that task runs picked by the sampling rate are profiled.
+
+        Steps:
+        1. Run a scheduled withdrawal with a task sampling rate of 0 and verify that nothing was written.
+        2. Run another one with a rate of 1.
+        3. Verify that one profile named after the task was written.
+        """
+        withdrawals = [
+            ScheduledWithdrawal.objects.create(wallet=self.wallet, amount=Decimal('10.00'), scheduled_time=timezone.now())
+            for _ in range(2)
+        ]
+        with override_settings(WALLET_PROFILE_DIR=self.profile_dir.name):
+            process_withdrawal(withdrawals[0].id)
+            self.assertEqual(self.profiles(), {})
+            with override_settings(WALLET_PROFILE_TASK_SAMPLE_RATE=1):
+                process_withdrawal(withdrawals[1].id)
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 1)
+        name, content = profiles.popitem()
+        self.assertTrue(name.startswith('task.wallets.tasks.process_withdrawal.'))
+        self.assertIn('wallets.models:withdraw', content)
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('180.00'))
+
+
+@override_settings(WALLET_SLOW_QUERY_MS=0)
+class SlowQueryTest(TestCase):
+    """
+    Test class for the slow query recorder.
+
+    A threshold of 0ms makes every query slow, so the recorder can be tested on
+    ordinary queries.
+    """
+    databases = {'default', 'shard_1'}
+    def setUp(self):
+        """
+        Set up a wallet, then forget the queries that created it.
+
+        The recorder is disabled by default, so the test connection, opened before the
+        threshold was set, gets it here.
+        """
+        self.client = APIClient()
+        install_slow_query_recorder(type(connection), connection)
+        with override_settings(WALLET_SLOW_QUERY_MS=None):
+            self.wallet = Wallet.objects.create(balance=Decimal('100.00'))
+
+    def tearDown(self):
+        """
+        Remove the recorder from the test connection.
+        """
+        connection.execute_wrappers[:] = [wrapper for wrapper in connection.execute_wrappers if not isinstance(wrapper, SlowQueryRecorder)]
+
+    def test_recorder_is_installed(self):
+        """
+        Test that new connections get exactly one recorder.
+        """
+        self.assertEqual(sum(isinstance(wrapper, SlowQueryRecorder) for wrapper in connection.execute_wrappers), 1)
+
+    def test_records_wallet_queries_with_plan(self):
+        """
+        Test that slow wallet queries are stored with their plan and other tables are ignored.
+
+        Steps:
+        1. Look a wallet up by UUID and list the standing orders.
+        2. Verify that only the wallet query was recorded.
+        3. Verify that its plan shows the UUID index and its origin is the test.
+        """
+        with patch('builtins.print'):
+            Wallet.objects.filter(uuid=self.wallet.uuid).first()
+            list(StandingOrder.objects.all())
+        query = SlowQuery.objects.get()
+        self.assertIn('"wallets_wallet"', query.sql)
+        self.assertIn('INDEX', query.plan)
+        self.assertEqual(query.origin, 'wallets.tests:SlowQueryTest.test_records_wallet_queries_with_plan')
+        self.assertEqual(query.fingerprint, fingerprint(query.sql))
+
+    def test_origin_is_the_view(self):
+        """
+        Test that queries issued by a deposit are attributed to the deposit view.
+        """
+        with patch('builtins.print'):
+            response = self.client.post(reverse('wallets:create_deposit', kwargs={'uuid': self.wallet.uuid}), {'amount': 10}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(SlowQuery.objects.values_list('origin', flat=True)), {'wallets.views:CreateDepositView.post'})
+
+    def test_threshold(self):
+        """
+        Test that queries under the threshold, or with the recorder disabled, are not recorded.
+        """
+        for threshold in (60000, None):
+            with override_settings(WALLET_SLOW_QUERY_MS=threshold):
+                Wallet.objects.filter(uuid=self.wallet.uuid).first()
+        self.assertFalse(SlowQuery.objects.exists())
+
+    @override_settings(WALLET_SLOW_QUERY_MS=None, WALLET_SLOW_QUERY_RETENTION_DAYS=7)
+    def test_cleanup_slow_queries(self):
+        """
+        Test that the cleanup task removes the records older than the retention period.
+
+        Steps:
+        1. Store slow queries from eight days ago and from today.
+        2. Run the cleanup task with batches of one row.
+        3. Verify that only today's records are left.
+        """
+        for days in (8, 8, 0):
+            query = SlowQuery.objects.create(fingerprint='f', sql='SELECT 1', duration=150, origin='test')
+            SlowQuery.objects.filter(pk=query.pk).update(created_at=timezone.now() - datetime.timedelta(days=days))
+        with patch('builtins.print'):
+            self.assertEqual(cleanup_slow_queries(batch_size=1), 2)
+        self.assertEqual(SlowQuery.objects.count(), 1)
+
+    def test_summary_command(self):
+        """
+        Test that the summary ranks queries by total time across their runs.
+
+        Steps:
+        1. Record two runs of a 40ms query and one run of a 60ms query, whose IN lists differ in length.
+        2. Run the summary command.
+        3. Verify that the query with the highest total time comes first.
+        """
+        for sql, duration in (('SELECT 1 WHERE id IN (%s, %s)', 40), ('SELECT 1 WHERE id IN (%s)', 40), ('SELECT 2', 60)):
+            SlowQuery.objects.create(fingerprint=fingerprint(sql), sql=sql, duration=duration, origin='test')
+        out = StringIO()
+        call_command('slow_queries', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('#1 total=80.0ms runs=2'))
+        self.assertIn('#2 total=60.0ms runs=1', out.getvalue())
+
+    @override_settings(WALLET_SLOW_QUERY_MS=None, WALLET_SHARDS=['default', 'shard_1'])
+    def test_summary_command_merges_shards(self):
+        """
+        Test that the summary includes the slow queries of every shard.
+
+        Steps:
+        1. Record a 40ms query on each shard and a 60ms query on the first shard only.
+        2. Run the summary command.
+        3. Verify that the runs of the first query are merged across shards and ranked first,
+           with the latest run, from the second shard, as its sample.
+        """
+        for minutes, (shard, sql, duration) in enumerate((('default', 'SELECT 1', 40), ('default', 'SELECT 2', 60), ('shard_1', 'SELECT 1', 40))):
+            with use_shard(shard):
+                query = SlowQuery.objects.create(fingerprint=fingerprint(sql), sql=sql, duration=duration, origin=shard)
+                SlowQuery.objects.filter(pk=query.pk).update(created_at=timezone.now() - datetime.timedelta(minutes=10 - minutes))
+        out = StringIO()
+        call_command('slow_queries', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('#1 total=80.0ms runs=2'))
+        self.assertEqual(lines[1], '  origin: shard_1')
+        self.assertIn('#2 total=60.0ms runs=1', out.getvalue())
+
+
+class PendingPayoutTest(TestCase):
+    """
+    Test class for pending payouts and the payout poller.
+
+    This class tests that withdrawals accepted but not yet paid by the bank stay
+    debited, and that the poller settles or refunds them once the bank has decided.
+    """
+    def setUp(self):
+        """
+        Set up a wallet with three pending payouts.
+        """
+        self.wallet = Wallet.objects.create(balance=Decimal('100.00'))
+        with patch('wallets.models.requests.post') as mock_post:
+            for reference in ('p1', 'p2', 'p3'):
+                mock_post.return_value.json.return_value = {'status': 202, 'data': 'pending', 'reference': reference}
+                self.wallet.withdraw(Decimal('10.00'))
+        self.later = timezone.now() + datetime.timedelta(minutes=1)
+
+    def test_withdraw_pending(self):
+        """
+        Test that an accepted payout stays debited and pending.
+
+        Steps:
+        1. Verify that the three withdrawals were debited.
+        2. Verify that their ledger rows are pending, unsettled and due for a check.
+        3. Verify that they are not yet in the daily aggregate.
+        """
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('70.00'))
+        payouts = Transaction.objects.pending_payouts()
+        self.assertEqual(sorted(payouts.values_list('bank_reference', flat=True)), ['p1', 'p2', 'p3'])
+        self.assertFalse(payouts.filter(settle=True).exists())
+        self.assertEqual(Transaction.objects.due_payouts(self.later).count(), 3)
+        self.assertFalse(WalletDailyAggregate.objects.exists())
+
+    def test_poll_batch(self):
+        """
+        Test that one batched status call settles, refunds or backs off each payout.
+
+        Steps:
+        1. Poll with the bank answering paid, failed and still pending.
+        2. Verify that the bank was called once for the whole batch.
+        3. Verify that the failed payout was refunded and the paid one aggregated.
+        4. Verify that the pending payout is checked again later and not polled twice.
+        """
+        answers = {'payouts': [
+            {'reference': 'p1', 'status': 200, 'data': 'paid'},
+            {'reference': 'p2', 'status': 422, 'data': 'rejected'},
+            {'reference': 'p3', 'status': 202, 'data': 'pending'},
+        ]}
+        with patch('wallets.payouts.requests.post') as mock_post:
+            mock_post.return_value.json.return_value = answers
+            counts = poll_due_payouts(now=self.later)
+            self.assertEqual(poll_due_payouts(now=self.later)['checked'], 0)
+        mock_post.assert_called_once()
+        self.assertEqual(counts, {'checked': 3, 'settled': 1, 'refunded': 1, 'pending': 1})
+
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('80.00'))
+        self.assertTrue(Transaction.objects.get(bank_reference='p1').settle)
+        self.assertEqual(WalletDailyAggregate.objects.get().withdrawal_total, Decimal('10.00'))
+        self.assertEqual(OutboxEvent.objects.filter(payload__pending=False).count(), 2)
+        still_pending = Transaction.objects.pending_payouts().get()
+        self.assertEqual(still_pending.bank_reference, 'p3')
+        self.assertEqual(still_pending.next_poll_at, self.later + datetime.timedelta(seconds=20))
+
+    def test_poll_single_calls_and_failures(self):
+        """
+        Test the per-payout status calls and that bank errors leave payouts pending.
+
+        Steps:
+        1. Disable batched status calls and make the bank unreachable.
+        2. Verify that every payout was asked about and stays pending and debited.
+        3. Make the bank answer paid and run the periodic task after the backoff.
+        4. Verify that all payouts were settled.
+        """
+        with patch('wallets.payouts.BANK_BATCH_STATUS', False), patch('wallets.payouts.requests.get') as mock_get:
+            mock_get.side_effect = requests.exceptions.ConnectionError()
+            self.assertEqual(poll_due_payouts(now=self.later)['pending'], 3)
+            self.assertEqual(mock_get.call_count, 3)
+            self.assertEqual(Transaction.objects.pending_payouts().count(), 3)
+
+            mock_get.side_effect = None
+            mock_get.return_value.json.return_value = {'status': 200, 'data': 'paid'}
+            with patch('wallets.tasks.timezone.now', return_value=self.later + datetime.timedelta(minutes=1)):
+                self.assertEqual(poll_pending_payouts()['settled'], 3)
+        self.assertFalse(Transaction.objects.pending_payouts().exists())
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('70.00'))
+
+    def test_unknown_answers_stay_pending(self):
+        """
+        Test that only explicit failure codes refund a payout.
+
+        Steps:
+        1. Poll with the bank answering a server error, no status and a failure code.
+        2. Verify that only the payout with the failure code was refunded.
+        3. Poll with answers that are not JSON objects, batched and per payout.
+        4. Verify that the remaining payouts stay pending and debited.
+        """
+        answers = {'payouts': [
+            {'reference': 'p1', 'status': 500, 'data': 'error'},
+            {'reference': 'p2', 'data': 'unknown'},
+            {'reference': 'p3', 'status': 402, 'data': 'rejected'},
+        ]}
+        with patch('wallets.payouts.requests.post') as mock_post:
+            mock_post.return_value.json.return_value = answers
+            self.assertEqual(poll_due_payouts(now=self.later), {'checked': 3, 'settled': 0, 'refunded': 1, 'pending': 2})
+            for hours, body in enumerate((['p1', 'p2'], {'payouts': 'p1'}, {'payouts': ['p1', None]}), start=2):
+                mock_post.return_value.json.return_value = body
+                self.assertEqual(poll_due_payouts(now=self.later + datetime.timedelta(hours=hours))['pending'], 2)
+        with patch('wallets.payouts.BANK_BATCH_STATUS', False), patch('wallets.payouts.requests.get') as mock_get:
+            mock_get.return_value.json.return_value = [200, 'paid']
+            self.assertEqual(poll_due_payouts(now=self.later + datetime.timedelta(days=1))['pending'], 2)
+        self.assertEqual(Transaction.objects.pending_payouts().count(), 2)
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('80.00'))
+
+    def test_due_payouts_use_partial_index(self):
+        """
+        Test that the poller query reads the partial index on pending rows.
+        """
+        self.assertIn('wallets_tx_pending_poll_idx', Transaction.objects.due_payouts(self.later).explain())
+
+
+@override_settings(WALLET_APPEND_ONLY_LEDGER=True)
+class AppendOnlyLedgerTest(TestCase):
+    """
+    Test class for the append-only ledger mode.
+
+    This class tests that deposits and withdrawals only append ledger entries, that
+    balances are read as the materialized balance plus the unfolded tail, and that the
+    ledger folder materializes the entries exactly once.
+    """
+    def setUp(self):
+        """
+        Set up a wallet and an API client.
+        """
+        self.wallet = Wallet.objects.create(balance=Decimal('50.00'))
+        self.client = APIClient()
+
+    def test_append_and_fold(self):
+        """
+        Test that writes leave the balance column alone until they are folded.
+
+        Steps:
+        1. Deposit and withdraw through the API.
+        2. Verify that the responses and the retrieve endpoint include the entries.
+        3. Verify that the balance column and the daily aggregate are unchanged.
+        4. Fold the ledger twice and verify that the entries were applied once.
+        """
+        response = self.client.post(reverse('wallets:create_deposit', kwargs={'uuid': self.wallet.uuid}), {'amount': '0.30'}, format='json')
+        self.assertEqual(Decimal(str(response.data['new_balance'])), Decimal('50.30'))
+        with patch('wallets.models.requests.post') as mock_post:
+            mock_post.return_value.json.return_value = {'status': 200, 'data': 'paid'}
+            response = self.client.post(reverse('wallets:create_withdraw', kwargs={'uuid': self.wallet.uuid}), {'amount': '50.30'}, format='json')
+        self.assertEqual(Decimal(str(response.data['new_balance'])), Decimal('0.00'))
+        response = self.client.get(reverse('wallets:retrieve_wallet', kwargs={'uuid': self.wallet.uuid}))
+        self.assertEqual(Decimal(str(response.data['balance'])), Decimal('0.00'))
+
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('50.00'))
+        self.assertEqual(Transaction.objects.unfolded().count(), 2)
+        self.assertEqual(OutboxEvent.objects.count(), 2)
+        self.assertFalse(WalletDailyAggregate.objects.exists())
+
+        self.assertEqual(fold_ledger(), 2)
+        self.assertEqual(fold_ledger(), 0)
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('0.00'))
+        self.assertEqual(Wallet.objects.available_balance(self.wallet.pk), Decimal('0.00'))
+        aggregate = WalletDailyAggregate.objects.get()
+        self.assertEqual((aggregate.deposit_total, aggregate.withdrawal_total), (Decimal('0.30'), Decimal('50.30')))
+
+    def test_withdraw_checks_tail(self):
+        """
+        Test that the overdraft check includes the unfolded entries.
+
+        Steps:
+        1. Withdraw most of the balance without folding.
+        2. Verify that a second withdrawal above the remaining amount is rejected.
+        3. Verify that no entry was appended for it and the bank was called once.
+        """
+        with patch('wallets.models.requests.post') as mock_post:
+            mock_post.return_value.json.return_value = {'status': 200, 'data': 'paid'}
+            self.wallet.withdraw(Decimal('40.00'))
+            with self.assertRaises(InsufficientFundsError):
+                self.wallet.withdraw(Decimal('10.01'))
+        mock_post.assert_called_once()
+        self.assertEqual(Transaction.objects.filter(wallet=self.wallet).count(), 1)
+        self.assertEqual(self.wallet.balance, Decimal('10.00'))
+
+    def test_transfers_check_tail(self):
+        """
+        Test that transfers and transfer batches include the unfolded entries.
+
+        Steps:
+        1. Withdraw most of the balance without folding.
+        2. Verify that a transfer and a batch above the remaining amount are rejected.
+        3. Verify that a transfer within it is applied.
+        4. Fold the ledger and verify that no wallet went negative.
+        """
+        target = Wallet.objects.create()
+        with patch('wallets.models.requests.post') as mock_post:
+            mock_post.return_value.json.return_value = {'status': 200, 'data': 'paid'}
+            self.wallet.withdraw(Decimal('40.00'))
+        with self.assertRaises(InsufficientFundsError):
+            self.wallet.transfer_to(target, Decimal('10.01'))
+        with self.assertRaises(InsufficientFundsError):
+            apply_transfer_batch([(self.wallet.pk, target.pk, Decimal('6.00')), (self.wallet.pk, target.pk, Decimal('4.01'))])
+        self.assertFalse(Transaction.objects.filter(transfer_id__isnull=False).exists())
+
+        self.wallet.transfer_to(target, Decimal('10.00'))
+        self.assertEqual(self.wallet.balance, Decimal('0.00'))
+        self.assertEqual(target.balance, Decimal('10.00'))
+        fold_ledger()
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('0.00'))
+
+    def test_failed_and_pending_payouts(self):
+        """
+        Test that failed payouts never count and refunds of folded payouts do.
+
+        Steps:
+        1. Withdraw once with the bank down and once with the payout left pending.
+        2. Verify that only the pending payout counts in the available balance.
+        3. Fold the ledger, then let the bank reject the pending payout.
+        4. Verify that the payout was credited back exactly once.
+        """
+        with patch('wallets.models.requests.post') as mock_post:
+            mock_post.side_effect = requests.exceptions.ConnectionError()
+            self.wallet.withdraw(Decimal('20.00'))
+            mock_post.side_effect = None
+            mock_post.return_value.json.return_value = {'status': 202, 'data': 'pending', 'reference': 'p1'}
+            self.wallet.withdraw(Decimal('30.00'))
+        self.assertEqual(Wallet.objects.available_balance(self.wallet.pk), Decimal('20.00'))
+
+        fold_ledger()
+        later = timezone.now() + datetime.timedelta(minutes=1)
+        with patch('wallets.payouts.requests.post') as mock_post:
+            mock_post.return_value.json.return_value = {'payouts': [{'reference': 'p1', 'status': 422, 'data': 'rejected'}]}
+            self.assertEqual(poll_due_payouts(now=later)['refunded'], 1)
+        fold_ledger()
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('50.00'))
+        self.assertEqual(Wallet.objects.available_balance(self.wallet.pk), Decimal('50.00'))
+        self.assertFalse(WalletDailyAggregate.objects.exists())
+
+
+class WalletPkCacheTest(TransactionTestCase):
+    """
+    Test class for the wallet UUID to primary key cache.
+
+    Answers are only cached outside transactions, so the tests run in autocommit.
+    """
+    def setUp(self):
+        """
+        Set up a wallet, an API client and an empty cache.
+        """
+        self.wallet = Wallet.objects.create(balance=Decimal('10.00'))
+        self.client = APIClient()
+        wallet_pk_cache.clear()
+
+    def tearDown(self):
+        """
+        Empty the cache, whose entries would outlive the flushed wallets.
+        """
+        wallet_pk_cache.clear()
+
+    @override_settings(WALLET_PK_CACHE_SIZE=2, WALLET_PK_CACHE_NEGATIVE_TTL=0)
+    def test_lru_eviction_and_negative_ttl(self):
+        """
+        Test that the cache is bounded and that unknown UUIDs expire.
+
+        Steps:
+        1. Cache three UUIDs in a cache of two, using the first one in between.
+        2. Verify that the least recently used one was evicted.
+        3. Verify that an unknown UUID with a zero TTL is looked up again.
+        """
+        cache = WalletPkCache()
+        first, second, third, unknown = (uuid4() for _ in range(4))
+        cache.put(first, 1)
+        cache.put(second, 2)
+        self.assertEqual(cache.get(first), (True, 1))
+        cache.put(third, 3)
+        self.assertEqual(cache.get(second), (False, None))
+        self.assertEqual(cache.get(third), (True, 3))
+        cache.put(unknown, None)
+        self.assertEqual(cache.get(unknown), (False, None))
+        self.assertEqual(cache.stats(), {'size': 1, 'hits': 2, 'negative_hits': 0, 'misses': 2, 'hit_rate': 0.5})
+
+    def test_views_load_by_pk(self):
+        """
+        Test that the wallet endpoints look a cached wallet up by primary key.
+
+        Steps:
+        1. Retrieve the wallet twice.
+        2. Verify that the second request loads it by primary key, not by UUID.
+        3. Verify that a deposit uses the cached primary key too.
+        """
+        url = reverse('wallets:retrieve_wallet', kwargs={'uuid': self.wallet.uuid})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"uuid" =', queries[0]['sql'])
+
+        response = self.client.post(reverse('wallets:create_deposit', kwargs={'uuid': self.wallet.uuid}), {'amount': 5}, format='json')
+        self.assertEqual(response.data['new_balance'], Decimal('15.00'))
+        self.assertEqual(wallet_pk_cache.stats()['hits'], 2)
+
+    def test_negative_entries_and_invalidation(self):
+        """
+        Test that unknown UUIDs are cached until a wallet takes them, and deleted wallets are forgotten.
+
+        Steps:
+        1. Retrieve an unknown UUID twice and verify that the second 404 costs no query.
+        2. Create a wallet with that UUID through the bulk endpoint and verify that it is found.
+        3. Delete the wallet and verify that it is not found anymore.
+        """
+        unknown = uuid4()
+        url = reverse('wallets:retrieve_wallet', kwargs={'uuid': unknown})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(len(queries), 0)
+
+        response = self.client.post(reverse('wallets:bulk_create_wallet'), {'wallets': [{'uuid': str(unknown), 'balance': 3}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+        Wallet.objects.get(uuid=unknown).delete()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class WithdrawalReplayTest(TestCase):
+    """
+    Test class for the bulk replay of failed withdrawals.
+
+    This class tests that failed withdrawals are selected by window and bank status
+    code, queued once in throttled batches, and replayed once as withdrawals linked to them.
+    """
+    def setUp(self):
+        """
+        Set up a wallet with withdrawals that failed with 503 and 500, a settled one, and an old 503.
+        """
+        self.wallet = Wallet.objects.create(balance=Decimal('100.00'))
+        with patch('wallets.models.requests.post') as mock_post:
+            mock_post.side_effect = requests.exceptions.ConnectionError()
+            self.wallet.withdraw(Decimal('10.00'))
+            self.wallet.withdraw(Decimal('20.00'))
+            old = self.wallet.withdraw(Decimal('5.00'))
+            mock_post.side_effect = requests.exceptions.HTTPError()
+            self.wallet.withdraw(Decimal('30.00'))
+            mock_post.side_effect = None
+            mock_post.return_value.json.return_value = {'status': 200, 'data': 'paid'}
+            self.wallet.withdraw(Decimal('1.00'))
+        Transaction.objects.filter(pk=old.pk).update(created_at=timezone.now() - datetime.timedelta(days=2))
+        self.since = timezone.now() - datetime.timedelta(hours=1)
+        self.until = timezone.now() + datetime.timedelta(minutes=1)
+
+    def test_start_replay_batches_once(self):
+        """
+        Test that a replay queues the matching withdrawals in spaced batches, once.
+
+        Steps:
+        1. Start a replay of the 503 withdrawals of the last hour in batches of one.
+        2. Verify that two batches were sent to the retry queue ten seconds apart.
+        3. Start the same replay again and verify that nothing is queued.
+        """
+        with patch('wallets.tasks.replay_withdrawal_batch.apply_async') as mock_apply:
+            with self.captureOnCommitCallbacks(execute=True):
+                replay = start_replay(self.since, self.until, ['503'], batch_size=1, interval=10)
+            self.assertEqual(replay.total, 2)
+            self.assertEqual([call.kwargs['countdown'] for call in mock_apply.call_args_list], [0, 10])
+            self.assertEqual({call.kwargs['queue'] for call in mock_apply.call_args_list}, {WITHDRAW_RETRY_QUEUE})
+            self.assertEqual(sorted(Transaction.objects.filter(replay_item__replay=replay).values_list('amount', flat=True)), [Decimal('10.00'), Decimal('20.00')])
+
+            mock_apply.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                again = start_replay(self.since, self.until, ['503', '500'], batch_size=1, interval=10)
+            self.assertEqual(again.total, 1)
+            self.assertEqual(mock_apply.call_count, 1)
+
+    def test_replay_links_and_reports(self):
+        """
+        Test that replayed withdrawals link to the originals and run once.
+
+        Steps:
+        1. Replay the 503 withdrawals with the bank paying the first and failing the second.
+        2. Verify that each retry points to its original and only the paid one was debited.
+        3. Deliver the batch again and verify that nothing is withdrawn twice.
+        4. Verify the final report and that the replay is finished.
+        """
+        with patch('wallets.tasks.replay_withdrawal_batch.apply_async'):
+            replay = start_replay(self.since, self.until, ['503'])
+        item_ids = list(replay.items.order_by('id').values_list('id', flat=True))
+        with patch('wallets.models.requests.post') as mock_post:
+            paid = Mock()
+            paid.json.return_value = {'status': 200, 'data': 'paid'}
+            mock_post.side_effect = [paid, requests.exceptions.Timeout()]
+            self.assertEqual(replay_items(item_ids), {'succeeded': 1, 'failed': 1, 'skipped': 0})
+            self.assertEqual(replay_items(item_ids), {'succeeded': 0, 'failed': 0, 'skipped': 2})
+        self.assertEqual(mock_post.call_count, 2)
+
+        retries = Transaction.objects.filter(retry_of__isnull=False).order_by('id')
+        self.assertEqual([(retry.retry_of.amount, retry.settle) for retry in retries], [(Decimal('10.00'), True), (Decimal('20.00'), False)])
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('89.00'))
+
+        replay.refresh_from_db()
+        self.assertIsNotNone(replay.finished_at)
+        report = replay_report(replay)
+        self.assertEqual((report['succeeded'], report['failed'], report['progress'], report['success_rate']), (1, 1, 1.0, 0.5))
+
+    def test_command_dry_run_and_report(self):
+        """
+        Test the replay command.
+
+        Steps:
+        1. Run a dry run over 503 and 500 and verify the count.
+        2. Start a replay through the command and report on it by UUID.
+        """
+        out = StringIO()
+        call_command('replay_withdrawals', since=self.since.isoformat(), status=['503', '500'], dry_run=True, stdout=out)
+        self.assertIn('3 failed withdrawals would be replayed', out.getvalue())
+
+        with patch('wallets.tasks.replay_withdrawal_batch.apply_async'):
+            call_command('replay_withdrawals', since=self.since.isoformat(), status=['500'], stdout=out)
+        replay = WithdrawalReplay.objects.get()
+        out = StringIO()
+        call_command('replay_withdrawals', report=str(replay.uuid), stdout=out)
+        self.assertIn('0% of 1 processed', out.getvalue())
+
+
+class MinorUnitsTest(TestCase):
+    """
+    Test class for the integer minor-unit money columns.
+    """
+    def setUp(self):
+        """
+        Set up a wallet with a balance of 100.00 and an API client.
+        """
+        self.wallet = Wallet.objects.create(balance=Decimal('100.00'))
+        self.client = APIClient()
+
+    @patch('wallets.models.requests.post')
+    def test_dual_writes(self, mock_post):
+        """
+        Test that balance changes move the minor-unit balance in the same statement.
+
+        Steps:
+        1. Backfill the wallet, then enable WALLET_MINOR_UNITS.
+        2. Deposit, withdraw and transfer, and create a wallet.
+        3. Verify the minor-unit balances and amounts and that no row is out of step.
+        """
+        mock_post.return_value.json.return_value = {'status': 200, 'data': 'paid'}
+        backfill_minor_units()
+        with override_settings(WALLET_MINOR_UNITS=True):
+            target = Wallet.objects.create(balance=Decimal('0.10'))
+            self.wallet.deposit(Decimal('10.55'))
+            self.wallet.withdraw(Decimal('5.05'))
+            self.wallet.transfer_to(target, Decimal('0.50'))
+        self.wallet.refresh_from_db()
+        target.refresh_from_db()
+        self.assertEqual((self.wallet.balance_minor, target.balance_minor), (10500, 60))
+        self.assertEqual(
+            sorted(Transaction.objects.filter(wallet=self.wallet).values_list('amount_minor', flat=True)),
+            [50, 505, 1055],
+        )
+        self.assertEqual(minor_unit_mismatches(), {'wallet': 0, 'transaction': 0})
+
+    def test_backfill(self):
+        """
+        Test that the backfill copies the rows written before minor units were enabled.
+
+        Steps:
+        1. Deposit with WALLET_MINOR_UNITS disabled and verify the rows are out of step.
+        2. Backfill in batches of one row and verify nothing is out of step.
+        3. Deposit with WALLET_MINOR_UNITS enabled and verify both balances moved.
+        """
+        self.wallet.deposit(Decimal('0.25'))
+        self.assertEqual(minor_unit_mismatches(), {'wallet': 1, 'transaction': 1})
+        counts = backfill_minor_units(batch_size=1)
+        self.assertEqual(counts, {'wallet': 1, 'transaction': 1})
+        self.assertEqual(minor_unit_mismatches(), {'wallet': 0, 'transaction': 0})
+        with override_settings(WALLET_MINOR_UNITS=True):
+            self.wallet.deposit(Decimal('0.75'))
+        self.assertEqual((self.wallet.balance, self.wallet.balance_minor), (Decimal('101.00'), 10100))
+
+    def test_serializers_render_minor_units(self):
+        """
+        Test that the API renders minor-unit amounts like decimal ones.
+
+        Steps:
+        1. Verify the conversion helpers on rounding and negative amounts.
+        2. Retrieve the wallet before and after the backfill, with and without the fast path.
+        3. Verify that every response carries the same balance.
+        """
+        self.assertEqual(to_minor_units(Decimal('0.005')), 1)
+        self.assertEqual(to_minor_units(100.1), 10010)
+        self.assertEqual(format_minor_units(-5), '-0.05')
+        self.assertEqual(format_minor_units(12345678901), '123456789.01')
+        url = reverse('wallets:retrieve_wallet', kwargs={'uuid': self.wallet.uuid})
+        balances = []
+        for backfilled in (False, True):
+            if backfilled:
+                backfill_minor_units()
+            for fast_path in (False, True):
+                with override_settings(WALLET_MINOR_UNITS=True, WALLET_MINOR_UNIT_READS=True, WALLET_FAST_PATH=fast_path):
+                    response = self.client.get(url)
+                self.assertNotIn('balance_minor', response.json())
+                balances.append(response.json()['balance'])
+        self.assertEqual(balances, ['100.00'] * 4)
+
+
+    def test_reads_wait_for_verify(self):
+        """
+        Test that the minor-unit columns are only read behind their own flag.
+
+        Steps:
+        1. Backfill, enable dual writes and update the balance through `save()`.
+        2. Verify that the minor-unit balance followed, with and without `update_fields`.
+        3. Move the decimal balance the way a process with dual writes disabled would.
+        4. Verify that `--verify` reports the row and the API renders the decimal balance
+           on both paths until minor-unit reads are enabled.
+        """
+        backfill_minor_units()
+        with override_settings(WALLET_MINOR_UNITS=True):
+            self.wallet.balance = Decimal('7.25')
+            self.wallet.save()
+            self.assertEqual(Wallet.objects.values_list('balance_minor', flat=True).get(pk=self.wallet.pk), 725)
+            self.wallet.balance = Decimal('8.50')
+            self.wallet.save(update_fields=['balance'])
+            self.assertEqual(Wallet.objects.values_list('balance_minor', flat=True).get(pk=self.wallet.pk), 850)
+
+        Wallet.objects.filter(pk=self.wallet.pk).update(balance=Decimal('9.00'))
+        out = StringIO()
+        call_command('backfill_minor_units', '--verify', stdout=out)
+        self.assertIn('Out of step: 1 wallet rows', out.getvalue())
+        url = reverse('wallets:retrieve_wallet', kwargs={'uuid': self.wallet.uuid})
+        for fast_path in (False, True):
+            with override_settings(WALLET_MINOR_UNITS=True, WALLET_FAST_PATH=fast_path):
+                self.assertEqual(self.client.get(url).json()['balance'], '9.00')
+
+
+@override_settings(WALLET_SHARDS=['default', 'shard_1'])
+class ShardingTest(TestCase):
+    """
+    Test class for the horizontal sharding of wallets over two SQLite databases.
+    """
+    databases = {'default', 'shard_1'}
+
+    def setUp(self):
+        """
+        Set up the test environment.
+
+        It sets up the test client and the primary key range of the second shard.
+        """
+        self.client = APIClient()
+        shard_map.clear()
+        wallet_pk_cache.clear()
+        reset_shard_sequences('shard_1')
+
+    def tearDown(self):
+        """
+        Drop the shard map and UUID cache, which may hold rows rolled back with the test.
+        """
+        shard_map.clear()
+        wallet_pk_cache.clear()
+
+    def uuid_on(self, shard):
+        """
+        Returns a new wallet UUID that belongs to the given shard.
+        """
+        while True:
+            value = uuid4()
+            if shard_for_uuid(value) == shard:
+                return value
+
+    def test_wallets_are_routed_to_their_shard(self):
+        """
+        Test that wallets are stored on the shard of their UUID and served from it.
+
+        Steps:
+        1. Create one wallet per shard with the bulk endpoint.
+        2. Verify that each wallet is stored on its shard only, the one on the second
+           shard with a primary key from the range of that shard.
+        3. Deposit into and retrieve the wallet on the second shard through the API.
+        4. Verify that a transfer to a wallet on the other shard is rejected with 400.
+        """
+        first, second = self.uuid_on('default'), self.uuid_on('shard_1')
+        data = {'wallets': [{'uuid': str(first), 'balance': 10}, {'uuid': str(second), 'balance': 20}]}
+        response = self.client.post(reverse('wallets:bulk_create_wallet'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(list(Wallet.objects.using('default').values_list('uuid', flat=True)), [first])
+        self.assertEqual(list(Wallet.objects.using('shard_1').values_list('uuid', flat=True)), [second])
+        self.assertGreater(Wallet.objects.using('shard_1').get().pk, WALLET_SHARD_PK_STRIDE)
+
+        response = self.client.post(reverse('wallets:create_deposit', args=[second]), {'amount': 5}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(reverse('wallets:retrieve_wallet', args=[second]))
+        self.assertEqual(response.data['balance'], '25.00')
+        self.assertEqual(Transaction.objects.using('shard_1').count(), 1)
+        self.assertFalse(Transaction.objects.using('default').exists())
+
+        response = self.client.post(reverse('wallets:create_transfer', args=[second]), {'to': str(first), 'amount': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_locked_bucket(self):
+        """
+        Test that a wallet whose bucket is being moved is not served or withdrawn from.
+
+        Steps:
+        1. Create a wallet on the second shard and schedule a withdrawal from it.
+        2. Verify that its beat task carries the wallet UUID.
+        3. Lock the bucket of the wallet.
+        4. Verify that the wallet endpoint answers 503 with a Retry-After header and that
+           the withdrawal task is sent again later instead of running.
+        """
+        wallet = Wallet.objects.create(uuid=self.uuid_on('shard_1'), balance=100)
+        response = self.client.post(
+            reverse('wallets:schedule_withdraw', args=[wallet.uuid]),
+            {'amount': 10, 'scheduled_time': '2030-01-01 09:00:00'},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        kwargs = json.loads(PeriodicTask.objects.get(name=f"withdraw-{response.data['id']}").kwargs)
+        self.assertEqual(kwargs['wallet_uuid'], str(wallet.uuid))
+
+        WalletShardBucket.objects.create(bucket=bucket_for_uuid(wallet.uuid), shard='shard_1', locked=True)
+        shard_map.clear()
+        response = self.client.get(reverse('wallets:retrieve_wallet', args=[wallet.uuid]))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], str(WALLET_SHARD_MAP_TTL))
+        with patch('wallets.tasks.process_withdrawal.apply_async') as apply_async:
+            process_withdrawal(**kwargs)
+        self.assertEqual(apply_async.call_args.kwargs['countdown'], WALLET_SHARD_MAP_TTL)
+        self.assertFalse(ScheduledWithdrawal.objects.using('shard_1').get().processed)
+
+    def test_move_buckets(self):
+        """
+        Test moving the bucket of a wallet, with its rows, to the other shard.
+
+        Steps:
+        1. Create wallets on both shards, a deposit, and a withdrawal batch over both.
+        2. Move the bucket of the wallet of the first shard to the second shard.
+        3. Verify that the wallet, its transaction and its withdrawal are on the second
+           shard with the same primary keys, and gone from the first.
+        4. Verify that the wallet is served through the API with its balance, that the
+           batch still counts both withdrawals, and that the shard report sees both
+           wallets on the second shard.
+        """
+        moving = Wallet.objects.create(uuid=self.uuid_on('default'), balance=10)
+        staying = Wallet.objects.create(uuid=self.uuid_on('shard_1'), balance=10)
+        subscription = WebhookSubscription.objects.using('default').create(wallet=moving, url='https://merchant.example/events')
+        WebhookSubscription.objects.db_manager('default').flag_wallet(moving.pk)
+        moving.refresh_from_db()
+        with use_shard('default'):
+            moving.deposit(Decimal('5.00'))
+        items = [{'wallet': str(wallet.uuid), 'amount': 1, 'scheduled_time': '2030-01-01 09:00:00'} for wallet in (moving, staying)]
+        response = self.client.post(reverse('wallets:schedule_withdraw_batch'), {'items': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        batch_uuid = response.data['batch']
+        transaction_pk = Transaction.objects.using('default').get().pk
+        withdrawal_pk = ScheduledWithdrawal.objects.using('default').get().pk
+
+        result = move_buckets([bucket_for_uuid(moving.uuid)], 'shard_1', wait=0)
+        self.assertEqual(result['wallets'], 1)
+        self.assertEqual(shard_for_uuid(moving.uuid), 'shard_1')
+        self.assertFalse(Wallet.objects.using('default').exists())
+        self.assertFalse(Transaction.objects.using('default').exists())
+        self.assertEqual(Wallet.objects.using('shard_1').get(uuid=moving.uuid).pk, moving.pk)
+        self.assertEqual(Transaction.objects.using('shard_1').get().pk, transaction_pk)
+        self.assertEqual(ScheduledWithdrawal.objects.using('shard_1').get(pk=withdrawal_pk).wallet_id, moving.pk)
+        self.assertEqual(WebhookDelivery.objects.using('shard_1').get().subscription_id, subscription.pk)
+        self.assertFalse(WebhookSubscription.objects.using('default').exists())
+
+        response = self.client.get(reverse('wallets:retrieve_wallet', args=[moving.uuid]))
+        self.assertEqual(response.data['balance'], '15.00')
+        response = self.client.get(reverse('wallets:retrieve_withdraw_batch', args=[batch_uuid]))
+        self.assertEqual((response.data['total'], response.data['pending']), (2, 2))
+        # The test data is not committed, so the shards are queried from this thread.
+        out = StringIO()
+        call_command('shard_report', sequential=True, stdout=out)
+        self.assertIn('shard_1: 2049 buckets, 2 wallets, balance 25.00', out.getvalue())
+
+
+class WebhookTest(TestCase):
+    """
+    Test class for webhook subscriptions and the batched webhook delivery.
+
+    This class tests that balance changes queue one delivery per subscription in their
+    own transaction, and that deliveries are batched per endpoint, signed, retried with
+    a backoff and given up after WEBHOOK_MAX_ATTEMPTS attempts.
+    """
+    def setUp(self):
+        """
+        Set up the test client and two wallets subscribed to the same endpoint.
+
+        The hosts of the tests resolve to public addresses, or to the address given in
+        `self.addresses`, without DNS.
+        """
+        self.addresses = {}
+        resolver = patch('wallets.webhooks.socket.getaddrinfo', side_effect=self.getaddrinfo)
+        resolver.start()
+        self.addCleanup(resolver.stop)
+        self.client = APIClient()
+        self.wallets = [Wallet.objects.create(balance=100) for _ in range(2)]
+        self.subscriptions = []
+        self.secret = 'merchant-secret-0123456789'
+        for wallet in self.wallets:
+            data = {'url': 'https://merchant.example/events', 'secret': self.secret}
+            response = self.client.post(reverse('wallets:webhooks', args=[wallet.uuid]), data, format='json')
+            self.assertEqual((response.status_code, response.data['secret']), (status.HTTP_201_CREATED, self.secret))
+            self.subscriptions.append(WebhookSubscription.objects.get(pk=response.data['id']))
+
+    def getaddrinfo(self, host, port, **kwargs):
+        address = self.addresses.get(host, '93.184.216.34')
+        return [(socket.AF_INET6 if ':' in address else socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (address, port))]
+
+    def deposit(self, wallet, amount):
+        return self.client.post(reverse('wallets:create_deposit', args=[wallet.uuid]), {'amount': amount}, format='json')
+
+    def test_balance_changes_are_queued(self):
+        """
+        Test that a balance change queues one delivery per subscription and sends the
+        delivery task after commit.
+
+        Steps:
+        1. Verify that the subscribed wallets are flagged and the secret is not listed.
+        2. Deposit into a subscribed wallet and an unsubscribed one.
+        3. Verify that only the subscribed wallet queued a delivery, with the outbox event.
+        4. Verify that the delivery task is sent for the shard once the deposit committed.
+        """
+        self.assertTrue(all(Wallet.objects.filter(pk__in=[wallet.pk for wallet in self.wallets]).values_list('has_webhooks', flat=True)))
+        response = self.client.get(reverse('wallets:webhooks', args=[self.wallets[0].uuid]))
+        self.assertEqual([(item['url'], 'secret' in item) for item in response.data], [('https://merchant.example/events', False)])
+
+        other = Wallet.objects.create(balance=100)
+        with patch('wallets.webhooks.enqueue_delivery') as enqueue_delivery:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.deposit(self.wallets[0], 10).status_code, status.HTTP_200_OK)
+            self.assertEqual(self.deposit(other, 10).status_code, status.HTTP_200_OK)
+
+        delivery = WebhookDelivery.objects.get()
+        event = OutboxEvent.objects.get(wallet_uuid=self.wallets[0].uuid)
+        self.assertEqual((delivery.subscription, delivery.event_id, delivery.event_type), (self.subscriptions[0], event.id, 'wallet.deposit'))
+        self.assertEqual(delivery.payload['amount'], '10.00')
+        self.assertIsNotNone(delivery.next_attempt_at)
+        enqueue_delivery.assert_called_once_with('default')
+
+        with patch('wallets.tasks.deliver_webhooks.apply_async') as apply_async:
+            send_delivery_task('default')
+        apply_async.assert_called_once_with(kwargs={'shard': 'default'}, retry=False)
+
+    def test_deliver_batches(self):
+        """
+        Test that the events of an endpoint are sent in signed batches and retried.
+
+        Steps:
+        1. Deposit twice into each wallet, and once into a wallet of a failing endpoint
+           with a generated secret.
+        2. Deliver with batches of three events.
+        3. Verify that the events of both wallets, which share the endpoint and secret,
+           were sent in order in two signed requests, and that they are delivered.
+        4. Verify that the failing delivery is retried after its Retry-After delay.
+        5. Verify that the delivery is given up after WEBHOOK_MAX_ATTEMPTS attempts.
+        """
+        failing = Wallet.objects.create(balance=100)
+        response = self.client.post(reverse('wallets:webhooks', args=[failing.uuid]), {'url': 'https://down.example/events'}, format='json')
+        self.assertEqual(len(response.data['secret']), 64)
+        for wallet in self.wallets:
+            self.deposit(wallet, 1)
+            self.deposit(wallet, 2)
+        self.deposit(failing, 3)
+
+        def post(url, data, headers, timeout, allow_redirects):
+            if 'down.example' in url:
+                return Mock(status_code=503, headers={'Retry-After': '30'})
+            return Mock(status_code=200, headers={})
+
+        session = Mock()
+        session.post.side_effect = post
+        sender = WebhookSender(workers=2, session=session)
+        now = timezone.now()
+        counts = deliver_due_webhooks(now=now, batch_size=3, sender=sender)
+        self.assertEqual(counts, {'sent': 5, 'delivered': 4, 'retrying': 1, 'dropped': 0, 'requests': 3})
+
+        calls = [call for call in session.post.call_args_list if 'merchant.example' in call.args[0]]
+        self.assertEqual(len(calls), 2)
+        events = [event for call in calls for event in json.loads(call.kwargs['data'])['events']]
+        self.assertEqual([event['data']['amount'] for event in events], ['1.00', '2.00', '1.00', '2.00'])
+        self.assertEqual(calls[0].kwargs['headers'][SIGNATURE_HEADER], sign(self.secret, calls[0].kwargs['data']))
+        self.assertEqual(WebhookDelivery.objects.filter(delivered_at__isnull=False, next_attempt_at__isnull=True).count(), 4)
+
+        retry = WebhookDelivery.objects.get(delivered_at__isnull=True)
+        self.assertEqual((retry.attempts, retry.last_status), (1, 503))
+        self.assertEqual(retry.next_attempt_at, now + datetime.timedelta(seconds=30))
+        self.assertEqual(deliver_due_webhooks(now=now, sender=sender)['sent'], 0)
+
+        with patch('wallets.webhooks.WEBHOOK_MAX_ATTEMPTS', 2):
+            counts = deliver_due_webhooks(now=retry.next_attempt_at, sender=sender)
+        self.assertEqual((counts['sent'], counts['dropped']), (1, 1))
+        retry.refresh_from_db()
+        self.assertEqual((retry.attempts, retry.next_attempt_at, retry.delivered_at), (2, None, None))
+        sender.close()
+
+    def test_endpoint_concurrency(self):
+        """
+        Test that the sender bounds the requests in flight per endpoint.
+
+        Steps:
+        1. Send eight batches to each of two endpoints from eight threads, with at most
+           two requests in flight per endpoint.
+        2. Verify that both endpoints were served at the same time, never with more than
+           two requests in flight each.
+        """
+        in_flight = {}
+        peaks = {}
+        lock = threading.Lock()
+
+        def post(url, data, headers, timeout, allow_redirects):
+            host = url.split('/')[2]
+            with lock:
+                in_flight[host] = in_flight.get(host, 0) + 1
+                peaks[host] = max(peaks.get(host, 0), in_flight[host])
+            time.sleep(0.02)
+            with lock:
+                in_flight[host] -= 1
+            return Mock(status_code=204, headers={})
+
+        session = Mock()
+        session.post.side_effect = post
+        sender = WebhookSender(workers=8, endpoint_concurrency=2, session=session)
+        batches = [(f"https://{host}/events", 'secret', [{'id': index}]) for index in range(8) for host in ('a.example', 'b.example')]
+        started = time.perf_counter()
+        results = sender.send(batches)
+        elapsed = time.perf_counter() - started
+        sender.close()
+        self.assertEqual(results, [(204, None, '')] * 16)
+        self.assertEqual(peaks, {'a.example': 2, 'b.example': 2})
+        self.assertLess(elapsed, 8 * 0.02)
+
+    def test_unsafe_urls(self):
+        """
+        Test that webhooks are only sent to https URLs of public hosts.
+
+        Steps:
+        1. Subscribe with plain http, loopback, private, link-local and IPv4-mapped
+           loopback hosts, and an unresolvable host.
+        2. Verify that every subscription is rejected with 400.
+        3. Point the host of an existing subscription at the metadata address.
+        4. Verify that its delivery is not sent and is retried, without redirects
+           followed for the other endpoint.
+        """
+        self.addresses.update({
+            'internal.example': '10.0.0.5',
+            'rebind.example': '127.0.0.1',
+            'mapped.example': '::ffff:127.0.0.1',
+        })
+        url = reverse('wallets:webhooks', args=[self.wallets[0].uuid])
+        for webhook_url in (
+            'http://merchant.example/events', 'https://127.0.0.1/events', 'https://internal.example/events',
+            'https://169.254.169.254/latest/meta-data', 'https://[::1]/events', 'https://mapped.example/events',
+        ):
+            response = self.client.post(url, {'url': webhook_url}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, webhook_url)
+            self.assertIn('url', response.data)
+        with patch('wallets.webhooks.socket.getaddrinfo', side_effect=socket.gaierror('not found')):
+            self.assertEqual(self.client.post(url, {'url': 'https://nowhere.example/events'}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(WebhookSubscription.objects.count(), 2)
+
+        moved = Wallet.objects.create(balance=100)
+        self.client.post(reverse('wallets:webhooks', args=[moved.uuid]), {'url': 'https://moved.example/events'}, format='json')
+        self.deposit(moved, 1)
+        self.deposit(self.wallets[0], 1)
+        self.addresses['moved.example'] = '169.254.169.254'
+        session = Mock()
+        session.post.return_value = Mock(status_code=200, headers={})
+        sender = WebhookSender(workers=2, session=session)
+        counts = deliver_due_webhooks(sender=sender)
+        sender.close()
+        self.assertEqual((counts['delivered'], counts['retrying']), (1, 1))
+        self.assertEqual([call.args[0] for call in session.post.call_args_list], ['https://merchant.example/events'])
+        self.assertFalse(session.post.call_args.kwargs['allow_redirects'])
+        retry = WebhookDelivery.objects.get(subscription__wallet=moved)
+        self.assertIn('non-public address 169.254.169.254', retry.last_error)
+
+    def test_cancel_subscription(self):
+        """
+        Test cancelling a webhook subscription.
+
+        Steps:
+        1. Queue a delivery and cancel the subscription.
+        2. Verify that the pending delivery is dropped and the wallet is no longer flagged.
+        3. Verify that later balance changes queue nothing and that a second cancel is refused.
+        """
+        self.deposit(self.wallets[0], 1)
+        url = reverse('wallets:cancel_webhook', args=[self.wallets[0].uuid, self.subscriptions[0].pk])
+        response = self.client.post(url)
+        self.assertEqual((response.status_code, response.data['dropped']), (status.HTTP_200_OK, 1))
+        self.assertFalse(WebhookDelivery.objects.due(timezone.now()).exists())
+        self.assertFalse(Wallet.objects.get(pk=self.wallets[0].pk).has_webhooks)
+
+        self.deposit(self.wallets[0], 1)
+        self.assertEqual(WebhookDelivery.objects.count(), 1)
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_409_CONFLICT)
@@ -0,0 +1,279 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+RATE_DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """
+    Parses a DRF style rate string into token bucket parameters.
+
+    The number of requests is used as the bucket capacity (the allowed burst) and
+    the bucket refills at that many tokens per period.
+
+    Args:
+        rate (str): A rate such as '10/min' or '5/s'.
+
+    Returns:
+        tuple: The bucket capacity and the refill rate in tokens per second.
+    """
+    num, period = rate.split('/')
+    capacity = int(num)
+    return capacity, capacity / RATE_DURATIONS[period[0]]
+
+
+def refill(tokens, updated_at, capacity, refill_rate, now):
+    """
+    Computes the number of tokens in a bucket at a given time.
+
+    Args:
+        tokens (float): The number of tokens at `updated_at`.
+        updated_at (float): The time the bucket was last updated.
+        capacity (int): The maximum number of tokens.
+        refill_rate (float): The number of tokens added per second.
+        now (float): The current time.
+
+    Returns:
+        float: The number of tokens available at `now`.
+    """
+    return min(capacity, tokens + (now - updated_at) * refill_rate)
+
+
+class LocalBucketStore:
+    """
+    In-process token bucket store.
+
+    Buckets live in a bounded LRU dictionary guarded by a lock, so memory use stays
+    constant no matter how many wallets or clients are seen. Limits are enforced per
+    process; use CacheBucketStore to share buckets between processes.
+
+    Attributes:
+        max_buckets (int): The maximum number of buckets kept in memory.
+    """
+    def __init__(self, max_buckets=100000):
+        self.max_buckets = max_buckets
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, refill_rate):
+        """
+        Takes one token from a bucket.
+
+        Args:
+            key (str): The bucket key.
+            capacity (int): The maximum number of tokens.
+            refill_rate (float): The number of tokens added per second.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds until one is available.
+        """
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated_at = self.buckets.pop(key, (capacity, now))
+            tokens = refill(tokens, updated_at, capacity, refill_rate, now)
+            wait = 0 if tokens >= 1 else (1 - tokens) / refill_rate
+            if not wait:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+        return wait
+
+    def give(self, key, capacity, refill_rate):
+        """
+        Puts back a token taken from a bucket.
+
+        Args:
+            key (str): The bucket key.
+            capacity (int): The maximum number of tokens.
+            refill_rate (float): The number of tokens added per second.
+        """
+        with self.lock:
+            if key in self.buckets:
+                tokens, updated_at = self.buckets[key]
+                self.buckets[key] = (min(capacity, tokens + 1), updated_at)
+
+    def clear(self):
+        """
+        Removes every bucket.
+        """
+        with self.lock:
+            self.buckets.clear()
+
+
+class CacheBucketStore:
+    """
+    Token bucket store backed by a Django cache shared between processes.
+
+    The read-modify-write of a bucket is not atomic across processes, so under heavy
+    concurrency a few extra requests may be let through. That is acceptable for load
+    shedding, which is what the limiter is for.
+
+    Attributes:
+        cache_alias (str): The alias of the Django cache holding the buckets.
+    """
+    def __init__(self, cache_alias):
+        self.cache_alias = cache_alias
+
+    def take(self, key, capacity, refill_rate):
+        """
+        Takes one token from a bucket.
+
+        Args:
+            key (str): The bucket key.
+            capacity (int): The maximum number of tokens.
+            refill_rate (float): The number of tokens added per second.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds until one is available.
+        """
+        cache = caches[self.cache_alias]
+        now = time.time()
+        tokens, updated_at = cache.get(key, (capacity, now))
+        tokens = refill(tokens, updated_at, capacity, refill_rate, now)
+        wait = 0 if tokens >= 1 else (1 - tokens) / refill_rate
+        if not wait:
+            tokens -= 1
+        cache.set(key, (tokens, now), timeout=int(capacity / refill_rate) + 1)
+        return wait
+
+    def give(self, key, capacity, refill_rate):
+        """
+        Puts back a token taken from a bucket.
+
+        Args:
+            key (str): The bucket key.
+            capacity (int): The maximum number of tokens.
+            refill_rate (float): The number of tokens added per second.
+        """
+        cache = caches[self.cache_alias]
+        bucket = cache.get(key)
+        if bucket is not None:
+            tokens, updated_at = bucket
+            cache.set(key, (min(capacity, tokens + 1), updated_at), timeout=int(capacity / refill_rate) + 1)
+
+    def clear(self):
+        """
+        Removes every bucket. Shared buckets expire on their own, so this is a no-op.
+        """
+
+
+local_bucket_store = LocalBucketStore()
+
+
+def get_bucket_store():
+    """
+    Returns the bucket store selected by the WALLET_THROTTLE_CACHE setting.
+
+    Returns:
+        LocalBucketStore or CacheBucketStore: The in-process store when the setting is
+            None, otherwise a store backed by the named cache.
+    """
+    cache_alias = getattr(settings, 'WALLET_THROTTLE_CACHE', None)
+    if cache_alias is None:
+        return local_bucket_store
+    return CacheBucketStore(cache_alias)
+
+
+def clear_buckets(**kwargs):
+    """
+    Clears the in-process buckets when the throttle settings change.
+    """
+    if kwargs.get('setting') in (None, 'REST_FRAMEWORK', 'WALLET_THROTTLE_CACHE'):
+        local_bucket_store.clear()
+
+
+setting_changed.connect(clear_buckets)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Base class for token bucket throttles.
+
+    The rate of a view is looked up in DEFAULT_THROTTLE_RATES under
+    `<view.throttle_scope>_<scope_suffix>`, so every endpoint can have its own
+    limits. Views without a scope, or scopes without a configured rate, are not limited.
+
+    DRF asks every throttle of a view, even after one has rejected the request. A
+    rejected request must not count against the other buckets, so the tokens taken by
+    earlier throttles are put back on rejection, and later throttles do not take any.
+
+    Attributes:
+        scope_suffix (str): The suffix identifying the throttle in the rate name.
+    """
+    scope_suffix = None
+
+    def get_rate(self, view):
+        """
+        Returns the configured rate for the view, or None if it is not limited.
+        """
+        scope = getattr(view, 'throttle_scope', None)
+        if scope is None:
+            return None
+        return api_settings.DEFAULT_THROTTLE_RATES.get(f"{scope}_{self.scope_suffix}")
+
+    def get_ident_key(self, request, view):
+        """
+        Returns the identity the bucket belongs to, or None if it cannot be determined.
+        """
+        raise NotImplementedError('.get_ident_key() must be overridden')
+
+    def allow_request(self, request, view):
+        """
+        Takes a token from the bucket of the request and reports whether it was available.
+        """
+        self.wait_time = 0
+        rate = self.get_rate(view)
+        ident = self.get_ident_key(request, view) if rate else None
+        if ident is None:
+            return True
+        if not hasattr(request, 'throttle_tokens'):
+            request.throttle_tokens = []
+        taken = request.throttle_tokens
+        if taken is None:
+            # The request was already rejected and is answered with 429 anyway.
+            return True
+        capacity, refill_rate = parse_rate(rate)
+        key = f"throttle:{view.throttle_scope}:{self.scope_suffix}:{ident}"
+        store = get_bucket_store()
+        self.wait_time = store.take(key, capacity, refill_rate)
+        if self.wait_time:
+            for bucket in taken:
+                store.give(*bucket)
+            request.throttle_tokens = None
+            return False
+        taken.append((key, capacity, refill_rate))
+        return True
+
+    def wait(self):
+        """
+        Returns the number of seconds until the next request is allowed.
+        """
+        return self.wait_time
+
+
+class WalletRateThrottle(TokenBucketThrottle):
+    """
+    Limits the request rate per wallet, identified by the `uuid` URL argument.
+    """
+    scope_suffix = 'wallet'
+
+    def get_ident_key(self, request, view):
+        uuid = view.kwargs.get('uuid')
+        return str(uuid) if uuid is not None else None
+
+
+class ClientRateThrottle(TokenBucketThrottle):
+    """
+    Limits the request rate per client, identified by its IP address.
+    """
+    scope_suffix = 'client'
+
+    def get_ident_key(self, request, view):
+        return self.get_ident(request)
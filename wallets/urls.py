@@ -1,13 +1,25 @@
 from django.urls import path
 
-from wallets.views import CreateDepositView, ScheduleWithdrawView, CreateWalletView, RetrieveWalletView, CreateWithdrawView
+from wallets.views import CreateDepositView, ScheduleWithdrawView, CreateWalletView, RetrieveWalletView, CreateWithdrawView, CreateTransferView, BatchTransferView, WalletDailyAggregateView, BulkCreateWalletView, BatchScheduleWithdrawView, RetrieveWithdrawalBatchView, CancelScheduledWithdrawView, RescheduleWithdrawView, CreateStandingOrderView, CancelStandingOrderView, WebhookSubscriptionView, CancelWebhookSubscriptionView
 
 app_name = "wallets"
 
 urlpatterns = [
     path("", CreateWalletView.as_view(), name="create_wallet"),
+    path("bulk", BulkCreateWalletView.as_view(), name="bulk_create_wallet"),
+    path("transfers/batch", BatchTransferView.as_view(), name="batch_transfer"),
+    path("schedulewithdraw/batches", BatchScheduleWithdrawView.as_view(), name="schedule_withdraw_batch"),
+    path("schedulewithdraw/batches/<uuid:batch_uuid>", RetrieveWithdrawalBatchView.as_view(), name="retrieve_withdraw_batch"),
     path("<uuid>/", RetrieveWalletView.as_view(), name="retrieve_wallet"),
     path("<uuid>/deposit", CreateDepositView.as_view(), name="create_deposit"),
     path("<uuid>/withdraw", CreateWithdrawView.as_view(), name="create_withdraw"),
+    path("<uuid>/transfer", CreateTransferView.as_view(), name="create_transfer"),
     path("<uuid>/schedulewithdraw", ScheduleWithdrawView.as_view(), name="schedule_withdraw"),
+    path("<uuid>/schedulewithdraw/<int:pk>/cancel", CancelScheduledWithdrawView.as_view(), name="cancel_scheduled_withdraw"),
+    path("<uuid>/schedulewithdraw/<int:pk>/reschedule", RescheduleWithdrawView.as_view(), name="reschedule_withdraw"),
+    path("<uuid>/standingorders", CreateStandingOrderView.as_view(), name="create_standing_order"),
+    path("<uuid>/standingorders/<int:pk>/cancel", CancelStandingOrderView.as_view(), name="cancel_standing_order"),
+    path("<uuid>/webhooks", WebhookSubscriptionView.as_view(), name="webhooks"),
+    path("<uuid>/webhooks/<int:pk>/cancel", CancelWebhookSubscriptionView.as_view(), name="cancel_webhook"),
+    path("<uuid>/aggregates", WalletDailyAggregateView.as_view(), name="daily_aggregates"),
 ]
\ No newline at end of file
@@ -1,17 +1,25 @@
-from rest_framework.generics import CreateAPIView, RetrieveAPIView
+from rest_framework.generics import CreateAPIView, RetrieveAPIView, ListAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from wallets.models import Wallet, Transaction, ScheduledWithdrawal
-from wallets.serializers import DepositSerializer, WithdrawSerializer, ScheduleWithdrawSerializer
+from wallets.models import Wallet, Transaction, ScheduledWithdrawal, ScheduledWithdrawalBatch, StandingOrder, WalletDailyAggregate, WebhookSubscription, WebhookDelivery
+from wallets.serializers import DepositSerializer, WithdrawSerializer, TransferSerializer, BatchTransferSerializer, ScheduleWithdrawSerializer, RescheduleWithdrawSerializer, BatchScheduleWithdrawSerializer, StandingOrderSerializer, WalletDailyAggregateSerializer, AggregateRangeSerializer, WebhookSubscriptionSerializer
 from django.shortcuts import get_object_or_404
+from django.http import Http404
 from rest_framework import status
 from django.utils import timezone
-from django.db import models, transaction
-from wallets.tasks import process_withdrawal
-from django_celery_beat.models import ClockedSchedule, PeriodicTask
+from django.db import models, transaction, IntegrityError
+from wallets.netting import apply_transfer_batch
+from wallets.fastpath import FastPathMixin, fast_path_enabled
+from wallets.ledger import append_only_ledger_enabled
+from wallets.minor_units import minor_unit_reads_enabled, minor_units_enabled, to_minor_units, format_minor_units
+from wallets.pk_cache import wallet_pk_cache, wallet_or_404
+from wallets.sharding import copy_rows, for_each_shard, group_by_shard, shard_for_uuid, use_shard, wallet_db
+import contextlib
 import json
 from wallets.models import Wallet
-from wallets.serializers import WalletSerializer
+from wallets.serializers import WalletSerializer, BulkCreateWalletSerializer
+from base.vars import WALLET_BULK_BATCH_SIZE, WITHDRAW_URGENT_QUEUE, WITHDRAW_SCHEDULED_QUEUE, WITHDRAW_BULK_QUEUE
+from uuid import uuid4
 import datetime
 
 class CreateWalletView(CreateAPIView):
@@ -29,7 +37,85 @@ class CreateWalletView(CreateAPIView):
     serializer_class = WalletSerializer
 
 
-class RetrieveWalletView(RetrieveAPIView):
+class BulkCreateWalletView(APIView):
+    """
+    API view for creating many wallets in one request.
+
+    The wallets are validated together and inserted with `bulk_create` in batches of
+    WALLET_BULK_BATCH_SIZE rows inside a single database transaction, so either every
+    wallet of the request is created or none is. With sharding enabled, each wallet is
+    inserted on the shard of its UUID, in one transaction per shard.
+
+    Attributes:
+        throttle_scope (str): The scope used to look up the rate limits of this endpoint.
+
+    Methods:
+        post(request, *args, **kwargs): Handles HTTP POST requests for creating wallets.
+            It validates the request, rejects UUIDs that are already taken, creates the
+            wallets and returns their UUIDs and balances.
+
+    Sample Request:
+        {
+        "wallets": [
+            {"uuid": "12c599be-7847-47d4-b063-e80e6e36b0cb", "balance": 10},
+            {"balance": 5}
+        ]
+        }
+    """
+    throttle_scope = "bulk_create_wallet"
+
+    def post(self, request, *args, **kwargs):
+        """
+        Handles HTTP POST requests for creating wallets in bulk.
+
+        Args:
+            request (HttpRequest): The HTTP request object containing the request data.
+            *args: Additional positional arguments.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            Response: A response containing the created wallets, or an error message if
+                the request is invalid or one of the UUIDs is already taken.
+
+        Sample Request:
+            {
+            "count": 1000
+            }
+        """
+        serializer = BulkCreateWalletSerializer(data=request.data)
+        if serializer.is_valid():
+            items = serializer.validated_data['wallets']
+            existing = Wallet.objects.existing_uuids([item['uuid'] for item in items if 'uuid' in item], batch_size=WALLET_BULK_BATCH_SIZE)
+            if existing:
+                return Response({'error': 'Wallets already exist.', 'uuids': existing}, status=status.HTTP_400_BAD_REQUEST)
+
+            minor_units = minor_units_enabled()
+            wallets = [
+                Wallet(uuid=item.get('uuid') or uuid4(), balance=item['balance'], balance_minor=to_minor_units(item['balance']) if minor_units else None)
+                for item in items
+            ]
+            try:
+                # With sharding enabled, one transaction per shard; they commit one after
+                # the other once every insert has succeeded.
+                with contextlib.ExitStack() as stack:
+                    for shard, group in group_by_shard(wallets, key=lambda wallet: wallet.uuid).items():
+                        stack.enter_context(transaction.atomic(using=shard))
+                        Wallet.objects.using(shard).bulk_create(group, batch_size=WALLET_BULK_BATCH_SIZE)
+            except IntegrityError:
+                return Response({'error': 'Wallets already exist.'}, status=status.HTTP_400_BAD_REQUEST)
+            # bulk_create sends no post_save, so UUIDs cached as unknown are evicted here.
+            wallet_pk_cache.forget(*(wallet.uuid for wallet in wallets))
+            return Response(
+                {
+                    'created': len(wallets),
+                    'wallets': [{'uuid': wallet.uuid, 'balance': wallet.balance} for wallet in wallets],
+                },
+                status=status.HTTP_201_CREATED,
+            )
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class RetrieveWalletView(FastPathMixin, RetrieveAPIView):
     """
     API view for retrieving a wallet by its UUID.
 
@@ -44,14 +130,59 @@ class RetrieveWalletView(RetrieveAPIView):
         queryset (QuerySet): The queryset containing all wallet instances.
         lookup_field (str): The name of the field used to retrieve a specific wallet instance.
             In this case, it's set to "uuid" to retrieve a wallet by its UUID.
+
+    On the fast path (WALLET_FAST_PATH), only the UUID and balance are loaded and
+    returned, without the serializer. In append-only ledger mode (WALLET_APPEND_ONLY_LEDGER)
+    the balance includes the ledger entries not folded yet. The wallet is loaded by
+    primary key, resolved from the UUID through the in-process UUID cache.
     """
     serializer_class = WalletSerializer
     queryset = Wallet.objects.all()
     
     lookup_field = "uuid"
 
+    def get_queryset(self):
+        """
+        Returns the wallets, with their available balance in append-only ledger mode.
+        """
+        if append_only_ledger_enabled():
+            return Wallet.objects.with_available_balance()
+        return super().get_queryset()
+
+    def get_object(self):
+        """
+        Returns the wallet, with the unfolded ledger entries included in its balance in
+        append-only ledger mode.
+        """
+        wallet = wallet_or_404(self.kwargs[self.lookup_field], self.get_queryset())
+        self.check_object_permissions(self.request, wallet)
+        if append_only_ledger_enabled():
+            # The minor-unit balance lacks the unfolded entries, so the serializer falls
+            # back to the decimal balance.
+            wallet.balance = wallet.available_balance
+            wallet.balance_minor = None
+        return wallet
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Returns the wallet, trimmed to its UUID and balance on the fast path.
 
-class CreateDepositView(APIView):
+        With minor-unit reads enabled the fast path reads only the minor-unit balance
+        of a backfilled wallet and formats it without building a Decimal.
+        """
+        if not fast_path_enabled():
+            return super().retrieve(request, *args, **kwargs)
+        if minor_unit_reads_enabled() and not append_only_ledger_enabled():
+            wallet = wallet_or_404(kwargs[self.lookup_field], self.get_queryset().only('uuid', 'balance_minor'))
+            if wallet.balance_minor is not None:
+                return Response({'uuid': str(wallet.uuid), 'balance': format_minor_units(wallet.balance_minor)})
+        else:
+            wallet = wallet_or_404(kwargs[self.lookup_field], self.get_queryset().only('uuid', 'balance'))
+        balance = wallet.available_balance if append_only_ledger_enabled() else wallet.balance
+        return Response({'uuid': str(wallet.uuid), 'balance': str(balance)})
+
+
+class CreateDepositView(FastPathMixin, APIView):
     """
     API view for creating a deposit transaction for a specific wallet.
 
@@ -63,13 +194,19 @@ class CreateDepositView(APIView):
     Attributes:
         serializer_class (Serializer): The serializer class responsible for validating
             the incoming data.
+        throttle_scope (str): The scope used to look up the rate limits of this endpoint.
     
     Methods:
         post(request, uuid, *args, **kwargs): Handles HTTP POST requests for creating
             deposit transactions. It validates the incoming data, retrieves the wallet
             by its UUID, deposits the specified amount into the wallet, and returns
             the updated wallet details.
+
+    With WALLET_FAST_PATH enabled, the amount is checked with the lightweight
+    validator and the response is rendered as compact JSON without negotiation.
     """
+    throttle_scope = "deposit"
+
     def post(self, reqeust, uuid, *args, **kwargs):
         """
         Handles HTTP POST requests for creating deposit transactions.
@@ -92,18 +229,17 @@ class CreateDepositView(APIView):
             "amount":10
             }
         """
-        serializer = DepositSerializer(data=self.request.data)
-        if serializer.is_valid():
-            amount = serializer.validated_data['amount']
-            wallet = get_object_or_404(Wallet, uuid=uuid)
+        amount, errors = self.validated_amount(self.request, DepositSerializer)
+        if errors is None:
+            wallet = wallet_or_404(uuid)
             try:
                 wallet.deposit(amount)
                 return Response({'uuid': wallet.uuid, 'new_balance': wallet.balance}, status=status.HTTP_200_OK)
             except ValueError as e:
                 return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response(errors, status=status.HTTP_400_BAD_REQUEST)
         
-class CreateWithdrawView(APIView):
+class CreateWithdrawView(FastPathMixin, APIView):
     """
     API view for creating a withdrawal transaction for a specific wallet.
 
@@ -115,13 +251,19 @@ class CreateWithdrawView(APIView):
     Attributes:
         serializer_class (Serializer): The serializer class responsible for validating
             the incoming data.
+        throttle_scope (str): The scope used to look up the rate limits of this endpoint.
     
     Methods:
         post(request, uuid, *args, **kwargs): Handles HTTP POST requests for creating
             withdrawal transactions. It validates the incoming data, retrieves the wallet
             by its UUID, withdraws the specified amount from the wallet, and returns
             the updated wallet details.
+
+    With WALLET_FAST_PATH enabled, the amount is checked with the lightweight
+    validator and the response is rendered as compact JSON without negotiation.
     """
+    throttle_scope = "withdraw"
+
     def post(self, reqeust, uuid, *args, **kwargs):
         """
         Handles HTTP POST requests for creating withdrawal transactions.
@@ -144,15 +286,136 @@ class CreateWithdrawView(APIView):
             "amount":10
             }
         """
-        serializer = WithdrawSerializer(data=self.request.data)
-        if serializer.is_valid():
-            amount = serializer.validated_data['amount']
-            wallet = get_object_or_404(Wallet, uuid=uuid)
+        amount, errors = self.validated_amount(self.request, WithdrawSerializer)
+        if errors is None:
+            wallet = wallet_or_404(uuid)
             try:
                 wallet.withdraw(amount)
                 return Response({'uuid': wallet.uuid, 'new_balance': wallet.balance}, status=status.HTTP_200_OK)
             except ValueError as e:
                 return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class CreateTransferView(APIView):
+    """
+    API view for transferring an amount from one wallet to another.
+
+    The transfer is internal: both balances change in one database transaction and
+    the bank is not called. Each side gets a ledger row, and the rows share a transfer ID.
+    With sharding enabled, both wallets must be on the same shard.
+
+    Attributes:
+        throttle_scope (str): The scope used to look up the rate limits of this endpoint.
+
+    Methods:
+        post(request, uuid, *args, **kwargs): Handles HTTP POST requests for creating
+            transfers. It validates the incoming data, retrieves both wallets, moves
+            the amount and returns the new balance of the source wallet.
+
+    Sample Request:
+        {
+        "to":"4c7f3f5e-5b0a-4a57-8d3c-8f0f1d1c9b7e",
+        "amount":10
+        }
+    """
+    throttle_scope = "transfer"
+
+    def post(self, request, uuid, *args, **kwargs):
+        """
+        Handles HTTP POST requests for creating transfers.
+
+        Args:
+            request (HttpRequest): The HTTP request object containing the request data.
+            uuid (str): The UUID of the wallet the amount is taken from.
+            *args: Additional positional arguments.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            Response: A response containing the new balance of the source wallet and the
+                transfer ID, or an error message if the transfer fails.
+
+        Raises:
+            Http404: If either wallet does not exist.
+            InsufficientFundsError: If the source wallet has insufficient funds.
+        """
+        serializer = TransferSerializer(data=request.data)
+        if serializer.is_valid():
+            wallet = wallet_or_404(uuid)
+            if shard_for_uuid(serializer.validated_data['to']) != wallet_db():
+                return Response({'error': 'Transfers between shards are not supported.'}, status=status.HTTP_400_BAD_REQUEST)
+            target = wallet_or_404(serializer.validated_data['to'])
+            try:
+                transfer_id = wallet.transfer_to(target, serializer.validated_data['amount'])
+                return Response({'uuid': wallet.uuid, 'new_balance': wallet.balance, 'transfer_id': transfer_id}, status=status.HTTP_200_OK)
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class BatchTransferView(APIView):
+    """
+    API view for applying a batch of internal transfers, such as marketplace settlements.
+
+    The transfers are netted into one balance update per wallet and applied all
+    together or not at all, see `apply_transfer_batch`. With sharding enabled, all the
+    wallets of a batch must be on the same shard.
+
+    Attributes:
+        throttle_scope (str): The scope used to look up the rate limits of this endpoint.
+
+    Methods:
+        post(request, *args, **kwargs): Handles HTTP POST requests for applying a batch.
+            It validates the transfers, resolves their wallets and applies them.
+
+    Sample Request:
+        {
+        "transfers": [
+            {"wallet": "12c599be-7847-47d4-b063-e80e6e36b0cb", "to": "4c7f3f5e-5b0a-4a57-8d3c-8f0f1d1c9b7e", "amount": 10},
+            {"wallet": "9a1d2c3b-4e5f-4a6b-8c7d-0e1f2a3b4c5d", "to": "4c7f3f5e-5b0a-4a57-8d3c-8f0f1d1c9b7e", "amount": 5}
+        ]
+        }
+    """
+    throttle_scope = "transfer_batch"
+
+    def post(self, request, *args, **kwargs):
+        """
+        Handles HTTP POST requests for applying a batch of transfers.
+
+        Args:
+            request (HttpRequest): The HTTP request object containing the request data.
+            *args: Additional positional arguments.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            Response: A response containing the transfer IDs in request order and the
+                number of updated wallets, or an error message if the request is invalid
+                or refers to unknown wallets.
+
+        Raises:
+            InsufficientFundsError: If a debit of the batch is not covered.
+        """
+        serializer = BatchTransferSerializer(data=request.data)
+        if serializer.is_valid():
+            items = serializer.validated_data['transfers']
+            uuids = {item['wallet'] for item in items} | {item['to'] for item in items}
+            shards = group_by_shard(uuids)
+            if len(shards) > 1:
+                return Response({'error': 'Transfers between shards are not supported.'}, status=status.HTTP_400_BAD_REQUEST)
+            wallet_pks = Wallet.objects.pks_by_uuid(uuids, batch_size=WALLET_BULK_BATCH_SIZE)
+            missing = sorted(str(uuid) for uuid in uuids if uuid not in wallet_pks)
+            if missing:
+                return Response({'error': 'Wallets do not exist.', 'uuids': missing}, status=status.HTTP_400_BAD_REQUEST)
+
+            with use_shard(next(iter(shards))):
+                result = apply_transfer_batch([
+                    (wallet_pks[item['wallet']], wallet_pks[item['to']], item['amount'])
+                    for item in items
+                ])
+            return Response(
+                {'transfers': len(items), 'wallets_updated': result['wallets_updated'], 'transfer_ids': result['transfer_ids']},
+                status=status.HTTP_200_OK,
+            )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -168,19 +431,24 @@ class ScheduleWithdrawView(APIView):
     Attributes:
         serializer_class (Serializer): The serializer class responsible for validating
             the incoming data.
+        throttle_scope (str): The scope used to look up the rate limits of this endpoint.
     
     Methods:
         post(request, uuid, *args, **kwargs): Handles HTTP POST requests for scheduling
             withdrawals. It validates the incoming data, retrieves the wallet
             by its UUID, schedules the withdrawal, creates a periodic task for
-            processing the withdrawal, and returns a success response if the
+            processing the withdrawal on the scheduled or, for urgent withdrawals,
+            the urgent queue, and returns a success response if the
             scheduling is successful.
     Sample Request:
         {
         "amount":10,
-        "scheduled_time":"2024-05-24 09:00:00"
+        "scheduled_time":"2024-05-24 09:00:00",
+        "urgent":false
         }
     """
+    throttle_scope = "schedule_withdraw"
+
     def post(self, request, uuid, *args, **kwargs):
         """
         Handles HTTP POST requests for scheduling withdrawals.
@@ -208,30 +476,532 @@ class ScheduleWithdrawView(APIView):
         if serializer.is_valid():
             amount = serializer.validated_data['amount']
             scheduled_time = serializer.validated_data['scheduled_time']
+            queue = WITHDRAW_URGENT_QUEUE if serializer.validated_data['urgent'] else WITHDRAW_SCHEDULED_QUEUE
             # scheduled_time = timezone.datetime.strptime(scheduled_time_str, '%Y-%m-%d %H:%M:%S')
-            wallet = get_object_or_404(Wallet, uuid=uuid)
-            with transaction.atomic():
+            wallet = wallet_or_404(uuid)
+            # The beat task is written to the default database, the withdrawal to the wallet shard.
+            with transaction.atomic(using=wallet_db()), transaction.atomic():
                 scheduled_withdrawal = ScheduledWithdrawal.objects.create(wallet=wallet, amount=amount, scheduled_time=scheduled_time)
-                scheduled_withdrawal.save()
+                ScheduledWithdrawal.objects.schedule_task(scheduled_withdrawal, queue)
+
+            return Response({'status': 'success', 'message': 'Withdrawal scheduled', 'id': scheduled_withdrawal.id})
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class CancelScheduledWithdrawView(APIView):
+    """
+    API view for cancelling a pending scheduled withdrawal.
+
+    The withdrawal is looked up by its ID within the wallet, and the cancellation is
+    a conditional update that loses against a worker that has already claimed the
+    withdrawal. The beat task of the withdrawal is deleted with it.
+
+    Attributes:
+        throttle_scope (str): The scope used to look up the rate limits of this endpoint.
+
+    Methods:
+        post(request, uuid, pk, *args, **kwargs): Handles HTTP POST requests for
+            cancelling a scheduled withdrawal.
+    """
+    throttle_scope = "schedule_withdraw"
+
+    def post(self, request, uuid, pk, *args, **kwargs):
+        """
+        Handles HTTP POST requests for cancelling a scheduled withdrawal.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            uuid (str): The UUID of the wallet the withdrawal belongs to.
+            pk (int): The ID of the scheduled withdrawal.
+            *args: Additional positional arguments.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            Response: A success response, or a 409 response if the withdrawal has
+                already been processed or cancelled.
+
+        Raises:
+            Http404: If the wallet has no scheduled withdrawal with the specified ID.
+        """
+        scheduled_withdrawal = get_object_or_404(ScheduledWithdrawal, pk=pk, wallet_id=wallet_pk_cache.resolve(uuid))
+        if not ScheduledWithdrawal.objects.cancel(scheduled_withdrawal):
+            return Response({'error': 'Withdrawal is no longer pending.'}, status=status.HTTP_409_CONFLICT)
+        return Response({'status': 'success', 'message': 'Withdrawal cancelled', 'id': scheduled_withdrawal.id})
+
+
+class RescheduleWithdrawView(APIView):
+    """
+    API view for moving a pending scheduled withdrawal to another time.
+
+    The withdrawal is looked up by its ID within the wallet, and the new time is
+    written with a conditional update that loses against a worker that has already
+    claimed the withdrawal. Its beat task is moved to the new time.
+
+    Attributes:
+        throttle_scope (str): The scope used to look up the rate limits of this endpoint.
+
+    Methods:
+        post(request, uuid, pk, *args, **kwargs): Handles HTTP POST requests for
+            rescheduling a scheduled withdrawal.
+
+    Sample Request:
+        {
+        "scheduled_time":"2024-05-25 09:00:00"
+        }
+    """
+    throttle_scope = "schedule_withdraw"
+
+    def post(self, request, uuid, pk, *args, **kwargs):
+        """
+        Handles HTTP POST requests for rescheduling a scheduled withdrawal.
+
+        Args:
+            request (HttpRequest): The HTTP request object containing the request data.
+            uuid (str): The UUID of the wallet the withdrawal belongs to.
+            pk (int): The ID of the scheduled withdrawal.
+            *args: Additional positional arguments.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            Response: A success response, a 400 response if the new time is invalid, or
+                a 409 response if the withdrawal has already been processed or cancelled.
+
+        Raises:
+            Http404: If the wallet has no scheduled withdrawal with the specified ID.
+        """
+        serializer = RescheduleWithdrawSerializer(data=request.data)
+        if serializer.is_valid():
+            scheduled_time = serializer.validated_data['scheduled_time']
+            scheduled_withdrawal = get_object_or_404(ScheduledWithdrawal, pk=pk, wallet_id=wallet_pk_cache.resolve(uuid))
+            queue = WITHDRAW_BULK_QUEUE if scheduled_withdrawal.batch_id else WITHDRAW_SCHEDULED_QUEUE
+            if not ScheduledWithdrawal.objects.reschedule(scheduled_withdrawal, scheduled_time, queue):
+                return Response({'error': 'Withdrawal is no longer pending.'}, status=status.HTTP_409_CONFLICT)
+            return Response({'status': 'success', 'message': 'Withdrawal rescheduled', 'id': scheduled_withdrawal.id})
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class BatchScheduleWithdrawView(APIView):
+    """
+    API view for scheduling a batch of withdrawals, such as a payroll run, in one request.
+
+    The whole batch is validated before anything is written. The withdrawals are then
+    inserted with `bulk_create` in batches of WALLET_BULK_BATCH_SIZE rows, and a single
+    clocked one-off task is created per distinct scheduled time instead of one per
+    withdrawal. When it fires, that task fans the withdrawals of its time slot out to
+    the bulk queue. A payroll of thousands of withdrawals at the same time therefore
+    adds one row to the beat schedule rather than thousands. With sharding enabled, the
+    withdrawals are inserted on the shards of their wallets, and each of these shards
+    gets a row of the batch with the same ID and its own share of the items.
+
+    Attributes:
+        throttle_scope (str): The scope used to look up the rate limits of this endpoint.
+
+    Methods:
+        post(request, *args, **kwargs): Handles HTTP POST requests for scheduling a batch.
+            It validates the items, resolves their wallets, schedules the withdrawals
+            and returns the batch UUID used to track them.
+
+    Sample Request:
+        {
+        "items": [
+            {"wallet": "12c599be-7847-47d4-b063-e80e6e36b0cb", "amount": 10, "scheduled_time": "2024-05-24 09:00:00"},
+            {"wallet": "4c7f3f5e-5b0a-4a57-8d3c-8f0f1d1c9b7e", "amount": 25, "scheduled_time": "2024-05-24 09:00:00"}
+        ]
+        }
+    """
+    throttle_scope = "schedule_withdraw_batch"
+
+    def post(self, request, *args, **kwargs):
+        """
+        Handles HTTP POST requests for scheduling a batch of withdrawals.
 
-                clocked, created = ClockedSchedule.objects.get_or_create(
-                    clocked_time=scheduled_time
+        Args:
+            request (HttpRequest): The HTTP request object containing the request data.
+            *args: Additional positional arguments.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            Response: A response containing the batch UUID, the number of scheduled
+                withdrawals and the number of clocked tasks, or an error message if the
+                request is invalid or refers to unknown wallets.
+        """
+        from django_celery_beat.models import ClockedSchedule, PeriodicTask
+
+        serializer = BatchScheduleWithdrawSerializer(data=request.data)
+        if serializer.is_valid():
+            items = serializer.validated_data['items']
+            wallet_pks = Wallet.objects.pks_by_uuid({item['wallet'] for item in items}, batch_size=WALLET_BULK_BATCH_SIZE)
+            missing = sorted({str(item['wallet']) for item in items if item['wallet'] not in wallet_pks})
+            if missing:
+                return Response({'error': 'Wallets do not exist.', 'uuids': missing}, status=status.HTTP_400_BAD_REQUEST)
+
+            scheduled_times = sorted({item['scheduled_time'] for item in items})
+            shards = group_by_shard(items, key=lambda item: item['wallet'])
+            with contextlib.ExitStack() as stack:
+                for shard in shards:
+                    stack.enter_context(transaction.atomic(using=shard))
+                stack.enter_context(transaction.atomic())
+                batch = None
+                for shard, shard_items in shards.items():
+                    if batch is None:
+                        first_shard = shard
+                        batch = ScheduledWithdrawalBatch.objects.using(shard).create(item_count=len(shard_items))
+                    else:
+                        # The other shards get a copy of the batch with the same ID.
+                        copy_rows(ScheduledWithdrawalBatch.objects.using(first_shard).filter(pk=batch.pk), shard)
+                        ScheduledWithdrawalBatch.objects.using(shard).filter(pk=batch.pk).update(item_count=len(shard_items))
+                    ScheduledWithdrawal.objects.using(shard).bulk_create(
+                        [
+                            ScheduledWithdrawal(
+                                wallet_id=wallet_pks[item['wallet']],
+                                amount=item['amount'],
+                                scheduled_time=item['scheduled_time'],
+                                batch_id=batch.pk,
+                            )
+                            for item in shard_items
+                        ],
+                        batch_size=WALLET_BULK_BATCH_SIZE,
+                    )
+                for scheduled_time in scheduled_times:
+                    clocked, created = ClockedSchedule.objects.get_or_create(clocked_time=scheduled_time)
+                    PeriodicTask.objects.create(
+                        clocked=clocked,
+                        name=f"batch-{batch.uuid}-{scheduled_time.isoformat()}",
+                        task="wallets.tasks.process_withdrawal_batch",
+                        one_off=True,
+                        queue=WITHDRAW_BULK_QUEUE,
+                        kwargs=json.dumps(
+                            {
+                                "batch_id": batch.id,
+                                "scheduled_time": scheduled_time.isoformat(),
+                            }
+                        ),
                     )
-            
-                task = PeriodicTask.objects.create(
-                    
-                    clocked=clocked,
-                    name=f"{uuid}-{amount}-withdraw-{datetime.datetime.now().timestamp()}",
-                    task="wallets.tasks.process_withdrawal",
-                    one_off=True,
-                    queue="withdraw",
-                    kwargs=json.dumps(
-                        {
-                            "scheduled_withdrawal_id": scheduled_withdrawal.id,
-                        }
-                    ),
-                )
-
-            return Response({'status': 'success', 'message': 'Withdrawal scheduled'})
+
+            return Response(
+                {'batch': batch.uuid, 'scheduled': len(items), 'triggers': len(scheduled_times)},
+                status=status.HTTP_201_CREATED,
+            )
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class RetrieveWithdrawalBatchView(APIView):
+    """
+    API view for tracking the progress of a batch of scheduled withdrawals.
+
+    Methods:
+        get(request, batch_uuid, *args, **kwargs): Handles HTTP GET requests and returns
+            the number of withdrawals of the batch that are processed, cancelled and pending,
+            summed over the shards holding part of the batch.
+
+    Sample Request:
+        GET /wallets/schedulewithdraw/batches/0b1f0a38-8c1e-4b3a-9d2a-6a4f1e9d8c11
+    """
+
+    def get(self, request, batch_uuid, *args, **kwargs):
+        """
+        Handles HTTP GET requests for the status of a withdrawal batch.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            batch_uuid (UUID): The UUID of the batch.
+            *args: Additional positional arguments.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            Response: A response containing the batch UUID, its creation time and the
+                number of total, processed, cancelled and pending withdrawals.
+
+        Raises:
+            Http404: If the batch with the specified UUID does not exist.
+        """
+        def batch_progress(shard):
+            batch = ScheduledWithdrawalBatch.objects.filter(uuid=batch_uuid).first()
+            if batch is None:
+                return None
+            counts = batch.items.aggregate(
+                processed=models.Count('id', filter=models.Q(processed=True)),
+                cancelled=models.Count('id', filter=models.Q(cancelled=True)),
+            )
+            return batch, counts
+
+        parts = [part for part in for_each_shard(batch_progress, parallel=False).values() if part is not None]
+        if not parts:
+            raise Http404("No ScheduledWithdrawalBatch matches the given query.")
+        total = sum(batch.item_count for batch, counts in parts)
+        processed = sum(counts['processed'] for batch, counts in parts)
+        cancelled = sum(counts['cancelled'] for batch, counts in parts)
+        return Response({
+            'batch': parts[0][0].uuid,
+            'created_at': parts[0][0].created_at,
+            'total': total,
+            'processed': processed,
+            'cancelled': cancelled,
+            'pending': total - processed - cancelled,
+        })
+
+
+class CreateStandingOrderView(APIView):
+    """
+    API view for creating a standing order, a withdrawal that recurs on a cron or interval rule.
+
+    No beat task is created per order or per occurrence: the `run_standing_orders`
+    task finds the due orders through their precomputed `next_run_at`.
+
+    Attributes:
+        throttle_scope (str): The scope used to look up the rate limits of this endpoint.
+
+    Methods:
+        post(request, uuid, *args, **kwargs): Handles HTTP POST requests for creating
+            a standing order on the wallet.
+
+    Sample Request:
+        {
+        "amount":10,
+        "cron":"0 9 * * mon"
+        }
+    """
+    throttle_scope = "schedule_withdraw"
+
+    def post(self, request, uuid, *args, **kwargs):
+        """
+        Handles HTTP POST requests for creating a standing order.
+
+        Args:
+            request (HttpRequest): The HTTP request object containing the request data.
+            uuid (str): The UUID of the wallet the withdrawals are taken from.
+            *args: Additional positional arguments.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            Response: A response containing the standing order and its first occurrence,
+                or an error message if the request is invalid.
+
+        Raises:
+            Http404: If the wallet with the specified UUID does not exist.
+
+        Sample Request:
+            {
+            "amount":10,
+            "interval":604800,
+            "start_at":"2024-05-27 09:00:00"
+            }
+        """
+        serializer = StandingOrderSerializer(data=request.data)
+        if serializer.is_valid():
+            wallet = wallet_or_404(uuid)
+            order = StandingOrder.objects.create(wallet=wallet, **serializer.validated_data)
+            return Response(
+                {
+                    'id': order.id,
+                    'amount': order.amount,
+                    'cron': order.cron,
+                    'interval': order.interval.total_seconds() if order.interval else None,
+                    'next_run_at': order.next_run_at,
+                },
+                status=status.HTTP_201_CREATED,
+            )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+
+class CancelStandingOrderView(APIView):
+    """
+    API view for cancelling a standing order.
+
+    Withdrawals already created for past occurrences are not affected; use the
+    scheduled withdrawal cancel endpoint for those.
+
+    Attributes:
+        throttle_scope (str): The scope used to look up the rate limits of this endpoint.
+
+    Methods:
+        post(request, uuid, pk, *args, **kwargs): Handles HTTP POST requests for
+            cancelling a standing order.
+    """
+    throttle_scope = "schedule_withdraw"
+
+    def post(self, request, uuid, pk, *args, **kwargs):
+        """
+        Handles HTTP POST requests for cancelling a standing order.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            uuid (str): The UUID of the wallet the order belongs to.
+            pk (int): The ID of the standing order.
+            *args: Additional positional arguments.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            Response: A success response, or a 409 response if the order was already cancelled.
+
+        Raises:
+            Http404: If the wallet has no standing order with the specified ID.
+        """
+        order = get_object_or_404(StandingOrder, pk=pk, wallet_id=wallet_pk_cache.resolve(uuid))
+        if not StandingOrder.objects.filter(pk=order.pk, active=True).update(active=False):
+            return Response({'error': 'Standing order is already cancelled.'}, status=status.HTTP_409_CONFLICT)
+        return Response({'status': 'success', 'message': 'Standing order cancelled', 'id': order.id})
+
+
+class WebhookSubscriptionView(APIView):
+    """
+    API view for listing and creating the webhook subscriptions of a wallet.
+
+    Every balance change of the wallet is then POSTed to the URL of each active
+    subscription, in batches, as `{"events": [{"id", "type", "attempt", "data"}]}` and
+    signed with an HMAC-SHA256 of the body in the `X-Wallet-Signature` header.
+
+    Attributes:
+        throttle_scope (str): The scope used to look up the rate limits of this endpoint.
+
+    Methods:
+        get(request, uuid, *args, **kwargs): Handles HTTP GET requests for listing the
+            subscriptions of the wallet.
+        post(request, uuid, *args, **kwargs): Handles HTTP POST requests for creating
+            a subscription.
+
+    Sample Request:
+        {
+        "url":"https://merchant.example/wallet-events"
+        }
+    """
+    throttle_scope = "webhook"
+
+    def get(self, request, uuid, *args, **kwargs):
+        """
+        Handles HTTP GET requests for listing the webhook subscriptions of a wallet.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            uuid (str): The UUID of the wallet.
+            *args: Additional positional arguments.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            Response: The subscriptions of the wallet, without their secrets.
+
+        Raises:
+            Http404: If the wallet with the specified UUID does not exist.
+        """
+        wallet_pk = wallet_pk_cache.resolve(uuid)
+        if wallet_pk is None:
+            raise Http404("No Wallet matches the given query.")
+        subscriptions = WebhookSubscription.objects.filter(wallet_id=wallet_pk).order_by('id')
+        return Response(WebhookSubscriptionSerializer(subscriptions, many=True).data)
+
+    def post(self, request, uuid, *args, **kwargs):
+        """
+        Handles HTTP POST requests for creating a webhook subscription.
+
+        Args:
+            request (HttpRequest): The HTTP request object containing the request data.
+            uuid (str): The UUID of the wallet.
+            *args: Additional positional arguments.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            Response: The subscription with its signing secret, which is not shown
+                again, or an error message if the request is invalid.
+
+        Raises:
+            Http404: If the wallet with the specified UUID does not exist.
+        """
+        serializer = WebhookSubscriptionSerializer(data=request.data)
+        if serializer.is_valid():
+            wallet = wallet_or_404(uuid)
+            with transaction.atomic(using=wallet_db()):
+                subscription = serializer.save(wallet=wallet)
+                WebhookSubscription.objects.flag_wallet(wallet.pk)
+            return Response(
+                WebhookSubscriptionSerializer(subscription, context={'created': True}).data,
+                status=status.HTTP_201_CREATED,
+            )
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class CancelWebhookSubscriptionView(APIView):
+    """
+    API view for cancelling a webhook subscription.
+
+    No further events are queued for the subscription, and the events not delivered
+    yet are dropped.
+
+    Attributes:
+        throttle_scope (str): The scope used to look up the rate limits of this endpoint.
+
+    Methods:
+        post(request, uuid, pk, *args, **kwargs): Handles HTTP POST requests for
+            cancelling a subscription.
+    """
+    throttle_scope = "webhook"
+
+    def post(self, request, uuid, pk, *args, **kwargs):
+        """
+        Handles HTTP POST requests for cancelling a webhook subscription.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            uuid (str): The UUID of the wallet the subscription belongs to.
+            pk (int): The ID of the subscription.
+            *args: Additional positional arguments.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            Response: A success response with the number of events dropped, or a 409
+                response if the subscription was already cancelled.
+
+        Raises:
+            Http404: If the wallet has no subscription with the specified ID.
+        """
+        subscription = get_object_or_404(WebhookSubscription, pk=pk, wallet_id=wallet_pk_cache.resolve(uuid))
+        with transaction.atomic(using=wallet_db()):
+            if not WebhookSubscription.objects.filter(pk=subscription.pk, active=True).update(active=False):
+                return Response({'error': 'Webhook subscription is already cancelled.'}, status=status.HTTP_409_CONFLICT)
+            dropped = WebhookDelivery.objects.filter(subscription=subscription, next_attempt_at__isnull=False).update(
+                next_attempt_at=None,
+                last_error='Subscription cancelled',
+            )
+            WebhookSubscription.objects.flag_wallet(subscription.wallet_id)
+        return Response({'status': 'success', 'message': 'Webhook subscription cancelled', 'id': subscription.id, 'dropped': dropped})
+
+
+class WalletDailyAggregateView(ListAPIView):
+    """
+    API view for listing the daily deposit and withdrawal totals of a wallet.
+
+    The report is served straight from the WalletDailyAggregate table, so its cost
+    depends on the number of days in the range and not on the number of transactions.
+
+    Attributes:
+        serializer_class (Serializer): The serializer class responsible for serializing
+            the daily aggregates.
+
+    Methods:
+        get_queryset(): Validates the `start` and `end` query parameters and returns the
+            aggregates of the wallet in that range, ordered by day.
+
+    Sample Request:
+        GET /wallets/12c599be-7847-47d4-b063-e80e6e36b0cb/aggregates?start=2024-05-01&end=2024-05-31
+    """
+    serializer_class = WalletDailyAggregateSerializer
+
+    def get_queryset(self):
+        """
+        Returns the aggregates of the wallet in the requested date range.
+
+        Returns:
+            QuerySet: The daily aggregates ordered by day.
+
+        Raises:
+            ValidationError: If the date range is missing or invalid.
+            Http404: If the wallet with the specified UUID does not exist.
+        """
+        serializer = AggregateRangeSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        wallet_pk = wallet_pk_cache.resolve(self.kwargs['uuid'])
+        if wallet_pk is None:
+            raise Http404("No Wallet matches the given query.")
+        return WalletDailyAggregate.objects.filter(
+            wallet_id=wallet_pk,
+            date__range=(serializer.validated_data['start'], serializer.validated_data['end']),
+        ).order_by('date')
@@ -0,0 +1,417 @@
+import datetime
+import hashlib
+import hmac
+import ipaddress
+import json
+import socket
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, zip_longest
+from urllib.parse import urlsplit
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from kombu.exceptions import OperationalError
+from wallets.models import WebhookDelivery
+from wallets.sharding import wallet_db
+from wallet.utils import lazy_import
+from base.vars import (
+    WEBHOOK_BATCH_SIZE, WEBHOOK_ENDPOINT_CONCURRENCY, WEBHOOK_LEASE_SIZE, WEBHOOK_MAX_ATTEMPTS,
+    WEBHOOK_RETRY_BASE_INTERVAL, WEBHOOK_RETRY_MAX_INTERVAL, WEBHOOK_TIMEOUT, WEBHOOK_WORKERS,
+)
+
+requests = lazy_import('requests')
+
+SIGNATURE_HEADER = 'X-Wallet-Signature'
+
+
+def retry_interval(attempts, retry_after=None):
+    """
+    Returns the delay before a webhook event is sent again.
+
+    The delay doubles with every attempt, from WEBHOOK_RETRY_BASE_INTERVAL up to
+    WEBHOOK_RETRY_MAX_INTERVAL, so an endpoint that is down for a while is not flooded
+    when it comes back. A delay asked for by the endpoint with `Retry-After` takes
+    precedence, within the same bounds.
+
+    Args:
+        attempts (int): The number of attempts already made.
+        retry_after (int): The delay asked for by the endpoint in seconds, if any.
+
+    Returns:
+        datetime.timedelta: The delay.
+    """
+    if retry_after is not None:
+        seconds = retry_after
+    else:
+        seconds = WEBHOOK_RETRY_BASE_INTERVAL * 2 ** min(attempts - 1, 32)
+    return datetime.timedelta(seconds=max(1, min(seconds, WEBHOOK_RETRY_MAX_INTERVAL)))
+
+
+def sign(secret, body):
+    """
+    Signs a webhook request body.
+
+    Receivers recompute the HMAC of the raw body with the secret of their subscription
+    and compare it with the `X-Wallet-Signature` header.
+
+    Args:
+        secret (str): The secret of the subscription.
+        body (bytes): The request body.
+
+    Returns:
+        str: The signature, e.g. "sha256=<hex digest>".
+    """
+    return 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def endpoint_of(url):
+    """
+    Returns the endpoint a webhook URL belongs to, for the concurrency limits.
+
+    Args:
+        url (str): The webhook URL.
+
+    Returns:
+        str: The scheme and the host and port of the URL, e.g. "https://merchant.example".
+    """
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc.lower()}"
+
+
+def check_webhook_url(url):
+    """
+    Checks that events may be sent to a webhook URL.
+
+    The URL must use https, and every address its host resolves to must be public, so
+    a subscription cannot make the workers call loopback, private, link-local (such as
+    cloud metadata) or reserved addresses. The host is resolved again before each
+    delivery, since its DNS records may have changed since the subscription was made.
+
+    Args:
+        url (str): The webhook URL.
+
+    Raises:
+        ValueError: If the URL is not https, or its host cannot be resolved or resolves
+            to an address that is not public.
+    """
+    parts = urlsplit(url)
+    if parts.scheme != 'https' or not parts.hostname:
+        raise ValueError("Webhook URLs must be https URLs with a host.")
+    try:
+        addresses = [ipaddress.ip_address(parts.hostname)]
+    except ValueError:
+        try:
+            infos = socket.getaddrinfo(parts.hostname, parts.port or 443, proto=socket.IPPROTO_TCP)
+        except (OSError, ValueError):
+            raise ValueError(f"Webhook host {parts.hostname} cannot be resolved.")
+        addresses = [ipaddress.ip_address(info[4][0].split('%')[0]) for info in infos]
+    for address in addresses:
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise ValueError(f"Webhook host {parts.hostname} resolves to the non-public address {address}.")
+
+
+def pooled_session(size, hosts=100):
+    """
+    Opens an HTTP session that keeps up to `size` connections alive per host.
+
+    Args:
+        size (int): The number of connections kept per host, one per sending thread.
+        hosts (int): The number of hosts whose connections are kept. Past it, the
+            connections of the least recently used host are closed.
+
+    Returns:
+        requests.Session: The session.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=hosts, pool_maxsize=size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class WebhookSender:
+    """
+    Sends batches of webhook events from a pool of threads.
+
+    The threads share one HTTP session, so a connection to an endpoint is reused
+    by the following requests instead of being opened for each of them. At most
+    `endpoint_concurrency` requests are in flight per endpoint, so one merchant cannot
+    take every thread nor receive more requests than it can serve.
+
+    Before sending, the URL of each endpoint is checked again with `check_webhook_url`,
+    and redirects are not followed, so an endpoint cannot point the workers at an
+    internal address after it was subscribed.
+
+    Attributes:
+        session (requests.Session): The session the requests are sent with.
+        timeout (float): The timeout of each request in seconds.
+        check_urls (bool): Whether URLs are checked before sending. Only the local
+            benchmark, which serves plain HTTP on 127.0.0.1, turns it off.
+
+    Usage:
+        sender = WebhookSender(workers=16)
+        results = sender.send([(url, secret, events)])
+    """
+    def __init__(self, workers=WEBHOOK_WORKERS, endpoint_concurrency=WEBHOOK_ENDPOINT_CONCURRENCY, session=None, timeout=WEBHOOK_TIMEOUT, check_urls=True):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='webhook')
+        self.endpoint_concurrency = endpoint_concurrency
+        self.session = session if session is not None else pooled_session(workers)
+        self.timeout = timeout
+        self.check_urls = check_urls
+        self.limits = {}
+        self.lock = threading.Lock()
+
+    def limit(self, endpoint):
+        """
+        Returns the semaphore bounding the requests in flight to an endpoint.
+        """
+        with self.lock:
+            if endpoint not in self.limits:
+                self.limits[endpoint] = threading.BoundedSemaphore(self.endpoint_concurrency)
+            return self.limits[endpoint]
+
+    def post(self, url, secret, events):
+        """
+        Sends one batch of events to a webhook URL.
+
+        Args:
+            url (str): The webhook URL.
+            secret (str): The secret the body is signed with.
+            events (list): The events, in the order they happened.
+
+        Returns:
+            tuple: The HTTP status, or None if no response was received, the delay asked
+                for with `Retry-After` in seconds, if any, and the error, if any.
+        """
+        body = json.dumps({'events': events}, cls=DjangoJSONEncoder).encode()
+        headers = {'Content-Type': 'application/json', SIGNATURE_HEADER: sign(secret, body)}
+        with self.limit(endpoint_of(url)):
+            try:
+                response = self.session.post(url, data=body, headers=headers, timeout=self.timeout, allow_redirects=False)
+            except requests.exceptions.RequestException as e:
+                return None, None, str(e)[:255]
+        if 200 <= response.status_code < 300:
+            return response.status_code, None, ''
+        retry_after = response.headers.get('Retry-After', '')
+        return response.status_code, int(retry_after) if retry_after.isdigit() else None, f"HTTP {response.status_code}"
+
+    def send(self, batches):
+        """
+        Sends batches of events concurrently.
+
+        The batches are interleaved by endpoint before they are handed to the pool, so
+        the threads spread over the endpoints instead of queueing behind the limit of
+        the first one. The URL of each endpoint is checked once per call, and the
+        batches of an endpoint that fails the check are not sent.
+
+        Args:
+            batches (list): (url, secret, events) tuples.
+
+        Returns:
+            list: The result of `post` for each batch, in the order of `batches`.
+        """
+        by_endpoint = defaultdict(list)
+        for index, batch in enumerate(batches):
+            by_endpoint[endpoint_of(batch[0])].append(index)
+        results = {}
+        if self.check_urls:
+            for endpoint, indexes in list(by_endpoint.items()):
+                try:
+                    check_webhook_url(batches[indexes[0]][0])
+                except ValueError as e:
+                    results.update((index, (None, None, str(e)[:255])) for index in by_endpoint.pop(endpoint))
+        order = [index for index in chain.from_iterable(zip_longest(*by_endpoint.values())) if index is not None]
+        futures = {index: self.pool.submit(self.post, *batches[index]) for index in order}
+        return [results[index] if index in results else futures[index].result() for index in range(len(batches))]
+
+    def close(self):
+        """
+        Stops the threads and closes the pooled connections.
+        """
+        self.pool.shutdown()
+        self.session.close()
+
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def webhook_sender():
+    """
+    Returns the sender of this process, created on first use.
+
+    The sender and its connections are kept between task runs, so a worker sending to
+    the same endpoints keeps their connections open.
+
+    Returns:
+        WebhookSender: The sender.
+    """
+    global _sender
+    with _sender_lock:
+        if _sender is None:
+            _sender = WebhookSender()
+        return _sender
+
+
+_pending_tasks = set()
+_task_lock = threading.Lock()
+_task_pool = None
+
+
+def enqueue_delivery(shard=None):
+    """
+    Sends the webhook delivery task, once the deliveries of a transaction have committed.
+
+    The task is sent from a background thread, so the request that changed the balance
+    does not wait for the broker. A task still waiting to be sent for the same shard
+    covers the new deliveries too, so a burst of balance changes sends a few tasks,
+    not one per change.
+
+    Args:
+        shard (str): The shard the deliveries were queued on.
+    """
+    global _task_pool
+    with _task_lock:
+        if shard in _pending_tasks:
+            return
+        _pending_tasks.add(shard)
+        if _task_pool is None:
+            _task_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='webhook-enqueue')
+    _task_pool.submit(send_delivery_task, shard)
+
+
+def send_delivery_task(shard):
+    """
+    Sends the webhook delivery task for a shard to the broker.
+
+    The deliveries are already stored, so if the broker cannot be reached the task is
+    not retried here; the periodic run of `deliver_webhooks` sends them instead.
+
+    Args:
+        shard (str): The shard to send from.
+    """
+    from wallets.tasks import deliver_webhooks
+
+    with _task_lock:
+        _pending_tasks.discard(shard)
+    try:
+        deliver_webhooks.apply_async(kwargs={'shard': shard}, retry=False)
+    except OperationalError as e:
+        print(f"Webhook delivery task not sent, left to the periodic run: {e}")
+
+
+def lease_due_deliveries(now, lease_size):
+    """
+    Takes the next deliveries due and schedules their following attempt.
+
+    The due rows are read from the partial `next_attempt_at` index and locked with
+    SELECT ... FOR UPDATE SKIP LOCKED, so concurrent tasks take different deliveries.
+    Their attempt count and `next_attempt_at` are moved forward before anything is sent,
+    which both leases the rows to this task and sets the backoff of the deliveries that
+    fail. A task that dies while sending leaves its deliveries to a later attempt.
+
+    Args:
+        now (datetime): The current time.
+        lease_size (int): The maximum number of deliveries to take.
+
+    Returns:
+        list: The leased deliveries, with their subscriptions, oldest first.
+    """
+    with transaction.atomic(using=wallet_db()):
+        deliveries = list(
+            WebhookDelivery.objects.due(now)
+            .select_related('subscription')
+            .select_for_update(skip_locked=True, of=('self',))[:lease_size]
+        )
+        by_attempts = defaultdict(list)
+        for delivery in deliveries:
+            by_attempts[delivery.attempts].append(delivery.pk)
+            delivery.attempts += 1
+        for attempts, pks in by_attempts.items():
+            WebhookDelivery.objects.filter(pk__in=pks).update(
+                attempts=attempts + 1,
+                next_attempt_at=now + retry_interval(attempts + 1),
+            )
+    return deliveries
+
+
+def event_body(delivery):
+    """
+    Returns an event as it is sent to the endpoint.
+
+    Args:
+        delivery (WebhookDelivery): The delivery.
+
+    Returns:
+        dict: The outbox event id, which receivers deduplicate on, the event type, the
+            attempt number and the event itself.
+    """
+    return {'id': delivery.event_id, 'type': delivery.event_type, 'attempt': delivery.attempts, 'data': delivery.payload}
+
+
+def deliver_due_webhooks(now=None, lease_size=WEBHOOK_LEASE_SIZE, batch_size=WEBHOOK_BATCH_SIZE, sender=None):
+    """
+    Sends the next deliveries due to their webhook endpoints.
+
+    The leased deliveries are grouped by URL and secret, so the events of several
+    wallets subscribed to the same endpoint travel together, and sent in batches of up
+    to `batch_size` events per request, in the order they happened. A batch is
+    acknowledged by any 2xx answer. A batch that fails is sent again after an
+    exponential backoff, or after the `Retry-After` delay of the endpoint, until
+    WEBHOOK_MAX_ATTEMPTS attempts have been made. Delivery is at least once: receivers
+    should deduplicate on the event `id`.
+
+    Args:
+        now (datetime): The current time.
+        lease_size (int): The maximum number of deliveries taken.
+        batch_size (int): The maximum number of events per request.
+        sender (WebhookSender): The sender; defaults to the sender of this process.
+
+    Returns:
+        dict: The number of deliveries taken, delivered, left to retry and given up,
+            and of requests sent.
+    """
+    now = now or timezone.now()
+    deliveries = lease_due_deliveries(now, lease_size)
+    counts = {'sent': len(deliveries), 'delivered': 0, 'retrying': 0, 'dropped': 0, 'requests': 0}
+    if not deliveries:
+        return counts
+
+    groups = defaultdict(list)
+    for delivery in deliveries:
+        groups[(delivery.subscription.url, delivery.subscription.secret)].append(delivery)
+    batches = [
+        (url, secret, group[start:start + batch_size])
+        for (url, secret), group in groups.items()
+        for start in range(0, len(group), batch_size)
+    ]
+    results = (sender or webhook_sender()).send([
+        (url, secret, [event_body(delivery) for delivery in batch]) for url, secret, batch in batches
+    ])
+    counts['requests'] = len(batches)
+
+    delivered = defaultdict(list)
+    for (url, secret, batch), (status_code, retry_after, error) in zip(batches, results):
+        if not error:
+            delivered[status_code].extend(delivery.pk for delivery in batch)
+            continue
+        dropped = [delivery.pk for delivery in batch if delivery.attempts >= WEBHOOK_MAX_ATTEMPTS]
+        retrying = [delivery.pk for delivery in batch if delivery.attempts < WEBHOOK_MAX_ATTEMPTS]
+        print(f"Webhook batch of {len(batch)} events to {url} failed: {error}")
+        WebhookDelivery.objects.filter(pk__in=dropped).update(next_attempt_at=None, last_status=status_code, last_error=error)
+        retry_fields = {'last_status': status_code, 'last_error': error}
+        if retry_after is not None:
+            retry_fields['next_attempt_at'] = now + retry_interval(None, retry_after)
+        WebhookDelivery.objects.filter(pk__in=retrying).update(**retry_fields)
+        counts['dropped'] += len(dropped)
+        counts['retrying'] += len(retrying)
+
+    delivered_at = timezone.now()
+    for status_code, pks in delivered.items():
+        WebhookDelivery.objects.filter(pk__in=pks).update(delivered_at=delivered_at, next_attempt_at=None, last_status=status_code, last_error='')
+        counts['delivered'] += len(pks)
+    return counts